@@ -37,6 +37,11 @@ const imageEmbeddingSchema = new mongoose.Schema({
             type: String,
             default: 'ResNet50'
         },
+        // Id model trong registry của Python service (resnet50, efficientnet_b0, ...)
+        modelId: {
+            type: String,
+            default: 'resnet50'
+        },
         vectorDimension: {
             type: Number,
             default: 2048
@@ -0,0 +1,392 @@
+"""
+Smart Tro MCP - Conversation flow benchmark / load harness
+Replay hội thoại guided nhiều turn (kịch bản cố định + sinh ngẫu nhiên) vào
+/api/chat ở nhiều mức concurrency. Node API và vietnamlabs.com được thay bằng
+upstream_stub (latency chỉnh được); gradio_server chạy bằng uvicorn ở process
+riêng, khởi động lại cho mỗi mức concurrency để cache/prefetch bắt đầu từ đầu.
+
+Báo cáo:
+- mỗi mức concurrency: throughput (turn/s, hội thoại/s), latency p50/p90/p99
+  theo bước hội thoại, hit rate của search cache / prefetch, latency upstream
+- latency từng extractor (scan, budget, location, ward match, ...) đo trong
+  process trên đúng các tin nhắn đã replay
+
+Usage:
+    python bench_chat_flow.py
+    python bench_chat_flow.py --concurrency 1,8,32 --conversations 300 --search-latency-ms 300
+    python bench_chat_flow.py --no-cache --protocol lean --think-ms 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import aiohttp
+
+from entity_extractor import EntityExtractor, fold, _DIGIT
+from gazetteer import Gazetteer
+from chat_protocol import apply_patch
+from upstream_stub import REAL_WARDS, UpstreamStub
+
+SCRIPTED = [
+    ['xin chào', 'Tìm trọ phù hợp', 'từ 2 triệu - 3 triệu', 'Khu vực cụ thể',
+     'Phường Tân Định, tp hồ chí minh', 'Thêm yêu cầu', 'Tiện ích cần có',
+     'wifi, điều hòa, máy giặt', 'Thêm yêu cầu', 'Diện tích chỗ thuê', '25 m2', 'Tìm kiếm'],
+    ['chào bot, mình cần tìm căn hộ ở hà nội', 'Tìm căn hộ phù hợp', 'khoảng 8 triệu',
+     'Khu vực cụ thể', 'cầu giấy hà nội', 'Tìm kiếm'],
+    ['hi', 'Tìm trọ phù hợp', 'dưới 2tr5', 'Thêm thông tin khác', 'gần trường UIT', 'Thêm yêu cầu',
+     'Khu vực cụ thể', 'linh xuan, thu duc, hcm', 'Tìm kiếm'],
+]
+
+GREETINGS = ['xin chào', 'hi', 'alo', 'chào bot', 'mình muốn thuê phòng ở tp hcm',
+             'cho hỏi phòng ở đà nẵng', 'chào, mình cần tìm trọ ở hà nội', 'hello, ở sài gòn có phòng không']
+PROPERTY_TYPES = ['Tìm trọ phù hợp', 'Tìm căn hộ phù hợp']
+OPTIONS = {
+    'location': 'Khu vực cụ thể',
+    'area': 'Diện tích chỗ thuê',
+    'amenities': 'Tiện ích cần có',
+    'university': 'Thêm thông tin khác',
+}
+PROVINCE_PHRASES = {
+    'Hồ Chí Minh': ['tp hồ chí minh', 'tp hcm', 'sài gòn', 'hcm'],
+    'Hà Nội': ['hà nội', 'hn hà nội'],
+    'Đà Nẵng': ['đà nẵng'],
+    'Cần Thơ': ['cần thơ'],
+}
+AMENITY_WORDS = ['wifi', 'điều hòa', 'máy giặt', 'tủ lạnh', 'ban công', 'thang máy', 'chỗ để xe', 'bếp riêng']
+UNIVERSITIES = ['gần trường UIT', 'đại học bách khoa hcmut', 'gần FPT', 'Đại học Công nghiệp TP HCM', 'rmit quận 7']
+
+
+def random_budget(rng: random.Random) -> str:
+    low = rng.randint(1, 6)
+    return rng.choice([
+        f"từ {low} triệu - {low + rng.randint(1, 3)} triệu",
+        f"dưới {low + 1} triệu",
+        f"khoảng {low}tr",
+        f"tầm {low}tr5",
+        f"{low} - {low + 2} triệu",
+        f"{low * 1000000}",
+    ])
+
+
+def random_answer(option: str, rng: random.Random) -> str:
+    if option == 'location':
+        province = rng.choice(list(REAL_WARDS))
+        ward = rng.choice(REAL_WARDS[province])
+        text = f"{rng.choice([ward, ward.replace('Phường ', '')])}, {rng.choice(PROVINCE_PHRASES[province])}"
+        # Một phần user gõ không dấu
+        return fold(text.lower()) if rng.random() < 0.3 else text
+    if option == 'area':
+        return rng.choice(['{} m2', 'khoảng {}m2', 'tầm {} mét vuông', '{}'])\
+            .format(rng.choice([15, 20, 25, 30, 40]))
+    if option == 'amenities':
+        return ', '.join(rng.sample(AMENITY_WORDS, rng.randint(1, 4)))
+    return rng.choice(UNIVERSITIES)
+
+
+def random_conversation(rng: random.Random) -> List[str]:
+    """greeting -> loại phòng -> ngân sách -> 1..4 yêu cầu bổ sung -> Tìm kiếm"""
+    turns = [rng.choice(GREETINGS), rng.choice(PROPERTY_TYPES), random_budget(rng)]
+    for index, option in enumerate(rng.sample(list(OPTIONS), rng.randint(1, len(OPTIONS)))):
+        if index:
+            turns.append('Thêm yêu cầu')
+        turns += [OPTIONS[option], random_answer(option, rng)]
+    turns.append('Tìm kiếm')
+    return turns
+
+
+def build_conversations(count: int, scripted_ratio: float, seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    return [rng.choice(SCRIPTED) if rng.random() < scripted_ratio else random_conversation(rng)
+            for _ in range(count)]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {'n': 0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {'n': len(ordered), 'p50': rank(0.50), 'p90': rank(0.90), 'p99': rank(0.99), 'max': ordered[-1]}
+
+
+def print_table(title: str, rows: Dict[str, List[float]], unit: str = 'ms'):
+    print(f"  {title:<26}{'n':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  ({unit})")
+    for name, samples in rows.items():
+        stats = percentiles(samples)
+        print(f"  {name:<26}{stats['n']:>7}{stats['p50']:>10.3f}{stats['p90']:>10.3f}"
+              f"{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+
+
+# ---------- server ----------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ChatServer:
+    """gradio_server:app chạy bằng uvicorn ở process con, upstream trỏ vào stub"""
+
+    def __init__(self, stub: UpstreamStub, snapshot_path: str, extra_env: Dict[str, str]):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ)
+        env.update(
+            BACKEND_API_BASE_URL=stub.backend_api_url,
+            VIETNAMLABS_API_URL=stub.vietnamlabs_url,
+            GAZETTEER_SNAPSHOT=snapshot_path,
+            PYTHONUNBUFFERED='1',
+            **extra_env
+        )
+        # stderr ra file (PIPE không ai đọc sẽ đầy và chặn server khi chạy lâu)
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'gradio_server:app', '--host', '127.0.0.1',
+             '--port', str(self.port), '--log-level', 'warning', '--no-access-log'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=self.log
+        )
+
+    async def wait_ready(self, session: aiohttp.ClientSession, timeout: float = 60):
+        """Chờ server nhận request và gazetteer đã load xong (snapshot hoặc refresh từ stub)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f"chat server exited: {self.log.read().decode()[-2000:]}")
+            try:
+                async with session.get(f"{self.url}/api/gazetteer") as response:
+                    stats = (await response.json())['data']
+                    if stats['wards'] and not stats['refreshing']:
+                        return stats
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        raise TimeoutError("chat server not ready")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+# ---------- load ----------
+
+async def run_conversation(session: aiohttp.ClientSession, url: str, session_id: str, turns: List[str],
+                           lean: bool, think: float, latencies: Dict[str, List[float]], errors: List[str]):
+    state, version, step = None, None, 'greeting'
+    for message in turns:
+        body = {'message': message, 'sessionId': session_id}
+        if lean:
+            body.update(protocol='lean', stateVersion=version)
+        else:
+            body['conversationState'] = state
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{url}/api/chat", json=body) as response:
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            errors.append(f"{step}: {type(e).__name__}")
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        if not data.get('success'):
+            errors.append(f"{step}: {data.get('message') or data.get('detail')}")
+            return
+        # Latency gắn với bước đang được xử lý (bước search = confirm_search)
+        latencies[step].append(elapsed)
+        latencies['(all turns)'].append(elapsed)
+        if lean:
+            state = apply_patch(state, data['stateDelta']) if 'stateDelta' in data else data.get('conversationState')
+            version = data.get('stateVersion')
+        else:
+            state = data.get('conversationState')
+        step = (state or {}).get('current_step', step)
+        if think:
+            await asyncio.sleep(think * random.random() * 2)
+
+
+async def run_level(stub: UpstreamStub, args, concurrency: int, conversations: List[List[str]],
+                    snapshot_path: str, extra_env: Dict[str, str]) -> Dict[str, Any]:
+    server = ChatServer(stub, snapshot_path, extra_env)
+    connector = aiohttp.TCPConnector(limit=concurrency + 4)
+    timeout = aiohttp.ClientTimeout(total=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await server.wait_ready(session)
+            warmup: Dict[str, List[float]] = defaultdict(list)
+            for index, turns in enumerate(build_conversations(args.warmup, args.scripted_ratio, args.seed + 1)):
+                await run_conversation(session, server.url, f"warmup-{index}", turns, args.protocol == 'lean',
+                                       0, warmup, [])
+
+            latencies: Dict[str, List[float]] = defaultdict(list)
+            errors: List[str] = []
+            queue = list(enumerate(conversations))
+            queue.reverse()
+
+            async def worker():
+                while queue:
+                    index, turns = queue.pop()
+                    await run_conversation(session, server.url, f"bench-c{concurrency}-{index}", turns,
+                                           args.protocol == 'lean', args.think_ms / 1000, latencies, errors)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+            async with session.get(f"{server.url}/api/metrics") as response:
+                metrics = (await response.json())['data']
+    finally:
+        server.stop()
+
+    return {'concurrency': concurrency, 'elapsed': elapsed, 'latencies': latencies,
+            'errors': errors, 'metrics': metrics}
+
+
+def report_level(result: Dict[str, Any], conversations: int):
+    latencies = result['latencies']
+    turns = len(latencies['(all turns)'])
+    elapsed = result['elapsed']
+    print(f"\n== concurrency {result['concurrency']}: {conversations} conversations, {turns} turns "
+          f"in {elapsed:.2f}s -> {turns / elapsed:.1f} turns/s, {conversations / elapsed:.1f} conversations/s, "
+          f"{len(result['errors'])} errors")
+    order = ['greeting', 'property_type', 'budget_input', 'additional_options', 'location_input',
+             'area_input', 'amenities_input', 'university_input', 'confirm_search', '(all turns)']
+    print_table('step', {step: latencies[step] for step in order if step in latencies})
+
+    metrics = result['metrics']
+    cache, prefetch = metrics['search_cache'], metrics['prefetch']
+    print(f"  search cache: hits {cache['hits']} stale {cache['stale_hits']} misses {cache['misses']} "
+          f"(hit ratio {cache['hit_ratio']}), collapsed {cache['singleflight']['collapsed']}; "
+          f"prefetch hits {prefetch['hits']}/{prefetch['hits'] + prefetch['misses']}, wasted {prefetch['wasted']}")
+    for name, upstream in metrics['http']['upstreams'].items():
+        latency = upstream['latency']
+        print(f"  upstream {name:<12} calls {upstream['calls']:>5} errors {upstream['errors']:>3} "
+              f"p50 {latency['p50_ms']}ms p99 {latency['p99_ms']}ms")
+    if result['errors']:
+        print(f"  first errors: {result['errors'][:5]}")
+
+
+# ---------- extractor ----------
+
+def profile_extractors(snapshot_path: str, messages: List[str], repeat: int) -> Dict[str, List[float]]:
+    """
+    Đo từng bước của EntityExtractor.parse (và ward match của gazetteer) trên
+    các tin nhắn đã replay; gọi thẳng từng bước nên LRU của parse() không che mất chi phí
+    """
+    gazetteer = Gazetteer('', snapshot_path=snapshot_path)
+    gazetteer.load_snapshot()
+    extractor = EntityExtractor([p['name'] for p in gazetteer.provinces], cache_size=0)
+    matcher = gazetteer.ward_matcher
+    timings: Dict[str, List[float]] = defaultdict(list)
+    clock = time.perf_counter_ns
+
+    for message in messages:
+        for _ in range(repeat):
+            t0 = clock()
+            lower = message.lower()
+            folded = fold(lower)
+            t1 = clock()
+            hits = extractor.scan(lower, folded)
+            t2 = clock()
+            extractor._property_type(hits)
+            t3 = clock()
+            extractor._city(hits, lower)
+            t4 = clock()
+            has_digit = _DIGIT.search(lower) is not None
+            if has_digit:
+                extractor._budget(lower)
+            t5 = clock()
+            if has_digit:
+                extractor._area(message)
+            t6 = clock()
+            location = extractor._location(lower, hits)
+            t7 = clock()
+            extractor._university(lower, hits, message.strip())
+            t8 = clock()
+            parse = extractor.parse(message)
+            t9 = clock()
+            for name, begin, end in (('normalize+fold', t0, t1), ('scan (automaton)', t1, t2),
+                                     ('property_type', t2, t3), ('city', t3, t4), ('budget', t4, t5),
+                                     ('area', t5, t6), ('location', t6, t7), ('university', t7, t8),
+                                     ('parse (total)', t8, t9)):
+                timings[name].append((end - begin) / 1000)
+            # Ward match chỉ chạy ở bước search, trên keyword địa điểm (giống _build_search_params)
+            for keyword in extractor.location_keywords(parse):
+                begin = clock()
+                matcher.match(keyword, province=location.get('province_name'))
+                timings['ward match (keyword)'].append((clock() - begin) / 1000)
+    return timings
+
+
+async def main_async(args):
+    stub = UpstreamStub(seed=args.seed).start()
+    stub.configure('search', latency_ms=args.search_latency_ms, jitter_ms=args.jitter_ms)
+    stub.configure('amenities', latency_ms=args.amenities_latency_ms, jitter_ms=args.jitter_ms)
+    stub.configure('vietnamlabs', latency_ms=args.vietnamlabs_latency_ms, jitter_ms=args.jitter_ms)
+
+    extra_env = {}
+    if args.no_cache:
+        extra_env.update(SEARCH_CACHE_TTL_SECONDS='0', SEARCH_CACHE_STALE_SECONDS='0', PREFETCH_ENABLED='0')
+
+    conversations = build_conversations(args.conversations, args.scripted_ratio, args.seed)
+    levels = [int(level) for level in args.concurrency.split(',')]
+    print(f"{len(conversations)} conversations/level ({args.scripted_ratio:.0%} scripted), protocol {args.protocol}, "
+          f"stub latency search {args.search_latency_ms}ms amenities {args.amenities_latency_ms}ms "
+          f"vietnamlabs {args.vietnamlabs_latency_ms}ms (+0..{args.jitter_ms}ms), "
+          f"cache {'off' if args.no_cache else 'on'}")
+
+    summary = []
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, 'gazetteer.json')
+        for concurrency in levels:
+            result = await run_level(stub, args, concurrency, conversations, snapshot_path, extra_env)
+            report_level(result, len(conversations))
+            summary.append(result)
+
+        messages = sorted({message for turns in conversations for message in turns})
+        print(f"\n== extractors: {len(messages)} distinct messages x {args.extractor_repeat}")
+        print_table('extractor', profile_extractors(snapshot_path, messages, args.extractor_repeat), unit='us')
+    stub.stop()
+
+    print(f"\n{'concurrency':>11}{'turns/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'search p99':>12}{'errors':>8}")
+    for result in summary:
+        overall = percentiles(result['latencies']['(all turns)'])
+        search = percentiles(result['latencies'].get('confirm_search', []))
+        print(f"{result['concurrency']:>11}{overall['n'] / result['elapsed']:>10.1f}{overall['p50']:>10.2f}"
+              f"{overall['p99']:>10.2f}{search['p99']:>12.2f}{len(result['errors']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot conversation flow load benchmark")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Các mức concurrency, phân tách bằng dấu phẩy")
+    parser.add_argument("--conversations", type=int, default=200, help="Số hội thoại mỗi mức")
+    parser.add_argument("--scripted-ratio", type=float, default=0.3, help="Tỷ lệ hội thoại theo kịch bản cố định")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--protocol", choices=["full", "lean"], default="full")
+    parser.add_argument("--think-ms", type=float, default=0, help="Thời gian user 'suy nghĩ' trung bình giữa các turn")
+    parser.add_argument("--search-latency-ms", type=float, default=150)
+    parser.add_argument("--amenities-latency-ms", type=float, default=50)
+    parser.add_argument("--vietnamlabs-latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--no-cache", action="store_true", help="Tắt search cache + prefetch")
+    parser.add_argument("--extractor-repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
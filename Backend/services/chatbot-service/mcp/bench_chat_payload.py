@@ -0,0 +1,97 @@
+"""
+Smart Tro MCP - Chat payload benchmark
+Đo số byte mỗi turn của /api/chat qua cùng một guided flow (kết thúc bằng search):
+- full: client gửi lại toàn bộ conversationState, response có state + property đầy đủ
+- lean: client chỉ gửi stateVersion, response có stateDelta + property đã project
+mỗi protocol chạy với và không có Accept-Encoding (br/gzip). Search trả về
+property giả lập cùng cấu trúc searchPropertiesController, không gọi Node API.
+
+Usage:
+    python bench_chat_payload.py
+    python bench_chat_payload.py --properties 20 --sessions 20
+"""
+import argparse
+import contextlib
+import io
+import random
+from typing import Dict, List
+
+from fastapi.testclient import TestClient
+
+import gradio_server
+from chat_protocol import apply_patch
+from upstream_stub import AMENITIES, fake_property
+
+FLOW = [
+    'xin chào', 'Tìm trọ phù hợp', 'từ 2 triệu - 3 triệu', 'Khu vực cụ thể',
+    'Phường Tân Định, tp hồ chí minh', 'Thêm yêu cầu', 'Tiện ích cần có',
+    'wifi, điều hòa, máy giặt', 'Thêm yêu cầu', 'Diện tích chỗ thuê', '25 m2', 'Tìm kiếm'
+]
+
+
+def run_session(client: TestClient, session_id: str, lean: bool, compressed: bool) -> List[Dict[str, int]]:
+    headers = {'Accept-Encoding': 'br, gzip' if compressed else 'identity'}
+    state, version, turns = None, None, []
+    for message in FLOW:
+        body = {'message': message, 'sessionId': session_id}
+        if lean:
+            body.update(protocol='lean', stateVersion=version)
+        else:
+            body['conversationState'] = state
+        response = client.post('/api/chat', json=body, headers=headers)
+        data = response.json()
+        turns.append({
+            'request': len(response.request.content),
+            'wire': int(response.headers.get('content-length') or len(response.content)),
+            'raw': len(response.content),
+        })
+        if lean:
+            state = apply_patch(state, data['stateDelta']) if 'stateDelta' in data else data['conversationState']
+            version = data['stateVersion']
+        else:
+            state = data['conversationState']
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat payload size benchmark")
+    parser.add_argument("--properties", type=int, default=20, help="Số property search trả về")
+    parser.add_argument("--sessions", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    properties = [fake_property(i, rng, province='Thành phố Hồ Chí Minh') for i in range(args.properties)]
+
+    async def fake_fetch(params):
+        return properties
+
+    service = gradio_server.mcp_service
+    service.amenities_cache = AMENITIES
+    service._fetch_properties = fake_fetch
+    # Không dùng lifespan => không gọi Node API / vietnamlabs.com
+    client = TestClient(gradio_server.app)
+
+    print(f"{len(FLOW)} turns/session, {args.sessions} sessions, {args.properties} properties in search turn\n")
+    print(f"{'mode':<18}{'req B/turn':>12}{'resp B/turn':>13}{'wire B/turn':>13}{'search turn wire':>18}")
+    baseline = None
+    for lean in (False, True):
+        for compressed in (False, True):
+            totals = {'request': 0, 'raw': 0, 'wire': 0}
+            search_wire = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                for n in range(args.sessions):
+                    turns = run_session(client, f"bench-{lean}-{compressed}-{n}", lean, compressed)
+                    for turn in turns:
+                        for key in totals:
+                            totals[key] += turn[key]
+                    search_wire += turns[-1]['wire']
+            count = args.sessions * len(FLOW)
+            wire = totals['wire'] / count
+            baseline = baseline or wire
+            name = f"{'lean' if lean else 'full'}{' + br' if compressed else ''}"
+            print(f"{name:<18}{totals['request'] / count:>12.0f}{totals['raw'] / count:>13.0f}"
+                  f"{wire:>13.0f}{search_wire / args.sessions:>18.0f}   ({wire / baseline:.0%} of full)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+Smart Tro MCP - Entity extraction benchmark
+So sánh EntityExtractor (chuẩn hóa một lần + một lượt Aho-Corasick + regex
+có kích hoạt) với các helper cũ của SmartTroMCP (mỗi helper tự lowercase và
+chạy list regex / vòng `keyword in text` riêng) trên cùng một bộ tin nhắn:
+- messages/s khi trích xuất toàn bộ thực thể của mỗi tin nhắn
+- tỷ lệ kết quả giống nhau theo từng loại thực thể (và ví dụ khác nhau)
+
+Usage:
+    python bench_extraction.py
+    python bench_extraction.py --messages 20000 --show-diffs 10
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from entity_extractor import EntityExtractor
+
+PROVINCES = ['Hồ Chí Minh', 'Hà Nội', 'Đà Nẵng', 'Cần Thơ', 'Bình Dương', 'Đồng Nai', 'Khánh Hòa']
+
+MESSAGE_TEMPLATES = [
+    'Tìm trọ phù hợp', 'Tìm căn hộ phù hợp', 'tôi muốn thuê phòng trọ ở {city}',
+    'từ {a} triệu - {b} triệu', 'từ {a} đến {b} triệu', 'dưới {a} triệu', 'trên {a} triệu',
+    '{a} triệu {c}', 'khoảng {a}tr', '{money}', 'tầm {a} triệu một tháng',
+    'Phường {ward}, {city}', 'phường {ward}', 'xã {ward}, tỉnh {province}', 'p. {ward_ascii}',
+    'tp hồ chí minh', 'thành phố hà nội', 'tỉnh {province}', 'ho chi minh city',
+    'gần {ward} {city}', '{area}', '{area} m2', 'khoảng {area}m2',
+    'wifi, điều hòa, máy giặt', 'cần có máy lạnh và tủ lạnh', 'có ban công, thang máy, chỗ để xe',
+    'bếp riêng và wifi', 'tivi, tủ quần áo', 'parking, elevator, fridge',
+    'Đại học Công nghiệp TP HCM', 'đh bách khoa', 'trường đại học kinh tế', 'học ở hutech', 'sinh viên uit',
+    'Thêm yêu cầu', 'Tìm kiếm', 'Khu vực cụ thể', 'Tiện ích cần có'
+]
+WARDS = ['Tân Định', 'An Nhơn', 'Bến Nghé', 'Thảo Điền', 'Linh Trung', 'Hiệp Phú', 'Tân Phú', 'Phú Mỹ']
+
+
+def build_messages(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        ward = rng.choice(WARDS)
+        messages.append(rng.choice(MESSAGE_TEMPLATES).format(
+            city=rng.choice(['hồ chí minh', 'hà nội', 'đà nẵng', 'sài gòn', 'cần thơ']),
+            province=rng.choice(PROVINCES).lower(), ward=ward,
+            ward_ascii=ward.encode('ascii', 'ignore').decode() or 'tan dinh',
+            a=rng.randint(1, 5), b=rng.randint(5, 9), c=rng.choice([200, 500, 800]),
+            money=rng.choice([1500000, 2500000, 3000000]), area=rng.randint(15, 60)
+        ))
+    return messages
+
+
+class LegacyExtractors:
+    """Các helper trích xuất cũ của SmartTroMCP (giữ nguyên để làm baseline)"""
+
+    def __init__(self, provinces):
+        self.provinces_cache = [{'name': name} for name in provinces]
+
+    def _get_amenity_ids_by_names(self, amenity_names: List[str]) -> List[str]:
+        # Mapping tên -> ID giống nhau ở cả hai cách, không tính vào benchmark
+        return list(amenity_names)
+
+    def _extract_location(self, message: str) -> str:
+        """Extract địa điểm từ tin nhắn"""
+        message = message.lower()
+
+        # Tìm tỉnh thành phố
+        cities = [
+            'hà nội', 'hồ chí minh', 'tp hcm', 'sài gòn', 'thành phố hồ chí minh',
+            'đà nẵng', 'hải phòng', 'cần thơ', 'nha trang', 'vũng tàu', 'đà lạt'
+        ]
+
+        for city in cities:
+            if city in message:
+                return city.title()
+
+        return message.strip()
+
+    def _extract_property_type(self, message: str) -> str:
+        """Extract loại property từ tin nhắn"""
+        message = message.lower()
+
+        if 'trọ' in message:
+            return 'phong_tro'
+        elif 'căn hộ' in message:
+            return 'can_ho'
+
+        return 'phong_tro'  # default
+
+    def _extract_budget(self, message: str) -> Dict[str, float]:
+        """Extract budget từ tin nhắn"""
+        # Patterns để tìm giá tiền (theo thứ tự ưu tiên)
+        price_patterns = [
+            # Pattern có "từ...đến" với triệu
+            (r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)',
+             lambda x, y: {"min": float(x) * 1000000, "max": float(y) * 1000000}),
+
+            # Pattern có "từ...đến" với số thuần (giả sử là VND)
+            (r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:đồng|vnd|vnđ|$)?',
+             lambda x, y: {"min": float(x), "max": float(y)}),
+
+            # Pattern "X triệu Y" (như "3 triệu 500" = 3.5 triệu)
+            (r'(\d+)\s*(?:triệu|tr)\s*(\d+)',
+             lambda x, y: {"max": (float(x) + float(y)/1000) * 1000000}),
+
+            # Pattern "dưới" với triệu
+            (r'dưới\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)',
+             lambda x: {"max": float(x) * 1000000}),
+
+            # Pattern "trên" với triệu
+            (r'trên\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)',
+             lambda x: {"min": float(x) * 1000000}),
+
+            # Pattern số + triệu (đơn giản)
+            (r'(\d+(?:\.\d+)?)\s*(?:triệu|tr)',
+             lambda x: {"max": float(x) * 1000000}),
+
+            # Pattern số thuần lớn (>= 100000, có thể là VND)
+            (r'\b(\d{6,})\b',
+             lambda x: {"max": float(x)} if float(x) >= 100000 else None),
+
+            # Pattern số nhỏ hơn (có thể là triệu)
+            (r'\b(\d+(?:\.\d+)?)\b',
+             lambda x: {"max": float(x) * 1000000} if float(x) < 100 else {"max": float(x)})
+        ]
+
+        for i, (pattern, extractor) in enumerate(price_patterns):
+            match = re.search(pattern, message.lower())
+            if match:
+                try:
+                    if len(match.groups()) == 2:
+                        result = extractor(match.group(1), match.group(2))
+                    else:
+                        result = extractor(match.group(1))
+
+                    if result:  # Kiểm tra kết quả không None
+                        print(f"Budget extracted: {result}")
+                        return result
+                except Exception as e:
+                    print(f"Error processing pattern {i+1}: {e}")
+                    continue
+
+        print("No budget pattern matched")
+        return {}
+
+    def _extract_area(self, message: str) -> float:
+        """Extract diện tích từ tin nhắn"""
+        match = re.search(r'(\d+(?:\.\d+)?)', message)
+        if match:
+            return float(match.group(1))
+        return 0
+
+    def _extract_location_from_text(self, text: str) -> Dict[str, Optional[str]]:
+        """Trích xuất thông tin location từ text (province và ward)"""
+        result = {'province_name': None, 'ward_name': None}
+
+        text_lower = text.lower()
+
+        # Ưu tiên tìm phường/xã trước để tránh nhầm lẫn với province
+        ward_patterns = [
+            (r'(phường)\s+([a-zA-ZÀ-ỹ0-9\s]+?)(?:\s*[,.]|$)', 'phường'),     # "phường tân định" -> giữ nguyên "Phường Tân Định"
+            (r'(xã)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)', 'xã'),               # "xã tân phú" -> giữ nguyên "Xã Tân Phú"
+            (r'(thị trấn)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)', 'thị trấn'),   # "thị trấn long thành" -> "Thị Trấn Long Thành"
+            (r'(?:p\.?)\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)', None),            # "p. tân định" -> chỉ lấy tên không có prefix
+            (r'(?:ward)\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)', None)             # "ward tan dinh" -> chỉ lấy tên không có prefix
+        ]
+
+        for pattern_info in ward_patterns:
+            if isinstance(pattern_info, tuple):
+                pattern, prefix_to_keep = pattern_info
+                matches = re.findall(pattern, text_lower)
+                if matches:
+                    if len(matches[0]) == 2 and prefix_to_keep:  # Có prefix để giữ
+                        prefix, ward_name = matches[0]
+                        result['ward_name'] = f"{prefix_to_keep.title()} {ward_name.strip().title()}"
+                    else:  # Không giữ prefix hoặc chỉ có tên
+                        ward_name = matches[0][1] if len(matches[0]) == 2 else matches[0]
+                        result['ward_name'] = ward_name.strip().title()
+                    break
+            else:  # Backward compatibility cho pattern cũ
+                matches = re.findall(pattern_info, text_lower)
+                if matches:
+                    ward_name = matches[0].strip()
+                    result['ward_name'] = ward_name.title()
+                    break
+
+        # Chỉ tìm province nếu có prefix rõ ràng hoặc tên thành phố lớn
+        # Patterns cụ thể cho province (không dùng pattern tổng quát gây nhầm lẫn)
+        province_patterns = [
+            r'(?:tp|thành phố)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)',  # "tp hồ chí minh" or "thành phố hồ chí minh"
+            r'(?:tỉnh)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)',         # "tỉnh an giang"
+            r'([a-zA-ZÀ-ỹ\s]+?)\s+(?:province|city)',              # "ho chi minh city"
+            r'(hồ chí minh|hà nội|đà nẵng|cần thơ|hải phòng|an giang|bà rịa|bắc giang|bắc kạn|bạc liêu|bắc ninh|bến tre|bình định|bình dương|bình phước|bình thuận|cà mau|cao bằng|đắk lắk|đắk nông|điện biên|đồng nai|đồng tháp|gia lai|hà giang|hà nam|hà tĩnh|hải dương|hậu giang|hòa bình|hưng yên|khánh hòa|kiên giang|kon tum|lai châu|lâm đồng|lạng sơn|lào cai|long an|nam định|nghệ an|ninh bình|ninh thuận|phú thọ|phú yên|quảng bình|quảng nam|quảng ngãi|quảng ninh|quảng trị|sóc trăng|sơn la|tây ninh|thái bình|thái nguyên|thanh hóa|thừa thiên|tiền giang|trà vinh|tuyên quang|vĩnh long|vĩnh phúc|yên bái)(?=\s|$|[,.])',  # Tên tỉnh/thành phố cụ thể
+        ]
+
+        for pattern in province_patterns:
+            matches = re.findall(pattern, text_lower)
+            if matches:
+                province_name = matches[0].strip()
+                # Normalize common city names
+                if 'hồ chí minh' in province_name or 'hcm' in province_name or 'sài gòn' in province_name:
+                    result['province_name'] = 'Hồ Chí Minh'
+                elif 'hà nội' in province_name:
+                    result['province_name'] = 'Hà Nội'
+                elif 'đà nẵng' in province_name:
+                    result['province_name'] = 'Đà Nẵng'
+                elif 'cần thơ' in province_name:
+                    result['province_name'] = 'Cần Thơ'
+                elif 'hải phòng' in province_name:
+                    result['province_name'] = 'Hải Phòng'
+                else:
+                    result['province_name'] = province_name.title()
+                break
+
+        # Fallback: Tìm province bằng cache nếu chưa có ward và có prefix rõ ràng
+        if not result['province_name'] and not result['ward_name'] and self.provinces_cache:
+            # Chỉ tìm trong cache nếu có prefix "tỉnh" hoặc "thành phố"
+            if any(prefix in text_lower for prefix in ['tỉnh ', 'thành phố ', 'tp ']):
+                for province in self.provinces_cache:
+                    province_name_lower = province['name'].lower()
+                    # Tìm exact match hoặc substring trong text có prefix
+                    if province_name_lower in text_lower:
+                        result['province_name'] = province['name']
+                        break
+
+        return result
+
+    def _extract_amenities_from_text(self, text: str) -> List[str]:
+        """Trích xuất danh sách amenities từ text"""
+        # Các từ khóa tiện ích phổ biến
+        amenity_keywords = {
+            'wifi': ['wifi', 'internet', 'mạng'],
+            'điều hòa': ['điều hòa', 'máy lạnh', 'air conditioner', 'ac'],
+            'máy giặt': ['máy giặt', 'washing machine'],
+            'tủ lạnh': ['tủ lạnh', 'refrigerator', 'fridge'],
+            'bếp': ['bếp', 'kitchen', 'nấu ăn'],
+            'gác lửng': ['gác lửng', 'loft'],
+            'ban công': ['ban công', 'balcony'],
+            'toilet riêng': ['toilet riêng', 'wc riêng', 'nhà vệ sinh riêng'],
+            'bảo vệ': ['bảo vệ', 'security', 'an ninh'],
+            'thang máy': ['thang máy', 'elevator', 'lift'],
+            'chỗ để xe': ['chỗ để xe', 'parking', 'gửi xe']
+        }
+
+        text_lower = text.lower()
+        found_amenities = []
+
+        for amenity_name, keywords in amenity_keywords.items():
+            for keyword in keywords:
+                if keyword in text_lower:
+                    found_amenities.append(amenity_name)
+                    break
+
+        # Map sang amenity IDs
+        return self._get_amenity_ids_by_names(found_amenities)
+
+    def _extract_amenities_with_ids(self, message: str) -> Dict[str, Any]:
+        """Extract tiện ích từ tin nhắn và map sang Object IDs"""
+        # Extract amenity names từ message
+        amenity_names = []
+        message_lower = message.lower()
+
+        # Map keyword trong message với tên chính xác trong database
+        # Dựa trên response API: Wifi, Máy lạnh, Tủ lạnh, Ban công, Máy giặt, Tủ quần áo, Nhà bếp, Bãi đỗ xe, Thang máy, Tivi
+        amenity_mapping = {
+            # Wifi
+            'wifi': 'Wifi',
+            'wi-fi': 'Wifi',
+            'mạng': 'Wifi',
+            'internet': 'Wifi',
+
+            # Máy lạnh
+            'điều hòa': 'Máy lạnh',
+            'máy lạnh': 'Máy lạnh',
+            'air conditioner': 'Máy lạnh',
+            'ac': 'Máy lạnh',
+
+            # Tủ lạnh
+            'tủ lạnh': 'Tủ lạnh',
+            'tủ đá': 'Tủ lạnh',
+            'refrigerator': 'Tủ lạnh',
+            'fridge': 'Tủ lạnh',
+
+            # Ban công
+            'ban công': 'Ban công',
+            'balcony': 'Ban công',
+            'sân phơi': 'Ban công',
+
+            # Máy giặt
+            'máy giặt': 'Máy giặt',
+            'washing machine': 'Máy giặt',
+
+            # Tủ quần áo
+            'tủ quần áo': 'Tủ quần áo',
+            'tủ áo': 'Tủ quần áo',
+            'wardrobe': 'Tủ quần áo',
+
+            # Nhà bếp
+            'nhà bếp': 'Nhà bếp',
+            'bếp': 'Nhà bếp',
+            'kitchen': 'Nhà bếp',
+            'nấu ăn': 'Nhà bếp',
+
+            # Bãi đỗ xe
+            'bãi đỗ xe': 'Bãi đỗ xe',
+            'gửi xe': 'Bãi đỗ xe',
+            'đỗ xe': 'Bãi đỗ xe',
+            'parking': 'Bãi đỗ xe',
+            'chỗ để xe': 'Bãi đỗ xe',
+
+            # Thang máy
+            'thang máy': 'Thang máy',
+            'elevator': 'Thang máy',
+            'lift': 'Thang máy',
+
+            # Tivi
+            'tivi': 'Tivi',
+            'tv': 'Tivi',
+            'television': 'Tivi'
+        }
+
+        # Tìm kiếm keywords trong message
+        found_amenities = set()  # Dùng set để tránh duplicate
+        for keyword, db_name in amenity_mapping.items():
+            if keyword in message_lower:
+                found_amenities.add(db_name)
+
+        amenity_names = list(found_amenities)
+
+        # Map amenity names to IDs using cached data
+        amenity_ids = self._get_amenity_ids_by_names(amenity_names)
+
+        return {
+            'names': amenity_names,
+            'ids': amenity_ids,
+            'text': message.strip()
+        }
+
+    def _extract_university(self, message: str) -> str:
+        """Extract thông tin trường đại học"""
+        message_lower = message.lower()
+
+        # Patterns cho trường đại học
+        university_patterns = [
+            r'(?:đh|đại học)\s+(công nghiệp|bách khoa|kinh tế|sư phạm|y dược|nông lâm|xây dựng|[^,\.\s]+(?:\s+[^,\.\s]+)*)',
+            r'trường\s+(đại học\s+)?([^,\.\s]+(?:\s+[^,\.\s]+)*)',
+            r'\b(uit|hcmut|hust|neu|fpt|rmit|tdt|tdtu|hutech)\b',
+        ]
+
+        for pattern in university_patterns:
+            match = re.search(pattern, message_lower)
+            if match:
+                if isinstance(match.groups(), tuple) and len(match.groups()) > 1:
+                    return ' '.join([g for g in match.groups() if g and g.strip()])
+                else:
+                    return match.group(1) if len(match.groups()) > 0 else match.group(0)
+
+        return message.strip()
+
+
+def legacy_parse(legacy: LegacyExtractors, message: str) -> Dict[str, Any]:
+    return {
+        'city': legacy._extract_location(message),
+        'property_type': legacy._extract_property_type(message),
+        'budget': legacy._extract_budget(message),
+        'area': legacy._extract_area(message),
+        'location': legacy._extract_location_from_text(message),
+        'amenities': sorted(legacy._extract_amenities_with_ids(message)['names']),
+        'amenity_terms': sorted(legacy._extract_amenities_from_text(message)),
+        'university': legacy._extract_university(message)
+    }
+
+
+def engine_parse(extractor: EntityExtractor, message: str) -> Dict[str, Any]:
+    parse = extractor.parse(message)
+    return {
+        'city': parse['city'],
+        'property_type': parse['property_type'],
+        'budget': parse['budget'],
+        'area': parse['area'],
+        'location': parse['location'],
+        'amenities': sorted(parse['amenities']),
+        'amenity_terms': sorted(parse['amenity_terms']),
+        'university': parse['university']
+    }
+
+
+def timed(fn, messages) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        for message in messages:
+            fn(message)
+        return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entity extraction benchmark")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--show-diffs", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages)
+    legacy = LegacyExtractors(PROVINCES)
+    # cache_size=0: đo chi phí parse thật, không phải LRU
+    extractor = EntityExtractor(PROVINCES, cache_size=0)
+
+    legacy_s = timed(lambda m: legacy_parse(legacy, m), messages)
+    engine_s = timed(lambda m: engine_parse(extractor, m), messages)
+    print(f"{len(messages)} messages, automaton states: {len(extractor.automaton)}")
+    print(f"legacy helpers : {len(messages) / legacy_s:,.0f} messages/s")
+    print(f"engine         : {len(messages) / engine_s:,.0f} messages/s ({legacy_s / engine_s:.1f}x)")
+
+    same: Dict[str, int] = {}
+    diffs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for message in sorted(set(messages)):
+            old, new = legacy_parse(legacy, message), engine_parse(extractor, message)
+            for field in old:
+                if old[field] == new[field]:
+                    same[field] = same.get(field, 0) + 1
+                else:
+                    diffs.append((message, field, old[field], new[field]))
+    unique = len(set(messages))
+    print("agreement with legacy (unique messages):")
+    for field in sorted(same, key=lambda f: -same[f]):
+        print(f"  {field:14}: {same[field] / unique:.3f}")
+    for message, field, old, new in diffs[:args.show_diffs]:
+        print(f"  diff {field}: {message!r}: legacy={old!r} engine={new!r}")
+
+
+if __name__ == "__main__":
+    main()
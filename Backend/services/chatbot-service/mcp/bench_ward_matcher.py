@@ -0,0 +1,225 @@
+"""
+Smart Tro MCP - Ward matcher benchmark
+So sánh WardMatcher (trigram index + edit distance) với cách match tuyến tính
+cũ (_fuzzy_match_ward_name + Jaccard ký tự) về lookups/s và độ chính xác
+trên các kiểu nhập thường gặp: đúng tên, không dấu, gõ sai, đảo ký tự,
+thiếu ký tự, có prefix "p."/"phường", và keyword không phải tên phường.
+Cuối cùng đo latency typeahead (PlaceTypeahead.suggest) trên mọi tiền tố.
+
+Dùng gazetteer snapshot nếu có, nếu không thì sinh danh sách phường giả lập.
+
+Usage:
+    python bench_ward_matcher.py
+    python bench_ward_matcher.py --snapshot data/gazetteer.json --queries 2000
+"""
+import argparse
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+from gazetteer import DEFAULT_SNAPSHOT_PATH, normalize_wards
+from typeahead import PlaceTypeahead
+from ward_matcher import WardMatcher, fold_diacritics
+
+SYLLABLES = [
+    'Tân', 'Định', 'An', 'Nhơn', 'Phú', 'Bình', 'Hòa', 'Long', 'Thạnh', 'Mỹ', 'Phước', 'Hiệp',
+    'Thuận', 'Đông', 'Tây', 'Nam', 'Bắc', 'Trung', 'Lộc', 'Khánh', 'Xuân', 'Vĩnh', 'Hưng',
+    'Thành', 'Lợi', 'Quang', 'Sơn', 'Hải', 'Linh', 'Đức', 'Gia', 'Cát', 'Lái', 'Thới', 'Hội'
+]
+
+
+def synthetic_wards(count: int, provinces: int = 34, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    names = set()
+    raw = []
+    while len(raw) < count:
+        prefix = rng.choice(['Phường', 'Phường', 'Xã'])
+        bare = ' '.join(rng.sample(SYLLABLES, rng.choice([2, 2, 3])))
+        # Tên không dấu, bỏ prefix là duy nhất => mỗi query chỉ có một đáp án đúng
+        if fold_diacritics(bare) in names:
+            continue
+        names.add(fold_diacritics(bare))
+        name = f"{prefix} {bare}"
+        raw.append({'name': name, 'province': f"Tỉnh {rng.randrange(provinces)}"})
+    return normalize_wards(raw)
+
+
+def load_wards(snapshot_path: str, count: int) -> List[Dict]:
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            wards = json.load(f)['wards']
+        print(f"Using {len(wards)} wards from {snapshot_path}")
+        return wards
+    except (OSError, KeyError, ValueError):
+        print(f"No snapshot at {snapshot_path}, using {count} synthetic wards")
+        return synthetic_wards(count)
+
+
+# ---------- cách match cũ (baseline) ----------
+
+LEGACY_PREFIXES = ['thị trấn', 'p.', 'p', 'ward', 'commune']
+
+
+def _legacy_strip(text: str) -> str:
+    for prefix in LEGACY_PREFIXES:
+        if text.startswith(prefix + ' '):
+            return text[len(prefix + ' '):].strip()
+        elif text.startswith(prefix):
+            return text[len(prefix):].strip()
+    return text
+
+
+def _legacy_similarity(str1: str, str2: str) -> float:
+    if not str1 or not str2:
+        return 0.0
+    if str1 == str2:
+        return 1.0
+    str1_chars, str2_chars = set(str1.lower()), set(str2.lower())
+    total_chars = str1_chars.union(str2_chars)
+    return len(str1_chars.intersection(str2_chars)) / len(total_chars) if total_chars else 0.0
+
+
+def legacy_match(keyword: str, wards_list: List[Dict]) -> Optional[str]:
+    keyword_lower = keyword.lower().strip()
+    cleaned_keyword = _legacy_strip(keyword_lower)
+    best_match, best_score = None, 0
+    for ward in wards_list:
+        ward_name = ward['name'].lower().strip()
+        cleaned_ward_name = _legacy_strip(ward_name)
+        if cleaned_keyword == cleaned_ward_name or keyword_lower == ward_name:
+            return ward['name']
+        if cleaned_keyword in cleaned_ward_name or cleaned_ward_name in cleaned_keyword:
+            score = min(len(cleaned_keyword), len(cleaned_ward_name)) / max(len(cleaned_keyword), len(cleaned_ward_name))
+            if score > best_score:
+                best_score, best_match = score, ward['name']
+        keyword_words, ward_words = set(cleaned_keyword.split()), set(cleaned_ward_name.split())
+        if keyword_words and ward_words:
+            common_words = keyword_words.intersection(ward_words)
+            if common_words:
+                word_score = len(common_words) / max(len(keyword_words), len(ward_words))
+                if word_score > best_score and word_score >= 0.5:
+                    best_score, best_match = word_score, ward['name']
+        if len(cleaned_keyword) >= 3 and len(cleaned_ward_name) >= 3:
+            similarity = _legacy_similarity(cleaned_keyword, cleaned_ward_name)
+            if similarity > best_score and similarity >= 0.7:
+                best_score, best_match = similarity, ward['name']
+    return best_match if best_score >= 0.6 else None
+
+
+# ---------- bộ query ----------
+
+def _bare(name: str) -> str:
+    for prefix in ('Phường ', 'Xã ', 'Thị trấn '):
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def _typo(text: str, rng: random.Random) -> str:
+    positions = [i for i, ch in enumerate(text) if ch.isalpha()]
+    i = rng.choice(positions)
+    return text[:i] + rng.choice('aeioubcdhmnt') + text[i + 1:]
+
+
+def _transpose(text: str, rng: random.Random) -> str:
+    positions = [i for i in range(len(text) - 1) if text[i].isalpha() and text[i + 1].isalpha() and text[i] != text[i + 1]]
+    i = rng.choice(positions)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def _drop(text: str, rng: random.Random) -> str:
+    positions = [i for i, ch in enumerate(text) if ch.isalpha()]
+    i = rng.choice(positions)
+    return text[:i] + text[i + 1:]
+
+
+QUERY_KINDS = {
+    'exact': lambda name, rng: name,
+    'bare_name': lambda name, rng: _bare(name).lower(),
+    'no_accents': lambda name, rng: fold_diacritics(_bare(name)),
+    'p_prefix': lambda name, rng: f"p. {_bare(name).lower()}",
+    'typo': lambda name, rng: _typo(_bare(name).lower(), rng),
+    'transposed': lambda name, rng: _transpose(_bare(name).lower(), rng),
+    'dropped_char': lambda name, rng: _drop(_bare(name).lower(), rng),
+}
+
+NON_WARD_KEYWORDS = ['gần trường', 'đại học công nghiệp', 'quận 12', 'ký túc xá', 'gần chợ', 'hutech', 'có wifi']
+
+
+def build_queries(wards: List[Dict], per_kind: int, seed: int = 1):
+    rng = random.Random(seed)
+    queries = []
+    for kind, make in QUERY_KINDS.items():
+        for ward in rng.sample(wards, min(per_kind, len(wards))):
+            queries.append((kind, make(ward['name'], rng), ward['name']))
+    for keyword in NON_WARD_KEYWORDS:
+        queries.append(('non_ward', keyword, None))
+    return queries
+
+
+def evaluate(match_fn, queries) -> Dict:
+    """Độ chính xác theo từng loại query; keyword không phải phường phải trả về None"""
+    per_kind = {}
+    start_time = time.perf_counter()
+    for kind, query, expected in queries:
+        got = match_fn(query)
+        bucket = per_kind.setdefault(kind, [0, 0])
+        bucket[1] += 1
+        if expected is None:
+            bucket[0] += got is None
+        else:
+            bucket[0] += got == expected
+    elapsed = time.perf_counter() - start_time
+    correct = sum(b[0] for b in per_kind.values())
+    return {
+        'lookups_per_s': round(len(queries) / elapsed, 1),
+        'accuracy': round(correct / len(queries), 4),
+        'per_kind': {kind: round(b[0] / b[1], 3) for kind, b in per_kind.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ward matcher benchmark")
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_PATH)
+    parser.add_argument("--wards", type=int, default=3300, help="synthetic wards when there is no snapshot")
+    parser.add_argument("--queries", type=int, default=100, help="queries per kind")
+    parser.add_argument("--legacy-queries", type=int, default=30, help="queries per kind for the slow baseline")
+    args = parser.parse_args()
+
+    wards = load_wards(args.snapshot, args.wards)
+
+    start_time = time.perf_counter()
+    matcher = WardMatcher(wards)
+    print(f"Index build: {(time.perf_counter() - start_time) * 1000:.0f}ms, {matcher.stats()}")
+
+    def indexed(query):
+        match = matcher.match(query)
+        return match.name if match else None
+
+    new = evaluate(indexed, build_queries(wards, args.queries))
+    old = evaluate(lambda q: legacy_match(q, wards), build_queries(wards, args.legacy_queries))
+    print(f"legacy linear : {old}")
+    print(f"indexed       : {new}")
+    print(f"speedup       : {new['lookups_per_s'] / old['lookups_per_s']:.0f}x")
+
+    # Typeahead: mọi độ dài tiền tố của tên thật, có và không dấu
+    typeahead = PlaceTypeahead([], wards)
+    rng = random.Random(2)
+    prefixes = []
+    for ward in rng.sample(wards, min(args.queries, len(wards))):
+        for n in range(1, len(ward['name']) + 1):
+            prefixes.append(ward['name'][:n])
+            prefixes.append(fold_diacritics(_bare(ward['name']))[:n])
+    latencies = []
+    for prefix in prefixes:
+        start_time = time.perf_counter()
+        typeahead.suggest(prefix, limit=8)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+    print(f"typeahead     : {len(prefixes)} prefixes, p50={latencies[len(latencies) // 2]:.3f}ms, "
+          f"p99={latencies[int(len(latencies) * 0.99)]:.3f}ms, max={latencies[-1]:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Smart Tro MCP - Lean chat protocol
+Server giữ conversation state chuẩn trong session store; client chỉ gửi lại
+stateVersion. Mỗi turn trả về delta dạng JSON Merge Patch (RFC 7386) so với
+version client đang có, và properties chỉ gồm các field card trong chat grid
+(PropertySlider) thực sự hiển thị.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+# Field mà card trong chat grid (Frontend PropertySlider.jsx) hiển thị
+CARD_FIELDS = (
+    '_id', 'title', 'images', 'isPromoted', 'detailAddress', 'ward', 'province',
+    'rentPrice', 'promotionPrice', 'area', 'maxOccupants', 'amenities'
+)
+
+
+def state_version(state: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Version = hash nội dung state, giống nhau trên mọi worker / backend session"""
+    if state is None:
+        return None
+    payload = json.dumps(state, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def diff_state(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge patch biến `old` thành `new`: key đổi/thêm mang giá trị mới, key bị xóa = None"""
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            child = diff_state(old[key], value)
+            if child:
+                patch[key] = child
+        elif value != old[key]:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+def apply_patch(state: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Áp merge patch (phía client làm tương tự); trả về dict mới"""
+    result = dict(state)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = apply_patch(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def project_property(prop: Dict[str, Any]) -> Dict[str, Any]:
+    """Chỉ giữ field card cần; ảnh đầu tiên, tiện ích chỉ còn tên"""
+    card = {field: prop[field] for field in CARD_FIELDS if prop.get(field) not in (None, '', [])}
+    if card.get('images'):
+        card['images'] = card['images'][:1]
+    if card.get('amenities'):
+        # Node trả `amenities` là ID, tên nằm trong `fullAmenities`
+        names = {str(a.get('_id')): a.get('name') for a in prop.get('fullAmenities') or [] if isinstance(a, dict)}
+        card['amenities'] = [
+            amenity.get('name') or amenity.get('_id') if isinstance(amenity, dict) else names.get(str(amenity), amenity)
+            for amenity in card['amenities']
+        ]
+    return card
+
+
+def project_properties(properties: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+    if properties is None:
+        return None
+    return [project_property(prop) for prop in properties]
@@ -0,0 +1,146 @@
+"""
+Smart Tro MCP - Circuit breaker
+Mỗi upstream (Node search, amenities, vietnamlabs.com) có một breaker riêng:
+- closed: request đi bình thường; tỷ lệ lỗi trong cửa sổ trượt vượt ngưỡng => open
+- open: từ chối ngay (không chờ timeout 5-10s), caller dùng fallback
+- half_open: sau `open_seconds` cho vài request thăm dò; thành công => closed,
+  lỗi => open lại
+"""
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Breaker theo tỷ lệ lỗi trong `window_seconds` gần nhất (cần ít nhất `minimum_calls` call)
+
+    acquire() trả về permit (None = bị từ chối); kết quả call báo lại bằng
+    record(permit, ok), hoặc release(permit) nếu call bị hủy. Permit gắn với
+    "thế hệ" trạng thái nên kết quả của call bắt đầu trước khi breaker đổi
+    trạng thái không làm sai lệch lượt thăm dò.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, minimum_calls: int = 5,
+                 window_seconds: float = 30, open_seconds: float = 15, half_open_calls: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_rate_threshold = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+
+        self._state = CLOSED
+        self._generation = 0
+        self._opened_at = 0.0
+        self._outcomes: deque = deque()  # (thời điểm, ok) trong cửa sổ
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+        self.opened = 0
+        self.rejected = 0
+        self.last_change: Optional[Dict[str, Any]] = None
+
+    # ---------- trạng thái ----------
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, 'open timeout elapsed')
+        return self._state
+
+    def retry_after(self) -> float:
+        """Số giây đến lượt thăm dò tiếp theo (0 nếu đang nhận request)"""
+        if self.state != OPEN:
+            return 0.0
+        return round(max(0.0, self.open_seconds - (self._clock() - self._opened_at)), 1)
+
+    def _transition(self, state: str, reason: str):
+        self._state = state
+        self._generation += 1
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = self._clock()
+            self.opened += 1
+        if state == CLOSED:
+            self._outcomes.clear()
+            self._failures = 0
+        self.last_change = {'state': state, 'reason': reason, 'at': datetime.now().isoformat()}
+        print(f"Circuit '{self.name}' -> {state} ({reason})")
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def failure_rate(self) -> Optional[float]:
+        self._prune(self._clock())
+        if not self._outcomes:
+            return None
+        return self._failures / len(self._outcomes)
+
+    # ---------- permit ----------
+
+    def acquire(self) -> Optional[int]:
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probes >= self.half_open_calls):
+            self.rejected += 1
+            return None
+        if state == HALF_OPEN:
+            self._probes += 1
+        return self._generation
+
+    def release(self, permit: Optional[int]):
+        """Call bị hủy trước khi có kết quả: trả lại suất thăm dò"""
+        if permit == self._generation and self._state == HALF_OPEN:
+            self._probes -= 1
+
+    def record(self, permit: Optional[int], ok: bool):
+        if permit is None or permit != self._generation:
+            return
+        if self._state == HALF_OPEN:
+            if not ok:
+                self._transition(OPEN, 'probe failed')
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CLOSED, 'probe succeeded')
+            return
+
+        now = self._clock()
+        self._outcomes.append((now, ok))
+        if not ok:
+            self._failures += 1
+        self._prune(now)
+        calls = len(self._outcomes)
+        if calls >= self.minimum_calls and self._failures / calls >= self.failure_rate_threshold:
+            self._transition(OPEN, f"{self._failures}/{calls} failures in {self.window_seconds:g}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        rate = self.failure_rate()
+        return {
+            'state': self.state,
+            'failure_rate': round(rate, 3) if rate is not None else None,
+            'window_calls': len(self._outcomes),
+            'retry_after_seconds': self.retry_after(),
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'last_change': self.last_change,
+            'settings': {
+                'failure_rate': self.failure_rate_threshold,
+                'minimum_calls': self.minimum_calls,
+                'window_seconds': self.window_seconds,
+                'open_seconds': self.open_seconds,
+                'half_open_calls': self.half_open_calls
+            }
+        }
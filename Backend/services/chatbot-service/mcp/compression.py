@@ -0,0 +1,167 @@
+"""
+Smart Tro MCP - Response compression
+ASGI middleware nén response (brotli nếu có package `brotli`, không thì gzip)
+khi body lớn hơn ngưỡng, và đo số byte mỗi turn (request, response gốc, byte
+thực gửi) theo path + protocol để so sánh full vs lean.
+Response streaming (SSE...) được chuyển thẳng, không buffer, không nén.
+"""
+import gzip
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli là optional => chỉ dùng gzip
+    brotli = None
+
+# Header endpoint gắn vào response để metrics tách theo protocol (full / lean / stream)
+PROTOCOL_HEADER = b"x-chat-protocol"
+
+
+class _BytesStats:
+    def __init__(self):
+        self.turns = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.wire_bytes = 0
+        self.compressed = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        turns = self.turns or 1
+        return {
+            'turns': self.turns,
+            'compressed': self.compressed,
+            'avg_request_bytes': round(self.request_bytes / turns),
+            'avg_response_bytes': round(self.response_bytes / turns),
+            'avg_wire_bytes': round(self.wire_bytes / turns),
+            'total_wire_bytes': self.wire_bytes
+        }
+
+
+class PayloadMetrics:
+    """Byte mỗi turn theo "<path> <protocol>" (middleware ghi, /api/metrics đọc)"""
+
+    def __init__(self, paths: Iterable[str] = ()):
+        self.paths = set(paths)
+        self.minimum_size = None
+        self._stats: Dict[str, _BytesStats] = {}
+
+    def record(self, key: str, request_bytes: int, response_bytes: int, wire_bytes: int, compressed: bool):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _BytesStats()
+        stats.turns += 1
+        stats.request_bytes += request_bytes
+        stats.response_bytes += response_bytes
+        stats.wire_bytes += wire_bytes
+        stats.compressed += int(compressed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'encodings': ['br', 'gzip'] if brotli is not None else ['gzip'],
+            'minimum_size': self.minimum_size,
+            'per_turn': {key: stats.snapshot() for key, stats in sorted(self._stats.items())}
+        }
+
+
+class CompressionMiddleware:
+    """
+    Nén response hoàn chỉnh >= `minimum_size` byte theo Accept-Encoding (br > gzip)
+
+    Nếu có `metrics`, request tới `metrics.paths` được đo byte/turn.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 metrics: Optional[PayloadMetrics] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.minimum_size = minimum_size
+
+    def _encoding(self, scope) -> Optional[str]:
+        accept = ''
+        for name, value in scope.get('headers', []):
+            if name == b'accept-encoding':
+                accept = value.decode('latin-1').lower()
+                break
+        if brotli is not None and 'br' in accept:
+            return 'br'
+        if 'gzip' in accept:
+            return 'gzip'
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._encoding(scope)
+        measure = self.metrics is not None and scope.get('path') in self.metrics.paths
+        request_bytes = 0
+        start_message = None
+        chunks = []
+        streaming = False
+        sent = {'wire': 0, 'raw': 0, 'compressed': False, 'protocol': None}
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message['type'] == 'http.request':
+                request_bytes += len(message.get('body', b''))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal start_message, streaming
+            if message['type'] == 'http.response.start':
+                start_message = message
+                for name, value in message.get('headers', []):
+                    if name == PROTOCOL_HEADER:
+                        sent['protocol'] = value.decode('latin-1')
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            sent['raw'] += len(body)
+            if streaming or (message.get('more_body') and not chunks):
+                # Streaming: gửi header gốc rồi chuyển thẳng từng chunk
+                if not streaming:
+                    streaming = True
+                    await send(start_message)
+                sent['wire'] += len(body)
+                await send(message)
+                return
+
+            chunks.append(body)
+            if message.get('more_body'):
+                return
+            body = b''.join(chunks)
+            headers = [(k, v) for k, v in start_message.get('headers', [])]
+            already_encoded = any(k == b'content-encoding' for k, _ in headers)
+            if encoding and not already_encoded and len(body) >= self.minimum_size:
+                body = self._compress(body, encoding)
+                headers = [(k, v) for k, v in headers if k != b'content-length']
+                headers += [
+                    (b'content-encoding', encoding.encode()),
+                    (b'content-length', str(len(body)).encode()),
+                    (b'vary', b'Accept-Encoding')
+                ]
+                sent['compressed'] = True
+            sent['wire'] += len(body)
+            await send(dict(start_message, headers=headers))
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, counting_receive if measure else receive, send_wrapper)
+
+        if measure:
+            protocol = sent['protocol'] or ('stream' if streaming else 'full')
+            self.metrics.record(f"{scope['path']} {protocol}", request_bytes,
+                                sent['raw'], sent['wire'], sent['compressed'])
@@ -0,0 +1,444 @@
+"""
+Smart Tro MCP - Entity extraction engine
+Chuẩn hóa tin nhắn một lần (NFC, lowercase, bỏ dấu giữ nguyên độ dài) rồi
+quét một lượt Aho-Corasick qua toàn bộ từ điển: tỉnh/thành, tiện ích, trường
+đại học, loại nhà và các từ khóa kích hoạt. Regex (đã compile sẵn) chỉ chạy
+khi từ khóa kích hoạt của nó xuất hiện, ví dụ pattern phường/xã chỉ chạy khi
+có "phường", "xã", "p."...
+
+parse(message) trả về một dict dùng chung cho mọi step handler.
+"""
+import re
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# ---------- từ điển ----------
+
+# Keyword trong tin nhắn -> tên tiện ích chính xác trong database
+# (Wifi, Máy lạnh, Tủ lạnh, Ban công, Máy giặt, Tủ quần áo, Nhà bếp, Bãi đỗ xe, Thang máy, Tivi)
+AMENITY_KEYWORDS = {
+    'wifi': 'Wifi', 'wi-fi': 'Wifi', 'mạng': 'Wifi', 'internet': 'Wifi',
+    'điều hòa': 'Máy lạnh', 'máy lạnh': 'Máy lạnh', 'air conditioner': 'Máy lạnh', 'ac': 'Máy lạnh',
+    'tủ lạnh': 'Tủ lạnh', 'tủ đá': 'Tủ lạnh', 'refrigerator': 'Tủ lạnh', 'fridge': 'Tủ lạnh',
+    'ban công': 'Ban công', 'balcony': 'Ban công', 'sân phơi': 'Ban công',
+    'máy giặt': 'Máy giặt', 'washing machine': 'Máy giặt',
+    'tủ quần áo': 'Tủ quần áo', 'tủ áo': 'Tủ quần áo', 'wardrobe': 'Tủ quần áo',
+    'nhà bếp': 'Nhà bếp', 'bếp': 'Nhà bếp', 'kitchen': 'Nhà bếp', 'nấu ăn': 'Nhà bếp',
+    'bãi đỗ xe': 'Bãi đỗ xe', 'gửi xe': 'Bãi đỗ xe', 'đỗ xe': 'Bãi đỗ xe', 'parking': 'Bãi đỗ xe',
+    'chỗ để xe': 'Bãi đỗ xe',
+    'thang máy': 'Thang máy', 'elevator': 'Thang máy', 'lift': 'Thang máy',
+    'tivi': 'Tivi', 'tv': 'Tivi', 'television': 'Tivi'
+}
+
+# Tên tiện ích chung (dùng khi criteria chứa tên thay vì ID) -> các keyword
+AMENITY_TERMS = {
+    'wifi': ['wifi', 'internet', 'mạng'],
+    'điều hòa': ['điều hòa', 'máy lạnh', 'air conditioner', 'ac'],
+    'máy giặt': ['máy giặt', 'washing machine'],
+    'tủ lạnh': ['tủ lạnh', 'refrigerator', 'fridge'],
+    'bếp': ['bếp', 'kitchen', 'nấu ăn'],
+    'gác lửng': ['gác lửng', 'loft'],
+    'ban công': ['ban công', 'balcony'],
+    'toilet riêng': ['toilet riêng', 'wc riêng', 'nhà vệ sinh riêng'],
+    'bảo vệ': ['bảo vệ', 'security', 'an ninh'],
+    'thang máy': ['thang máy', 'elevator', 'lift'],
+    'chỗ để xe': ['chỗ để xe', 'parking', 'gửi xe']
+}
+
+PROVINCE_NAMES = [
+    'hồ chí minh', 'hà nội', 'đà nẵng', 'cần thơ', 'hải phòng', 'an giang', 'bà rịa', 'bắc giang',
+    'bắc kạn', 'bạc liêu', 'bắc ninh', 'bến tre', 'bình định', 'bình dương', 'bình phước',
+    'bình thuận', 'cà mau', 'cao bằng', 'đắk lắk', 'đắk nông', 'điện biên', 'đồng nai', 'đồng tháp',
+    'gia lai', 'hà giang', 'hà nam', 'hà tĩnh', 'hải dương', 'hậu giang', 'hòa bình', 'hưng yên',
+    'khánh hòa', 'kiên giang', 'kon tum', 'lai châu', 'lâm đồng', 'lạng sơn', 'lào cai', 'long an',
+    'nam định', 'nghệ an', 'ninh bình', 'ninh thuận', 'phú thọ', 'phú yên', 'quảng bình',
+    'quảng nam', 'quảng ngãi', 'quảng ninh', 'quảng trị', 'sóc trăng', 'sơn la', 'tây ninh',
+    'thái bình', 'thái nguyên', 'thanh hóa', 'thừa thiên', 'tiền giang', 'trà vinh', 'tuyên quang',
+    'vĩnh long', 'vĩnh phúc', 'yên bái'
+]
+PROVINCE_ALIASES = {'sài gòn': 'Hồ Chí Minh', 'tp hcm': 'Hồ Chí Minh', 'tphcm': 'Hồ Chí Minh', 'hcm': 'Hồ Chí Minh'}
+
+# Thành phố hay gặp ở câu chào (thứ tự = ưu tiên, giống danh sách cũ)
+GREETING_CITIES = [
+    'hà nội', 'hồ chí minh', 'tp hcm', 'sài gòn', 'thành phố hồ chí minh',
+    'đà nẵng', 'hải phòng', 'cần thơ', 'nha trang', 'vũng tàu', 'đà lạt'
+]
+
+UNIVERSITY_ABBREVIATIONS = ['uit', 'hcmut', 'hust', 'neu', 'fpt', 'rmit', 'tdt', 'tdtu', 'hutech']
+
+# Từ khóa kích hoạt regex: category -> các từ
+TRIGGERS = {
+    'ward_prefix': ['phường', 'xã', 'thị trấn', 'p', 'p.', 'ward'],
+    'province_prefix': ['tp', 'thành phố', 'tỉnh'],
+    'province_suffix': ['province', 'city'],
+    'university_prefix': ['đh', 'đại học', 'trường'],
+    'property_type': ['trọ', 'căn hộ'],
+}
+
+# Không match bản bỏ dấu cho các từ mà bản không dấu là từ thông dụng khác nghĩa
+ACCENT_REQUIRED = {'mạng', 'bếp', 'xã', 'tủ áo', 'tủ đá', 'trọ', 'đỗ xe', 'tỉnh', 'trường', 'đh',
+                   'bảo vệ', 'an ninh', 'bà rịa', 'hà nam', 'sơn la', 'long an', 'gia lai'}
+
+# ---------- regex compile sẵn ----------
+
+BUDGET_PATTERNS = [
+    # "từ...đến" với triệu
+    (re.compile(r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)'),
+     lambda x, y: {"min": float(x) * 1000000, "max": float(y) * 1000000}),
+    # "từ...đến" với số thuần (giả sử là VND)
+    (re.compile(r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:đồng|vnd|vnđ|$)?'),
+     lambda x, y: {"min": float(x), "max": float(y)}),
+    # "X triệu Y" (như "3 triệu 500" = 3.5 triệu)
+    (re.compile(r'(\d+)\s*(?:triệu|tr)\s*(\d+)'),
+     lambda x, y: {"max": (float(x) + float(y) / 1000) * 1000000}),
+    # "dưới" với triệu
+    (re.compile(r'dưới\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)'),
+     lambda x: {"max": float(x) * 1000000}),
+    # "trên" với triệu
+    (re.compile(r'trên\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)'),
+     lambda x: {"min": float(x) * 1000000}),
+    # số + triệu (đơn giản)
+    (re.compile(r'(\d+(?:\.\d+)?)\s*(?:triệu|tr)'),
+     lambda x: {"max": float(x) * 1000000}),
+    # số thuần lớn (>= 100000, có thể là VND)
+    (re.compile(r'\b(\d{6,})\b'),
+     lambda x: {"max": float(x)} if float(x) >= 100000 else None),
+    # số nhỏ hơn (có thể là triệu)
+    (re.compile(r'\b(\d+(?:\.\d+)?)\b'),
+     lambda x: {"max": float(x) * 1000000} if float(x) < 100 else {"max": float(x)})
+]
+
+NUMBER_PATTERN = re.compile(r'(\d+(?:\.\d+)?)')
+
+# (pattern, prefix giữ lại trong tên phường)
+WARD_PATTERNS = [
+    (re.compile(r'(phường)\s+([a-zA-ZÀ-ỹ0-9\s]+?)(?:\s*[,.]|$)'), 'phường'),
+    (re.compile(r'(xã)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)'), 'xã'),
+    (re.compile(r'(thị trấn)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)'), 'thị trấn'),
+    (re.compile(r'\bp\.?\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)'), None),
+    (re.compile(r'\bward\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)'), None)
+]
+
+PROVINCE_PREFIX_PATTERNS = [
+    re.compile(r'(?:tp|thành phố)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)'),
+    re.compile(r'(?:tỉnh)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)'),
+]
+PROVINCE_SUFFIX_PATTERN = re.compile(r'([a-zA-ZÀ-ỹ\s]+?)\s+(?:province|city)')
+
+UNIVERSITY_PATTERNS = [
+    re.compile(r'(?:đh|đại học)\s+(công nghiệp|bách khoa|kinh tế|sư phạm|y dược|nông lâm|xây dựng|[^,\.\s]+(?:\s+[^,\.\s]+)*)'),
+    re.compile(r'trường\s+(đại học\s+)?([^,\.\s]+(?:\s+[^,\.\s]+)*)'),
+]
+
+LOCATION_KEYWORD_PATTERNS = [
+    re.compile(r'(?:quận|q\.?|huyện)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)', re.IGNORECASE),
+    re.compile(r'(?:tỉnh|thành phố|tp\.?)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)', re.IGNORECASE),
+    re.compile(r'(?:phường|p\.?|xã|thị trấn)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)', re.IGNORECASE),
+    re.compile(r'([a-zA-ZÀ-ỹ\s]+)(?=\s*[,\.]|$)', re.IGNORECASE)
+]
+
+# ---------- chuẩn hóa ----------
+
+
+def _build_fold_table() -> Dict[int, str]:
+    """Bảng str.translate: ký tự Latin có dấu -> ký tự không dấu (đúng 1 ký tự)"""
+    table = {ord('đ'): 'd', ord('Đ'): 'D'}
+    for code in range(0xC0, 0x1EFA):
+        ch = chr(code)
+        base = ''.join(c for c in unicodedata.normalize('NFD', ch) if unicodedata.category(c) != 'Mn')
+        if len(base) == 1 and base != ch:
+            table[code] = base
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+_DIGIT = re.compile(r'\d')
+
+
+def fold(lower: str) -> str:
+    """Bỏ dấu từng ký tự, giữ nguyên độ dài (input đã NFC + lowercase)"""
+    if lower.isascii():
+        return lower
+    return lower.translate(_FOLD_TABLE)
+
+
+def canonical_province(name: str) -> str:
+    """Chuẩn hóa tên tỉnh bắt được từ regex (giống logic cũ)"""
+    if 'hồ chí minh' in name or 'hcm' in name or 'sài gòn' in name:
+        return 'Hồ Chí Minh'
+    if 'hà nội' in name:
+        return 'Hà Nội'
+    if 'đà nẵng' in name:
+        return 'Đà Nẵng'
+    if 'cần thơ' in name:
+        return 'Cần Thơ'
+    if 'hải phòng' in name:
+        return 'Hải Phòng'
+    return name.title()
+
+
+# ---------- Aho-Corasick ----------
+
+class Automaton:
+    """Aho-Corasick trên chuỗi bỏ dấu; mỗi output là (độ dài, payload)"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+
+    def add(self, term: str, payload: Any):
+        state = 0
+        for ch in term:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((len(term), payload))
+
+    def build(self) -> 'Automaton':
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+        return self
+
+    def __len__(self):
+        return len(self._goto)
+
+    def scan(self, text: str) -> Iterable[Tuple[int, int, Any]]:
+        """Mọi match (start, end, payload), kể cả chồng lấn"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, payload in out[state]:
+                    yield i + 1 - length, i + 1, payload
+
+
+def _is_boundary(text: str, start: int, end: int) -> bool:
+    return ((start == 0 or not text[start - 1].isalnum())
+            and (end == len(text) or not text[end].isalnum() or not text[end - 1].isalnum()))
+
+
+class EntityExtractor:
+    """
+    Bộ trích xuất dùng chung: build automaton một lần (và lại khi danh sách
+    tỉnh của gazetteer đổi), parse() có LRU nhỏ vì cùng một chuỗi keyword
+    thường được parse nhiều lần trong một lượt tìm kiếm.
+    """
+
+    def __init__(self, gazetteer_provinces: Optional[List[str]] = None, cache_size: int = 512):
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._cache_lock = Lock()
+        self.parses = 0
+        self.cache_hits = 0
+
+        automaton = Automaton()
+
+        def add(term, category, value, priority=0):
+            term = unicodedata.normalize('NFC', term.lower())
+            accented = term if term in ACCENT_REQUIRED else None
+            automaton.add(fold(term), (category, value, priority, accented))
+
+        for keyword, db_name in AMENITY_KEYWORDS.items():
+            add(keyword, 'amenity', db_name)
+        for generic_name, keywords in AMENITY_TERMS.items():
+            for keyword in keywords:
+                add(keyword, 'amenity_term', generic_name)
+        for name in PROVINCE_NAMES:
+            add(name, 'province', canonical_province(name))
+        for alias, canonical in PROVINCE_ALIASES.items():
+            add(alias, 'province', canonical)
+        for priority, name in enumerate(gazetteer_provinces or []):
+            if name:
+                add(name, 'gazetteer_province', name, priority)
+        for priority, city in enumerate(GREETING_CITIES):
+            add(city, 'city', city.title(), priority)
+        for abbreviation in UNIVERSITY_ABBREVIATIONS:
+            add(abbreviation, 'university', abbreviation)
+        for category, words in TRIGGERS.items():
+            for word in words:
+                add(word, category, word)
+        self.automaton = automaton.build()
+
+    # ---------- parse ----------
+
+    def scan(self, lower: str, folded: str) -> Dict[str, List[Tuple[int, int, Any, int]]]:
+        """Một lượt automaton -> hits theo category (start, end, value, priority)"""
+        hits: Dict[str, List[Tuple[int, int, Any, int]]] = {}
+        for start, end, (category, value, priority, accented) in self.automaton.scan(folded):
+            if not _is_boundary(folded, start, end):
+                continue
+            if accented is not None and lower[start:end] != accented:
+                continue
+            hits.setdefault(category, []).append((start, end, value, priority))
+        return hits
+
+    def parse(self, message: str) -> Dict[str, Any]:
+        """Parse đầy đủ một tin nhắn; kết quả chỉ đọc, dùng chung cho mọi handler"""
+        message = message or ''
+        with self._cache_lock:
+            self.parses += 1
+            cached = self._cache.get(message)
+            if cached is not None:
+                self._cache.move_to_end(message)
+                self.cache_hits += 1
+                return cached
+
+        text = message.strip()
+        lower = unicodedata.normalize('NFC', message).lower()
+        folded = fold(lower)
+        hits = self.scan(lower, folded)
+        has_digit = _DIGIT.search(lower) is not None
+
+        result = {
+            'text': text,
+            'lower': lower,
+            'hits': hits,
+            'property_type': self._property_type(hits),
+            'city': self._city(hits, lower),
+            'budget': self._budget(lower) if has_digit else {},
+            'area': self._area(message) if has_digit else 0,
+            'location': self._location(lower, hits),
+            'amenities': _unique(value for _, _, value, _ in hits.get('amenity', ())),
+            'amenity_terms': _unique(value for _, _, value, _ in hits.get('amenity_term', ())),
+            'university': self._university(lower, hits, text)
+        }
+
+        if self.cache_size > 0:
+            with self._cache_lock:
+                self._cache[message] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    # ---------- từng loại thực thể ----------
+
+    @staticmethod
+    def _property_type(hits) -> str:
+        words = {value for _, _, value, _ in hits.get('property_type', ())}
+        if 'trọ' in words:
+            return 'phong_tro'
+        if 'căn hộ' in words:
+            return 'can_ho'
+        return 'phong_tro'  # default
+
+    @staticmethod
+    def _city(hits, lower: str) -> str:
+        cities = hits.get('city')
+        if cities:
+            return min(cities, key=lambda hit: hit[3])[2]
+        return lower.strip()
+
+    @staticmethod
+    def _budget(lower: str) -> Dict[str, float]:
+        for i, (pattern, extractor) in enumerate(BUDGET_PATTERNS):
+            match = pattern.search(lower)
+            if match:
+                try:
+                    result = extractor(*match.groups())
+                    if result:
+                        return result
+                except Exception as e:
+                    print(f"Error processing pattern {i + 1}: {e}")
+        return {}
+
+    @staticmethod
+    def _area(message: str) -> float:
+        match = NUMBER_PATTERN.search(message)
+        return float(match.group(1)) if match else 0
+
+    @staticmethod
+    def _location(lower: str, hits) -> Dict[str, Optional[str]]:
+        result = {'province_name': None, 'ward_name': None}
+
+        # Ưu tiên tìm phường/xã trước để tránh nhầm lẫn với province
+        if 'ward_prefix' in hits:
+            for pattern, prefix_to_keep in WARD_PATTERNS:
+                match = pattern.search(lower)
+                if match:
+                    ward_name = match.group(match.lastindex).strip().title()
+                    result['ward_name'] = f"{prefix_to_keep.title()} {ward_name}" if prefix_to_keep else ward_name
+                    break
+
+        # Province: prefix rõ ràng ("tp", "tỉnh"), "... city", rồi từ điển tên tỉnh
+        captured = None
+        if 'province_prefix' in hits:
+            for pattern in PROVINCE_PREFIX_PATTERNS:
+                match = pattern.search(lower)
+                if match:
+                    captured = canonical_province(match.group(1).strip())
+                    break
+        if captured is None and 'province_suffix' in hits:
+            match = PROVINCE_SUFFIX_PATTERN.search(lower)
+            if match:
+                captured = canonical_province(match.group(1).strip())
+        if captured is None and 'province' in hits:
+            captured = min(hits['province'], key=lambda hit: hit[0])[2]
+        result['province_name'] = captured
+
+        # Fallback: tên tỉnh theo gazetteer, chỉ khi có prefix rõ ràng và chưa có ward
+        if (not result['province_name'] and not result['ward_name']
+                and 'province_prefix' in hits and 'gazetteer_province' in hits):
+            result['province_name'] = min(hits['gazetteer_province'], key=lambda hit: hit[3])[2]
+        return result
+
+    @staticmethod
+    def _university(lower: str, hits, text: str) -> str:
+        if 'university_prefix' in hits:
+            for pattern in UNIVERSITY_PATTERNS:
+                match = pattern.search(lower)
+                if match:
+                    return ' '.join(g for g in match.groups() if g and g.strip())
+        if 'university' in hits:
+            return min(hits['university'], key=lambda hit: hit[0])[2]
+        return text
+
+    @staticmethod
+    def location_keywords(parse: Dict[str, Any]) -> List[str]:
+        """Keywords khu vực chưa map được thành province/ward (cho search text)"""
+        location = parse['location']
+        if location.get('province_name') and location.get('ward_name'):
+            return []
+        keywords = []
+        for pattern in LOCATION_KEYWORD_PATTERNS:
+            for match in pattern.findall(parse['text']):
+                match_text = match.strip()
+                if (match_text and match_text != location.get('province_name')
+                        and match_text != location.get('ward_name')):
+                    keywords.append(match_text)
+        return keywords
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cache_lock:
+            return {
+                'automaton_states': len(self.automaton),
+                'parses': self.parses,
+                'cache_hits': self.cache_hits,
+                'cache_entries': len(self._cache)
+            }
+
+
+def _unique(values: Iterable[str]) -> List[str]:
+    seen = []
+    for value in values:
+        if value not in seen:
+            seen.append(value)
+    return seen
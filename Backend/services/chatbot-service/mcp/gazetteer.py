@@ -0,0 +1,307 @@
+"""
+Smart Tro MCP - Gazetteer (tỉnh/thành + phường/xã)
+Tải danh sách tỉnh và phường/xã từ vietnamlabs.com song song (pool giới hạn),
+chuẩn hóa rồi lưu thành snapshot JSON có version trên đĩa. Snapshot được build
+sẵn lúc build image (`python gazetteer.py`), khi khởi động service chỉ đọc
+snapshot (vài ms); mạng chỉ dùng để refresh ở background.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from typeahead import PlaceTypeahead
+from ward_matcher import WardMatcher
+
+# Tăng khi format snapshot thay đổi - snapshot cũ sẽ bị bỏ qua và tải lại
+SNAPSHOT_FORMAT = 1
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.json")
+
+
+def normalize_province(province: Dict[str, Any]) -> Dict[str, str]:
+    """Format province giống provinces_cache cũ"""
+    name = (province.get('name') or '').strip()
+    return {'name': name, 'code': name.lower().replace(' ', '_')}
+
+
+def normalize_wards(raw_wards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Format wards giống fetchWards trong locationService.js"""
+    formatted_wards = []
+    for index, ward in enumerate(raw_wards):
+        formatted_wards.append({
+            'id': index,  # Simple index cho frontend
+            'code': ward.get('name', ''),  # Sử dụng tên ward làm code để match với schema
+            'name': ward.get('name', ''),  # Tên ward để hiển thị và lưu vào DB
+            'province': ward.get('province', ''),
+            'mergedFrom': ward.get('mergedFrom') or []  # Đảm bảo luôn có array
+        })
+    return formatted_wards
+
+
+class Gazetteer:
+    """
+    Danh sách tỉnh + phường/xã dùng chung cho toàn service
+
+    - load_snapshot(): đọc snapshot local, không gọi mạng
+    - arefresh(): tải lại từ vietnamlabs.com qua AsyncHttpClient chung của service
+      (tối đa `max_workers` request song song), ghi snapshot mới (atomic) rồi swap
+      vào bộ nhớ
+    - schedule_refresh(): arefresh() ở background trên event loop đang chạy
+    """
+
+    def __init__(self, api_url: str, snapshot_path: str = DEFAULT_SNAPSHOT_PATH,
+                 max_workers: int = 8, max_age_hours: float = 168, timeout: float = 5,
+                 retries: int = 2):
+        self.api_url = api_url.rstrip('/')
+        self.snapshot_path = snapshot_path
+        self.max_workers = max_workers
+        self.max_age_seconds = max_age_hours * 3600
+        self.timeout = timeout
+        self.retries = retries
+
+        self.provinces: List[Dict[str, str]] = []
+        self.wards: List[Dict[str, Any]] = []
+        self.wards_by_province: Dict[str, List[Dict[str, Any]]] = {}
+        self.ward_matcher = WardMatcher([])
+        self.typeahead = PlaceTypeahead([], [])
+        self.version: Optional[str] = None
+        self.created_at: Optional[float] = None
+        self.source: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.last_refresh: Dict[str, Any] = {}
+
+    # ---------- trạng thái ----------
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.provinces)
+
+    def is_stale(self) -> bool:
+        if not self.loaded or self.created_at is None:
+            return True
+        return time.time() - self.created_at > self.max_age_seconds
+
+    def _install(self, snapshot: Dict[str, Any], source: str):
+        """Swap toàn bộ dữ liệu một lần để reader không thấy trạng thái nửa vời"""
+        wards_by_province: Dict[str, List[Dict[str, Any]]] = {}
+        for ward in snapshot['wards']:
+            wards_by_province.setdefault(ward['province'], []).append(ward)
+        # Build index fuzzy match + typeahead một lần cho mỗi snapshot, ngoài lock
+        ward_matcher = WardMatcher(snapshot['wards'])
+        typeahead = PlaceTypeahead(snapshot['provinces'], snapshot['wards'])
+        with self._lock:
+            self.provinces = snapshot['provinces']
+            self.wards = snapshot['wards']
+            self.wards_by_province = wards_by_province
+            self.ward_matcher = ward_matcher
+            self.typeahead = typeahead
+            self.version = snapshot['version']
+            self.created_at = snapshot['created_at']
+            self.source = source
+
+    def wards_for(self, province_name: str) -> List[Dict[str, Any]]:
+        return self.wards_by_province.get(province_name, [])
+
+    # ---------- snapshot ----------
+
+    def load_snapshot(self) -> bool:
+        """Đọc snapshot từ đĩa; trả về False nếu không có hoặc sai format"""
+        start_time = time.perf_counter()
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            print(f"Gazetteer snapshot not found: {self.snapshot_path}")
+            return False
+        except Exception as e:
+            print(f"Error reading gazetteer snapshot: {e}")
+            return False
+
+        if snapshot.get('format') != SNAPSHOT_FORMAT or not snapshot.get('provinces'):
+            print(f"Ignoring gazetteer snapshot with format {snapshot.get('format')}")
+            return False
+
+        self._install(snapshot, source='snapshot')
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        print(f"Loaded gazetteer snapshot {self.version}: {len(self.provinces)} provinces, "
+              f"{len(self.wards)} wards in {elapsed_ms:.1f}ms")
+        return True
+
+    def _write_snapshot(self, snapshot: Dict[str, Any]):
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    # ---------- network (qua AsyncHttpClient dùng chung của service) ----------
+
+    async def _afetch_province_wards(self, http, province_name: str) -> List[Dict[str, Any]]:
+        data = await http.get_json(
+            f"{self.api_url}/vietnamprovince",
+            {'province': province_name, 'limit': 1000, 'offset': 0},
+            upstream='vietnamlabs', timeout=self.timeout, retries=self.retries
+        )
+        return data if isinstance(data, list) else []
+
+    async def afetch_province_wards(self, http, province_name: str) -> List[Dict[str, Any]]:
+        """Tải wards của một tỉnh (dùng khi chưa có snapshot)"""
+        return normalize_wards(await self._afetch_province_wards(http, province_name))
+
+    async def afetch(self, http) -> Dict[str, Any]:
+        """
+        Tải provinces rồi wards của từng tỉnh, tối đa `max_workers` request song song
+        trên pool của `http`; lỗi một tỉnh làm hỏng cả lần tải
+        """
+        provinces = _parse_provinces(await http.get_json(
+            f"{self.api_url}/vietnamprovince",
+            upstream='vietnamlabs', timeout=self.timeout, retries=self.retries
+        ))
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def fetch_one(province):
+            async with semaphore:
+                return await self._afetch_province_wards(http, province['name'])
+
+        # gather giữ đúng thứ tự tỉnh => snapshot ổn định giữa các lần tải
+        per_province = await asyncio.gather(*(fetch_one(province) for province in provinces))
+        return self._build_snapshot(provinces, per_province)
+
+    def _build_snapshot(self, provinces: List[Dict[str, str]], per_province) -> Dict[str, Any]:
+        raw_wards = []
+        for province, wards in zip(provinces, per_province):
+            for ward in wards:
+                if not ward.get('province'):
+                    ward = dict(ward, province=province['name'])
+                raw_wards.append(ward)
+
+        content = {'provinces': provinces, 'wards': normalize_wards(raw_wards)}
+        return {
+            'format': SNAPSHOT_FORMAT,
+            'version': _content_version(content),
+            'created_at': time.time(),
+            'source': self.api_url,
+            **content
+        }
+
+    async def arefresh(self, http) -> Dict[str, Any]:
+        """
+        Tải lại gazetteer và ghi snapshot, giữ dữ liệu cũ nếu tải lỗi
+        Ghi snapshot + build index chạy trong thread riêng, không chặn event loop
+        """
+        start_time = time.perf_counter()
+        try:
+            snapshot = await self.afetch(http)
+        except Exception as e:
+            return self._refresh_failed(e)
+
+        def apply():
+            with self._refresh_lock:
+                return self._apply_refresh(snapshot, start_time)
+        return await asyncio.to_thread(apply)
+
+    def _refresh_failed(self, error: Exception) -> Dict[str, Any]:
+        self.last_refresh = {
+            'ok': False,
+            'error': str(error),
+            'at': datetime.now().isoformat()
+        }
+        print(f"Gazetteer refresh failed, keeping {self.version}: {error}")
+        return self.last_refresh
+
+    def _apply_refresh(self, snapshot: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        changed = snapshot['version'] != self.version
+        try:
+            self._write_snapshot(snapshot)
+        except Exception as e:
+            print(f"Error writing gazetteer snapshot: {e}")
+        self._install(snapshot, source='network')
+
+        self.last_refresh = {
+            'ok': True,
+            'changed': changed,
+            'version': self.version,
+            'provinces': len(self.provinces),
+            'wards': len(self.wards),
+            'elapsed_s': round(time.perf_counter() - start_time, 2),
+            'at': datetime.now().isoformat()
+        }
+        print(f"Gazetteer refreshed: {self.last_refresh}")
+        return self.last_refresh
+
+    @property
+    def refreshing(self) -> bool:
+        task = self._refresh_task
+        return bool(task and not task.done())
+
+    def schedule_refresh(self, http) -> bool:
+        """Refresh bằng task trên event loop đang chạy; False nếu đang có một lần refresh chạy"""
+        if self.refreshing:
+            return False
+        self._refresh_task = asyncio.get_running_loop().create_task(self.arefresh(http))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'source': self.source,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat() if self.created_at else None,
+            'stale': self.is_stale(),
+            'provinces': len(self.provinces),
+            'wards': len(self.wards),
+            'ward_matcher': self.ward_matcher.stats(),
+            'typeahead': self.typeahead.stats(),
+            'snapshot_path': self.snapshot_path,
+            'refreshing': self.refreshing,
+            'last_refresh': self.last_refresh
+        }
+
+
+def _parse_provinces(provinces_data: Any) -> List[Dict[str, str]]:
+    provinces = [normalize_province(p) for p in provinces_data or [] if isinstance(p, dict)]
+    provinces = [p for p in provinces if p['name']]
+    if not provinces:
+        raise RuntimeError("vietnamlabs.com returned no provinces")
+    return provinces
+
+
+def _content_version(content: Dict[str, Any]) -> str:
+    """Version = hash nội dung, để biết lần refresh có thực sự đổi dữ liệu không"""
+    payload = json.dumps(content, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+async def _build(args) -> Dict[str, Any]:
+    from http_client import AsyncHttpClient
+
+    http = AsyncHttpClient(timeout=30, retries=3)
+    gazetteer = Gazetteer(args.api_url, args.snapshot, max_workers=args.workers, timeout=30, retries=3)
+    gazetteer.load_snapshot()
+    try:
+        return await gazetteer.arefresh(http)
+    finally:
+        await http.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Dockerfile chạy lệnh này lúc build image => container mới có sẵn snapshot
+    parser = argparse.ArgumentParser(description="Build/refresh the gazetteer snapshot")
+    parser.add_argument("--api-url", default=os.getenv("VIETNAMLABS_API_URL", "https://vietnamlabs.com/api"))
+    parser.add_argument("--snapshot", default=os.getenv("GAZETTEER_SNAPSHOT", DEFAULT_SNAPSHOT_PATH))
+    parser.add_argument("--workers", type=int, default=8)
+    result = asyncio.run(_build(parser.parse_args()))
+    raise SystemExit(0 if result.get('ok') else 1)
@@ -4,21 +4,76 @@ Tạo API endpoint để phục vụ guided conversation cho frontend
 """
 import json
 import asyncio
-import re
-import requests
+import copy
 import os
+import time
 from datetime import datetime
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional, Any
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import threading
 
+from chat_protocol import diff_state, project_properties, state_version
+from compression import CompressionMiddleware, PayloadMetrics
+from entity_extractor import EntityExtractor
+from gazetteer import Gazetteer, DEFAULT_SNAPSHOT_PATH
+from http_client import AsyncHttpClient, CircuitOpenError
+from prefetch import SearchPrefetcher
+from search_cache import SearchCache
+from session_store import create_session_store
+
 # ====== Config từ ENV cho môi trường Cloud Run ======
 BACKEND_API_BASE_URL = os.getenv(
     "BACKEND_API_BASE_URL", "http://localhost:5000/api"
 ).rstrip("/")
+VIETNAMLABS_API_URL = os.getenv(
+    "VIETNAMLABS_API_URL", "https://vietnamlabs.com/api"
+).rstrip("/")
+
+# Gazetteer (tỉnh + phường/xã): snapshot local, refresh từ vietnamlabs.com khi cũ
+GAZETTEER_SNAPSHOT = os.getenv("GAZETTEER_SNAPSHOT", DEFAULT_SNAPSHOT_PATH)
+GAZETTEER_WORKERS = int(os.getenv("GAZETTEER_WORKERS", "8"))
+GAZETTEER_MAX_AGE_HOURS = float(os.getenv("GAZETTEER_MAX_AGE_HOURS", "168"))
+
+# HTTP client dùng chung (Node API + vietnamlabs.com): pool keep-alive, timeout, retry
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+
+# Circuit breaker mỗi upstream (search, amenities, vietnamlabs): mở khi tỷ lệ lỗi vượt ngưỡng,
+# từ chối ngay trong CIRCUIT_OPEN_SECONDS rồi cho request thăm dò
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "1") == "1"
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "15"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+
+# Cache kết quả search: TTL, cửa sổ stale-while-revalidate (0 = tắt), số entry tối đa
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "60"))
+SEARCH_CACHE_STALE_SECONDS = float(os.getenv("SEARCH_CACHE_STALE_SECONDS", "300"))
+SEARCH_CACHE_MAX = int(os.getenv("SEARCH_CACHE_MAX", "1000"))
+SEARCH_CACHE_PRICE_BUCKET = int(os.getenv("SEARCH_CACHE_PRICE_BUCKET", "500000"))
+SEARCH_CACHE_AREA_BUCKET = int(os.getenv("SEARCH_CACHE_AREA_BUCKET", "5"))
+# Khoảng giá/diện tích đã nới ra biên bucket lấy trang lớn gấp N lần rồi lọc lại theo khoảng gốc
+SEARCH_CACHE_OVERFETCH = int(os.getenv("SEARCH_CACHE_OVERFETCH", "3"))
+
+# Prefetch search khi session đã có loại phòng + ngân sách (trước bước "Tìm kiếm")
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_MAX_IN_FLIGHT = int(os.getenv("PREFETCH_MAX_IN_FLIGHT", "20"))
+
+# Response lớn hơn ngưỡng này (byte) được nén brotli/gzip theo Accept-Encoding
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+# /api/chat/stream: số property mỗi event `properties`
+SSE_PROPERTY_BATCH = int(os.getenv("SSE_PROPERTY_BATCH", "5"))
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:5000")
@@ -37,6 +92,9 @@ class ChatMessage(BaseModel):
     message: str
     sessionId: Optional[str] = None
     conversationState: Optional[Dict] = None
+    # protocol="lean": không gửi conversationState, chỉ gửi stateVersion đã nhận ở turn trước
+    protocol: Optional[str] = None
+    stateVersion: Optional[str] = None
 
 class ChatResponse(BaseModel):
     success: bool
@@ -49,26 +107,87 @@ class ChatResponse(BaseModel):
     showGrid: Optional[bool] = False   
     placeholder: Optional[str] = None
     searchCriteria: Optional[Dict] = None
+    # Upstream gián đoạn: "cached" (kết quả cũ) hoặc "unavailable" (thử lại sau retryAfter giây)
+    degraded: Optional[str] = None
+    retryAfter: Optional[float] = None
+
+class LeanChatResponse(BaseModel):
+    success: bool
+    sessionId: str
+    message: str
+    step: str
+    options: Optional[List[str]] = None
+    properties: Optional[List[Dict]] = None
+    totalFound: Optional[int] = None
+    showGrid: Optional[bool] = None
+    placeholder: Optional[str] = None
+    stateVersion: str
+    degraded: Optional[str] = None
+    retryAfter: Optional[float] = None
+    # Client đúng version => chỉ có stateDelta (merge patch); lệch/mới => conversationState đầy đủ
+    stateDelta: Optional[Dict] = None
+    conversationState: Optional[Dict] = None
+
 class SmartTroMCP:
     def __init__(self):
          # base URL backend Node (Cloud Run) - lấy từ ENV
         base = BACKEND_API_BASE_URL 
         self.property_search_url = f"{base}/search-properties/properties"
-        self.location_api_url = "https://vietnamlabs.com/api"
+        self.location_api_url = VIETNAMLABS_API_URL
         self.amenities_api_url = f"{base}/amenities/all"
         
-        # Cache cho wards data
-        self.wards_cache = None
+        # Gazetteer: provinces + wards đọc từ snapshot, refresh ở background
+        self.gazetteer = Gazetteer(
+            self.location_api_url,
+            snapshot_path=GAZETTEER_SNAPSHOT,
+            max_workers=GAZETTEER_WORKERS,
+            max_age_hours=GAZETTEER_MAX_AGE_HOURS
+        )
+        
+        # Mọi request ra ngoài đi qua một client async dùng chung
+        self.http = AsyncHttpClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            connect_timeout=HTTP_CONNECT_TIMEOUT_SECONDS,
+            retries=HTTP_RETRIES,
+            pool_size=HTTP_POOL_SIZE,
+            pool_per_host=HTTP_POOL_PER_HOST,
+            keepalive_seconds=HTTP_KEEPALIVE_SECONDS,
+            breakers_enabled=CIRCUIT_BREAKER_ENABLED,
+            breaker_options={
+                'failure_rate': CIRCUIT_FAILURE_RATE,
+                'minimum_calls': CIRCUIT_MIN_CALLS,
+                'window_seconds': CIRCUIT_WINDOW_SECONDS,
+                'open_seconds': CIRCUIT_OPEN_SECONDS,
+                'half_open_calls': CIRCUIT_HALF_OPEN_CALLS
+            }
+        )
+        # Tạo sẵn breaker để /api/breakers luôn có đủ các upstream
+        for upstream in ('search', 'amenities', 'vietnamlabs'):
+            self.http.breaker(upstream)
         
         # Cache để tránh gọi API nhiều lần
-        self.provinces_cache = None
         self.amenities_cache = None
+        self._amenities_task = None
+        self.search_cache = SearchCache(
+            ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+            stale_seconds=SEARCH_CACHE_STALE_SECONDS,
+            max_entries=SEARCH_CACHE_MAX,
+            price_bucket=SEARCH_CACHE_PRICE_BUCKET,
+            area_bucket=SEARCH_CACHE_AREA_BUCKET,
+            overfetch=SEARCH_CACHE_OVERFETCH
+        )
+        self.prefetcher = SearchPrefetcher(self._prefetch_search, max_in_flight=PREFETCH_MAX_IN_FLIGHT)
+        self._started = False
         
-        # Session storage (trong production nên dùng Redis hoặc database)
-        self.conversation_sessions = {}
+        # Entity extractor (automaton build lại khi gazetteer đổi version)
+        self._extractor = None
+        self._extractor_version = None
         
-        # Load data khi khởi tạo
-        self._load_initial_data()
+        # Session storage: memory (LRU + TTL), SQLite hoặc Redis theo SESSION_BACKEND
+        self.sessions = create_session_store()
+        
+        # Snapshot gazetteer load ngay (không gọi mạng); amenities + refresh chạy ở startup()
+        self.gazetteer.load_snapshot()
         
         # Định nghĩa conversation flow
         self.conversation_flow = {
@@ -119,39 +238,60 @@ class SmartTroMCP:
             }
         }
     
-    def _load_initial_data(self):
-        """Load provinces và amenities vào cache"""
+    @property
+    def provinces_cache(self) -> List[Dict[str, str]]:
+        return self.gazetteer.provinces
+    
+    @property
+    def wards_cache(self) -> List[Dict[str, Any]]:
+        return self.gazetteer.wards
+    
+    @property
+    def extractor(self) -> EntityExtractor:
+        if self._extractor is None or self._extractor_version != self.gazetteer.version:
+            self._extractor = EntityExtractor([p['name'] for p in self.gazetteer.provinces])
+            self._extractor_version = self.gazetteer.version
+        return self._extractor
+    
+    def _parse(self, text: str) -> Dict[str, Any]:
+        """Parse tin nhắn một lần (province, ward, budget, tiện ích, trường...)"""
+        return self.extractor.parse(text)
+    
+    async def startup(self):
+        """Load amenities và refresh gazetteer nếu thiếu/cũ (gọi một lần trong event loop)"""
+        if self._started:
+            return
+        self._started = True
+        if self.gazetteer.is_stale():
+            self.gazetteer.schedule_refresh(self.http)
+        await self._load_amenities()
+    
+    async def shutdown(self):
+        await self.http.close()
+    
+    async def _load_amenities(self):
+        """Load amenities vào cache"""
         try:
-            # Load provinces từ vietnamlabs.com API
-            response = requests.get(f"{self.location_api_url}/vietnamprovince")
-            if response.status_code == 200:
-                provinces_data = response.json()
-                # Chuyển đổi format để tương thích với code hiện tại
-                self.provinces_cache = []
-                if isinstance(provinces_data, list):
-                    for province in provinces_data:
-                        self.provinces_cache.append({
-                            'name': province.get('name', ''),
-                            'code': province.get('name', '').lower().replace(' ', '_')
-                        })
-                print(f"Loaded {len(self.provinces_cache)} provinces from vietnamlabs.com")
+            data = await self.http.get_json(self.amenities_api_url, upstream='amenities')
+            # Extract amenities from nested structure
+            if 'data' in data and 'amenities' in data['data']:
+                self.amenities_cache = data['data']['amenities']
+            elif 'amenities' in data:
+                self.amenities_cache = data['amenities']
+            else:
+                self.amenities_cache = data if isinstance(data, list) else []
             
-            # Load amenities
-            response = requests.get(self.amenities_api_url)
-            if response.status_code == 200:
-                data = response.json()
-                # Extract amenities from nested structure
-                if 'data' in data and 'amenities' in data['data']:
-                    self.amenities_cache = data['data']['amenities']
-                elif 'amenities' in data:
-                    self.amenities_cache = data['amenities']
-                else:
-                    self.amenities_cache = data if isinstance(data, list) else []
-                
-                print(f"Loaded {len(self.amenities_cache)} amenities")
+            print(f"Loaded {len(self.amenities_cache)} amenities")
         except Exception as e:
+            # Giữ amenities đã load trước đó (nếu có)
             print(f"Error loading initial data: {e}")
     
+    def _ensure_amenities(self):
+        """Amenities chưa load được (upstream lỗi lúc startup) => thử lại ở background, không chặn turn"""
+        if self.amenities_cache or (self._amenities_task and not self._amenities_task.done()):
+            return
+        self._amenities_task = asyncio.get_running_loop().create_task(self._load_amenities())
+    
     def _get_province_name_by_keyword(self, keyword: str) -> Optional[str]:
         """Tìm tên tỉnh từ keyword"""
         if not self.provinces_cache:
@@ -194,268 +334,46 @@ class SmartTroMCP:
         print(f"Final amenity IDs: {amenity_ids}")
         return amenity_ids
     
-    def _fetch_wards_from_vietnamlabs(self, province_name: str = None) -> List[Dict[str, Any]]:
+    async def _fetch_wards_from_vietnamlabs(self, province_name: str = None) -> List[Dict[str, Any]]:
         """
-        Fetch wards từ vietnamlabs.com API tương tự fetchWards trong locationService.js
+        Lấy wards từ gazetteer (snapshot vietnamlabs.com), format giống fetchWards trong locationService.js
+        Không block chat turn: khi chưa có snapshot thì refresh song song chạy ở background
         """
-        if self.wards_cache:
-            return self.wards_cache
-            
-        try:
-            all_wards = []
-            
-            if province_name:
-                # Fetch wards cho một tỉnh cụ thể
-                encoded_province = requests.utils.quote(province_name)
-                url = f"{self.location_api_url}/vietnamprovince?province={encoded_province}&limit=1000&offset=0"
-                response = requests.get(url, timeout=5)
-                
-                if response.status_code == 200:
-                    wards_data = response.json()
-                    if isinstance(wards_data, list):
-                        for ward in wards_data:
-                            all_wards.append(ward)
-            else:
-                # Fetch wards từ tất cả các tỉnh
-                if self.provinces_cache:
-                    for province in self.provinces_cache:
-                        try:
-                            encoded_province = requests.utils.quote(province['name'])
-                            url = f"{self.location_api_url}/vietnamprovince?province={encoded_province}&limit=1000&offset=0"
-                            response = requests.get(url, timeout=5)
-                            
-                            if response.status_code == 200:
-                                wards_data = response.json()
-                                if isinstance(wards_data, list):
-                                    for ward in wards_data:
-                                        all_wards.append(ward)
-                        except Exception as e:
-                            print(f"Error fetching wards for province {province['name']}: {e}")
-                            continue
-            
-            # Chuyển đổi theo format yêu cầu (giống fetchWards trong locationService.js)
-            formatted_wards = []
-            for index, ward in enumerate(all_wards):
-                formatted_wards.append({
-                    'id': index,  # Simple index cho frontend
-                    'code': ward.get('name', ''),  # Sử dụng tên ward làm code để match với schema
-                    'name': ward.get('name', ''),  # Tên ward để hiển thị và lưu vào DB
-                    'province': ward.get('province', ''),
-                    'mergedFrom': ward.get('mergedFrom', [])  # Đảm bảo luôn có array, không undefined
-                })
-            
-            # Cache kết quả
-            self.wards_cache = formatted_wards
-            print(f"Loaded {len(formatted_wards)} wards from vietnamlabs.com")
-            return formatted_wards
-            
-        except Exception as e:
-            print(f"Error fetching wards from vietnamlabs.com: {e}")
-            return []
+        if province_name:
+            wards = self.gazetteer.wards_for(province_name)
+            if wards or self.gazetteer.loaded:
+                return wards
+            # Chưa có snapshot: chỉ tải riêng tỉnh này
+            try:
+                return await self.gazetteer.afetch_province_wards(self.http, province_name)
+            except Exception as e:
+                print(f"Error fetching wards for province {province_name}: {e}")
+                return []
+        
+        if not self.gazetteer.loaded:
+            self.gazetteer.schedule_refresh(self.http)
+        return self.gazetteer.wards
     
-    def _fuzzy_match_ward_name(self, keyword: str, wards_list: List[Dict]) -> Optional[str]:
+    def _fuzzy_match_ward_name(self, keyword: str, province_name: str = None) -> Optional[str]:
         """
         So sánh chuỗi gần đúng để tìm ward name từ keyword
+        Dùng index trigram + edit distance của gazetteer (build sẵn khi load snapshot)
         """
-        if not keyword or not wards_list:
-            return None
-        
-        keyword_lower = keyword.lower().strip()
-        
-        # Chỉ loại bỏ các prefix không phải "phường" và "xã" đầy đủ
-        prefixes_to_remove = ['thị trấn', 'p.', 'p', 'ward', 'commune']
-        cleaned_keyword = keyword_lower
-        
-        for prefix in prefixes_to_remove:
-            if cleaned_keyword.startswith(prefix + ' '):
-                cleaned_keyword = cleaned_keyword[len(prefix + ' '):].strip()
-                break
-            elif cleaned_keyword.startswith(prefix):
-                cleaned_keyword = cleaned_keyword[len(prefix):].strip()
-                break
-        
-        best_match = None
-        best_score = 0
-        
-        for ward in wards_list:
-            ward_name = ward['name'].lower().strip()
-            
-            # Loại bỏ prefix từ ward name để so sánh (trừ "phường" và "xã" đầy đủ)
-            cleaned_ward_name = ward_name
-            for prefix in prefixes_to_remove:
-                if cleaned_ward_name.startswith(prefix + ' '):
-                    cleaned_ward_name = cleaned_ward_name[len(prefix + ' '):].strip()
-                    break
-                elif cleaned_ward_name.startswith(prefix):
-                    cleaned_ward_name = cleaned_ward_name[len(prefix):].strip()
-                    break
-            
-            # 1. Exact match - ưu tiên cao nhất
-            if cleaned_keyword == cleaned_ward_name or keyword_lower == ward_name:
-                return ward['name']
-            
-            # 2. Substring match
-            if cleaned_keyword in cleaned_ward_name or cleaned_ward_name in cleaned_keyword:
-                score = min(len(cleaned_keyword), len(cleaned_ward_name)) / max(len(cleaned_keyword), len(cleaned_ward_name))
-                if score > best_score:
-                    best_score = score
-                    best_match = ward['name']
-            
-            # 3. Word-based matching cho tên compound
-            keyword_words = set(cleaned_keyword.split())
-            ward_words = set(cleaned_ward_name.split())
-            
-            if keyword_words and ward_words:
-                common_words = keyword_words.intersection(ward_words)
-                if common_words:
-                    word_score = len(common_words) / max(len(keyword_words), len(ward_words))
-                    if word_score > best_score and word_score >= 0.5:  # Threshold cho word matching
-                        best_score = word_score
-                        best_match = ward['name']
-            
-            # 4. Character similarity (Levenshtein-like approach đơn giản)
-            if len(cleaned_keyword) >= 3 and len(cleaned_ward_name) >= 3:
-                similarity = self._calculate_string_similarity(cleaned_keyword, cleaned_ward_name)
-                if similarity > best_score and similarity >= 0.7:  # Threshold cho character similarity
-                    best_score = similarity
-                    best_match = ward['name']
-        
-        # Chỉ return nếu match score đủ cao
-        if best_score >= 0.6:  # Threshold tổng quát
-            print(f"Ward fuzzy matched: '{keyword}' -> '{best_match}' (score: {best_score:.2f})")
-            return best_match
-        
+        matcher = self.gazetteer.ward_matcher
+        match = matcher.match(keyword, province=province_name) if province_name else None
+        if not match:
+            # Tên tỉnh từ user có thể khác tên trong gazetteer => thử toàn quốc
+            match = matcher.match(keyword)
+        if match:
+            print(f"Ward fuzzy matched: '{keyword}' -> '{match.name}' (score: {match.score:.2f})")
+            return match.name
         return None
     
-    def _calculate_string_similarity(self, str1: str, str2: str) -> float:
-        """
-        Tính độ tương tự giữa hai chuỗi (đơn giản hóa Levenshtein distance)
-        """
-        if not str1 or not str2:
-            return 0.0
-        
-        if str1 == str2:
-            return 1.0
-        
-        # Tính số ký tự chung
-        str1_chars = set(str1.lower())
-        str2_chars = set(str2.lower())
-        
-        common_chars = str1_chars.intersection(str2_chars)
-        total_chars = str1_chars.union(str2_chars)
-        
-        if not total_chars:
-            return 0.0
-        
-        return len(common_chars) / len(total_chars)
-    
-    def _extract_location_from_text(self, text: str) -> Dict[str, Optional[str]]:
-        """Trích xuất thông tin location từ text (province và ward)"""
-        result = {'province_name': None, 'ward_name': None}
-        
-        text_lower = text.lower()
-        
-        # Ưu tiên tìm phường/xã trước để tránh nhầm lẫn với province
-        ward_patterns = [
-            (r'(phường)\s+([a-zA-ZÀ-ỹ0-9\s]+?)(?:\s*[,.]|$)', 'phường'),     # "phường tân định" -> giữ nguyên "Phường Tân Định"
-            (r'(xã)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)', 'xã'),               # "xã tân phú" -> giữ nguyên "Xã Tân Phú"
-            (r'(thị trấn)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)', 'thị trấn'),   # "thị trấn long thành" -> "Thị Trấn Long Thành"
-            (r'(?:p\.?)\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)', None),            # "p. tân định" -> chỉ lấy tên không có prefix
-            (r'(?:ward)\s+([a-zA-Z0-9\s]+?)(?:\s*[,.]|$)', None)             # "ward tan dinh" -> chỉ lấy tên không có prefix
-        ]
-        
-        for pattern_info in ward_patterns:
-            if isinstance(pattern_info, tuple):
-                pattern, prefix_to_keep = pattern_info
-                matches = re.findall(pattern, text_lower)
-                if matches:
-                    if len(matches[0]) == 2 and prefix_to_keep:  # Có prefix để giữ
-                        prefix, ward_name = matches[0]
-                        result['ward_name'] = f"{prefix_to_keep.title()} {ward_name.strip().title()}"
-                    else:  # Không giữ prefix hoặc chỉ có tên
-                        ward_name = matches[0][1] if len(matches[0]) == 2 else matches[0]
-                        result['ward_name'] = ward_name.strip().title()
-                    break
-            else:  # Backward compatibility cho pattern cũ
-                matches = re.findall(pattern_info, text_lower)
-                if matches:
-                    ward_name = matches[0].strip()
-                    result['ward_name'] = ward_name.title()
-                    break
-        
-        # Chỉ tìm province nếu có prefix rõ ràng hoặc tên thành phố lớn
-        # Patterns cụ thể cho province (không dùng pattern tổng quát gây nhầm lẫn)
-        province_patterns = [
-            r'(?:tp|thành phố)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)',  # "tp hồ chí minh" or "thành phố hồ chí minh"
-            r'(?:tỉnh)\s+([a-zA-ZÀ-ỹ\s]+?)(?:\s*[,.]|$)',         # "tỉnh an giang"
-            r'([a-zA-ZÀ-ỹ\s]+?)\s+(?:province|city)',              # "ho chi minh city"
-            r'(hồ chí minh|hà nội|đà nẵng|cần thơ|hải phòng|an giang|bà rịa|bắc giang|bắc kạn|bạc liêu|bắc ninh|bến tre|bình định|bình dương|bình phước|bình thuận|cà mau|cao bằng|đắk lắk|đắk nông|điện biên|đồng nai|đồng tháp|gia lai|hà giang|hà nam|hà tĩnh|hải dương|hậu giang|hòa bình|hưng yên|khánh hòa|kiên giang|kon tum|lai châu|lâm đồng|lạng sơn|lào cai|long an|nam định|nghệ an|ninh bình|ninh thuận|phú thọ|phú yên|quảng bình|quảng nam|quảng ngãi|quảng ninh|quảng trị|sóc trăng|sơn la|tây ninh|thái bình|thái nguyên|thanh hóa|thừa thiên|tiền giang|trà vinh|tuyên quang|vĩnh long|vĩnh phúc|yên bái)(?=\s|$|[,.])',  # Tên tỉnh/thành phố cụ thể
-        ]
-        
-        for pattern in province_patterns:
-            matches = re.findall(pattern, text_lower)
-            if matches:
-                province_name = matches[0].strip()
-                # Normalize common city names
-                if 'hồ chí minh' in province_name or 'hcm' in province_name or 'sài gòn' in province_name:
-                    result['province_name'] = 'Hồ Chí Minh'
-                elif 'hà nội' in province_name:
-                    result['province_name'] = 'Hà Nội'
-                elif 'đà nẵng' in province_name:
-                    result['province_name'] = 'Đà Nẵng'
-                elif 'cần thơ' in province_name:
-                    result['province_name'] = 'Cần Thơ'
-                elif 'hải phòng' in province_name:
-                    result['province_name'] = 'Hải Phòng'
-                else:
-                    result['province_name'] = province_name.title()
-                break
-        
-        # Fallback: Tìm province bằng cache nếu chưa có ward và có prefix rõ ràng
-        if not result['province_name'] and not result['ward_name'] and self.provinces_cache:
-            # Chỉ tìm trong cache nếu có prefix "tỉnh" hoặc "thành phố"
-            if any(prefix in text_lower for prefix in ['tỉnh ', 'thành phố ', 'tp ']):
-                for province in self.provinces_cache:
-                    province_name_lower = province['name'].lower()
-                    # Tìm exact match hoặc substring trong text có prefix
-                    if province_name_lower in text_lower:
-                        result['province_name'] = province['name']
-                        break
-        
-        return result
-    
-    def _extract_amenities_from_text(self, text: str) -> List[str]:
-        """Trích xuất danh sách amenities từ text"""
-        # Các từ khóa tiện ích phổ biến
-        amenity_keywords = {
-            'wifi': ['wifi', 'internet', 'mạng'],
-            'điều hòa': ['điều hòa', 'máy lạnh', 'air conditioner', 'ac'],
-            'máy giặt': ['máy giặt', 'washing machine'],
-            'tủ lạnh': ['tủ lạnh', 'refrigerator', 'fridge'],
-            'bếp': ['bếp', 'kitchen', 'nấu ăn'],
-            'gác lửng': ['gác lửng', 'loft'],
-            'ban công': ['ban công', 'balcony'],
-            'toilet riêng': ['toilet riêng', 'wc riêng', 'nhà vệ sinh riêng'],
-            'bảo vệ': ['bảo vệ', 'security', 'an ninh'],
-            'thang máy': ['thang máy', 'elevator', 'lift'],
-            'chỗ để xe': ['chỗ để xe', 'parking', 'gửi xe']
-        }
-        
-        text_lower = text.lower()
-        found_amenities = []
-        
-        for amenity_name, keywords in amenity_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    found_amenities.append(amenity_name)
-                    break
-        
-        # Map sang amenity IDs
-        return self._get_amenity_ids_by_names(found_amenities)
-
-    def process_guided_message(self, user_message: str, conversation_state: Dict = None) -> Dict[str, Any]:
+    async def process_guided_message(self, user_message: str, conversation_state: Dict = None,
+                                     defer_search: bool = False) -> Dict[str, Any]:
         """
         Xử lý tin nhắn theo guided conversation flow
+        defer_search=True: turn tìm kiếm trả về ngay với 'pending_search', chưa gọi Node API
         """
         if not conversation_state:
             conversation_state = {
@@ -467,33 +385,35 @@ class SmartTroMCP:
         current_step = conversation_state.get('current_step', 'greeting')
         collected_data = conversation_state.get('collected_data', {})
         
+        # Parse tin nhắn một lần, các handler dùng chung kết quả
+        parse = self._parse(user_message)
+        
         # Xử lý theo từng step
         if current_step == 'greeting':
-            return self._handle_greeting(user_message, conversation_state)
+            return self._handle_greeting(user_message, conversation_state, parse)
         elif current_step == 'property_type':
-            return self._handle_property_type(user_message, conversation_state)
+            return self._handle_property_type(user_message, conversation_state, parse)
         elif current_step == 'budget_input':
-            return self._handle_budget_input(user_message, conversation_state)
+            return self._handle_budget_input(user_message, conversation_state, parse)
         elif current_step == 'additional_options':
             return self._handle_additional_options(user_message, conversation_state)
         elif current_step == 'location_input':
-            return self._handle_location_detail_input(user_message, conversation_state)
+            return self._handle_location_detail_input(user_message, conversation_state, parse)
         elif current_step == 'area_input':
-            return self._handle_area_input(user_message, conversation_state)
+            return self._handle_area_input(user_message, conversation_state, parse)
         elif current_step == 'amenities_input':
-            return self._handle_amenities_input(user_message, conversation_state)
+            return self._handle_amenities_input(user_message, conversation_state, parse)
         elif current_step == 'university_input':
-            return self._handle_university_input(user_message, conversation_state)
+            return self._handle_university_input(user_message, conversation_state, parse)
         elif current_step == 'confirm_search':
-            return self._handle_confirm_search(user_message, conversation_state)
+            return await self._handle_confirm_search(user_message, conversation_state, defer_search)
         else:
             return self._handle_search(conversation_state)
     
-    def _handle_greeting(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_greeting(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý bước chào hỏi và chuyển sang chọn loại nhà"""
         # Extract location từ tin nhắn nếu có
-        location = self._extract_location(user_message)
-        state['collected_data']['location'] = location
+        state['collected_data']['location'] = parse['city']
         state['current_step'] = 'property_type'
         
         response = {
@@ -506,10 +426,9 @@ class SmartTroMCP:
     
 
     
-    def _handle_property_type(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_property_type(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc chọn loại property"""
-        property_type = self._extract_property_type(user_message)
-        state['collected_data']['property_type'] = property_type
+        state['collected_data']['property_type'] = parse['property_type']
         state['current_step'] = 'budget_input'
         
         response = {
@@ -520,9 +439,10 @@ class SmartTroMCP:
         }
         return response
     
-    def _handle_budget_input(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_budget_input(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc nhập budget"""
-        budget = self._extract_budget(user_message)
+        budget = dict(parse['budget'])
+        print(f"Budget extracted: {budget}" if budget else "No budget pattern matched")
         state['collected_data']['budget'] = budget
         state['current_step'] = 'additional_options'
         
@@ -573,28 +493,31 @@ class SmartTroMCP:
         
         return response
     
-    def _handle_location_detail_input(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_location_detail_input(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc nhập khu vực cụ thể"""
-        location_data = self._extract_location_details(user_message)
+        location_data = self._extract_location_details(parse)
         state['collected_data']['location_details'] = location_data
         return self._show_confirm_options(state)
     
-    def _handle_area_input(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_area_input(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc nhập diện tích"""
-        area = self._extract_area(user_message)
-        state['collected_data']['area'] = area
+        state['collected_data']['area'] = parse['area']
         return self._show_confirm_options(state)
     
-    def _handle_amenities_input(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_amenities_input(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc nhập tiện ích"""
-        amenities = self._extract_amenities_with_ids(user_message)
-        state['collected_data']['amenities'] = amenities
+        self._ensure_amenities()
+        amenity_names = list(parse['amenities'])
+        state['collected_data']['amenities'] = {
+            'names': amenity_names,
+            'ids': self._get_amenity_ids_by_names(amenity_names),
+            'text': parse['text']
+        }
         return self._show_confirm_options(state)
     
-    def _handle_university_input(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    def _handle_university_input(self, user_message: str, state: Dict, parse: Dict) -> Dict[str, Any]:
         """Xử lý việc nhập thông tin trường học"""
-        university = self._extract_university(user_message)
-        state['collected_data']['university'] = university
+        state['collected_data']['university'] = parse['university']
         return self._show_confirm_options(state)
     
     def _show_confirm_options(self, state: Dict) -> Dict[str, Any]:
@@ -608,7 +531,7 @@ class SmartTroMCP:
         }
         return response
     
-    def _handle_confirm_search(self, user_message: str, state: Dict) -> Dict[str, Any]:
+    async def _handle_confirm_search(self, user_message: str, state: Dict, defer_search: bool = False) -> Dict[str, Any]:
         """Xử lý việc xác nhận tìm kiếm hoặc thêm yêu cầu"""
         choice = user_message.lower()
         
@@ -623,21 +546,34 @@ class SmartTroMCP:
             }
         else:
             # Tiến hành tìm kiếm
-            return self._perform_search(state)
+            return await self._perform_search(state, defer_search)
         
         return response
     
-    def _perform_search(self, state: Dict) -> Dict[str, Any]:
+    async def _perform_search(self, state: Dict, defer_search: bool = False) -> Dict[str, Any]:
         """Thực hiện tìm kiếm dựa trên collected data"""
         collected = state['collected_data']
         
         # Chuyển đổi collected data thành search criteria
         criteria = self._convert_to_search_criteria(collected)
         
-        # Tìm kiếm properties
-        properties = self.search_properties_fast(criteria)
-        print('Found properties:', properties)
-
+        if defer_search:
+            # Streaming: gửi message ngay, search chạy sau khi client đã nhận byte đầu tiên
+            return {
+                'message': "Đang tìm kiếm các bài đăng phù hợp với yêu cầu của bạn...",
+                'search_criteria': criteria,
+                'conversation_state': state,
+                'step': 'search_results',
+                'show_grid': True,
+                'pending_search': True
+            }
+        
+        # Tìm kiếm properties (fallback kết quả cache / "thử lại" khi Node API gián đoạn)
+        outcome = await self.search_with_fallback(criteria)
+        print('Found properties:', outcome['properties'])
+        return self._search_outcome_response(state, criteria, outcome)
+    
+    def _search_results_response(self, state: Dict, criteria: Dict[str, Any], properties: List[Dict]) -> Dict[str, Any]:
         # Trả về tất cả properties không giới hạn
         total_found = len(properties)
 
@@ -654,237 +590,39 @@ class SmartTroMCP:
         
         return response
     
-    # Helper methods để extract thông tin
-    def _extract_location(self, message: str) -> str:
-        """Extract địa điểm từ tin nhắn"""
-        message = message.lower()
-        
-        # Tìm tỉnh thành phố
-        cities = [
-            'hà nội', 'hồ chí minh', 'tp hcm', 'sài gòn', 'thành phố hồ chí minh',
-            'đà nẵng', 'hải phòng', 'cần thơ', 'nha trang', 'vũng tàu', 'đà lạt'
-        ]
-        
-        for city in cities:
-            if city in message:
-                return city.title()
-        
-        return message.strip()
-    
-    def _extract_property_type(self, message: str) -> str:
-        """Extract loại property từ tin nhắn"""
-        message = message.lower()
-        
-        if 'trọ' in message:
-            return 'phong_tro'
-        elif 'căn hộ' in message:
-            return 'can_ho'
-        
-        return 'phong_tro'  # default
-    
-    def _extract_budget(self, message: str) -> Dict[str, float]:
-        """Extract budget từ tin nhắn"""
-        # Patterns để tìm giá tiền (theo thứ tự ưu tiên)
-        price_patterns = [
-            # Pattern có "từ...đến" với triệu
-            (r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)', 
-             lambda x, y: {"min": float(x) * 1000000, "max": float(y) * 1000000}),
-            
-            # Pattern có "từ...đến" với số thuần (giả sử là VND)
-            (r'từ\s*(\d+(?:\.\d+)?)\s*(?:đến|-)\s*(\d+(?:\.\d+)?)\s*(?:đồng|vnd|vnđ|$)?', 
-             lambda x, y: {"min": float(x), "max": float(y)}),
-            
-            # Pattern "X triệu Y" (như "3 triệu 500" = 3.5 triệu)
-            (r'(\d+)\s*(?:triệu|tr)\s*(\d+)', 
-             lambda x, y: {"max": (float(x) + float(y)/1000) * 1000000}),
-            
-            # Pattern "dưới" với triệu
-            (r'dưới\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)', 
-             lambda x: {"max": float(x) * 1000000}),
-            
-            # Pattern "trên" với triệu
-            (r'trên\s*(\d+(?:\.\d+)?)\s*(?:triệu|tr)', 
-             lambda x: {"min": float(x) * 1000000}),
-            
-            # Pattern số + triệu (đơn giản)
-            (r'(\d+(?:\.\d+)?)\s*(?:triệu|tr)', 
-             lambda x: {"max": float(x) * 1000000}),
-            
-            # Pattern số thuần lớn (>= 100000, có thể là VND)
-            (r'\b(\d{6,})\b', 
-             lambda x: {"max": float(x)} if float(x) >= 100000 else None),
-            
-            # Pattern số nhỏ hơn (có thể là triệu)
-            (r'\b(\d+(?:\.\d+)?)\b', 
-             lambda x: {"max": float(x) * 1000000} if float(x) < 100 else {"max": float(x)})
-        ]
-        
-        for i, (pattern, extractor) in enumerate(price_patterns):
-            match = re.search(pattern, message.lower())
-            if match:
-                try:
-                    if len(match.groups()) == 2:
-                        result = extractor(match.group(1), match.group(2))
-                    else:
-                        result = extractor(match.group(1))
-                    
-                    if result:  # Kiểm tra kết quả không None
-                        print(f"Budget extracted: {result}")
-                        return result
-                except Exception as e:
-                    print(f"Error processing pattern {i+1}: {e}")
-                    continue
+    def _search_outcome_response(self, state: Dict, criteria: Dict[str, Any], outcome: Dict[str, Any]) -> Dict[str, Any]:
+        """Response theo kết quả search_with_fallback"""
+        if outcome['degraded'] == 'unavailable':
+            # Giữ bước confirm_search để user bấm "Tìm kiếm" lại
+            retry_after = outcome.get('retry_after')
+            wait = f" sau khoảng {max(1, round(retry_after))} giây" if retry_after else " sau ít phút"
+            return {
+                'message': f"Hệ thống tìm kiếm đang tạm thời gián đoạn. Bạn vui lòng thử lại{wait} nhé!",
+                'options': ['Thêm yêu cầu', 'Tìm kiếm'],
+                'search_criteria': criteria,
+                'conversation_state': state,
+                'step': 'confirm_search',
+                'degraded': 'unavailable',
+                'retry_after': retry_after
+            }
         
-        print("No budget pattern matched")
-        return {}
-    
-    def _extract_area(self, message: str) -> float:
-        """Extract diện tích từ tin nhắn"""
-        match = re.search(r'(\d+(?:\.\d+)?)', message)
-        if match:
-            return float(match.group(1))
-        return 0
+        response = self._search_results_response(state, criteria, outcome['properties'])
+        if outcome['degraded'] == 'cached':
+            response['message'] += " (Hệ thống tìm kiếm đang gián đoạn, đây là kết quả đã lưu gần đây.)"
+            response['degraded'] = 'cached'
+        return response
     
-    def _extract_location_details(self, message: str) -> Dict[str, Any]:
-        """Extract thông tin location chi tiết (province và ward)"""
-        location_info = self._extract_location_from_text(message)
-        
-        result = {
-            'text': message.strip(),
+    # Helper methods để extract thông tin
+    def _extract_location_details(self, parse: Dict[str, Any]) -> Dict[str, Any]:
+        """Thông tin location chi tiết (province, ward và keywords còn lại) từ parse"""
+        location_info = parse['location']
+        return {
+            'text': parse['text'],
             'province_name': location_info.get('province_name'),
             'ward_name': location_info.get('ward_name'),
-            'keywords': []
+            # Các keywords không map được province hoặc ward dùng cho search text
+            'keywords': self.extractor.location_keywords(parse)
         }
-        
-        # Thêm các keywords không map được province hoặc ward vào search text
-        if not location_info.get('province_name') or not location_info.get('ward_name'):
-            # Extract location keywords từ message
-            location_patterns = [
-                r'(?:quận|q\.?|huyện)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)',
-                r'(?:tỉnh|thành phố|tp\.?)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)',
-                r'(?:phường|p\.?|xã|thị trấn)\s+([^,\.\s]+(?:\s+[^,\.\s]+)*)',
-                r'([a-zA-ZÀ-ỹ\s]+)(?=\s*[,\.]|$)'
-            ]
-            
-            for pattern in location_patterns:
-                matches = re.findall(pattern, message, re.IGNORECASE)
-                for match in matches:
-                    if match.strip():
-                        # Chỉ thêm vào keywords nếu chưa được extract thành province/ward
-                        match_text = match.strip()
-                        if (match_text != location_info.get('province_name') and 
-                            match_text != location_info.get('ward_name')):
-                            result['keywords'].append(match_text)
-        
-        return result
-    
-    def _extract_amenities_with_ids(self, message: str) -> Dict[str, Any]:
-        """Extract tiện ích từ tin nhắn và map sang Object IDs"""
-        # Extract amenity names từ message
-        amenity_names = []
-        message_lower = message.lower()
-        
-        # Map keyword trong message với tên chính xác trong database
-        # Dựa trên response API: Wifi, Máy lạnh, Tủ lạnh, Ban công, Máy giặt, Tủ quần áo, Nhà bếp, Bãi đỗ xe, Thang máy, Tivi
-        amenity_mapping = {
-            # Wifi
-            'wifi': 'Wifi',
-            'wi-fi': 'Wifi', 
-            'mạng': 'Wifi',
-            'internet': 'Wifi',
-            
-            # Máy lạnh
-            'điều hòa': 'Máy lạnh',
-            'máy lạnh': 'Máy lạnh',
-            'air conditioner': 'Máy lạnh',
-            'ac': 'Máy lạnh',
-            
-            # Tủ lạnh  
-            'tủ lạnh': 'Tủ lạnh',
-            'tủ đá': 'Tủ lạnh',
-            'refrigerator': 'Tủ lạnh',
-            'fridge': 'Tủ lạnh',
-            
-            # Ban công
-            'ban công': 'Ban công',
-            'balcony': 'Ban công',
-            'sân phơi': 'Ban công',
-            
-            # Máy giặt
-            'máy giặt': 'Máy giặt',
-            'washing machine': 'Máy giặt',
-            
-            # Tủ quần áo
-            'tủ quần áo': 'Tủ quần áo',
-            'tủ áo': 'Tủ quần áo',
-            'wardrobe': 'Tủ quần áo',
-            
-            # Nhà bếp
-            'nhà bếp': 'Nhà bếp',
-            'bếp': 'Nhà bếp',
-            'kitchen': 'Nhà bếp',
-            'nấu ăn': 'Nhà bếp',
-            
-            # Bãi đỗ xe
-            'bãi đỗ xe': 'Bãi đỗ xe',
-            'gửi xe': 'Bãi đỗ xe',
-            'đỗ xe': 'Bãi đỗ xe',
-            'parking': 'Bãi đỗ xe',
-            'chỗ để xe': 'Bãi đỗ xe',
-            
-            # Thang máy
-            'thang máy': 'Thang máy',
-            'elevator': 'Thang máy',
-            'lift': 'Thang máy',
-            
-            # Tivi
-            'tivi': 'Tivi',
-            'tv': 'Tivi',
-            'television': 'Tivi'
-        }
-        
-        # Tìm kiếm keywords trong message
-        found_amenities = set()  # Dùng set để tránh duplicate
-        for keyword, db_name in amenity_mapping.items():
-            if keyword in message_lower:
-                found_amenities.add(db_name)
-        
-        amenity_names = list(found_amenities)
-        
-        # Map amenity names to IDs using cached data
-        amenity_ids = self._get_amenity_ids_by_names(amenity_names)
-        
-        return {
-            'names': amenity_names,
-            'ids': amenity_ids,
-            'text': message.strip()
-        }
-    
-    def _extract_amenities(self, message: str) -> List[str]:
-        """Extract tiện ích từ tin nhắn (backward compatibility)"""
-        result = self._extract_amenities_with_ids(message)
-        return result['names']
-    
-    def _extract_university(self, message: str) -> str:
-        """Extract thông tin trường đại học"""
-        message_lower = message.lower()
-        
-        # Patterns cho trường đại học
-        university_patterns = [
-            r'(?:đh|đại học)\s+(công nghiệp|bách khoa|kinh tế|sư phạm|y dược|nông lâm|xây dựng|[^,\.\s]+(?:\s+[^,\.\s]+)*)',
-            r'trường\s+(đại học\s+)?([^,\.\s]+(?:\s+[^,\.\s]+)*)',
-            r'\b(uit|hcmut|hust|neu|fpt|rmit|tdt|tdtu|hutech)\b',
-        ]
-        
-        for pattern in university_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                if isinstance(match.groups(), tuple) and len(match.groups()) > 1:
-                    return ' '.join([g for g in match.groups() if g and g.strip()])
-                else:
-                    return match.group(1) if len(match.groups()) > 0 else match.group(0)
-        
-        return message.strip()
     
     def _convert_to_search_criteria(self, collected_data: Dict) -> Dict[str, Any]:
         """Chuyển đổi collected data thành search criteria cho API"""
@@ -922,7 +660,8 @@ class SmartTroMCP:
         if collected_data.get('amenities'):
             amenities_data = collected_data['amenities']
             if isinstance(amenities_data, dict) and 'ids' in amenities_data:
-                criteria["amenities"] = amenities_data['ids']
+                # Chưa map được ID (amenities chưa load) => gửi tên, map lại lúc build params
+                criteria["amenities"] = amenities_data['ids'] or amenities_data.get('names', [])
             elif isinstance(amenities_data, list):
                 criteria["amenities"] = amenities_data
         
@@ -936,32 +675,31 @@ class SmartTroMCP:
         
         return criteria
     
-    def process_guided_api(self, message: str, session_id: str = None, conversation_state: Dict = None) -> Dict[str, Any]:
+    async def process_guided_api(self, message: str, session_id: str = None, conversation_state: Dict = None,
+                                 defer_search: bool = False) -> Dict[str, Any]:
         """
         API endpoint cho guided conversation
         """
         if not session_id:
             session_id = f"session_{datetime.now().timestamp()}"
         
-        # Lấy hoặc tạo conversation state
-        if session_id not in self.conversation_sessions:
-            self.conversation_sessions[session_id] = {
+        # Sử dụng state từ request, nếu không thì lấy từ session storage hoặc tạo mới
+        current_state = conversation_state or await self.sessions.aget(session_id)
+        if not current_state:
+            current_state = {
                 'current_step': 'greeting',
                 'collected_data': {},
                 'conversation_history': []
             }
         
-        # Sử dụng state từ request hoặc session storage
-        if conversation_state:
-            self.conversation_sessions[session_id] = conversation_state
-        
-        current_state = self.conversation_sessions[session_id]
-        
         # Xử lý tin nhắn
-        result = self.process_guided_message(message, current_state)
+        result = await self.process_guided_message(message, current_state, defer_search)
         
         # Cập nhật session
-        self.conversation_sessions[session_id] = result.get('conversation_state', current_state)
+        await self.sessions.aset(session_id, result.get('conversation_state', current_state))
+        
+        if PREFETCH_ENABLED:
+            self._track_prefetch(session_id, result)
         
         # Thêm session_id vào response
         result['session_id'] = session_id
@@ -969,11 +707,99 @@ class SmartTroMCP:
         
         return result
     
-    def search_properties_fast(self, criteria: Dict[str, Any]) -> List[Dict]:
+    def _track_prefetch(self, session_id: str, result: Dict[str, Any]):
+        """Turn search: ghi nhận hit/miss; turn khác: prefetch nếu đã đủ criteria"""
+        if result.get('search_criteria') is not None:
+            self.prefetcher.consume(session_id, result['search_criteria'])
+            return
+        collected = result.get('conversation_state', {}).get('collected_data', {})
+        budget = collected.get('budget') or {}
+        if collected.get('property_type') and (budget.get('min') or budget.get('max')):
+            self.prefetcher.update(session_id, self._convert_to_search_criteria(collected))
+    
+    async def _prefetch_search(self, criteria: Dict[str, Any]):
+        """Chạy search vào SearchCache; lỗi được raise để prefetcher đếm"""
+        params = await self._build_search_params(criteria)
+        await self.search_cache.get(params, self._fetch_properties)
+    
+    async def process_lean_api(self, message: str, session_id: str = None, client_version: str = None,
+                               defer_search: bool = False) -> Dict[str, Any]:
+        """
+        Lean protocol: state chuẩn nằm ở session store, trả về delta so với version client đang có
+        """
+        stored = await self.sessions.aget(session_id) if session_id else None
+        in_sync = stored is not None and client_version == state_version(stored)
+        # Handler sửa state tại chỗ => giữ bản sao để tính delta
+        before = copy.deepcopy(stored) if in_sync else None
+        
+        result = await self.process_guided_api(message, session_id, defer_search=defer_search)
+        state = result.get('conversation_state', {})
+        
+        response = {
+            'success': result['success'],
+            'sessionId': result['session_id'],
+            'message': result.get('message', ''),
+            'step': result.get('step', ''),
+            'options': result.get('options'),
+            'properties': project_properties(result.get('properties')),
+            'totalFound': result.get('total_found'),
+            'showGrid': result.get('show_grid'),
+            'placeholder': result.get('placeholder'),
+            'stateVersion': state_version(state),
+            'degraded': result.get('degraded'),
+            'retryAfter': result.get('retry_after')
+        }
+        if in_sync:
+            response['stateDelta'] = diff_state(before, state)
+        else:
+            response['conversationState'] = state
+        if result.get('pending_search'):
+            response['pending_search'] = result['pending_search']
+            response['search_criteria'] = result['search_criteria']
+        return response
+    
+    async def search_with_fallback(self, criteria: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Tìm kiếm properties qua SearchCache + Node API
+        Node API lỗi / circuit 'search' mở => kết quả đã cache dù cũ (degraded='cached'),
+        không có thì degraded='unavailable' kèm retry_after (giây) để client thử lại
         """
-        Tìm kiếm properties nhanh qua API (sync version)
+        params = await self._build_search_params(criteria)
+        
+        try:
+            # Cùng params (sau chuẩn hóa) trong TTL => không gọi lại Node API
+            properties = await self.search_cache.get(params, self._fetch_properties)
+            
+            # Properties đã có sẵn các trường province, ward, detailAddress từ API
+            # Không cần tạo nested location object - đồng nhất với API search property
+            print(f"Final properties (direct fields): {len(properties)} items")
+            return {'properties': properties, 'degraded': None}
+        except Exception as e:
+            print(f"Search error: {e}")
+            cached = self.search_cache.fallback(params)
+            if cached is not None:
+                return {'properties': cached, 'degraded': 'cached'}
+            breaker = self.http.breaker('search')
+            if isinstance(e, CircuitOpenError):
+                retry_after = e.retry_after
+            else:
+                retry_after = breaker.retry_after() if breaker is not None else None
+            return {'properties': [], 'degraded': 'unavailable', 'retry_after': retry_after or None}
+    
+    async def search_properties_fast(self, criteria: Dict[str, Any]) -> List[Dict]:
+        """
+        Tìm kiếm properties nhanh qua API (async, dùng pool keep-alive chung)
         Returns properties với direct fields: province, ward, detailAddress (đồng nhất với API search)
         """
+        return (await self.search_with_fallback(criteria))['properties']
+    
+    async def _fetch_properties(self, params: Dict[str, Any]) -> List[Dict]:
+        """Gọi /search-properties/properties; lỗi được raise để không bị cache"""
+        data = await self.http.get_json(self.property_search_url, params=params, upstream='search')
+        return data.get("data", {}).get("properties", [])
+    
+    async def _build_search_params(self, criteria: Dict[str, Any]) -> Dict[str, Any]:
+        """Chuyển search criteria thành query params cho /search-properties/properties"""
         # Chuyển đổi criteria thành search params
         params = {
             "page": 1,
@@ -1010,7 +836,7 @@ class SmartTroMCP:
         if not params.get("province") or not params.get("ward"):
             if criteria["location"]["keywords"]:
                 keywords_text = " ".join(criteria["location"]["keywords"])
-                location_info = self._extract_location_from_text(keywords_text)
+                location_info = self._parse(keywords_text)['location']
                 
                 # Set province if not already set
                 if not params.get("province") and location_info.get('province_name'):
@@ -1032,13 +858,13 @@ class SmartTroMCP:
                 
                 # Enhanced ward matching sử dụng vietnamlabs.com API
                 if not params.get("ward"):
-                    # Fetch wards data từ vietnamlabs.com
-                    wards_list = self._fetch_wards_from_vietnamlabs()
+                    # Đảm bảo gazetteer đã có (hoặc đang refresh ở background)
+                    wards_list = await self._fetch_wards_from_vietnamlabs()
                     
                     if wards_list:
                         for keyword in criteria["location"]["keywords"]:
-                            # Thử fuzzy matching với từng keyword
-                            matched_ward = self._fuzzy_match_ward_name(keyword, wards_list)
+                            # Thử fuzzy matching với từng keyword (trong tỉnh đã xác định nếu có)
+                            matched_ward = self._fuzzy_match_ward_name(keyword, params.get("province"))
                             if matched_ward:
                                 params["ward"] = matched_ward
                                 print(f"Ward matched: '{keyword}' -> '{matched_ward}'")
@@ -1055,7 +881,8 @@ class SmartTroMCP:
                     amenity_ids = criteria["amenities"]
                 else:
                     # Try to map amenity names to IDs
-                    amenity_ids = self._extract_amenities_from_text(" ".join(criteria["amenities"]))
+                    amenity_terms = self._parse(" ".join(criteria["amenities"]))['amenity_terms']
+                    amenity_ids = self._get_amenity_ids_by_names(amenity_terms)
                     if amenity_ids:
                         params["amenities"] = ",".join(amenity_ids)
         
@@ -1065,7 +892,7 @@ class SmartTroMCP:
         # Get location_info first
         location_info = {'province_name': None, 'ward_name': None}
         if criteria["location"]["keywords"]:
-            location_info = self._extract_location_from_text(" ".join(criteria["location"]["keywords"]))
+            location_info = self._parse(" ".join(criteria["location"]["keywords"]))['location']
         
         # Chỉ thêm keywords chưa được map thành province hoặc ward
         if criteria["location"]["keywords"]:
@@ -1132,30 +959,23 @@ class SmartTroMCP:
         if search_terms:
             params["search"] = " ".join(search_terms)
         
-        try:
-            response = requests.get(self.property_search_url, params=params, timeout=10)
-            print(f"params: {params}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                properties = data.get("data", {}).get("properties", [])
-              
-                
-                # Properties đã có sẵn các trường province, ward, detailAddress từ API
-                # Không cần tạo nested location object - đồng nhất với API search property
-                print(f"Final properties (direct fields): {len(properties)} items")
-                return properties
-            else:
-                print(f"API Error: {response.status_code} - {response.text}")
-                return []
-        except Exception as e:
-            print(f"Search error: {e}")
-            return []
+        return params
     
     
 # Khởi tạo MCP service và FastAPI
 mcp_service = SmartTroMCP()
-app = FastAPI(title="Smart Tro MCP API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mcp_service.startup()
+    yield
+    await mcp_service.shutdown()
+
+app = FastAPI(title="Smart Tro MCP API", version="1.0.0", lifespan=lifespan)
+
+# Nén response lớn + đo byte mỗi turn của /api/chat (full vs lean) và /api/chat/stream
+payload_metrics = PayloadMetrics(paths=["/api/chat", "/api/chat/stream"])
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES, metrics=payload_metrics)
 
 # CORS middleware
 app.add_middleware(
@@ -1173,38 +993,173 @@ async def chat_endpoint(chat_message: ChatMessage):
     API endpoint cho guided conversation
     """
     try:
-        result = mcp_service.process_guided_api(
+        if chat_message.protocol == "lean":
+            result = await mcp_service.process_lean_api(
+                message=chat_message.message,
+                session_id=chat_message.sessionId,
+                client_version=chat_message.stateVersion
+            )
+            return JSONResponse(
+                LeanChatResponse(**result).model_dump(exclude_none=True),
+                headers={"X-Chat-Protocol": "lean"}
+            )
+        
+        result = await mcp_service.process_guided_api(
             message=chat_message.message,
             session_id=chat_message.sessionId,
             conversation_state=chat_message.conversationState
         )
         
-        return ChatResponse(
-            success=result.get('success', True),
-            message=result.get('message', ''),
-            step=result.get('step', ''),
-            options=result.get('options'),
-            properties=result.get('properties'),
-            totalFound=result.get('totalFound'),
-            conversationState=result.get('conversation_state', {}),
-            showGrid=result.get('showGrid', False),
-            placeholder=result.get('placeholder')
-        )
+        return _chat_response(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _chat_response(result: Dict[str, Any]) -> ChatResponse:
+    return ChatResponse(
+        success=result.get('success', True),
+        message=result.get('message', ''),
+        step=result.get('step', ''),
+        options=result.get('options'),
+        properties=result.get('properties'),
+        totalFound=result.get('totalFound'),
+        conversationState=result.get('conversation_state', {}),
+        showGrid=result.get('showGrid', False),
+        placeholder=result.get('placeholder'),
+        degraded=result.get('degraded'),
+        retryAfter=result.get('retry_after')
+    )
+
+def _sse(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode('utf-8')
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(chat_message: ChatMessage):
+    """
+    Guided conversation qua Server-Sent Events (cùng body với /api/chat, hỗ trợ protocol="lean")
+    - `message`: bot message + step (+ state), gửi ngay, không chờ Node API
+    - `properties`: kết quả search theo từng batch {offset, properties}
+    - `done`: totalFound (+ message kết quả nếu turn có search; degraded/retryAfter khi Node API gián đoạn), luôn là event cuối
+    """
+    lean = chat_message.protocol == "lean"
+    
+    async def events():
+        try:
+            if lean:
+                result = await mcp_service.process_lean_api(
+                    message=chat_message.message,
+                    session_id=chat_message.sessionId,
+                    client_version=chat_message.stateVersion,
+                    defer_search=True
+                )
+                yield _sse("message", LeanChatResponse(**result).model_dump(exclude_none=True))
+            else:
+                result = await mcp_service.process_guided_api(
+                    message=chat_message.message,
+                    session_id=chat_message.sessionId,
+                    conversation_state=chat_message.conversationState,
+                    defer_search=True
+                )
+                yield _sse("message", dict(_chat_response(result).model_dump(), sessionId=result['session_id']))
+            
+            if not result.get('pending_search'):
+                yield _sse("done", {"totalFound": result.get('total_found')})
+                return
+            
+            criteria = result['search_criteria']
+            outcome = await mcp_service.search_with_fallback(criteria)
+            properties = outcome['properties']
+            if lean:
+                properties = project_properties(properties)
+            for offset in range(0, len(properties), SSE_PROPERTY_BATCH):
+                yield _sse("properties", {
+                    "offset": offset,
+                    "properties": properties[offset:offset + SSE_PROPERTY_BATCH]
+                })
+            
+            final = mcp_service._search_outcome_response({}, criteria, outcome)
+            done = {
+                "totalFound": final.get('total_found'),
+                "message": final['message'],
+                "showGrid": final.get('show_grid', False)
+            }
+            if final.get('degraded'):
+                done.update(degraded=final['degraded'], retryAfter=final.get('retry_after'),
+                            step=final['step'], options=final.get('options'))
+            yield _sse("done", done)
+        except Exception as e:
+            yield _sse("error", {"message": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Chat-Protocol": "stream-lean" if lean else "stream"
+        }
+    )
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/api/metrics")
+def metrics():
+    """Metrics vận hành của chatbot service"""
+    return {
+        "success": True,
+        "data": {
+            "http": mcp_service.http.metrics(),
+            "search_cache": mcp_service.search_cache.metrics(),
+            "prefetch": mcp_service.prefetcher.metrics(),
+            "payload": payload_metrics.snapshot(),
+            "sessions": mcp_service.sessions.metrics(),
+            "extractor": mcp_service.extractor.stats(),
+            "gazetteer": mcp_service.gazetteer.stats()
+        }
+    }
+
+@app.get("/api/breakers")
+async def breaker_status():
+    """Trạng thái circuit breaker của từng upstream (search, amenities, vietnamlabs)"""
+    return {"success": True, "data": mcp_service.http.breaker_states()}
+
+@app.get("/api/locations/suggest")
+async def suggest_locations(
+    q: str = Query("", description="Tiền tố tên tỉnh/phường, có hoặc không dấu"),
+    limit: int = Query(8, ge=1, le=20),
+    type: Optional[str] = Query(None, pattern="^(province|ward)$"),
+    province: Optional[str] = None
+):
+    """Typeahead tỉnh/thành + phường/xã không phân biệt dấu"""
+    start_time = time.perf_counter()
+    suggestions = mcp_service.gazetteer.typeahead.suggest(q, limit=limit, kind=type, province=province)
+    return {
+        "success": True,
+        "data": suggestions,
+        "tookMs": round((time.perf_counter() - start_time) * 1000, 3)
+    }
+
+@app.get("/api/gazetteer")
+async def gazetteer_status():
+    """Trạng thái snapshot tỉnh/phường"""
+    return {"success": True, "data": mcp_service.gazetteer.stats()}
+
+@app.post("/api/gazetteer/refresh")
+async def gazetteer_refresh():
+    """Tải lại gazetteer từ vietnamlabs.com ở background"""
+    started = mcp_service.gazetteer.schedule_refresh(mcp_service.http)
+    return {"success": True, "started": started, "data": mcp_service.gazetteer.stats()}
+
 @app.get("/api/sessions/{session_id}")
-async def get_session(session_id: str):
+def get_session(session_id: str):
     """Lấy thông tin session"""
-    if session_id in mcp_service.conversation_sessions:
+    state = mcp_service.sessions.get(session_id)
+    if state is not None:
         return {
             "success": True,
-            "data": mcp_service.conversation_sessions[session_id]
+            "data": state
         }
     return {"success": False, "message": "Session not found"}
 
@@ -1222,8 +1177,9 @@ if __name__ == "__main__":
         # Import gradio only when needed
         import gradio as gr
         
-        def simple_chat(message):
-            result = mcp_service.process_guided_api(message)
+        async def simple_chat(message):
+            await mcp_service.startup()
+            result = await mcp_service.process_guided_api(message)
             return result.get('message', 'Error processing message')
         
         demo = gr.Interface(
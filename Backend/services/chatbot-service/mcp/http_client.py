@@ -0,0 +1,264 @@
+"""
+Smart Tro MCP - Async HTTP client
+Một aiohttp.ClientSession dùng chung cho mọi request ra ngoài (Node API search,
+amenities, vietnamlabs.com): kết nối keep-alive trong pool, timeout theo từng
+call, retry có giới hạn với backoff + jitter, histogram độ trễ theo upstream,
+circuit breaker theo upstream (circuit mở => CircuitOpenError ngay, không chờ timeout).
+"""
+import asyncio
+import random
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from circuit_breaker import CircuitBreaker, HALF_OPEN, OPEN
+
+# Biên trên các bucket histogram (ms); bucket cuối là +inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Status tạm thời (quá tải / gateway) mới retry; 4xx và 500 trả lỗi ngay
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class UpstreamError(Exception):
+    """Request tới upstream thất bại (HTTP lỗi, timeout, mất kết nối) sau khi đã retry"""
+
+    def __init__(self, upstream: str, message: str, status: Optional[int] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.status = status
+
+
+class CircuitOpenError(UpstreamError):
+    """Circuit của upstream đang mở: request bị từ chối ngay, thử lại sau `retry_after` giây"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, f"circuit open, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LatencyHistogram:
+    """Histogram bucket cố định; percentile ước lượng bằng biên trên của bucket"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = self.buckets[index] if index < len(self.buckets) else self.max_ms
+                return round(min(bound, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}ms" for bound in self.buckets] + ["inf"]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else None,
+            'p50_ms': self.percentile(0.50),
+            'p90_ms': self.percentile(0.90),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 2),
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+
+class _UpstreamStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.statuses = Counter()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'latency': self.latency.snapshot()
+        }
+
+
+class AsyncHttpClient:
+    """
+    Client HTTP async dùng chung cho cả service
+
+    - ClientSession + TCPConnector tạo lazily cho mỗi event loop đang chạy, giữ
+      kết nối keep-alive (`pool_size` tổng, `pool_per_host` mỗi host); loop tắt
+      thì session của nó được đóng theo
+    - get_json(): timeout cho mỗi lần thử, retry tối đa `retries` lần khi
+      timeout / lỗi kết nối / RETRY_STATUSES, chờ full-jitter backoff giữa các lần
+    - latency mỗi call (gồm cả retry) ghi vào histogram theo tên upstream
+    - mỗi upstream một CircuitBreaker (`breaker_options` truyền cho CircuitBreaker);
+      kết quả cả call (sau retry) mới tính vào tỷ lệ lỗi, 4xx không tính là lỗi upstream
+    """
+
+    def __init__(self, timeout: float = 10, connect_timeout: float = 3, retries: int = 2,
+                 backoff: float = 0.2, max_backoff: float = 2.0, pool_size: int = 100,
+                 pool_per_host: int = 20, keepalive_seconds: float = 30,
+                 breakers_enabled: bool = True, breaker_options: Optional[Dict[str, Any]] = None):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        self.keepalive_seconds = keepalive_seconds
+        self.breakers_enabled = breakers_enabled
+        self.breaker_options = breaker_options or {}
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Mỗi event loop một session: loop -> (session, task chờ loop tắt)
+        self._sessions: Dict[asyncio.AbstractEventLoop, Tuple[aiohttp.ClientSession, asyncio.Task]] = {}
+        self._upstreams: Dict[str, _UpstreamStats] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        # Session gắn với loop tạo ra nó (uvicorn, gradio, TestClient...) => mỗi loop một session
+        entry = self._sessions.get(loop)
+        if entry is not None:
+            if not entry[0].closed:
+                return entry[0]
+            entry[1].cancel()
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_per_host,
+            keepalive_timeout=self.keepalive_seconds,
+            ttl_dns_cache=300
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        self._sessions[loop] = (session, loop.create_task(self._close_on_shutdown(loop, session)))
+        return session
+
+    async def _close_on_shutdown(self, loop: asyncio.AbstractEventLoop, session: aiohttp.ClientSession):
+        """
+        Chờ tới khi loop tắt: asyncio.run / anyio cancel các task còn lại trước khi
+        đóng loop => đóng session ngay trên loop của nó, không để lại kết nối mồ côi
+        """
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self._sessions.get(loop, (None,))[0] is session:
+                del self._sessions[loop]
+            await session.close()
+
+    def _stats(self, upstream: str) -> _UpstreamStats:
+        stats = self._upstreams.get(upstream)
+        if stats is None:
+            stats = self._upstreams[upstream] = _UpstreamStats()
+        return stats
+
+    def breaker(self, upstream: str) -> Optional[CircuitBreaker]:
+        if not self.breakers_enabled:
+            return None
+        breaker = self._breakers.get(upstream)
+        if breaker is None:
+            breaker = self._breakers[upstream] = CircuitBreaker(upstream, **self.breaker_options)
+        return breaker
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: các client retry cùng lúc không dồn vào cùng một thời điểm
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    async def get_json(self, url: str, params: Dict[str, Any] = None, upstream: str = 'default',
+                       timeout: float = None, retries: int = None) -> Any:
+        """GET rồi parse JSON; raise UpstreamError nếu vẫn lỗi sau khi retry, CircuitOpenError nếu circuit mở"""
+        stats = self._stats(upstream)
+        breaker = self.breaker(upstream)
+        permit = breaker.acquire() if breaker is not None else None
+        if breaker is not None and permit is None:
+            raise CircuitOpenError(upstream, breaker.retry_after())
+
+        retries = self.retries if retries is None else retries
+        if breaker is not None and breaker.state == HALF_OPEN:
+            # Request thăm dò: một lần, không retry
+            retries = 0
+        call_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout, sock_connect=self.connect_timeout)
+        session = self._get_session()
+
+        stats.calls += 1
+        healthy = None
+        start_time = time.perf_counter()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    async with session.get(url, params=params, timeout=call_timeout) as response:
+                        stats.statuses[response.status] += 1
+                        if response.status == 200:
+                            data = await response.json(content_type=None)
+                            healthy = True
+                            return data
+                        body = (await response.text())[:200]
+                        error = UpstreamError(upstream, f"HTTP {response.status} {body}", response.status)
+                        if response.status not in RETRY_STATUSES:
+                            raise error
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    error = UpstreamError(upstream, f"timeout after {call_timeout.total}s")
+                except aiohttp.ClientError as e:
+                    error = UpstreamError(upstream, f"{type(e).__name__}: {e}")
+                if attempt < retries:
+                    if breaker is not None and breaker.state == OPEN:
+                        # Các call khác đã làm circuit mở => không retry nữa
+                        break
+                    stats.retries += 1
+                    await asyncio.sleep(self._backoff(attempt))
+            raise error
+        except Exception as e:
+            stats.errors += 1
+            # 4xx (trừ 429) là lỗi của request, upstream vẫn khỏe
+            status = getattr(e, 'status', None)
+            healthy = status is not None and status < 500 and status not in RETRY_STATUSES
+            raise
+        finally:
+            stats.latency.observe((time.perf_counter() - start_time) * 1000)
+            if breaker is not None:
+                if healthy is None:
+                    # Bị hủy (CancelledError) trước khi có kết quả
+                    breaker.release(permit)
+                else:
+                    breaker.record(permit, healthy)
+
+    async def close(self):
+        """Đóng session của loop đang chạy (session của loop khác tự đóng khi loop đó tắt)"""
+        entry = self._sessions.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            session, watcher = entry
+            watcher.cancel()
+            await session.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'pool_size': self.pool_size,
+            'pool_per_host': self.pool_per_host,
+            'keepalive_seconds': self.keepalive_seconds,
+            'timeout_seconds': self.timeout,
+            'retries': self.retries,
+            'upstreams': {name: stats.snapshot() for name, stats in sorted(self._upstreams.items())},
+            'breakers': self.breaker_states()
+        }
+
+    def breaker_states(self) -> Dict[str, Any]:
+        return {name: breaker.snapshot() for name, breaker in sorted(self._breakers.items())}
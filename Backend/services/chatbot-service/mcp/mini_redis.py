@@ -0,0 +1,214 @@
+"""
+Smart Tro MCP - Mini Redis
+Stand-in local nói giao thức RESP2, đủ cho RedisSessionStore và các cache dùng
+Redis: PING, GET, SET (EX/PX/NX), DEL, EXISTS, EXPIRE, TTL, DBSIZE, FLUSHDB,
+SELECT, AUTH, INFO và sorted set (ZADD, ZREM, ZCARD, ZCOUNT, ZRANGE,
+ZREMRANGEBYSCORE) cho index session. Chỉ dùng cho dev/test/benchmark, không dùng production.
+
+Usage:
+    python mini_redis.py --port 6390
+    SESSION_BACKEND=redis SESSION_REDIS_URL=redis://localhost:6390/0 python gradio_server.py
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+class MiniRedisState:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.zsets = {}  # key -> {member: score}
+        self.lock = threading.Lock()
+        self.expired_keys = 0
+
+    def alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and time.time() >= deadline:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self.expired_keys += 1
+            return False
+        return key in self.data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()  # inline command (redis-cli / telnet)
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, bool):
+            self.wfile.write(b":%d\r\n" % int(value))
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, Exception):
+            self.wfile.write(b"-ERR %s\r\n" % str(value).encode())
+        elif isinstance(value, str):
+            self.wfile.write(b"+%s\r\n" % value.encode())
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self._write(item)
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        state = self.server.state
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            command = args[0].decode().upper()
+            with state.lock:
+                try:
+                    reply = self._execute(state, command, args[1:])
+                except Exception as e:
+                    reply = e
+            self._write(reply)
+            self.wfile.flush()
+
+    @staticmethod
+    def _execute(state, command, args):
+        if command == "PING":
+            return "PONG"
+        if command in ("SELECT", "AUTH"):
+            return "OK"
+        if command == "GET":
+            return state.data[args[0]] if state.alive(args[0]) else None
+        if command == "SET":
+            key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+            if "NX" in options and state.alive(key):
+                return None
+            state.data[key] = value
+            state.expires.pop(key, None)
+            for flag, scale in (("EX", 1.0), ("PX", 0.001)):
+                if flag in options:
+                    state.expires[key] = time.time() + int(options[options.index(flag) + 1]) * scale
+            return "OK"
+        if command == "DEL":
+            removed = 0
+            for key in args:
+                if state.alive(key):
+                    removed += 1
+                if key in state.zsets:
+                    removed += 1
+                state.data.pop(key, None)
+                state.expires.pop(key, None)
+                state.zsets.pop(key, None)
+            return removed
+        if command == "EXISTS":
+            return sum(1 for key in args if state.alive(key))
+        if command == "EXPIRE":
+            if not state.alive(args[0]):
+                return 0
+            state.expires[args[0]] = time.time() + int(args[1])
+            return 1
+        if command == "TTL":
+            if not state.alive(args[0]):
+                return -2
+            deadline = state.expires.get(args[0])
+            return -1 if deadline is None else int(deadline - time.time())
+        if command == "DBSIZE":
+            for key in list(state.expires):
+                state.alive(key)
+            return len(state.data) + len(state.zsets)
+        if command == "FLUSHDB":
+            state.data.clear()
+            state.expires.clear()
+            state.zsets.clear()
+            return "OK"
+        if command == "INFO":
+            return f"# Stats\r\nexpired_keys:{state.expired_keys}\r\nevicted_keys:0\r\n".encode()
+        if command.startswith("Z"):
+            return _SortedSets.execute(state, command, args)
+        raise ValueError(f"unknown command '{command}'")
+
+
+class _SortedSets:
+    """Sorted set: chỉ các lệnh RedisSessionStore dùng, score là float, không hỗ trợ biên '('"""
+
+    @staticmethod
+    def execute(state, command, args):
+        zset = state.zsets.get(args[0], {})
+        if command == "ZADD":
+            zset = state.zsets.setdefault(args[0], {})
+            added = 0
+            for score, member in zip(args[1::2], args[2::2]):
+                added += member not in zset
+                zset[member] = float(score)
+            return added
+        if command == "ZREM":
+            removed = sum(1 for member in args[1:] if zset.pop(member, None) is not None)
+            if not zset:
+                state.zsets.pop(args[0], None)
+            return removed
+        if command == "ZCARD":
+            return len(zset)
+        if command == "ZCOUNT":
+            low, high = float(args[1]), float(args[2])
+            return sum(1 for score in zset.values() if low <= score <= high)
+        if command == "ZRANGE":
+            members = sorted(zset, key=lambda member: (zset[member], member))
+            start, stop = int(args[1]), int(args[2])
+            stop = len(members) + stop if stop < 0 else stop
+            return members[start:stop + 1]
+        if command == "ZREMRANGEBYSCORE":
+            low, high = float(args[1]), float(args[2])
+            doomed = [member for member, score in zset.items() if low <= score <= high]
+            for member in doomed:
+                del zset[member]
+            if not zset:
+                state.zsets.pop(args[0], None)
+            return len(doomed)
+        raise ValueError(f"unknown command '{command}'")
+
+
+class MiniRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.state = MiniRedisState()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        """Chạy server ở background thread (dùng trong test/benchmark)"""
+        threading.Thread(target=self.serve_forever, name="mini-redis", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local RESP stand-in for Redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = MiniRedisServer(args.host, args.port)
+    print(f"Mini Redis listening on {server.url}")
+    server.serve_forever()
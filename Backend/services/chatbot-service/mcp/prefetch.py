@@ -0,0 +1,109 @@
+"""
+Smart Tro MCP - Speculative search prefetch
+Khi collected_data của một session đã đủ tiêu chí (loại phòng + ngân sách),
+search được chạy trước ở background và kết quả nằm sẵn trong SearchCache;
+criteria đổi thì prefetch lại. Đến bước "Tìm kiếm", criteria giống prefetch
+gần nhất => search thật trúng cache (hoặc chờ chung request đang chạy qua
+singleflight) thay vì đợi Node API.
+"""
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+Search = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class _Prefetch:
+    __slots__ = ('signature', 'task')
+
+    def __init__(self, signature: str, task: asyncio.Task):
+        self.signature = signature
+        self.task = task
+
+
+class SearchPrefetcher:
+    """
+    Theo dõi prefetch gần nhất của mỗi session
+
+    - update(): gọi sau mỗi turn có đủ criteria; criteria mới => prefetch mới,
+      prefetch cũ chưa dùng tính là wasted
+    - consume(): gọi ở turn search; criteria trùng prefetch => hit
+    Tối đa `max_in_flight` prefetch chạy cùng lúc, vượt quá thì bỏ qua (skipped).
+    """
+
+    def __init__(self, search: Search, max_in_flight: int = 20, max_sessions: int = 10000):
+        self._search = search
+        self.max_in_flight = max_in_flight
+        self.max_sessions = max_sessions
+        self._sessions: 'OrderedDict[str, _Prefetch]' = OrderedDict()
+        self._in_flight = 0
+
+        self.started = 0
+        self.skipped = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    @staticmethod
+    def signature(criteria: Dict[str, Any]) -> str:
+        return json.dumps(criteria, ensure_ascii=False, sort_keys=True, default=str)
+
+    def update(self, session_id: str, criteria: Dict[str, Any]) -> bool:
+        """Bắt đầu prefetch cho criteria mới của session; False nếu trùng prefetch hiện có hoặc bị bỏ qua"""
+        signature = self.signature(criteria)
+        current = self._sessions.get(session_id)
+        if current is not None and current.signature == signature:
+            return False
+        if current is not None:
+            # Criteria đã đổi trước khi prefetch cũ được dùng
+            self.wasted += 1
+            del self._sessions[session_id]
+        if self._in_flight >= self.max_in_flight:
+            self.skipped += 1
+            return False
+
+        self.started += 1
+        self._in_flight += 1
+        task = asyncio.get_running_loop().create_task(self._run(criteria))
+        self._sessions[session_id] = _Prefetch(signature, task)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.wasted += 1
+        return True
+
+    async def _run(self, criteria: Dict[str, Any]):
+        try:
+            await self._search(criteria)
+        except Exception as e:
+            self.errors += 1
+            print(f"Prefetch search failed: {e}")
+        finally:
+            self._in_flight -= 1
+
+    def consume(self, session_id: str, criteria: Dict[str, Any]) -> bool:
+        """Gọi ở turn search: True nếu prefetch của session có đúng criteria này"""
+        current = self._sessions.pop(session_id, None)
+        if current is not None and current.signature == self.signature(criteria):
+            self.hits += 1
+            return True
+        self.misses += 1
+        if current is not None:
+            self.wasted += 1
+        return False
+
+    def metrics(self) -> Dict[str, Any]:
+        searches = self.hits + self.misses
+        return {
+            'started': self.started,
+            'in_flight': self._in_flight,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / searches, 3) if searches else None,
+            'wasted': self.wasted,
+            'wasted_ratio': round(self.wasted / self.started, 3) if self.started else None,
+            'pending_sessions': len(self._sessions)
+        }
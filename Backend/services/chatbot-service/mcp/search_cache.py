@@ -0,0 +1,217 @@
+"""
+Smart Tro MCP - Search result cache
+Cache kết quả /search-properties/properties theo params đã chuẩn hóa: key sắp
+xếp, bỏ giá trị rỗng, giá/diện tích làm tròn ra biên bucket (lấy trang lớn hơn
+rồi lọc lại theo khoảng gốc của từng request). TTL + LRU giới hạn
+số entry; hết TTL vẫn trả kết quả cũ ngay trong cửa sổ stale và refresh ở
+background (stale-while-revalidate). Các lần fetch cùng key đang chạy song song
+được gộp thành một call upstream (singleflight). Khi Node API lỗi / circuit mở,
+fallback() trả entry còn giữ trong LRU dù đã quá cửa sổ stale.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from singleflight import SingleFlight
+
+# param -> (field trong property, bucket dùng chung, là biên dưới?)
+BUCKETED_PARAMS = {
+    'minPrice': ('rentPrice', 'price', True),
+    'maxPrice': ('rentPrice', 'price', False),
+    'minArea': ('area', 'area', True),
+    'maxArea': ('area', 'area', False),
+}
+
+Fetch = Callable[[Dict[str, Any]], Awaitable[List[Dict]]]
+
+
+class _Entry:
+    __slots__ = ('properties', 'stored_at')
+
+    def __init__(self, properties: List[Dict], stored_at: float):
+        self.properties = properties
+        self.stored_at = stored_at
+
+
+class SearchCache:
+    """
+    Cache kết quả search theo params chuẩn hóa
+
+    - tuổi < ttl: hit, trả ngay
+    - ttl <= tuổi < ttl + stale: trả bản cũ ngay, refresh ở background (mỗi key một task)
+    - còn lại: miss, gọi fetch() rồi lưu
+    Miss và refresh cùng key chạy đồng thời chỉ gọi fetch() một lần (SingleFlight).
+    Params chuẩn hóa (khoảng giá/diện tích nới ra biên bucket, `limit` nhân
+    `overfetch`) là cache key và cũng là params gửi upstream. Hit, miss và
+    fallback() đều lọc trang đã cache theo khoảng gốc của request rồi cắt còn
+    `limit` gốc, nên cùng params luôn nhận cùng kết quả và không lọt bài ngoài
+    khoảng user hỏi.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, stale_seconds: float = 300, max_entries: int = 1000,
+                 price_bucket: int = 500000, area_bucket: int = 5, overfetch: int = 3):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.buckets = {'price': price_bucket, 'area': area_bucket}
+        self.overfetch = max(1, overfetch)
+
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.flight = SingleFlight()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evicted = 0
+        self.fallback_hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def canonicalize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Params chuẩn hóa (cũng là params gửi upstream)"""
+        canonical = {}
+        for name, value in params.items():
+            if value is None or value == '':
+                continue
+            if name in BUCKETED_PARAMS:
+                _, bucket_name, is_lower = BUCKETED_PARAMS[name]
+                bucket = self.buckets[bucket_name]
+                value = float(value)
+                if bucket > 0:
+                    value = (math.floor if is_lower else math.ceil)(value / bucket) * bucket
+                canonical[name] = int(value)
+            elif name == 'amenities':
+                canonical[name] = ','.join(sorted(filter(None, str(value).split(','))))
+            elif isinstance(value, str):
+                canonical[name] = ' '.join(value.split())
+            else:
+                canonical[name] = value
+        # Khoảng rộng hơn => lấy trang lớn hơn để sau khi lọc lại vẫn đủ `limit` bài
+        if 'limit' in canonical and any(name in canonical for name in BUCKETED_PARAMS):
+            canonical['limit'] = int(canonical['limit']) * self.overfetch
+        return canonical
+
+    @staticmethod
+    def key(canonical: Dict[str, Any]) -> str:
+        return json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+    async def get(self, params: Dict[str, Any], fetch: Fetch) -> List[Dict]:
+        """Kết quả cho `params`, gọi `fetch(params chuẩn hóa)` khi miss; lỗi fetch không được cache"""
+        if not self.enabled:
+            return await self.flight.do(self.key(params), lambda: fetch(params))
+
+        canonical = self.canonicalize(params)
+        key = self.key(canonical)
+        entry = self._entries.get(key)
+        now = time.time()
+
+        if entry is not None:
+            age = now - entry.stored_at
+            if age < self.ttl_seconds:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return _narrow(entry.properties, params)
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, canonical, fetch)
+                return _narrow(entry.properties, params)
+
+        self.misses += 1
+        properties = await self.flight.do(key, lambda: self._fetch_and_store(key, canonical, fetch))
+        return _narrow(properties, params)
+
+    async def _fetch_and_store(self, key: str, canonical: Dict[str, Any], fetch: Fetch) -> List[Dict]:
+        properties = await fetch(canonical)
+        self._store(key, properties)
+        return properties
+
+    def _store(self, key: str, properties: List[Dict]):
+        self._entries[key] = _Entry(properties, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def _schedule_refresh(self, key: str, canonical: Dict[str, Any], fetch: Fetch):
+        if key in self._refreshing:
+            return
+        task = asyncio.get_running_loop().create_task(self._refresh(key, canonical, fetch))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: str, canonical: Dict[str, Any], fetch: Fetch):
+        try:
+            await self.flight.do(key, lambda: self._fetch_and_store(key, canonical, fetch))
+        except Exception as e:
+            # Giữ bản cũ; request sau trong cửa sổ stale sẽ thử lại
+            self.refresh_errors += 1
+            print(f"Search cache refresh failed: {e}")
+            return
+        self.refreshes += 1
+
+    def fallback(self, params: Dict[str, Any]) -> Optional[List[Dict]]:
+        """Bản đã cache cho `params` bất kể tuổi, dùng khi upstream lỗi / circuit mở; None nếu chưa có"""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(self.key(self.canonicalize(params)))
+        if entry is None:
+            return None
+        self.fallback_hits += 1
+        return _narrow(entry.properties, params)
+
+    def clear(self):
+        self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'stale_seconds': self.stale_seconds,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+            'refreshing': len(self._refreshing),
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'evicted': self.evicted,
+            'fallback_hits': self.fallback_hits,
+            'singleflight': self.flight.metrics()
+        }
+
+
+def _exact_bounds(params: Dict[str, Any]) -> List[Tuple[str, float, bool]]:
+    return [
+        (BUCKETED_PARAMS[name][0], float(value), BUCKETED_PARAMS[name][2])
+        for name, value in params.items()
+        if name in BUCKETED_PARAMS and value is not None and value != ''
+    ]
+
+
+def _narrow(properties: List[Dict], params: Dict[str, Any]) -> List[Dict]:
+    """Lọc theo khoảng giá/diện tích gốc của request (property thiếu field thì giữ) rồi cắt còn `limit` gốc"""
+    bounds = _exact_bounds(params)
+    result = []
+    for prop in properties:
+        keep = True
+        for field, bound, is_lower in bounds:
+            value = prop.get(field)
+            if isinstance(value, (int, float)) and (value < bound if is_lower else value > bound):
+                keep = False
+                break
+        if keep:
+            result.append(prop)
+    limit = params.get('limit')
+    return result[:int(limit)] if limit else result
@@ -0,0 +1,468 @@
+"""
+Smart Tro MCP - Session store
+Lưu conversation state theo session_id, có giới hạn kích thước và TTL:
+- MemorySessionStore: LRU + TTL trong process (mặc định, 1 instance)
+- SQLiteSessionStore: file SQLite (WAL) dùng chung giữa các worker trên một máy
+- RedisSessionStore: client RESP tối giản (không cần thư viện redis), nhiều instance
+
+create_session_store() chọn backend theo SESSION_BACKEND. Code async (chat
+endpoint) dùng aget()/aset(): backend có I/O chặn chạy trong thread pool để
+không chặn event loop.
+"""
+import asyncio
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+
+class SessionStore(ABC):
+    """Interface chung; get() trả về None khi không có hoặc đã hết hạn"""
+
+    backend = "base"
+    # get/set/delete có I/O chặn (socket, file) => bản async chạy qua asyncio.to_thread
+    blocking = True
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._metrics_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.expired = 0
+        self.errors = 0
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, session_id: str, state: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    def close(self):
+        pass
+
+    async def aget(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if not self.blocking:
+            return self.get(session_id)
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aset(self, session_id: str, state: Dict[str, Any]):
+        if not self.blocking:
+            return self.set(session_id, state)
+        return await asyncio.to_thread(self.set, session_id, state)
+
+    async def adelete(self, session_id: str):
+        if not self.blocking:
+            return self.delete(session_id)
+        return await asyncio.to_thread(self.delete, session_id)
+
+    def _count(self, field: str, amount: int = 1):
+        with self._metrics_lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def metrics(self) -> Dict[str, Any]:
+        try:
+            size = self.size()
+        except Exception as e:
+            self._count('errors')
+            size = None
+            print(f"Session store size error: {e}")
+        with self._metrics_lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend,
+                "size": size,
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "writes": self.writes,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "errors": self.errors
+            }
+
+
+class MemorySessionStore(SessionStore):
+    """LRU + TTL trong bộ nhớ; giữ nguyên object state (không serialize)"""
+
+    backend = "memory"
+    blocking = False
+
+    def __init__(self, ttl_seconds: float = 7200, max_sessions: int = 10000):
+        super().__init__(ttl_seconds, max_sessions)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        # Dùng chung lock với counters: mọi thao tác đều đã nằm trong lock này
+        self._lock = self._metrics_lock
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            state, updated_at = entry
+            if self.ttl_seconds and time.time() - updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return state
+
+    def set(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (state, time.time())
+            self._sessions.move_to_end(session_id)
+            self.writes += 1
+            self._purge_expired()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def _purge_expired(self):
+        # Entry cũ nhất nằm đầu OrderedDict => dừng ở entry còn hạn đầu tiên
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        while self._sessions:
+            session_id, (_, updated_at) = next(iter(self._sessions.items()))
+            if updated_at >= cutoff:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def size(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Bảng sessions(id, state JSON, updated_at) trong SQLite WAL
+
+    Mỗi thread một connection. Entry hết hạn / vượt max_sessions được dọn
+    theo lô mỗi `purge_every` lần ghi để không trả giá trên mọi request.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, ttl_seconds: float = 7200, max_sessions: int = 100000,
+                 purge_every: int = 200):
+        super().__init__(ttl_seconds, max_sessions)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes_since_purge = 0
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, session_id):
+        row = self._connect().execute(
+            "SELECT state, updated_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        state, updated_at = row
+        if self.ttl_seconds and time.time() - updated_at > self.ttl_seconds:
+            self._connect().execute("DELETE FROM sessions WHERE id = ? AND updated_at = ?", (session_id, updated_at))
+            self._count('expired')
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(state)
+
+    def set(self, session_id, state):
+        self._connect().execute(
+            "INSERT INTO sessions (id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (session_id, json.dumps(state, ensure_ascii=False, default=str), time.time())
+        )
+        self._count('writes')
+        with self._metrics_lock:
+            self._writes_since_purge += 1
+            purge = self._writes_since_purge >= self.purge_every
+            if purge:
+                self._writes_since_purge = 0
+        if purge:
+            self.purge()
+
+    def purge(self):
+        """Xóa session hết hạn rồi cắt bớt session cũ nhất khi vượt max_sessions"""
+        db = self._connect()
+        if self.ttl_seconds:
+            expired = db.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            self._count('expired', expired)
+        overflow = self.size() - self.max_sessions
+        if overflow > 0:
+            evicted = db.execute(
+                "DELETE FROM sessions WHERE id IN ("
+                " SELECT id FROM sessions ORDER BY updated_at LIMIT ?)", (overflow,)
+            ).rowcount
+            self._count('evicted', evicted)
+
+    def delete(self, session_id):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def size(self):
+        # ttl_seconds = 0: không hết hạn => đếm tất cả
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds else float('-inf')
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (cutoff,)
+        ).fetchone()[0]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class RespError(Exception):
+    """Lỗi trả về từ server Redis (-ERR ...)"""
+
+
+class RespConnection:
+    """Một kết nối RESP2: gửi command dạng array, đọc reply"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: float = 2.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    def execute(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count == -1:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RespError(f"Unknown RESP reply: {line!r}")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session trong Redis (SET key value EX ttl); TTL do server lo
+
+    Sorted set `<prefix>index` (session_id -> updated_at) giữ thứ tự cập nhật:
+    mỗi `purge_every` lần ghi, entry hết hạn bị bỏ khỏi index và session cũ nhất
+    vượt `max_sessions` bị xóa (0 = không giới hạn). Client RESP tối giản với
+    pool kết nối, nên chạy được với Redis thật, KeyDB/Valkey hoặc stand-in local
+    (mini_redis.py).
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str = "redis://localhost:6379/0", ttl_seconds: float = 7200,
+                 max_sessions: int = 0, prefix: str = "smarttro:session:", pool_size: int = 16,
+                 timeout: float = 2.0, purge_every: int = 200):
+        super().__init__(ttl_seconds, max_sessions)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self.index_key = prefix + "index"
+        self.timeout = timeout
+        self.purge_every = purge_every
+        self._writes_since_purge = 0
+        self._pool: "queue.LifoQueue[RespConnection]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _execute(self, *args):
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+        try:
+            result = connection.execute(*args)
+        except (OSError, ConnectionError):
+            # Kết nối hỏng: bỏ đi, thử lại một lần với kết nối mới
+            connection.close()
+            connection = RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+            result = connection.execute(*args)
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return result
+
+    def get(self, session_id):
+        try:
+            data = self._execute("GET", self.prefix + session_id)
+        except Exception as e:
+            self._count('errors')
+            print(f"Redis session get error: {e}")
+            return None
+        if data is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(data)
+
+    def set(self, session_id, state):
+        payload = json.dumps(state, ensure_ascii=False, default=str)
+        args = ["SET", self.prefix + session_id, payload]
+        if self.ttl_seconds:
+            args += ["EX", int(self.ttl_seconds)]
+        try:
+            self._execute(*args)
+            self._execute("ZADD", self.index_key, time.time(), session_id)
+            self._count('writes')
+        except Exception as e:
+            self._count('errors')
+            print(f"Redis session set error: {e}")
+            return
+        with self._metrics_lock:
+            self._writes_since_purge += 1
+            purge = self._writes_since_purge >= self.purge_every
+            if purge:
+                self._writes_since_purge = 0
+        if purge:
+            try:
+                self.purge()
+            except Exception as e:
+                self._count('errors')
+                print(f"Redis session purge error: {e}")
+
+    def purge(self):
+        """Bỏ session hết hạn khỏi index rồi xóa session cũ nhất khi vượt max_sessions"""
+        if self.ttl_seconds:
+            expired = self._execute("ZREMRANGEBYSCORE", self.index_key, "-inf", time.time() - self.ttl_seconds)
+            self._count('expired', expired)
+        if not self.max_sessions:
+            return
+        overflow = self._execute("ZCARD", self.index_key) - self.max_sessions
+        if overflow > 0:
+            oldest = self._execute("ZRANGE", self.index_key, 0, overflow - 1)
+            if oldest:
+                self._execute("DEL", *[self.prefix.encode() + session_id for session_id in oldest])
+                self._execute("ZREM", self.index_key, *oldest)
+                self._count('evicted', len(oldest))
+
+    def delete(self, session_id):
+        try:
+            self._execute("DEL", self.prefix + session_id)
+            self._execute("ZREM", self.index_key, session_id)
+        except Exception as e:
+            self._count('errors')
+            print(f"Redis session delete error: {e}")
+
+    def size(self):
+        if self.ttl_seconds:
+            return self._execute("ZCOUNT", self.index_key, time.time() - self.ttl_seconds, "+inf")
+        return self._execute("ZCARD", self.index_key)
+
+    def metrics(self):
+        result = super().metrics()
+        try:
+            info = self._execute("INFO", "stats")
+            if isinstance(info, bytes):
+                for line in info.decode().splitlines():
+                    if line.startswith(("expired_keys:", "evicted_keys:")):
+                        key, value = line.split(":", 1)
+                        result[f"server_{key}"] = int(value)
+        except Exception:
+            pass
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def create_session_store() -> SessionStore:
+    """Backend theo ENV: SESSION_BACKEND=memory|sqlite|redis"""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", "7200"))
+    max_sessions = int(os.getenv("SESSION_MAX", "10000"))
+    if backend == "sqlite":
+        path = os.getenv("SESSION_SQLITE_PATH", os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "data", "sessions.db"
+        ))
+        return SQLiteSessionStore(path, ttl_seconds, max_sessions)
+    if backend == "redis":
+        return RedisSessionStore(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"), ttl_seconds, max_sessions)
+    return MemorySessionStore(ttl_seconds, max_sessions)
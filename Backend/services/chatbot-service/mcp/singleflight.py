@@ -0,0 +1,47 @@
+"""
+Smart Tro MCP - Singleflight
+Gộp các call async giống nhau đang chạy cùng lúc: call đầu tiên cho một key
+chạy thật, các call sau chờ và nhận chung kết quả (hoặc exception) của nó.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    do(key, fn): nếu đã có call cho `key` đang chạy thì chờ call đó, không gọi fn()
+
+    Call thật chạy trong một Task riêng và mọi caller chờ qua asyncio.shield,
+    nên một caller bị cancel (client ngắt kết nối) không làm hỏng các caller khác.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.get_running_loop().create_task(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # đánh dấu đã đọc khi mọi caller đều đã bị cancel
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'collapsed': self.collapsed,
+            'in_flight': len(self._in_flight)
+        }
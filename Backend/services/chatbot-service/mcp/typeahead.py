@@ -0,0 +1,178 @@
+"""
+Smart Tro MCP - Typeahead tỉnh/thành + phường/xã
+Gợi ý theo tiền tố, không phân biệt dấu ("tan d" -> "Phường Tân Định").
+Mảng key đã sort + bisect, build một lần khi gazetteer load. Tiền tố phổ biến
+("p", "phuong", "tan"...) có khoảng bisect rất rộng nên top kết quả của chúng
+được tính sẵn; filter theo loại/tỉnh dùng index con nhỏ build lazy.
+"""
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from ward_matcher import fold_diacritics, normalize_name, strip_prefix
+
+# Thứ hạng: khớp đầu tên đầy đủ < khớp đầu tên bỏ prefix < khớp đầu một từ sau
+TIER_FULL, TIER_BARE, TIER_WORD = 0, 1, 2
+KIND_PROVINCE, KIND_WARD = 0, 1
+KIND_LABELS = {KIND_PROVINCE: 'province', KIND_WARD: 'ward'}
+
+# Tiền tố có nhiều hơn DENSE_PREFIX entry được tính sẵn PRECOMPUTED_TOP kết quả
+DENSE_PREFIX = 64
+PRECOMPUTED_TOP = 60
+
+# place = (kind, name, province, accented lowercase name)
+Place = Tuple[int, str, str, str]
+
+
+class _PrefixIndex:
+    """Sorted array (key, tier, kind, len, place_id) + bisect trên một tập place"""
+
+    def __init__(self, places: List[Place], place_ids: List[int]):
+        self._places = places
+        entries = []
+        for place_id in place_ids:
+            kind, name, _, _ = places[place_id]
+            full = normalize_name(name).replace('.', '')
+            bare = strip_prefix(normalize_name(name))
+            keys = {full: TIER_FULL}
+            keys.setdefault(bare, TIER_BARE)
+            words = bare.split()
+            for i in range(1, len(words)):
+                keys.setdefault(' '.join(words[i:]), TIER_WORD)
+            for key, tier in keys.items():
+                entries.append((key, tier, kind, len(name), place_id))
+        entries.sort()
+        self._entries = entries
+        self._keys = [entry[0] for entry in entries]
+
+        # Tiền tố "dày": xếp hạng một lần, lúc query chỉ cần tra dict
+        buckets: Dict[str, List[tuple]] = {}
+        for key, tier, kind, length, place_id in entries:
+            for n in range(1, len(key) + 1):
+                buckets.setdefault(key[:n], []).append((tier, kind, length, place_id))
+        self._dense: Dict[str, List[int]] = {}
+        for prefix, ranked in buckets.items():
+            if len(ranked) > DENSE_PREFIX:
+                ranked.sort()
+                self._dense[prefix] = _dedupe((r[3] for r in ranked), PRECOMPUTED_TOP)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def suggest(self, prefix: str, accented: Optional[str], limit: int) -> List[int]:
+        dense = self._dense.get(prefix)
+        if dense is not None:
+            if accented:
+                # Query có dấu: đưa tên khớp đúng dấu lên trước (sort ổn định)
+                dense = sorted(dense, key=lambda p: accented not in self._places[p][3])
+            return dense[:limit]
+
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + '\uffff', lo=start)
+        ranked = []
+        for _, tier, kind, length, place_id in self._entries[start:end]:
+            accent_miss = bool(accented) and accented not in self._places[place_id][3]
+            ranked.append((accent_miss, tier, kind, length, place_id))
+        ranked.sort()
+        return _dedupe((r[4] for r in ranked), limit)
+
+    def stats(self) -> Dict[str, int]:
+        return {'keys': len(self._keys), 'dense_prefixes': len(self._dense)}
+
+
+def _dedupe(place_ids, limit):
+    seen, result = set(), []
+    for place_id in place_ids:
+        if place_id not in seen:
+            seen.add(place_id)
+            result.append(place_id)
+            if len(result) >= limit:
+                break
+    return result
+
+
+class PlaceTypeahead:
+    """
+    Typeahead cho toàn bộ tỉnh + phường/xã
+
+    Index chung build ngay; index con theo loại ('province'/'ward') hoặc theo
+    tỉnh build lần đầu được dùng rồi cache (vài trăm entry, vài ms).
+    """
+
+    def __init__(self, provinces: List[Dict[str, Any]], wards: List[Dict[str, Any]], max_limit: int = 20):
+        self.max_limit = max_limit
+        self._places: List[Place] = []
+        self._by_kind: Dict[int, List[int]] = {KIND_PROVINCE: [], KIND_WARD: []}
+        self._wards_by_province: Dict[str, List[int]] = {}
+
+        for province in provinces:
+            name = province.get('name')
+            if name:
+                self._add(KIND_PROVINCE, name, name)
+        for ward in wards:
+            name = ward.get('name')
+            if name:
+                place_id = self._add(KIND_WARD, name, ward.get('province', ''))
+                self._wards_by_province.setdefault(ward.get('province', ''), []).append(place_id)
+
+        self._indexes: Dict[Any, _PrefixIndex] = {
+            'all': _PrefixIndex(self._places, list(range(len(self._places))))
+        }
+
+    def _add(self, kind: int, name: str, province: str) -> int:
+        place_id = len(self._places)
+        self._places.append((kind, name, province, name.lower()))
+        self._by_kind[kind].append(place_id)
+        return place_id
+
+    def __len__(self):
+        return len(self._places)
+
+    def _index(self, kind: Optional[str], province: Optional[str]) -> _PrefixIndex:
+        if province:
+            # Lọc theo tỉnh: phường của tỉnh đó (+ chính tỉnh nếu không giới hạn loại)
+            key = ('province', province, kind)
+        elif kind:
+            key = ('kind', kind)
+        else:
+            return self._indexes['all']
+
+        index = self._indexes.get(key)
+        if index is None:
+            if province:
+                place_ids = [] if kind == 'province' else list(self._wards_by_province.get(province, []))
+                if kind != 'ward':
+                    place_ids += [p for p in self._by_kind[KIND_PROVINCE] if self._places[p][1] == province]
+            else:
+                place_ids = self._by_kind[KIND_PROVINCE if kind == 'province' else KIND_WARD]
+            index = _PrefixIndex(self._places, place_ids)
+            self._indexes[key] = index
+        return index
+
+    def _format(self, place_id: int) -> Dict[str, str]:
+        kind, name, province, _ = self._places[place_id]
+        return {
+            'type': KIND_LABELS[kind],
+            'name': name,
+            'province': province,
+            'label': name if kind == KIND_PROVINCE else f"{name}, {province}"
+        }
+
+    def suggest(self, query: str, limit: int = 8, kind: Optional[str] = None,
+                province: Optional[str] = None) -> List[Dict[str, str]]:
+        """Gợi ý theo tiền tố; `kind` = 'province' | 'ward', `province` giới hạn trong một tỉnh"""
+        limit = max(1, min(limit, self.max_limit))
+        prefix = normalize_name(query or '').replace('.', '')
+        if not prefix:
+            return []
+        accented = (query or '').lower().strip()
+        if fold_diacritics(accented) == accented:
+            accented = None
+        place_ids = self._index(kind, province).suggest(prefix, accented, limit)
+        return [self._format(place_id) for place_id in place_ids]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'places': len(self._places),
+            'indexes': len(self._indexes),
+            **self._indexes['all'].stats()
+        }
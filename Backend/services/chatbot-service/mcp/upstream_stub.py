@@ -0,0 +1,239 @@
+"""
+Smart Tro MCP - Upstream stub
+Stand-in local cho các upstream của chatbot, chạy trên một aiohttp server:
+- Node API:  /api/search-properties/properties, /api/amenities/all
+- vietnamlabs.com: /vietnamlabs/api/vietnamprovince (tỉnh, và phường theo ?province=)
+Mỗi upstream ('search', 'amenities', 'vietnamlabs') có latency, jitter, tỷ lệ lỗi
+503 và chế độ treo (không trả lời) chỉnh được lúc chạy. Chỉ dùng cho
+benchmark/test, không dùng production.
+
+Usage:
+    python upstream_stub.py --port 5055 --search-latency-ms 150
+    BACKEND_API_BASE_URL=http://localhost:5055/api \\
+    VIETNAMLABS_API_URL=http://localhost:5055/vietnamlabs/api python gradio_server.py
+"""
+import argparse
+import asyncio
+import random
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from bench_ward_matcher import synthetic_wards
+
+UPSTREAMS = ('search', 'amenities', 'vietnamlabs')
+
+# Phường thật dùng trong hội thoại mẫu (bench_chat_flow) + phường giả lập cho đủ kích thước
+REAL_WARDS = {
+    'Hồ Chí Minh': ['Phường Tân Định', 'Phường Bến Thành', 'Phường Sài Gòn', 'Phường Thảo Điền',
+                    'Phường An Nhơn', 'Phường Gò Vấp', 'Phường Linh Xuân', 'Phường Tân Phú',
+                    'Phường Hiệp Bình', 'Phường Bình Thạnh'],
+    'Hà Nội': ['Phường Hoàn Kiếm', 'Phường Ba Đình', 'Phường Cầu Giấy', 'Phường Đống Đa',
+               'Phường Hai Bà Trưng', 'Phường Tây Hồ'],
+    'Đà Nẵng': ['Phường Hải Châu', 'Phường Thanh Khê', 'Phường Sơn Trà', 'Phường Ngũ Hành Sơn'],
+    'Cần Thơ': ['Phường Ninh Kiều', 'Phường Cái Răng'],
+}
+
+AMENITIES = [
+    {'_id': f"{i:024x}", 'name': name, 'icon': f"fa-{i}", 'category': 'basic', 'isActive': True}
+    for i, name in enumerate(['Wifi', 'Điều hòa', 'Máy giặt', 'Tủ lạnh', 'Ban công', 'Thang máy',
+                              'Chỗ để xe', 'Bếp riêng', 'Tivi', 'Tủ quần áo'])
+]
+
+
+def fake_property(index: int, rng: random.Random, province: str = 'Hồ Chí Minh',
+                  ward: str = 'Phường Tân Định') -> Dict[str, Any]:
+    """Cùng field với transformedProperties trong searchPropertiesController.js"""
+    amenities = rng.sample(AMENITIES, 4)
+    return {
+        '_id': f"{index + 1:024x}",
+        'title': f"Phòng trọ mới xây số {index}, full nội thất, gần chợ và trường đại học",
+        'category': 'phong_tro',
+        'rentPrice': rng.randrange(1500000, 4000000, 100000),
+        'promotionPrice': 0,
+        'area': rng.randrange(15, 40),
+        'images': [f"https://res.cloudinary.com/demo/image/upload/v1/properties/{index}_{i}.jpg" for i in range(6)],
+        'video': f"https://res.cloudinary.com/demo/video/upload/v1/properties/{index}.mp4",
+        'approvalStatus': 'approved',
+        'status': 'available',
+        'contactName': 'Nguyễn Văn A',
+        'contactPhone': '0901234567',
+        'description': 'Phòng sạch sẽ, thoáng mát, có cửa sổ lớn, an ninh tốt, giờ giấc tự do. ' * 8,
+        'deposit': 2000000,
+        'electricPrice': 3500,
+        'waterPrice': 100000,
+        'maxOccupants': rng.randrange(1, 4),
+        'availableDate': '2025-01-01T00:00:00.000Z',
+        'amenities': [a['_id'] for a in amenities],
+        'fullAmenities': amenities,
+        'timeRules': 'Tự do',
+        'houseRules': ['Không hút thuốc', 'Giữ vệ sinh chung', 'Không nuôi thú cưng'],
+        'coordinates': {'lat': 10.79 + rng.random() / 100, 'lng': 106.69 + rng.random() / 100},
+        'packageInfo': {'plan': 'vip', 'postType': 'vip', 'isActive': True, 'status': 'active',
+                        'expiryDate': '2025-12-31T00:00:00.000Z', 'purchaseDate': '2025-01-01T00:00:00.000Z'},
+        'owner': {'_id': f"{index + 500:024x}", 'fullName': 'Chủ trọ', 'email': 'owner@example.com', 'phone': '0901234567'},
+        'province': province,
+        'ward': ward,
+        'detailAddress': f"{index} Hai Bà Trưng",
+        'views': rng.randrange(1000),
+        'favorites': rng.randrange(100),
+        'comments': rng.randrange(20),
+        'isPromoted': index < 3
+    }
+
+
+def stub_gazetteer(synthetic: int = 3300, provinces: int = 30) -> Dict[str, List[Dict[str, Any]]]:
+    """Tỉnh thật (REAL_WARDS) + `provinces` tỉnh giả lập, tổng khoảng `synthetic` phường"""
+    wards = {name: [{'name': ward, 'province': name, 'mergedFrom': []} for ward in names]
+             for name, names in REAL_WARDS.items()}
+    for ward in synthetic_wards(synthetic, provinces=provinces):
+        wards.setdefault(ward['province'], []).append(
+            {'name': ward['name'], 'province': ward['province'], 'mergedFrom': []})
+    return wards
+
+
+class UpstreamBehavior:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, hang: bool = False):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.hang = hang
+
+
+class UpstreamStub:
+    """
+    aiohttp server chạy ở background thread (loop riêng)
+
+    configure('search', latency_ms=300, error_rate=0.5) đổi hành vi lúc đang chạy;
+    requests / errors đếm số request theo upstream.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, seed: int = 0, synthetic_wards: int = 3300):
+        self.host = host
+        self.port = port
+        self.behaviors = {name: UpstreamBehavior() for name in UPSTREAMS}
+        self.requests = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._wards = stub_gazetteer(synthetic_wards)
+        self._properties = [fake_property(i, random.Random(i)) for i in range(100)]
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def backend_api_url(self) -> str:
+        return f"{self.url}/api"
+
+    @property
+    def vietnamlabs_url(self) -> str:
+        return f"{self.url}/vietnamlabs/api"
+
+    def configure(self, upstream: str, **settings) -> 'UpstreamStub':
+        targets = UPSTREAMS if upstream == 'all' else (upstream,)
+        for name in targets:
+            for key, value in settings.items():
+                setattr(self.behaviors[name], key, value)
+        return self
+
+    async def _behave(self, upstream: str) -> Optional[web.Response]:
+        """Áp latency / lỗi / treo; trả Response lỗi nếu request này phải lỗi"""
+        self.requests[upstream] += 1
+        behavior = self.behaviors[upstream]
+        if behavior.hang:
+            await asyncio.sleep(3600)
+        delay = behavior.latency_ms + (self._rng.uniform(0, behavior.jitter_ms) if behavior.jitter_ms else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if behavior.error_rate and self._rng.random() < behavior.error_rate:
+            self.errors[upstream] += 1
+            return web.json_response({'success': False, 'message': 'stub error'}, status=503)
+        return None
+
+    async def _search(self, request: web.Request) -> web.Response:
+        error = await self._behave('search')
+        if error is not None:
+            return error
+        query = request.query
+        limit = min(int(query.get('limit', 12)), len(self._properties))
+        province = query.get('province', 'Hồ Chí Minh')
+        ward = query.get('ward', '')
+        min_price = int(query.get('minPrice', 0))
+        max_price = int(query.get('maxPrice', 10 ** 12))
+        # Số kết quả phụ thuộc query => các search khác nhau trả về khác nhau
+        count = hash((province, ward, query.get('category'), query.get('search'))) % (limit + 1)
+        properties = [dict(p, province=province, ward=ward or p['ward']) for p in self._properties[:count]]
+        properties = [p for p in properties if min_price <= p['rentPrice'] <= max_price]
+        return web.json_response({'success': True, 'data': {'properties': properties, 'total': len(properties)}})
+
+    async def _amenities(self, request: web.Request) -> web.Response:
+        error = await self._behave('amenities')
+        if error is not None:
+            return error
+        return web.json_response({'success': True, 'data': {'amenities': AMENITIES}})
+
+    async def _vietnamprovince(self, request: web.Request) -> web.Response:
+        error = await self._behave('vietnamlabs')
+        if error is not None:
+            return error
+        province = request.query.get('province')
+        if province:
+            return web.json_response(self._wards.get(province, []))
+        return web.json_response([{'name': name} for name in self._wards])
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/search-properties/properties', self._search)
+        app.router.add_get('/api/amenities/all', self._amenities)
+        app.router.add_get('/vietnamlabs/api/vietnamprovince', self._vietnamprovince)
+        return app
+
+    async def _start(self):
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self) -> 'UpstreamStub':
+        """Chạy server ở background thread; trả về khi đã listen"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="upstream-stub", daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Node API and vietnamlabs.com")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    for name in UPSTREAMS:
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=0)
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = UpstreamStub(args.host, args.port)
+    for name in UPSTREAMS:
+        stub.configure(name, latency_ms=getattr(args, f"{name}_latency_ms"),
+                       error_rate=getattr(args, f"{name}_error_rate"), jitter_ms=args.jitter_ms)
+    stub.start()
+    print(f"Upstream stub on {stub.url} (Node API {stub.backend_api_url}, vietnamlabs {stub.vietnamlabs_url})")
+    threading.Event().wait()
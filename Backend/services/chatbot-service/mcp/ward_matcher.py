@@ -0,0 +1,212 @@
+"""
+Smart Tro MCP - Ward matcher
+Index so khớp gần đúng tên phường/xã, build một lần khi gazetteer load:
+- tên chuẩn hóa (lowercase, bỏ dấu, bỏ prefix "p.", "ward"...)
+- inverted index trigram ký tự để lấy ứng viên
+- chỉ chấm điểm ứng viên bằng Damerau-Levenshtein (OSA) có giới hạn
+"""
+import heapq
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from itertools import chain
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# Prefix hành chính bỏ đi khi so khớp (đã bỏ dấu). "phường"/"xã" cũng bỏ,
+# trừ khi phần còn lại là số ("Phường 1" != "Xã 1")
+WARD_PREFIXES = ('thi tran', 'phuong', 'xa', 'ward', 'commune', 'p.', 'p', 'tt.', 'tt')
+
+_NON_WORD = re.compile(r'[^\w\s]')
+_SPACES = re.compile(r'\s+')
+
+
+def fold_diacritics(text: str) -> str:
+    """'Phường Tân Định' -> 'phuong tan dinh'"""
+    text = text.lower().replace('đ', 'd')
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase, bỏ dấu, bỏ ký tự đặc biệt (giữ dấu chấm của 'p.' để strip prefix)"""
+    text = fold_diacritics(text or '')
+    text = _NON_WORD.sub(lambda m: m.group(0) if m.group(0) == '.' else ' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def strip_prefix(normalized: str) -> str:
+    for prefix in WARD_PREFIXES:
+        if normalized.startswith(prefix + ' ') or (prefix.endswith('.') and normalized.startswith(prefix)):
+            rest = normalized[len(prefix):].strip(' .')
+            # "phường 1" giữ nguyên prefix, nếu không "1" khớp với mọi "Xã 1"
+            if rest and not rest.isdigit():
+                return rest
+            return normalized.replace('.', '')
+    return normalized.replace('.', '')
+
+
+def ward_key(text: str) -> str:
+    return strip_prefix(normalize_name(text))
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a: str, b: str, bound: int) -> int:
+    """
+    Damerau-Levenshtein (optimal string alignment) với ngưỡng: dừng sớm và
+    trả về bound + 1 khi khoảng cách chắc chắn vượt quá `bound`
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if a == b:
+        return 0
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        ca = a[i - 1]
+        for j in range(1, len(b) + 1):
+            cb = b[j - 1]
+            cost = 0 if ca == cb else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb):
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > bound:
+            return bound + 1
+        previous_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= bound else bound + 1
+
+
+class WardMatch(NamedTuple):
+    name: str
+    province: str
+    score: float
+
+
+class WardMatcher:
+    """
+    Index tên phường/xã để match(keyword) không phải quét toàn bộ danh sách
+
+    Điểm: 1.0 cho khớp chính xác (sau chuẩn hóa), 1 - distance/len cho
+    khớp gần đúng, tỷ lệ độ dài cho khớp nguyên cụm từ nằm trong tên.
+    """
+
+    def __init__(self, wards: List[Dict[str, Any]], max_candidates: int = 40,
+                 min_score: float = 0.6, min_edit_score: float = 0.75):
+        self.max_candidates = max_candidates
+        self.min_score = min_score
+        self.min_edit_score = min_edit_score
+
+        self._names: List[str] = []
+        self._provinces: List[str] = []
+        self._keys: List[str] = []
+        self._accented: List[str] = []
+        self._exact: Dict[str, List[int]] = defaultdict(list)
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+        for ward in wards:
+            name = ward.get('name') or ''
+            key = ward_key(name)
+            if not key:
+                continue
+            ward_id = len(self._names)
+            self._names.append(name)
+            self._provinces.append(ward.get('province') or '')
+            self._keys.append(key)
+            self._accented.append(name.lower().strip())
+            self._exact[key].append(ward_id)
+            full_key = normalize_name(name).replace('.', '')
+            if full_key != key:
+                self._exact[full_key].append(ward_id)
+            for gram in trigrams(key):
+                self._postings[gram].append(ward_id)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _pick(self, ward_ids: List[int], accented: str, province: Optional[str]) -> Optional[int]:
+        """Ưu tiên đúng tỉnh, rồi đúng dấu, rồi thứ tự trong gazetteer"""
+        if province:
+            in_province = [w for w in ward_ids if self._provinces[w] == province]
+            if not in_province:
+                return None
+            ward_ids = in_province
+        for ward_id in ward_ids:
+            if self._accented[ward_id] == accented:
+                return ward_id
+        return ward_ids[0]
+
+    def match(self, keyword: str, province: Optional[str] = None) -> Optional[WardMatch]:
+        """Ward khớp nhất với keyword (tùy chọn giới hạn trong một tỉnh) hoặc None"""
+        if not keyword or not self._names:
+            return None
+        normalized = normalize_name(keyword)
+        key = strip_prefix(normalized)
+        if not key:
+            return None
+        accented = keyword.lower().strip()
+
+        # 1. Exact match (không dấu, không prefix)
+        for exact_key in (key, normalized.replace('.', '')):
+            ward_ids = self._exact.get(exact_key)
+            if ward_ids:
+                ward_id = self._pick(ward_ids, accented, province)
+                if ward_id is not None:
+                    return WardMatch(self._names[ward_id], self._provinces[ward_id], 1.0)
+
+        # 2. Ứng viên = ward có nhiều trigram chung nhất
+        query_grams = trigrams(key)
+        shared = Counter(chain.from_iterable(self._postings.get(gram, ()) for gram in query_grams))
+        if not shared:
+            return None
+        if province:
+            shared = Counter({w: c for w, c in shared.items() if self._provinces[w] == province})
+        min_shared = max(1, len(query_grams) // 4)
+        candidates = heapq.nsmallest(
+            self.max_candidates,
+            (w for w, c in shared.items() if c >= min_shared),
+            key=lambda w: (-shared[w], w)
+        )
+
+        # 3. Chấm điểm ứng viên
+        best_id, best_score = None, 0.0
+        padded_key = f" {key} "
+        for ward_id in candidates:
+            candidate = self._keys[ward_id]
+            longest = max(len(key), len(candidate))
+            score = 0.0
+
+            # Cả cụm từ nằm trong tên (hoặc ngược lại), theo ranh giới từ
+            if padded_key in f" {candidate} " or f" {candidate} " in padded_key:
+                score = min(len(key), len(candidate)) / longest
+
+            # Mỗi phép sửa làm mất tối đa 4 trigram (đảo ký tự) => cận dưới của khoảng cách;
+            # bỏ qua edit distance khi ứng viên không thể vượt best_score
+            min_distance = -(-(len(query_grams) - shared[ward_id]) // 4)
+            bound = int(longest * (1 - self.min_edit_score))
+            if min_distance <= bound and 1 - min_distance / longest >= best_score:
+                distance = bounded_edit_distance(key, candidate, bound)
+                if distance <= bound:
+                    score = max(score, 1 - distance / longest)
+
+            if score > best_score or (score == best_score and best_id is not None
+                                      and self._accented[ward_id] == accented):
+                best_id, best_score = ward_id, score
+
+        if best_id is None or best_score < self.min_score:
+            return None
+        return WardMatch(self._names[best_id], self._provinces[best_id], round(best_score, 4))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'wards': len(self._names),
+            'keys': len(self._exact),
+            'trigrams': len(self._postings)
+        }
@@ -39,9 +39,25 @@ class ImageSearchController {
             // Get topK from query params or default to 5
             const topK = parseInt(req.query.limit) || 5;
             
+            // Bộ lọc metadata: province, category, minPrice, maxPrice
+            const filters = {
+                province: req.query.province || req.body?.province,
+                category: req.query.category || req.body?.category,
+                minPrice: req.query.minPrice || req.body?.minPrice,
+                maxPrice: req.query.maxPrice || req.body?.maxPrice
+            };
+
+            // Người dùng rời trang -> hủy request tới Python service (nó sẽ bỏ việc đang chờ)
+            const abortController = new AbortController();
+            res.on('close', () => {
+                if (!res.writableEnded) abortController.abort();
+            });
+
             const searchResults = await imageSearchService.processImageSearch(
                 req.file.buffer,
-                topK
+                topK,
+                filters,
+                { signal: abortController.signal }
             );
             console.log ("result nhận được:", searchResults);
 
@@ -79,6 +95,27 @@ class ImageSearchController {
         }
     }
 
+    /**
+     * Đồng bộ toàn bộ embeddings trong MongoDB sang visual search index (admin, chạy 1 lần khi bật index)
+     */
+    async syncVectorIndex(req, res) {
+        try {
+            const stats = await imageSearchService.syncVectorIndex();
+            res.json({
+                success: true,
+                message: `Đã đồng bộ ${stats.indexed}/${stats.embeddings} ảnh của ${stats.properties} tin đăng`,
+                data: stats
+            });
+        } catch (error) {
+            console.error('Error in syncVectorIndex:', error);
+            res.status(500).json({
+                success: false,
+                message: 'Lỗi khi đồng bộ visual search index',
+                error: error.message
+            });
+        }
+    }
+
 
 
 }
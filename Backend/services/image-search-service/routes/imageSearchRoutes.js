@@ -4,6 +4,7 @@
 import express from 'express';
 import imageSearchController, { upload } from '../controllers/imageSearchController.js';
 import authMiddleware from '../../shared/middleware/authMiddleware.js';
+import { adminMiddleware } from '../../shared/middleware/adminMiddleware.js';
 
 const router = express.Router();
 
@@ -17,6 +18,17 @@ router.post(
     imageSearchController.searchByImage
 );
 
+/**
+ * POST /api/image-search/index/sync
+ * Backfill / đồng bộ lại visual search index từ MongoDB (admin)
+ */
+router.post(
+    '/index/sync',
+    authMiddleware,
+    adminMiddleware,
+    imageSearchController.syncVectorIndex
+);
+
 
 
 
@@ -9,14 +9,223 @@ import axios from 'axios';
 import FormData from 'form-data';
 import { ImageEmbedding, Property } from '../../../schemas/index.js';
 
+// Index được coi là đã đồng bộ khi có ít nhất tỉ lệ này số embedding trong MongoDB
+const INDEX_READY_RATIO = 0.95;
+// Số tin đăng mỗi lượt khi đồng bộ toàn bộ index
+const INDEX_SYNC_BATCH = 100;
+
 class ImageSearchService {
     constructor() {
         this.pythonServiceUrl = process.env.PYTHON_IMAGE_SERVICE_URL || 'http://localhost:8001';
         this.modelName = 'ResNet50';
         this.featureDimension = 2048; // ResNet50 feature dimension
+        // Model đang chạy bên Python service (cập nhật sau mỗi lần trích xuất)
+        this.modelId = null;
         this.serviceHealthy = false;
         this.lastHealthCheck = 0;
         this.healthCheckInterval = 30000; // 30 seconds
+        // Dùng visual search index (có lọc metadata) của Python service thay vì quét toàn bộ MongoDB
+        this.useVectorIndex = process.env.PYTHON_IMAGE_INDEX_ENABLED === 'true';
+        // Index rỗng / chưa đồng bộ (chưa chạy /index/sync) => quét MongoDB thay vì trả về []
+        this.vectorIndexReady = false;
+        this.lastIndexCheck = 0;
+    }
+
+    // Chuẩn hóa bộ lọc tìm kiếm (province, category, minPrice, maxPrice)
+    normalizeSearchFilters(filters = {}) {
+        const toList = (value) => {
+            if (!value) return undefined;
+            const list = (Array.isArray(value) ? value : String(value).split(','))
+                .map(v => String(v).trim())
+                .filter(Boolean);
+            return list.length > 0 ? list : undefined;
+        };
+
+        const minPrice = parseFloat(filters.minPrice);
+        const maxPrice = parseFloat(filters.maxPrice);
+
+        return {
+            province: toList(filters.province),
+            category: toList(filters.category),
+            minPrice: Number.isFinite(minPrice) ? minPrice : undefined,
+            maxPrice: Number.isFinite(maxPrice) ? maxPrice : undefined
+        };
+    }
+
+    // Item cho /index/upsert: embedding kèm metadata hiện tại của tin đăng (để lọc)
+    toIndexItem(embedding, property) {
+        return {
+            imageId: embedding._id.toString(),
+            propertyId: embedding.propertyId.toString(),
+            embedding: embedding.embedding,
+            imageUrl: embedding.imageUrl,
+            province: property?.province,
+            category: property?.category,
+            price: property?.rentPrice,
+            approvalStatus: property?.approvalStatus
+        };
+    }
+
+    // Gửi embeddings sang index theo từng model; trả về số ảnh đã index
+    async upsertIndexItems(embeddings, propertiesById) {
+        const byModel = new Map();
+        for (const embedding of embeddings) {
+            const modelId = embedding.metadata?.modelId || undefined;
+            if (!byModel.has(modelId)) byModel.set(modelId, []);
+            byModel.get(modelId).push(this.toIndexItem(embedding, propertiesById.get(embedding.propertyId.toString())));
+        }
+
+        let indexed = 0;
+        for (const [modelId, items] of byModel) {
+            try {
+                // Python service từ chối (409) embedding của model khác model đang chạy
+                await axios.post(`${this.pythonServiceUrl}/index/upsert`, { items, model: modelId }, { timeout: 30000 });
+                indexed += items.length;
+            } catch (error) {
+                console.error(`Error indexing ${items.length} embeddings (model ${modelId || 'unknown'}):`, error.response?.data?.detail || error.message);
+            }
+        }
+        return indexed;
+    }
+
+    // Đồng bộ embedding sang visual search index của Python service (kèm metadata để lọc)
+    async indexEmbeddingInPythonService(savedEmbedding) {
+        if (!this.useVectorIndex) return;
+
+        try {
+            const property = await Property.findById(savedEmbedding.propertyId)
+                .select('province category rentPrice approvalStatus')
+                .lean();
+            await this.upsertIndexItems([savedEmbedding], new Map([[savedEmbedding.propertyId.toString(), property]]));
+        } catch (error) {
+            console.error('Error indexing embedding in Python service:', error.message);
+        }
+    }
+
+    /**
+     * Cập nhật lại index cho 1 tin đăng sau khi duyệt / từ chối / chuyển về chờ duyệt:
+     * metadata (approvalStatus, province, category, giá) được ghi lúc lưu embedding nên phải upsert lại
+     */
+    async syncPropertyIndex(propertyId) {
+        if (!this.useVectorIndex) return { indexed: 0, removed: false };
+
+        try {
+            const [property, embeddings] = await Promise.all([
+                Property.findById(propertyId).select('province category rentPrice approvalStatus isDeleted').lean(),
+                ImageEmbedding.find({ propertyId }).lean()
+            ]);
+
+            if (!property || property.isDeleted || embeddings.length === 0) {
+                await axios.delete(`${this.pythonServiceUrl}/index/properties/${propertyId}`, { timeout: 10000 });
+                return { indexed: 0, removed: true };
+            }
+
+            const indexed = await this.upsertIndexItems(embeddings, new Map([[propertyId.toString(), property]]));
+            console.log(`Synced ${indexed}/${embeddings.length} embeddings of property ${propertyId} to vector index`);
+            return { indexed, removed: false };
+        } catch (error) {
+            console.error(`Error syncing property ${propertyId} to vector index:`, error.message);
+            return { indexed: 0, removed: false, error: error.message };
+        }
+    }
+
+    /**
+     * Backfill: đưa toàn bộ embeddings trong MongoDB (kèm metadata mới nhất) vào index
+     */
+    async syncVectorIndex() {
+        if (!this.useVectorIndex) {
+            throw new Error('Vector index đang tắt (PYTHON_IMAGE_INDEX_ENABLED != true)');
+        }
+
+        const startTime = Date.now();
+        const propertyIds = await ImageEmbedding.distinct('propertyId');
+        const stats = { properties: propertyIds.length, embeddings: 0, indexed: 0, removedProperties: 0 };
+
+        for (let start = 0; start < propertyIds.length; start += INDEX_SYNC_BATCH) {
+            const batch = propertyIds.slice(start, start + INDEX_SYNC_BATCH);
+            const [properties, embeddings] = await Promise.all([
+                Property.find({ _id: { $in: batch } })
+                    .select('province category rentPrice approvalStatus isDeleted')
+                    .lean(),
+                ImageEmbedding.find({ propertyId: { $in: batch } }).lean()
+            ]);
+
+            const propertiesById = new Map(
+                properties.filter(p => !p.isDeleted).map(p => [p._id.toString(), p])
+            );
+            const live = embeddings.filter(e => propertiesById.has(e.propertyId.toString()));
+            stats.embeddings += live.length;
+            stats.indexed += await this.upsertIndexItems(live, propertiesById);
+
+            // Tin đăng đã xóa: bỏ khỏi index
+            for (const propertyId of batch.filter(id => !propertiesById.has(id.toString()))) {
+                try {
+                    await axios.delete(`${this.pythonServiceUrl}/index/properties/${propertyId}`, { timeout: 10000 });
+                    stats.removedProperties += 1;
+                } catch (error) {
+                    console.error(`Error removing property ${propertyId} from vector index:`, error.message);
+                }
+            }
+        }
+
+        // Kiểm tra lại trạng thái index ở lần tìm kiếm tới
+        this.lastIndexCheck = 0;
+        stats.durationMs = Date.now() - startTime;
+        console.log('Vector index sync completed:', stats);
+        return stats;
+    }
+
+    // Index chỉ dùng được khi đã có gần đủ embeddings của MongoDB (cache theo healthCheckInterval)
+    async isVectorIndexReady() {
+        const now = Date.now();
+        if (now - this.lastIndexCheck < this.healthCheckInterval) {
+            return this.vectorIndexReady;
+        }
+        this.lastIndexCheck = now;
+
+        try {
+            const [response, total] = await Promise.all([
+                axios.get(`${this.pythonServiceUrl}/index/stats`, { timeout: 5000 }),
+                ImageEmbedding.estimatedDocumentCount()
+            ]);
+            const vectors = response.data.vectors || 0;
+            this.vectorIndexReady = vectors > 0 && vectors >= total * INDEX_READY_RATIO;
+            if (!this.vectorIndexReady) {
+                console.warn(`Vector index not synced (${vectors}/${total} embeddings), using MongoDB scan. Run POST /api/image-search/index/sync`);
+            }
+        } catch (error) {
+            this.vectorIndexReady = false;
+            console.error('Vector index stats unavailable:', error.message);
+        }
+        return this.vectorIndexReady;
+    }
+
+    // Tìm kiếm trên visual search index của Python service với bộ lọc metadata
+    async searchVectorIndex(queryEmbedding, topK, filters, modelId) {
+        const response = await axios.post(`${this.pythonServiceUrl}/search/by-embedding`, {
+            embedding: queryEmbedding,
+            model: modelId || undefined,
+            topK,
+            minScore: 0.65,
+            groupByProperty: true,
+            // 'two_stage': lọc ứng viên bằng vector nén rồi xếp hạng lại chính xác
+            // 'hierarchical': tìm theo vector đại diện của từng tin đăng trước, rồi xếp hạng lại ảnh
+            mode: process.env.PYTHON_IMAGE_SEARCH_MODE || 'exact',
+            filters: {
+                ...filters,
+                approvalStatus: ['approved']
+            }
+        }, { timeout: 10000 });
+
+        console.log('Vector index search stats:', response.data.index_stats);
+        console.log('Vector index search timings:', response.data.index_stats?.timings);
+
+        return response.data.results.map(hit => ({
+            _id: hit.imageId,
+            propertyId: hit.propertyId,
+            imageUrl: hit.imageUrl,
+            score: hit.score
+        }));
     }
 
     // Kiểm tra Python service health với caching
@@ -58,7 +267,8 @@ Hãy chạy: cd services/python-image-service && start.bat`);
     }
 
     // Lấy embedding từ ảnh sử dụng Python ResNet50 service
-    async extractImageFeatures(imageBuffer) {
+    // signal: AbortSignal hủy request khi client phía Node đã rời đi
+    async extractImageFeatures(imageBuffer, { signal } = {}) {
         try {
             // Kiểm tra Python service có sẵn không
             await this.checkPythonService();
@@ -73,26 +283,37 @@ Hãy chạy: cd services/python-image-service && start.bat`);
             });
 
             // Gửi request đến Python service
+            // X-Request-Timeout-Ms: Python service bỏ việc khi hết hạn thay vì chạy ResNet50 vô ích
+            const extractTimeoutMs = 30000; // 30s timeout cho xử lý ảnh
             const response = await axios.post(
                 `${this.pythonServiceUrl}/extract-features`,
                 formData,
                 {
                     headers: {
                         ...formData.getHeaders(),
+                        'X-Request-Timeout-Ms': String(extractTimeoutMs),
                     },
-                    timeout: 30000, // 30s timeout cho xử lý ảnh
+                    timeout: extractTimeoutMs,
+                    signal,
                 }
             );
 
             if (response.data.success) {
-                const { embedding, dimension, extraction_time_ms } = response.data;
+                const { embedding, dimension, extraction_time_ms, model, model_id } = response.data;
                 console.log("response.data:", response.data);
 
-                console.log(`Extracted ${dimension}-dimensional ResNet50 features in ${extraction_time_ms}ms`);
+                console.log(`Extracted ${dimension}-dimensional ${model} features in ${extraction_time_ms}ms`);
+
+                if (model_id) {
+                    this.modelName = model;
+                    this.modelId = model_id;
+                    this.featureDimension = dimension;
+                }
 
                 return {
                     embedding: embedding,
-                    dimension: dimension
+                    dimension: dimension,
+                    modelId: model_id
                 };
             } else {
                 throw new Error('Python service returned unsuccessful response');
@@ -106,6 +327,8 @@ Hãy chạy: cd services/python-image-service && start.bat`);
 Hãy chạy: cd services/python-image-service && start.bat`);
             } else if (error.response?.status === 400) {
                 throw new Error('Định dạng ảnh không hợp lệ hoặc ảnh quá lớn (max 10MB)');
+            } else if (error.response?.status === 504) {
+                throw new Error('Hết thời gian xử lý ảnh trong Python service');
             } else if (error.response?.status === 500) {
                 throw new Error('Lỗi xử lý ảnh trong Python service');
             } else {
@@ -156,6 +379,7 @@ Hãy chạy: cd services/python-image-service && start.bat`);
                 metadata: {
                     extractedAt: new Date(),
                     modelVersion: this.modelName,
+                    modelId: this.modelId || undefined,
                     vectorDimension: embeddingArray.length
                 }
             });
@@ -164,6 +388,8 @@ Hãy chạy: cd services/python-image-service && start.bat`);
             const saved = await imageEmbeddingData.save();
             console.log(`Successfully saved embedding with ID: ${saved._id}`);
 
+            await this.indexEmbeddingInPythonService(saved);
+
             // Verify save
             const verification = await ImageEmbedding.findById(saved._id);
             console.log('Verification - embedding exists in DB:', !!verification);
@@ -286,10 +512,23 @@ Hãy chạy: cd services/python-image-service && start.bat`);
 
 
     // Xử lý upload ảnh và tìm kiếm
-    async processImageSearch(imageBuffer, topK = 5) {
+    async processImageSearch(imageBuffer, topK = 5, filters = {}, { signal } = {}) {
         console.log('processImageSearch called with topK:', topK, 'type:', typeof topK);
-        const { embedding } = await this.extractImageFeatures(imageBuffer);
-        const similarEmbeddings = await this.searchByEmbedding(embedding, topK);
+        const searchFilters = this.normalizeSearchFilters(filters);
+        const { embedding, modelId } = await this.extractImageFeatures(imageBuffer, { signal });
+
+        let similarEmbeddings;
+        if (this.useVectorIndex && await this.isVectorIndexReady()) {
+            try {
+                // Index chỉ chấm điểm các vector thỏa bộ lọc
+                similarEmbeddings = await this.searchVectorIndex(embedding, topK, searchFilters, modelId);
+            } catch (error) {
+                console.error('Vector index search failed, falling back to MongoDB scan:', error.message);
+            }
+        }
+        if (!similarEmbeddings) {
+            similarEmbeddings = await this.searchByEmbedding(embedding, topK);
+        }
 
         // Build query object cho properties hợp lệ
         const now = new Date();
@@ -326,6 +565,19 @@ Hãy chạy: cd services/python-image-service && start.bat`);
         // Add property ID filter to query
         propertyQuery._id = { $in: propertyIds };
 
+        // Áp dụng bộ lọc metadata (đảm bảo đúng cả khi index chưa cập nhật)
+        if (searchFilters.province) {
+            propertyQuery.province = { $in: searchFilters.province };
+        }
+        if (searchFilters.category) {
+            propertyQuery.category = { $in: searchFilters.category };
+        }
+        if (searchFilters.minPrice !== undefined || searchFilters.maxPrice !== undefined) {
+            propertyQuery.rentPrice = {};
+            if (searchFilters.minPrice !== undefined) propertyQuery.rentPrice.$gte = searchFilters.minPrice;
+            if (searchFilters.maxPrice !== undefined) propertyQuery.rentPrice.$lte = searchFilters.maxPrice;
+        }
+
         console.log(`Searching for ${propertyIds.length} properties with validity conditions`);
 
         // Lấy properties với populate và điều kiện lọc
@@ -424,6 +676,16 @@ Hãy chạy: cd services/python-image-service && start.bat`);
         try {
             const result = await ImageEmbedding.deleteMany({ propertyId });
             console.log(`Deleted ${result.deletedCount} embeddings for property ${propertyId}`);
+
+            if (this.useVectorIndex) {
+                try {
+                    await axios.delete(`${this.pythonServiceUrl}/index/properties/${propertyId}`, {
+                        timeout: 10000
+                    });
+                } catch (error) {
+                    console.error('Error removing property from vector index:', error.message);
+                }
+            }
             return result;
         } catch (error) {
             console.error('Error deleting embeddings:', error);
@@ -1,5 +1,6 @@
 import adminPropertyRepository from '../repositories/adminPropertyRepository.js';
 import NotificationService from '../../notification-service/notificationService.js';
+import imageSearchService from '../../image-search-service/service/imageSearchService.js';
 
 class AdminPropertyController {
   // Lấy danh sách properties cho admin
@@ -71,6 +72,9 @@ class AdminPropertyController {
       // Duyệt property
       const updatedProperty = await adminPropertyRepository.approveProperty(propertyId, adminId);
 
+      // Cập nhật approvalStatus trong visual search index (chạy background)
+      imageSearchService.syncPropertyIndex(propertyId);
+
       // Gửi thông báo cho chủ tin đăng
       try {
         const ownerId = property.owner._id || property.owner; // Handle both object and string cases
@@ -144,6 +148,9 @@ class AdminPropertyController {
         reason.trim()
       );
 
+      // Tin bị từ chối không còn khớp bộ lọc approved của visual search index
+      imageSearchService.syncPropertyIndex(propertyId);
+
       // Gửi thông báo cho chủ tin đăng
       try {
         const ownerId = property.owner._id || property.owner; // Handle both object and string cases
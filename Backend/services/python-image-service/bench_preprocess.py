@@ -0,0 +1,162 @@
+"""
+SMART TRO - Preprocessing allocation benchmark
+Compares the per-image host memory work of
+- legacy: float32 array per image, expand_dims, numpy ImageNet preprocessing,
+          np.concatenate per batch
+- uint8:  uint8 pixels per image copied into the engine's preallocated batch
+          buffer; cast / BGR swap / mean subtraction run in the model graph
+
+Allocations and bytes are traced with tracemalloc (numpy reports its data
+buffers to it). Each step's output is kept alive until the end of its image
+or batch, so "allocs" counts the buffers a step creates (>= 1 KB) and
+"peak" includes short-lived temporaries. Pillow's own decode buffers are
+C heap, identical in both paths and not traced.
+
+Usage:
+    python bench_preprocess.py --images 256 --batch-size 16
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from inference_engine import BatchInferenceEngine
+
+INPUT_SIZE = (224, 224)
+IMAGENET_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+MIN_TRACKED_BYTES = 1024
+
+
+def _sample_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def _decode(image_bytes):
+    pil_image = Image.open(io.BytesIO(image_bytes))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return pil_image.resize(INPUT_SIZE, Image.Resampling.LANCZOS)
+
+
+def _caffe_preprocess(x):
+    """numpy path of keras.applications.resnet50.preprocess_input"""
+    x = x[..., ::-1]
+    x -= IMAGENET_BGR_MEAN
+    return x
+
+
+LEGACY_IMAGE_STEPS = [
+    ("to_float32", lambda pil: np.array(pil, dtype=np.float32)),
+    ("expand_dims", lambda x: np.expand_dims(x, axis=0)),
+    ("imagenet_preprocess", _caffe_preprocess),
+]
+
+UINT8_IMAGE_STEPS = [
+    ("to_uint8", lambda pil: np.asarray(pil, dtype=np.uint8)),
+]
+
+
+def _traced_step(fn, value, totals, name):
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    result = fn(value)
+    after, peak = tracemalloc.get_traced_memory()
+    created = after - before
+    step = totals.setdefault(name, {"allocs": 0, "bytes": 0, "peak_bytes": 0})
+    if created >= MIN_TRACKED_BYTES:
+        step["allocs"] += 1
+        step["bytes"] += created
+    step["peak_bytes"] = max(step["peak_bytes"], peak - before)
+    return result
+
+
+class _Sample:
+    """Stand-in for an InferenceTicket in the assemble benchmark"""
+    __slots__ = ("inputs",)
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+
+def run_path(name, images, batch_size, image_steps, assemble):
+    totals = {}
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    for offset in range(0, len(images), batch_size):
+        samples = []
+        for image_bytes in images[offset:offset + batch_size]:
+            value = _decode(image_bytes)
+            for step_name, fn in image_steps:
+                value = _traced_step(fn, value, totals, step_name)
+            samples.append(value)
+        batch = _traced_step(assemble, samples, totals, "assemble_batch")
+        del batch, samples
+
+    elapsed = time.perf_counter() - start_time
+    tracemalloc.stop()
+
+    count = len(images)
+    return {
+        "path": name,
+        "images": count,
+        "batch_size": batch_size,
+        "ms_per_image": round(elapsed * 1000 / count, 3),
+        "allocs_per_image": round(sum(s["allocs"] for s in totals.values()) / count, 2),
+        "kb_per_image": round(sum(s["bytes"] for s in totals.values()) / count / 1024, 1),
+        "steps": {
+            step: {
+                "allocs": s["allocs"],
+                "kb_per_image": round(s["bytes"] / count / 1024, 1),
+                "peak_kb": round(s["peak_bytes"] / 1024, 1)
+            }
+            for step, s in totals.items()
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing allocation benchmark")
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    images = _sample_images(args.images)
+
+    engine = BatchInferenceEngine(
+        predict_fn=None, max_batch_size=args.batch_size, input_shape=(*INPUT_SIZE, 3)
+    )
+    results = [
+        run_path(
+            "legacy_float32", images, args.batch_size, LEGACY_IMAGE_STEPS,
+            lambda samples: np.concatenate(samples, axis=0)
+        ),
+        run_path(
+            "uint8_preallocated", images, args.batch_size, UINT8_IMAGE_STEPS,
+            lambda samples: engine._assemble([_Sample(s) for s in samples])
+        ),
+    ]
+
+    for row in results:
+        print(
+            f"{row['path']:>20}: {row['ms_per_image']} ms/image, "
+            f"{row['allocs_per_image']} allocs/image, {row['kb_per_image']} KB/image"
+        )
+        for step, s in row["steps"].items():
+            print(f"{'':>22}{step:<20} allocs={s['allocs']:<6} "
+                  f"{s['kb_per_image']} KB/image  peak {s['peak_kb']} KB")
+
+
+if __name__ == "__main__":
+    main()
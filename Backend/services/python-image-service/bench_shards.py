@@ -0,0 +1,121 @@
+"""
+SMART TRO - Sharded index benchmark (single machine)
+Builds a synthetic catalog, then compares search throughput of one
+in-process EmbeddingIndex against ShardedIndex with N shard processes under
+concurrent clients, checks that the merged top-K matches the single index,
+and times a rebalance.
+
+Usage:
+    python bench_shards.py --photos 200000 --shards 4 --clients 8
+    python bench_shards.py --strategy province --rebalance-to 6
+"""
+
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sharded_index import ShardedIndex
+from vector_index import EmbeddingIndex
+
+PROVINCES = ["Hồ Chí Minh", "Hà Nội", "Đà Nẵng", "Cần Thơ", "Hải Phòng", "Bình Dương",
+             "Đồng Nai", "Khánh Hòa"]
+# Skewed like the real catalog: most listings are in the two big cities
+PROVINCE_WEIGHTS = np.array([0.38, 0.30, 0.08, 0.06, 0.06, 0.05, 0.04, 0.03])
+
+
+def build_catalog(photos, dimension, photos_per_property, seed=0):
+    rng = np.random.default_rng(seed)
+    index = EmbeddingIndex(dimension)
+    properties = photos // photos_per_property
+    provinces = rng.choice(len(PROVINCES), size=properties, p=PROVINCE_WEIGHTS)
+    centres = rng.standard_normal((properties, dimension)).astype(np.float32)
+    for n in range(photos):
+        p = n % properties
+        index.upsert(
+            image_id=f"img{n}",
+            property_id=f"prop{p}",
+            embedding=centres[p] + 0.5 * rng.standard_normal(dimension).astype(np.float32),
+            province=PROVINCES[provinces[p]],
+            price=float(rng.integers(1, 20)) * 1e6,
+            approval_status="approved"
+        )
+    return index
+
+
+def run_load(search, queries, clients, filters=None):
+    """Queries/s and per-query latency percentiles with `clients` concurrent callers"""
+    latencies = []
+
+    def one(query):
+        start_time = time.perf_counter()
+        search(query, top_k=10, filters=filters)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start_time
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {
+        "qps": round(len(queries) / elapsed, 1),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded index benchmark")
+    parser.add_argument("--photos", type=int, default=100_000)
+    parser.add_argument("--dimension", type=int, default=2048)
+    parser.add_argument("--photos-per-property", type=int, default=5)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--strategy", choices=("hash", "province"), default="hash")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rebalance-to", type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"Building {args.photos} x {args.dimension} catalog...")
+    single = build_catalog(args.photos, args.dimension, args.photos_per_property)
+    rng = np.random.default_rng(1)
+    queries = [single.export([f"img{n}"])[0]["embedding"] + 0.1 * rng.standard_normal(args.dimension)
+               for n in rng.integers(0, args.photos, size=args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = time.perf_counter()
+        sharded = ShardedIndex(
+            directory, args.dimension, shards=args.shards, strategy=args.strategy
+        ).start(seed=lambda: single)
+        print(f"Seeded {args.shards} {args.strategy} shards in {time.perf_counter() - start_time:.1f}s")
+        try:
+            mismatches = sum(
+                [h["imageId"] for h in single.search(q, top_k=10)[0]]
+                != [h["imageId"] for h in sharded.search(q, top_k=10)[0]]
+                for q in queries[:50]
+            )
+            print(f"Top-10 mismatches vs single index: {mismatches}/50")
+
+            print(f"single process : {run_load(single.search, queries, args.clients)}")
+            print(f"{args.shards} shards       : {run_load(sharded.search, queries, args.clients)}")
+            province_filter = {"province": ["Đà Nẵng"]}
+            print(f"single, 1 province : {run_load(single.search, queries, args.clients, province_filter)}")
+            print(f"sharded, 1 province: {run_load(sharded.search, queries, args.clients, province_filter)}")
+
+            for shard in sharded.shard_stats()["per_shard"]:
+                print(f"  shard {shard['shard']}: {shard['vectors']} vectors, "
+                      f"search_ms={shard['search_ms']}, round_trip_ms={shard['round_trip_ms']}")
+
+            if args.rebalance_to:
+                result = sharded.rebalance(args.rebalance_to)
+                print(f"Rebalanced to {args.rebalance_to}: moved {result['moved']} in "
+                      f"{result['elapsed_s']}s, imbalance {result['imbalance']}")
+                print(f"{args.rebalance_to} shards       : {run_load(sharded.search, queries, args.clients)}")
+        finally:
+            sharded.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+SMART TRO - Embedding model comparison on our own listing photos
+Measures, per registered model:
+- load time and inference latency (ms/image at batch 1 and at a larger batch)
+- retrieval quality without labels: every photo queries all the others and
+  counts as a hit when a photo of the same listing comes back (same-listing
+  recall@k and hit@k; listings with a single photo are not used as queries)
+- agreement with a reference model: overlap of each query's top-k
+
+Photos come either from a directory laid out as <dir>/<property_id>/*.jpg
+or from the image URLs stored in an existing index namespace.
+
+Usage:
+    python compare_models.py --photos ./sample_listings
+    python compare_models.py --from-index ./index_data --limit 2000 --json out.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_registry import DEFAULT_MODEL_ID, MODEL_SPECS, FeatureExtractor, namespace_dir
+from reembed_job import fetch_image
+from vector_index import EmbeddingIndex
+
+logger = logging.getLogger("compare_models")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def photos_from_directory(directory):
+    """[(property_id, image_bytes)] from <directory>/<property_id>/<photo>"""
+    photos = []
+    for property_id in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, property_id)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), "rb") as f:
+                    photos.append((property_id, f.read()))
+    return photos
+
+
+def photos_from_index(index_dir, limit, fetch_workers=16, seed=0):
+    """Download up to `limit` indexed photos, whole listings at a time"""
+    spec = MODEL_SPECS[DEFAULT_MODEL_ID]
+    index = EmbeddingIndex.load(
+        namespace_dir(index_dir, DEFAULT_MODEL_ID), spec["dimension"], model_id=DEFAULT_MODEL_ID
+    )
+    by_property = {}
+    for item in index.items():
+        if item["image_url"]:
+            by_property.setdefault(item["property_id"], []).append(item)
+
+    property_ids = sorted(by_property)
+    random.Random(seed).shuffle(property_ids)
+    selected = []
+    for property_id in property_ids:
+        if len(selected) >= limit:
+            break
+        selected.extend(by_property[property_id])
+
+    def fetch(item):
+        try:
+            return item["property_id"], fetch_image(item["image_url"])
+        except Exception as e:
+            logger.warning(f"Skipping {item['image_url']}: {e}")
+            return None
+
+    with ThreadPoolExecutor(fetch_workers) as pool:
+        return [photo for photo in pool.map(fetch, selected[:limit]) if photo is not None]
+
+
+def embed_all(extractor, pixels, batch_size):
+    vectors = []
+    for offset in range(0, len(pixels), batch_size):
+        vectors.append(extractor.predict_batch(np.stack(pixels[offset:offset + batch_size])))
+    return np.concatenate(vectors)
+
+
+def time_inference(extractor, pixels, batch_size, repeats):
+    """Median ms/image over `repeats` timed batches (after one warm-up batch)"""
+    batch = np.stack([pixels[i % len(pixels)] for i in range(batch_size)])
+    extractor.predict_batch(batch)
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        extractor.predict_batch(batch)
+        timings.append((time.perf_counter() - start_time) * 1000 / batch_size)
+    return round(float(np.median(timings)), 2)
+
+
+def neighbours(vectors, k):
+    """Top-k other photos per photo by cosine similarity"""
+    sims = vectors @ vectors.T
+    np.fill_diagonal(sims, -np.inf)
+    k = min(k, len(vectors) - 1)
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(sims, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def same_listing_quality(top, labels):
+    """Mean recall@k of same-listing photos and hit@k over photos with siblings"""
+    recalls, hits = [], []
+    for row, label in enumerate(labels):
+        siblings = int((labels == label).sum()) - 1
+        if siblings == 0:
+            continue
+        found = int((labels[top[row]] == label).sum())
+        recalls.append(found / min(siblings, top.shape[1]))
+        hits.append(found > 0)
+    if not recalls:
+        return None, None
+    return round(float(np.mean(recalls)), 4), round(float(np.mean(hits)), 4)
+
+
+def agreement(top, reference_top):
+    """Mean overlap of two models' top-k neighbour sets"""
+    overlap = [
+        len(set(a.tolist()) & set(b.tolist())) / top.shape[1]
+        for a, b in zip(top, reference_top)
+    ]
+    return round(float(np.mean(overlap)), 4)
+
+
+def compare(photos, model_ids, k=10, batch_size=16, repeats=5, reference=DEFAULT_MODEL_ID):
+    labels = np.array([property_id for property_id, _ in photos])
+    results = []
+    tops = {}
+    for model_id in model_ids:
+        extractor = FeatureExtractor(model_id)
+        start_time = time.perf_counter()
+        if not extractor.load_model():
+            results.append({"model_id": model_id, "error": extractor.load_error})
+            continue
+        load_s = time.perf_counter() - start_time
+
+        pixels = [extractor.preprocess_image(image_bytes) for _, image_bytes in photos]
+        vectors = embed_all(extractor, pixels, batch_size)
+        tops[model_id] = neighbours(vectors, k)
+        recall, hit = same_listing_quality(tops[model_id], labels)
+
+        results.append({
+            "model_id": model_id,
+            "model_name": extractor.model_name,
+            "dimension": extractor.feature_dimension,
+            "load_s": round(load_s, 2),
+            "ms_per_image_batch1": time_inference(extractor, pixels, 1, repeats),
+            f"ms_per_image_batch{batch_size}": time_inference(extractor, pixels, batch_size, repeats),
+            "index_mb_per_100k": round(100_000 * extractor.feature_dimension * 4 / (1024 * 1024), 1),
+            f"recall@{k}": recall,
+            f"hit@{k}": hit
+        })
+
+    for row in results:
+        if reference in tops and row["model_id"] in tops:
+            row[f"agreement@{k}_vs_{reference}"] = agreement(tops[row["model_id"]], tops[reference])
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compare embedding models on listing photos")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--photos", help="directory of <property_id>/<photo> files")
+    source.add_argument("--from-index", help="index dir whose image URLs are downloaded")
+    parser.add_argument("--limit", type=int, default=1000, help="photos to download with --from-index")
+    parser.add_argument("--models", default=",".join(MODEL_SPECS))
+    parser.add_argument("--reference", default=DEFAULT_MODEL_ID)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.photos:
+        photos = photos_from_directory(args.photos)
+    else:
+        photos = photos_from_index(args.from_index, args.limit)
+    if len(photos) < 2:
+        parser.error("Need at least two photos")
+    listings = len({property_id for property_id, _ in photos})
+    print(f"{len(photos)} photos from {listings} listings")
+
+    model_ids = [m.strip() for m in args.models.split(",") if m.strip()]
+    results = compare(photos, model_ids, args.k, args.batch_size, args.repeats, args.reference)
+
+    for row in results:
+        if "error" in row:
+            print(f"{row['model_id']:>20}: failed to load ({row['error']})")
+            continue
+        print(f"{row['model_id']:>20}: " + ", ".join(
+            f"{key}={value}" for key, value in row.items() if key not in ("model_id", "model_name")
+        ))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"photos": len(photos), "listings": listings, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
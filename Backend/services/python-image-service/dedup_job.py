@@ -0,0 +1,225 @@
+"""
+SMART TRO - Near-duplicate listing photo detection
+Offline job: blocked all-pairs cosine self-join over the visual search index
+to find near-identical photos across the catalog (duplicate or scam
+listings re-using someone else's pictures).
+
+The embedding matrix is memory-mapped from INDEX_DIR and split into row
+blocks; every (i, j >= i) block pair is one task computing a bounded
+block x block similarity matrix in a worker process. Pairs above the
+threshold are merged with union-find into clusters of images/properties.
+
+Usage:
+    python dedup_job.py --threshold 0.95 --workers 8 --output duplicates.json
+"""
+
+import os
+
+# One BLAS thread per worker process: parallelism comes from the pool
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse
+import json
+import logging
+import multiprocessing
+import time
+
+import numpy as np
+
+logger = logging.getLogger("dedup_job")
+
+DEFAULT_INDEX_DIR = os.getenv(
+    "INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_data")
+)
+
+# Worker-process globals, set once by _init_worker
+_vectors = None
+_property_codes = None
+_threshold = None
+_same_property = None
+
+
+def _init_worker(vectors_path, size, property_codes, threshold, include_same_property):
+    global _vectors, _property_codes, _threshold, _same_property
+    _vectors = np.load(vectors_path, mmap_mode="r")[:size]
+    _property_codes = property_codes
+    _threshold = threshold
+    _same_property = include_same_property
+
+
+def _compare_blocks(task):
+    """Similarity of one block pair; returns (rows, cols, scores) above threshold"""
+    i0, i1, j0, j1 = task
+    left = np.ascontiguousarray(_vectors[i0:i1], dtype=np.float32)
+    right = left if (i0, i1) == (j0, j1) else np.ascontiguousarray(_vectors[j0:j1], dtype=np.float32)
+    scores = left @ right.T
+
+    if i0 == j0:
+        # Diagonal block: strict upper triangle only (no self / mirrored pairs)
+        scores[np.tril_indices(scores.shape[0], k=0, m=scores.shape[1])] = -1.0
+
+    rows, cols = np.nonzero(scores >= _threshold)
+    pair_scores = scores[rows, cols]
+    rows = rows.astype(np.int64) + i0
+    cols = cols.astype(np.int64) + j0
+
+    if not _same_property and rows.size:
+        cross = _property_codes[rows] != _property_codes[cols]
+        rows, cols, pair_scores = rows[cross], cols[cross], pair_scores[cross]
+
+    return rows.astype(np.int32), cols.astype(np.int32), pair_scores.astype(np.float32)
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _block_tasks(size, block_size):
+    starts = list(range(0, size, block_size))
+    for a, i0 in enumerate(starts):
+        i1 = min(i0 + block_size, size)
+        for j0 in starts[a:]:
+            yield i0, i1, j0, min(j0 + block_size, size)
+
+
+def find_near_duplicates(index_dir, threshold=0.95, block_size=4096, workers=None,
+                         include_same_property=False):
+    """
+    Run the blocked self-join and return clusters of near-duplicate images
+
+    Memory per task is bounded by two float32 row blocks plus one
+    block_size x block_size score matrix (64 MB at the default 4096).
+    """
+    with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    size = meta.get("size", len(meta["image_ids"]))
+    image_ids = meta["image_ids"][:size]
+    property_ids = meta["property_ids"][:size]
+    image_urls = meta.get("image_urls", [""] * size)[:size]
+
+    # Integer-coded property ids so workers can compare them vectorized
+    property_lookup = {}
+    property_codes = np.array(
+        [property_lookup.setdefault(pid, len(property_lookup)) for pid in property_ids],
+        dtype=np.int32
+    )
+
+    # meta.json names the vectors file of the saved generation (older indexes: vectors.npy)
+    vectors_path = os.path.join(index_dir, meta.get("files", {}).get("vectors", "vectors.npy"))
+    tasks = list(_block_tasks(size, block_size))
+    workers = workers or os.cpu_count() or 1
+    logger.info(
+        f"Self-join of {size} vectors: {len(tasks)} block pairs of {block_size} rows, "
+        f"{workers} workers, threshold {threshold}"
+    )
+
+    start_time = time.time()
+    uf = _UnionFind(size)
+    best_score = {}
+    pair_count = 0
+
+    init_args = (vectors_path, size, property_codes, threshold, include_same_property)
+    if workers == 1:
+        _init_worker(*init_args)
+        results = map(_compare_blocks, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args)
+        results = pool.imap_unordered(_compare_blocks, tasks, chunksize=1)
+
+    try:
+        for done, (rows, cols, scores) in enumerate(results, 1):
+            pair_count += rows.size
+            for a, b, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+                uf.union(a, b)
+                best_score[a] = max(best_score.get(a, 0.0), score)
+                best_score[b] = max(best_score.get(b, 0.0), score)
+            if done % max(1, len(tasks) // 20) == 0:
+                logger.info(f"{done}/{len(tasks)} block pairs, {pair_count} pairs so far")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    groups = {}
+    for member in best_score:
+        groups.setdefault(uf.find(member), []).append(member)
+
+    clusters = []
+    for members in groups.values():
+        members.sort()
+        properties = sorted({property_ids[m] for m in members})
+        clusters.append({
+            "size": len(members),
+            "property_count": len(properties),
+            "properties": properties,
+            "max_score": round(max(best_score[m] for m in members), 4),
+            "images": [
+                {"imageId": image_ids[m], "propertyId": property_ids[m], "imageUrl": image_urls[m]}
+                for m in members
+            ]
+        })
+    clusters.sort(key=lambda c: (c["property_count"], c["size"]), reverse=True)
+
+    elapsed = time.time() - start_time
+    return {
+        "threshold": threshold,
+        "vectors": size,
+        "block_size": block_size,
+        "workers": workers,
+        "include_same_property": include_same_property,
+        "pairs": pair_count,
+        "clusters": clusters,
+        "elapsed_s": round(elapsed, 2),
+        "vectors_per_s": round(size / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Find near-duplicate listing photos")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--threshold", type=float, default=0.95,
+                        help="cosine similarity above which two photos are near-duplicates")
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to all cores")
+    parser.add_argument("--include-same-property", action="store_true",
+                        help="also pair photos of the same listing (excluded by default)")
+    parser.add_argument("--output", default="duplicates.json")
+    args = parser.parse_args()
+
+    report = find_near_duplicates(
+        args.index_dir,
+        threshold=args.threshold,
+        block_size=args.block_size,
+        workers=args.workers,
+        include_same_property=args.include_same_property
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    multi_property = sum(1 for c in report["clusters"] if c["property_count"] > 1)
+    logger.info(
+        f"{report['pairs']} pairs, {len(report['clusters'])} clusters "
+        f"({multi_property} spanning several properties) in {report['elapsed_s']}s "
+        f"-> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
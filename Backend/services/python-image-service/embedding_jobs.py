@@ -0,0 +1,447 @@
+"""
+SMART TRO - Durable embedding jobs
+Backfills submit a manifest of image URLs and get a job id back instead of
+holding one /batch-extract request open for the whole run. Jobs and their
+items live in a SQLite queue (WAL mode) next to the index, so they survive
+restarts and a dropped client loses nothing; a worker thread downloads the
+images, runs them through the shared inference engine at background
+priority and appends every result to <jobs_dir>/<job_id>.jsonl as it goes.
+
+Delivery is at-least-once: a crash between appending results and marking
+their items done re-runs those items, so readers dedupe on "seq". Claimed
+items record their owner (host:pid); only claims whose owner died, or whose
+lease ran out, are requeued, so pre-fork siblings never steal each other's work.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_engine import PRIORITY_BACKGROUND
+from reembed_job import fetch_image
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+DEFAULT_CHUNK_SIZE = 8
+DEFAULT_FETCH_WORKERS = 8
+IDLE_POLL_S = 1.0
+# Claims of another host (shared volume) can't be checked: requeued after the lease
+CLAIM_LEASE_S = 900
+RECOVER_INTERVAL_S = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    options TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    claimed_at REAL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS job_items_pending ON job_items (status, job_id, seq);
+"""
+
+def _claim_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """Whether the process that claimed an item may still be working on it"""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname():
+        return True  # left to the lease
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False  # one worker per process: nothing in flight while it recovers
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """SQLite-backed job queue; every method opens its own short transaction"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        db = self._connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def results_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.jsonl")
+
+    def create(self, items, options=None):
+        """Queue a job for [{"url": ..., **metadata}]; returns the job id"""
+        job_id = uuid.uuid4().hex
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO jobs (id, status, total, options, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, len(items), json.dumps(options or {}), time.time())
+            )
+            db.executemany(
+                "INSERT INTO job_items (job_id, seq, url, meta) VALUES (?, ?, ?, ?)",
+                (
+                    (job_id, seq, item["url"], json.dumps({k: v for k, v in item.items() if k != "url"}))
+                    for seq, item in enumerate(items)
+                )
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        return job_id
+
+    def recover(self, lease_s=CLAIM_LEASE_S):
+        """
+        Requeue items claimed by a process that died (or whose lease ran out);
+        returns how many. Claims of live siblings are left alone.
+        """
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            owners = [
+                row["owner"] for row in
+                db.execute("SELECT DISTINCT owner FROM job_items WHERE status = 'claimed'")
+            ]
+            requeued = 0
+            for owner in owners:
+                if not _owner_alive(owner):
+                    requeued += db.execute(
+                        "UPDATE job_items SET status = 'pending', owner = NULL, claimed_at = NULL "
+                        "WHERE status = 'claimed' AND owner IS ?", (owner,)
+                    ).rowcount
+            requeued += db.execute(
+                "UPDATE job_items SET status = 'pending', owner = NULL, claimed_at = NULL "
+                "WHERE status = 'claimed' AND claimed_at < ?", (time.time() - lease_s,)
+            ).rowcount
+            db.execute("COMMIT")
+            return requeued
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def claim(self, limit):
+        """Atomically claim the next pending items of the oldest unfinished job"""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            job = db.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') AND EXISTS ("
+                "  SELECT 1 FROM job_items WHERE job_id = jobs.id AND status = 'pending'"
+                ") ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if job is None:
+                db.execute("COMMIT")
+                return None, []
+            rows = db.execute(
+                "SELECT seq, url, meta FROM job_items WHERE job_id = ? AND status = 'pending' "
+                "ORDER BY seq LIMIT ?", (job["id"], limit)
+            ).fetchall()
+            owner, now = _claim_owner(), time.time()
+            db.executemany(
+                "UPDATE job_items SET status = 'claimed', owner = ?, claimed_at = ? "
+                "WHERE job_id = ? AND seq = ?",
+                ((owner, now, job["id"], row["seq"]) for row in rows)
+            )
+            if job["status"] == "queued":
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) "
+                    "WHERE id = ?", (time.time(), job["id"])
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        items = [{"seq": row["seq"], "url": row["url"], **json.loads(row["meta"])} for row in rows]
+        return dict(job), items
+
+    def complete_items(self, job_id, seqs, failed):
+        """Mark claimed items done once their results are on disk"""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "UPDATE job_items SET status = 'done' WHERE job_id = ? AND seq = ?",
+                ((job_id, seq) for seq in seqs)
+            )
+            db.execute(
+                "UPDATE jobs SET done = done + ?, failed = failed + ? WHERE id = ?",
+                (len(seqs), failed, job_id)
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'completed', finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND NOT EXISTS ("
+                "  SELECT 1 FROM job_items WHERE job_id = ? AND status != 'done'"
+                ")", (time.time(), job_id, job_id)
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def release_items(self, job_id, seqs):
+        """Return claimed items to the queue (engine swapped or stopping)"""
+        db = self._connect()
+        try:
+            db.executemany(
+                "UPDATE job_items SET status = 'pending', owner = NULL, claimed_at = NULL "
+                "WHERE job_id = ? AND seq = ? AND status = 'claimed'",
+                ((job_id, seq) for seq in seqs)
+            )
+        finally:
+            db.close()
+
+    def cancel(self, job_id):
+        db = self._connect()
+        try:
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id)
+            )
+            return cursor.rowcount > 0
+        finally:
+            db.close()
+
+    def fail(self, job_id, error):
+        db = self._connect()
+        try:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+        finally:
+            db.close()
+
+    def get(self, job_id):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            db.close()
+
+    def list(self, limit=50):
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            db.close()
+
+    def read_results(self, job_id, offset=0, limit=100):
+        """Result lines [offset, offset + limit) appended so far"""
+        results = []
+        try:
+            with open(self.results_path(job_id), encoding="utf-8") as f:
+                for n, line in enumerate(f):
+                    if n < offset:
+                        continue
+                    if len(results) >= limit or not line.endswith("\n"):
+                        break  # a partial last line is still being written
+                    results.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return results
+
+
+class JobWorker:
+    """
+    Works the job queue in chunks on a background thread
+
+    `pipeline()` returns the current (extractor, engine) pair, so a model
+    cut-over is picked up between chunks. `on_result(job, item, features)`
+    runs for every successful item (e.g. to upsert it into the index).
+    """
+
+    def __init__(self, store, pipeline, on_result=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 fetch_workers=DEFAULT_FETCH_WORKERS, fetch_fn=fetch_image):
+        self.store = store
+        self.pipeline = pipeline
+        self.on_result = on_result
+        self.chunk_size = chunk_size
+        self.fetch_fn = fetch_fn
+        self._pool = ThreadPoolExecutor(fetch_workers, thread_name_prefix="job-fetch")
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        # job id -> (monotonic start, items at start) of this process' run,
+        # so throughput ignores time spent before a restart
+        self._runs = {}
+        self._recovered_at = 0.0
+
+    def _recover(self):
+        """Requeue the claims of dead workers (this one's predecessor or a crashed sibling)"""
+        self._recovered_at = time.monotonic()
+        recovered = self.store.recover()
+        if recovered:
+            logger.info(f"Requeued {recovered} embedding job items claimed by a dead worker")
+
+    def start(self):
+        self._recover()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="embedding-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        """New work was queued"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job, items = self.store.claim(self.chunk_size)
+            except Exception as e:
+                logger.error(f"Embedding job queue error: {e}")
+                job, items = None, []
+            if not items:
+                if time.monotonic() - self._recovered_at >= RECOVER_INTERVAL_S:
+                    try:
+                        self._recover()
+                    except Exception as e:
+                        logger.error(f"Embedding job recovery error: {e}")
+                self._wake.wait(IDLE_POLL_S)
+                self._wake.clear()
+                continue
+            try:
+                self._process(job, items)
+            except Exception as e:
+                logger.error(f"Embedding job {job['id']} failed: {e}")
+                self.store.release_items(job["id"], [item["seq"] for item in items])
+                self.store.fail(job["id"], str(e))
+
+    def _fetch(self, extractor, item):
+        try:
+            return extractor.preprocess_image(self.fetch_fn(item["url"])), None
+        except Exception as e:
+            return None, str(e)
+
+    def _process(self, job, items):
+        extractor, engine = self.pipeline()
+        self._runs.setdefault(job["id"], (time.monotonic(), job["done"]))
+        decoded = list(self._pool.map(lambda item: self._fetch(extractor, item), items))
+
+        tickets = []
+        try:
+            for pixels, _ in decoded:
+                tickets.append(engine.submit(pixels, priority=PRIORITY_BACKGROUND) if pixels is not None else None)
+        except RuntimeError:
+            # Engine stopped by a model cut-over: retry the chunk on the new one
+            for ticket in tickets:
+                if ticket is not None:
+                    engine.cancel(ticket)
+            self.store.release_items(job["id"], [item["seq"] for item in items])
+            return
+
+        lines, failed = [], 0
+        for item, (_, error), ticket in zip(items, decoded, tickets):
+            result = {
+                "seq": item["seq"],
+                "url": item["url"],
+                "imageId": item.get("imageId"),
+                "propertyId": item.get("propertyId"),
+                "success": False
+            }
+            if ticket is not None:
+                try:
+                    vector, batch_seconds, _ = ticket.future.result()
+                    features = extractor.format_features(vector, batch_seconds)
+                    result.update(success=True, **features)
+                    if self.on_result is not None:
+                        self.on_result(job, item, features)
+                except Exception as e:
+                    error = str(e)
+            if not result["success"]:
+                result["error"] = error
+                failed += 1
+            lines.append(json.dumps(result, ensure_ascii=False))
+
+        if self.store.get(job["id"])["status"] == "cancelled":
+            return
+        with open(self.store.results_path(job["id"]), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.store.complete_items(job["id"], [item["seq"] for item in items], failed)
+
+    def progress(self, job_id):
+        """Job row plus throughput and ETA of the current run"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        job["options"] = json.loads(job["options"])
+        processed = job["done"]
+        remaining = job["total"] - processed
+        rate = None
+        run = self._runs.get(job_id)
+        if job["status"] not in TERMINAL_STATUSES:
+            if run is not None:
+                elapsed = time.monotonic() - run[0]
+                if elapsed > 0:
+                    rate = (processed - run[1]) / elapsed
+        elif job["started_at"] and job["finished_at"]:
+            elapsed = job["finished_at"] - job["started_at"]
+            rate = processed / elapsed if elapsed > 0 else None
+        job.update({
+            "processed": processed,
+            "remaining": remaining,
+            "percent": round(processed * 100 / job["total"], 1) if job["total"] else 100.0,
+            "images_per_s": round(rate, 2) if rate is not None else None,
+            "eta_s": (
+                round(remaining / rate, 1)
+                if rate and job["status"] not in TERMINAL_STATUSES else None
+            )
+        })
+        return job
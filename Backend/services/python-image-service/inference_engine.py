@@ -0,0 +1,396 @@
+"""
+SMART TRO - Deadline-aware micro-batching inference engine
+Requests are decoded on the thread pool, queued here and run through the
+model in small batches by a single inference thread.
+
+Every request may carry a deadline (X-Request-Timeout-Ms relative budget or
+X-Request-Deadline absolute epoch milliseconds). It is checked before each
+pipeline stage (read, decode, queue, inference); work whose deadline has
+passed or whose client disconnected is dropped, and queued tickets are
+removed from the queue, so nobody's ResNet50 forward pass is spent on a
+response that will never be read.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "x-request-deadline"      # absolute, unix epoch milliseconds
+TIMEOUT_HEADER = "x-request-timeout-ms"     # relative budget in milliseconds
+
+STAGES = ("read", "decode", "queue", "inference")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+DEFAULT_MAX_BATCH_SIZE = 16
+DEFAULT_MAX_WAIT_MS = 5.0
+DISCONNECT_POLL_S = 0.1
+
+
+class DeadlineExceeded(Exception):
+    """Work abandoned at `stage` because the deadline passed or the client left"""
+
+    def __init__(self, stage, reason="deadline"):
+        super().__init__(f"Request {reason} at stage '{stage}'")
+        self.stage = stage
+        self.reason = reason  # "deadline" | "disconnected"
+
+
+class RequestDeadline:
+    """Deadline of one request on the monotonic clock (None = no deadline)"""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, expires_at=None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_headers(cls, headers):
+        """Earliest of the relative and absolute deadline headers; bad values are ignored"""
+        now = time.monotonic()
+        candidates = []
+
+        timeout_ms = headers.get(TIMEOUT_HEADER)
+        if timeout_ms:
+            try:
+                candidates.append(now + float(timeout_ms) / 1000)
+            except ValueError:
+                logger.warning(f"Ignoring invalid {TIMEOUT_HEADER} header: {timeout_ms!r}")
+
+        deadline_ms = headers.get(DEADLINE_HEADER)
+        if deadline_ms:
+            try:
+                # Convert wall clock to monotonic once, on arrival
+                candidates.append(now + float(deadline_ms) / 1000 - time.time())
+            except ValueError:
+                logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {deadline_ms!r}")
+
+        return cls(min(candidates) if candidates else None)
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+
+class DeadlineMetrics:
+    """
+    Saved vs wasted work counters
+
+    saved:  requests dropped before their forward pass (per stage and reason)
+    wasted: forward passes whose result nobody read (deadline passed or
+            client disconnected while the batch was already running)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.with_deadline = 0
+        self.completed = 0
+        self.dropped = {reason: dict.fromkeys(STAGES, 0) for reason in ("deadline", "disconnected")}
+        self.removed_from_queue = 0
+        self.wasted_inferences = 0
+
+    def record_request(self, deadline):
+        with self._lock:
+            self.requests += 1
+            if deadline is not None and deadline.expires_at is not None:
+                self.with_deadline += 1
+
+    def record_drop(self, stage, reason):
+        with self._lock:
+            self.dropped[reason][stage] += 1
+
+    def record_queue_removal(self):
+        with self._lock:
+            self.removed_from_queue += 1
+
+    def record_wasted(self, count=1):
+        with self._lock:
+            self.wasted_inferences += count
+
+    def record_completed(self):
+        with self._lock:
+            self.completed += 1
+
+    def snapshot(self, avg_item_ms=None):
+        with self._lock:
+            dropped = {reason: dict(stages) for reason, stages in self.dropped.items()}
+            # Every drop happens before the forward pass it would have needed
+            saved = sum(sum(stages.values()) for stages in dropped.values())
+            return {
+                "requests": self.requests,
+                "with_deadline": self.with_deadline,
+                "completed": self.completed,
+                "dropped": dropped,
+                "removed_from_queue": self.removed_from_queue,
+                "saved_inferences": saved,
+                "wasted_inferences": self.wasted_inferences,
+                "saved_inference_ms_estimate": (
+                    round(saved * avg_item_ms, 1) if avg_item_ms is not None else None
+                ),
+                "wasted_inference_ms_estimate": (
+                    round(self.wasted_inferences * avg_item_ms, 1) if avg_item_ms is not None else None
+                )
+            }
+
+
+class InferenceTicket:
+    """One queued model input (a single sample) and the future its output is delivered on"""
+
+    __slots__ = ("inputs", "deadline", "future", "enqueued_at", "started", "abandoned")
+
+    def __init__(self, inputs, deadline):
+        self.inputs = inputs
+        self.deadline = deadline
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+        self.started = False
+        self.abandoned = False
+
+
+class BatchInferenceEngine:
+    """
+    Single inference thread draining a queue of tickets in batches
+
+    A batch is closed when it reaches max_batch_size or max_wait_ms after its
+    first ticket. Expired tickets are dropped when dequeued and again right
+    before the forward pass; cancel() removes a ticket that is still queued.
+
+    Background tickets (offline embedding jobs) wait in their own queue and
+    only take the batch slots interactive requests leave free.
+
+    With input_shape set, samples are copied into one preallocated batch
+    buffer and predict_fn receives a view of its first N rows, so assembling
+    a batch allocates nothing. predict_fn must not keep that view.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, metrics=None,
+                 input_shape=None, input_dtype=np.uint8):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.metrics = metrics or DeadlineMetrics()
+        self._batch_buffer = None
+        if input_shape is not None:
+            self._batch_buffer = np.empty((max_batch_size, *input_shape), dtype=input_dtype)
+        self._queue = collections.deque()
+        self._background = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.batches = 0
+        self.items = 0
+        self.busy_s = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="inference-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Refuse new tickets and finish the queued ones before the thread exits"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, inputs, deadline=None, priority=PRIORITY_INTERACTIVE):
+        ticket = InferenceTicket(inputs, deadline)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Inference engine is stopped")
+            queue = self._background if priority == PRIORITY_BACKGROUND else self._queue
+            queue.append(ticket)
+            self._cond.notify()
+        return ticket
+
+    def cancel(self, ticket):
+        """Abandon a ticket; returns True if it was still queued and got removed"""
+        with self._cond:
+            ticket.abandoned = True
+            for queue in (self._queue, self._background):
+                try:
+                    queue.remove(ticket)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return False
+        ticket.future.cancel()
+        self.metrics.record_queue_removal()
+        return True
+
+    def _expire(self, ticket, stage):
+        if ticket.future.set_running_or_notify_cancel():
+            ticket.future.set_exception(DeadlineExceeded(stage))
+        self.metrics.record_drop(stage, "deadline")
+
+    def _pending(self):
+        return len(self._queue) + len(self._background)
+
+    def _pop(self):
+        """Next ticket, interactive first"""
+        return self._queue.popleft() if self._queue else self._background.popleft()
+
+    def _take_batch(self):
+        """Block until at least one live ticket is queued, then fill a batch"""
+        batch = []
+        with self._cond:
+            while not batch:
+                while not self._pending() and not self._stopping:
+                    self._cond.wait()
+                if not self._pending():
+                    # Stopping, and everything queued before stop() is served
+                    return batch
+
+                close_at = time.monotonic() + self.max_wait_s
+                while len(batch) < self.max_batch_size:
+                    if not self._pending():
+                        remaining = close_at - time.monotonic()
+                        if remaining <= 0 or self._stopping:
+                            break
+                        self._cond.wait(remaining)
+                        continue
+                    ticket = self._pop()
+                    if ticket.deadline is not None and ticket.deadline.expired():
+                        self._expire(ticket, "queue")
+                        continue
+                    if not ticket.future.set_running_or_notify_cancel():
+                        continue
+                    ticket.started = True
+                    batch.append(ticket)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+
+            # Last check right before the forward pass
+            live = []
+            for ticket in batch:
+                if ticket.deadline is not None and ticket.deadline.expired():
+                    ticket.future.set_exception(DeadlineExceeded("inference"))
+                    self.metrics.record_drop("inference", "deadline")
+                elif ticket.abandoned:
+                    ticket.future.set_exception(DeadlineExceeded("inference", "disconnected"))
+                    self.metrics.record_drop("inference", "disconnected")
+                else:
+                    live.append(ticket)
+            if not live:
+                continue
+
+            start_time = time.perf_counter()
+            try:
+                outputs = self.predict_fn(self._assemble(live))
+            except Exception as e:
+                logger.error(f"Batch inference failed: {e}")
+                for ticket in live:
+                    ticket.future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start_time
+
+            self.batches += 1
+            self.items += len(live)
+            self.busy_s += elapsed
+
+            wasted = 0
+            for ticket, output in zip(live, outputs):
+                if ticket.abandoned or (ticket.deadline is not None and ticket.deadline.expired()):
+                    wasted += 1
+                ticket.future.set_result((output, elapsed, len(live)))
+            if wasted:
+                self.metrics.record_wasted(wasted)
+
+    def _assemble(self, tickets):
+        if self._batch_buffer is None:
+            return np.stack([ticket.inputs for ticket in tickets])
+        batch = self._batch_buffer[:len(tickets)]
+        for row, ticket in zip(batch, tickets):
+            np.copyto(row, ticket.inputs, casting="same_kind")
+        return batch
+
+    def avg_item_ms(self):
+        return self.busy_s * 1000 / self.items if self.items else None
+
+    def stats(self):
+        avg_item_ms = self.avg_item_ms()
+        return {
+            "queue_depth": len(self._queue),
+            "background_queue_depth": len(self._background),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait_s * 1000, 2),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "avg_batch_ms": round(self.busy_s * 1000 / self.batches, 2) if self.batches else None,
+            "avg_item_ms": round(avg_item_ms, 2) if avg_item_ms is not None else None,
+            "batch_buffer_mb": (
+                round(self._batch_buffer.nbytes / (1024 * 1024), 2)
+                if self._batch_buffer is not None else None
+            ),
+            "running": self._thread is not None and self._thread.is_alive()
+        }
+
+
+async def check_request(stage, deadline, is_disconnected, metrics):
+    """Raise DeadlineExceeded (and count the saved work) before starting `stage`"""
+    if deadline is not None and deadline.expired():
+        metrics.record_drop(stage, "deadline")
+        raise DeadlineExceeded(stage)
+    if is_disconnected is not None and await is_disconnected():
+        metrics.record_drop(stage, "disconnected")
+        raise DeadlineExceeded(stage, "disconnected")
+
+
+async def wait_for_result(engine, ticket, is_disconnected=None):
+    """
+    Await a ticket while watching the deadline and the client connection
+
+    Returns (output, batch_seconds, batch_size). An abandoned ticket is
+    removed from the queue if it has not started; a running one finishes
+    and is counted as wasted by the engine.
+    """
+    future = asyncio.wrap_future(ticket.future)
+    deadline = ticket.deadline
+    while True:
+        timeout = DISCONNECT_POLL_S
+        if deadline is not None and deadline.expires_at is not None:
+            timeout = min(timeout, deadline.remaining())
+        done, _ = await asyncio.wait({future}, timeout=timeout)
+        if done:
+            return future.result()
+
+        reason = None
+        if deadline is not None and deadline.expired():
+            reason = "deadline"
+        elif is_disconnected is not None and await is_disconnected():
+            reason = "disconnected"
+        if reason is None:
+            continue
+
+        if engine.cancel(ticket):
+            engine.metrics.record_drop("queue", reason)
+            raise DeadlineExceeded("queue", reason)
+        # Already in a running batch: the engine counts the wasted pass
+        raise DeadlineExceeded("inference", reason)
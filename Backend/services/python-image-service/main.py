@@ -4,18 +4,36 @@ ResNet50-based visual search for property rental images
 Google Lens-style image search functionality
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import tensorflow as tf
-from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-import numpy as np
-import io
-from PIL import Image
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
 import logging
 import uvicorn
 import time
 import json
 import os
+import asyncio
+
+# TensorFlow is imported inside FeatureExtractor.load_model so the
+# ASGI app can answer liveness probes before the heavy runtime is loaded
+
+from model_registry import (
+    DEFAULT_MODEL_ID, MODEL_SPECS, ModelRegistry, namespace_dir, resolve_model_id
+)
+from reembed_job import ReembedJob
+from embedding_jobs import JobStore, JobWorker, TERMINAL_STATUSES
+from vector_index import EmbeddingIndex, DEFAULT_CANDIDATES
+from property_index import PropertyIndex
+from sharded_index import ShardedIndex, ShardError
+from memory_stats import read_process_memory
+from result_cache import SearchResultCache, EmbeddingCache
+from inference_engine import (
+    BatchInferenceEngine, DeadlineExceeded, DeadlineMetrics, RequestDeadline,
+    check_request, wait_for_result
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,6 +59,31 @@ ALLOWED_ORIGINS = [
     "http://127.0.0.1:5000",
 ]
 
+# Fast boot: start serving immediately, import TensorFlow and load the model
+# in a background thread. Readiness (/readyz) flips once the model is usable.
+FAST_BOOT = os.getenv("FAST_BOOT", "0").lower() in ("1", "true", "yes")
+
+# Visual search index persistence directory (one namespace per model)
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_data"))
+
+# Embedding model served at boot; POST /models/{id}/activate records a
+# cut-over in INDEX_DIR/active_model.json, which then takes precedence
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL_ID)
+ACTIVE_MODEL_PATH = os.path.join(INDEX_DIR, "active_model.json")
+
+# Durable embedding jobs: SQLite queue + incremental results (jsonl per job)
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(INDEX_DIR, "jobs"))
+
+# Sharded index: INDEX_SHARDS > 0 partitions the index across that many
+# shard processes ("hash" by property or "province"); single API worker only
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "0"))
+INDEX_SHARD_STRATEGY = os.getenv("INDEX_SHARD_STRATEGY", "hash")
+
+# Property aggregates for hierarchical search: "mean" (one vector per
+# listing) or "medoids" (PROPERTY_REPRESENTATIVES photos per listing)
+PROPERTY_AGGREGATE = os.getenv("PROPERTY_AGGREGATE", "mean")
+PROPERTY_REPRESENTATIVES = int(os.getenv("PROPERTY_REPRESENTATIVES", "3"))
+
 # CORS middleware for Node.js backend
 app.add_middleware(
     CORSMiddleware,
@@ -50,155 +93,432 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class ResNet50FeatureExtractor:
+def _read_active_model():
+    try:
+        with open(ACTIVE_MODEL_PATH, encoding="utf-8") as f:
+            return resolve_model_id(json.load(f)["model_id"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return resolve_model_id(EMBEDDING_MODEL)
+
+
+# Initialize feature extractor (active model of the registry)
+model_registry = ModelRegistry()
+feature_extractor = model_registry.get(_read_active_model())
+
+# Visual search index (filled by the Node backend through /index/upsert)
+embedding_index = EmbeddingIndex(feature_extractor.feature_dimension, model_id=feature_extractor.model_id)
+# Coarse per-property index derived from it (mode="hierarchical")
+property_index = PropertyIndex(embedding_index, PROPERTY_AGGREGATE, PROPERTY_REPRESENTATIVES)
+
+# Top-K result cache (exact invalidation through the index mutation log) and
+# query image -> embedding cache for repeatedly searched reference photos
+result_cache = SearchResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+)
+query_embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "256"))
+)
+
+# Micro-batching inference queue; requests carry their deadline through it.
+# The engine thread is started per worker in the startup event.
+deadline_metrics = DeadlineMetrics()
+
+
+def _make_engine(extractor):
+    return BatchInferenceEngine(
+        extractor.predict_batch,
+        input_shape=(*extractor.input_size, 3),
+        max_batch_size=int(os.getenv("INFERENCE_MAX_BATCH", "16")),
+        max_wait_ms=float(os.getenv("INFERENCE_MAX_WAIT_MS", "5")),
+        metrics=deadline_metrics
+    )
+
+
+inference_engine = _make_engine(feature_extractor)
+
+# Background re-embedding of the catalog into another model's namespace
+reembed_job = None
+
+
+def _index_job_result(job, item, features):
+    """Upsert a job result into the index when the job asked for it"""
+    if not json.loads(job["options"]).get("indexResults"):
+        return
+    if features["model_id"] != embedding_index.model_id or not item.get("propertyId"):
+        return
+    embedding_index.upsert(
+        image_id=item.get("imageId") or item["url"],
+        property_id=item["propertyId"],
+        embedding=features["embedding"],
+        image_url=item["url"],
+        province=item.get("province"),
+        category=item.get("category"),
+        price=item.get("price"),
+        approval_status=item.get("approvalStatus")
+    )
+
+
+# Embedding jobs share the inference engine at background priority; the
+# pipeline is looked up per chunk so a model cut-over is picked up
+job_store = JobStore(JOBS_DIR)
+job_worker = JobWorker(
+    job_store,
+    pipeline=lambda: (feature_extractor, inference_engine),
+    on_result=_index_job_result,
+    chunk_size=int(os.getenv("JOB_CHUNK_SIZE", "8")),
+    fetch_workers=int(os.getenv("JOB_FETCH_WORKERS", "8"))
+)
+
+# Set by preload() when a pre-fork parent loaded the index before forking:
+# workers then share it read-only and skip loading/saving it themselves
+index_preloaded = False
+
+
+def _index_dir(extractor=None):
+    return namespace_dir(INDEX_DIR, (extractor or feature_extractor).model_id)
+
+
+def _property_index_dir(extractor=None):
+    return os.path.join(_index_dir(extractor), "properties")
+
+
+def _load_local_index(extractor=None):
+    extractor = extractor or feature_extractor
+    # Full-precision vectors stay memory-mapped in the namespace, compact codes in RAM
+    return EmbeddingIndex.load(
+        _index_dir(extractor), extractor.feature_dimension, model_id=extractor.model_id
+    )
+
+
+def _load_namespace(extractor=None):
+    """Image index and property aggregates of a model's namespace, not yet active"""
+    index = _load_local_index(extractor)
+    return index, PropertyIndex.load(
+        _property_index_dir(extractor), index, PROPERTY_AGGREGATE, PROPERTY_REPRESENTATIVES
+    )
+
+
+def reload_index():
+    """(Re)load the active model's index and its property aggregates"""
+    global embedding_index, property_index
+    if INDEX_SHARDS > 0:
+        if isinstance(embedding_index, ShardedIndex):
+            embedding_index.stop()
+        # A fresh shard layout is seeded from the unsharded namespace
+        embedding_index = ShardedIndex(
+            _index_dir(), feature_extractor.feature_dimension, feature_extractor.model_id,
+            shards=INDEX_SHARDS, strategy=INDEX_SHARD_STRATEGY
+        ).start(seed=_load_local_index)
+        property_index = None
+        return embedding_index
+
+    embedding_index, property_index = _load_namespace()
+    logger.info(
+        f"Visual search index ready with {len(embedding_index)} vectors "
+        f"({len(property_index)} property vectors)"
+    )
+    return embedding_index
+
+
+def save_index():
+    embedding_index.save(_index_dir())
+    if property_index is not None:
+        property_index.sync()
+        property_index.save(_property_index_dir())
+
+
+def ensure_sharded():
+    if not isinstance(embedding_index, ShardedIndex):
+        raise HTTPException(status_code=409, detail="Index is not sharded (set INDEX_SHARDS)")
+
+
+def ensure_unsharded(feature):
+    if isinstance(embedding_index, ShardedIndex):
+        raise HTTPException(
+            status_code=409,
+            detail=f"{feature} needs the unsharded index (INDEX_SHARDS=0)"
+        )
+
+
+def preload(load_model=True):
     """
-    ResNet50-based feature extractor for image similarity search
-    Extracts 2048-dimensional feature vectors from property images
+    Load the index (and optionally the model) in the current process
+
+    Used by prefork.py before forking so that workers share the pages.
     """
-    
-    def __init__(self):
-        self.model = None
-        self.model_name = "ResNet50"
-        self.feature_dimension = 2048
-        self.input_size = (224, 224)
-        self.is_loaded = False
-        
-    def load_model(self):
-        """Load ResNet50 model for feature extraction"""
-        if self.model is None:
-            logger.info("Loading ResNet50 model for property image search...")
-            start_time = time.time()
-            
-            try:
-                # Load ResNet50 without classification head
-                self.model = ResNet50(
-                    weights='imagenet',           # Pre-trained weights
-                    include_top=False,            # Remove classification layer
-                    pooling='avg',                # Global average pooling
-                    input_shape=(224, 224, 3)    # Standard input shape
-                )
-                
-                # Make model non-trainable for inference
-                self.model.trainable = False
-                
-                load_time = time.time() - start_time
-                self.is_loaded = True
-                
-                logger.info(f"ResNet50 loaded successfully in {load_time:.2f}s")
-                logger.info(f"Model output shape: {self.model.output_shape}")
-                logger.info(f"Feature dimension: {self.feature_dimension}")
-                
-                return True
-                
-            except Exception as e:
-                logger.error(f"Failed to load ResNet50: {e}")
-                self.is_loaded = False
-                return False
-                
-        return True
-    
-    def preprocess_image(self, image_bytes):
-        """
-        Preprocess image for ResNet50 inference
-        - Resize to 224x224
-        - Convert to RGB
-        - Normalize pixel values
-        """
-        try:
-            # Load image from bytes
-            pil_image = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert to RGB if needed
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-                logger.info(f"Converted image from {pil_image.mode} to RGB")
-            
-            # Resize to ResNet50 input size
-            pil_image = pil_image.resize(self.input_size, Image.Resampling.LANCZOS)
-            
-            # Convert to numpy array
-            img_array = np.array(pil_image, dtype=np.float32)
-            
-            # Add batch dimension [1, 224, 224, 3]
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            # ResNet50 preprocessing (ImageNet normalization)
-            img_array = preprocess_input(img_array)
-            
-            logger.info(f"Image preprocessed to shape: {img_array.shape}")
-            return img_array
-            
-        except Exception as e:
-            logger.error(f"Image preprocessing error: {e}")
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid image format or corrupted file: {e}"
+    global index_preloaded
+    if INDEX_SHARDS > 0:
+        raise RuntimeError(
+            "The sharded index runs its own shard processes; use WEB_CONCURRENCY=1 with INDEX_SHARDS"
+        )
+    reload_index()
+    index_preloaded = True
+    if load_model and not feature_extractor.load_model():
+        raise RuntimeError(f"{feature_extractor.model_name} model failed to load")
+
+
+def ensure_index_writable():
+    if index_preloaded:
+        raise HTTPException(
+            status_code=409,
+            detail="Index is read-only in pre-fork workers; update it on a single-worker "
+                   "instance, then send SIGHUP to the pre-fork server to reload"
+        )
+
+
+class IndexItem(BaseModel):
+    """One image embedding with the property metadata used for filtering"""
+    imageId: str
+    propertyId: str
+    embedding: List[float]
+    imageUrl: Optional[str] = None
+    province: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+    approvalStatus: Optional[str] = None
+
+
+class EmbeddingJobItem(BaseModel):
+    """One image of a job manifest; metadata is echoed in the results"""
+    url: str
+    imageId: Optional[str] = None
+    propertyId: Optional[str] = None
+    province: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+    approvalStatus: Optional[str] = None
+
+
+class EmbeddingJobRequest(BaseModel):
+    items: List[EmbeddingJobItem]
+    indexResults: bool = False  # also upsert results into the visual search index
+
+
+class IndexUpsertRequest(BaseModel):
+    items: List[IndexItem]
+    model: Optional[str] = None  # model id the embeddings were extracted with
+
+
+class SearchFilters(BaseModel):
+    """Metadata filters applied before scoring"""
+    province: Optional[List[str]] = None
+    category: Optional[List[str]] = None
+    approvalStatus: Optional[List[str]] = None
+    minPrice: Optional[float] = None
+    maxPrice: Optional[float] = None
+
+    def to_index_filters(self):
+        return {
+            "province": self.province,
+            "category": self.category,
+            "approval_status": self.approvalStatus,
+            "min_price": self.minPrice,
+            "max_price": self.maxPrice
+        }
+
+
+class EmbeddingSearchRequest(BaseModel):
+    embedding: List[float]
+    topK: int = 5
+    minScore: float = 0.0
+    groupByProperty: bool = True
+    filters: Optional[SearchFilters] = None
+    mode: str = "exact"
+    candidates: int = DEFAULT_CANDIDATES
+    model: Optional[str] = None  # model id the query embedding was extracted with
+
+
+def ensure_active_model(model):
+    """409 for embeddings of another model: vectors of different models are not comparable"""
+    if model is None:
+        return
+    try:
+        model_id = resolve_model_id(model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if model_id != feature_extractor.model_id:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Embedding model {model_id} does not match the active model "
+                   f"{feature_extractor.model_id}; re-extract the embedding"
+        )
+
+
+def _split_form_values(value):
+    """Form fields accept comma separated lists (e.g. province=Hà Nội,Hồ Chí Minh)"""
+    if not value:
+        return None
+    values = [v.strip() for v in value.split(",") if v.strip()]
+    return values or None
+
+
+def run_index_search(embedding, top_k, filters, min_score, group_by_property,
+                     mode="exact", candidates=DEFAULT_CANDIDATES):
+    """Run a filtered top-K search and shape the response"""
+    if mode not in ("exact", "two_stage", "hierarchical"):
+        raise HTTPException(status_code=400, detail=f"Unknown search mode: {mode}")
+    if mode == "hierarchical":
+        ensure_unsharded("Hierarchical search")
+
+    index_filters = filters.to_index_filters() if filters else None
+    candidates = max(candidates, top_k)
+    index = embedding_index
+    properties = property_index
+    cache_key = SearchResultCache.make_key(
+        embedding, top_k, index_filters, min_score, group_by_property, mode, candidates
+    )
+
+    cached = result_cache.get(cache_key, index)
+    if cached is not None:
+        hits, stats = cached
+        return {
+            "success": True,
+            "results": hits,
+            "count": len(hits),
+            "index_stats": stats,
+            "cached": True
+        }
+
+    try:
+        if mode == "hierarchical":
+            # candidates = number of properties whose photos are re-ranked
+            hits, stats = properties.search(
+                embedding,
+                top_k=top_k,
+                filters=index_filters,
+                min_score=min_score,
+                group_by_property=group_by_property,
+                candidates=candidates
             )
-    
-    def extract_features(self, image_bytes):
-        """
-        Extract 2048-dimensional feature vector using ResNet50
-        Returns normalized feature vector for similarity search
-        """
-        try:
-            # Ensure model is loaded
-            if not self.load_model():
-                raise HTTPException(
-                    status_code=500, 
-                    detail="ResNet50 model failed to load"
-                )
-            
-            # Preprocess image
-            processed_image = self.preprocess_image(image_bytes)
-            
-            # Extract features
-            start_time = time.time()
-            logger.info("Extracting ResNet50 features...")
-            
-            # Forward pass through ResNet50
-            features = self.model.predict(processed_image, verbose=0)
-            
-            extraction_time = time.time() - start_time
-            
-            # Normalize feature vector for cosine similarity
-            feature_vector = features[0]  # Remove batch dimension
-            norm = np.linalg.norm(feature_vector)
-            if norm > 0:
-                feature_vector = feature_vector / norm
-            
-            # Convert to Python list for JSON serialization
-            feature_list = feature_vector.tolist()
-            
-            logger.info(f"Extracted {len(feature_list)}-dim features in {extraction_time:.2f}s")
-            
-            return {
-                "embedding": feature_list,
-                "dimension": len(feature_list),
-                "model": self.model_name,
-                "extraction_time_ms": round(extraction_time * 1000, 2),
-                "normalized": True
-            }
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Feature extraction failed: {e}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Feature extraction error: {e}"
+        else:
+            hits, stats = index.search(
+                embedding,
+                top_k=top_k,
+                filters=index_filters,
+                min_score=min_score,
+                group_by_property=group_by_property,
+                mode=mode,
+                candidates=candidates
             )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result_cache.put(
+        cache_key, index, stats["index_version"], hits, stats,
+        embedding, index_filters, top_k, min_score, mode
+    )
+
+    return {
+        "success": True,
+        "results": hits,
+        "count": len(hits),
+        "index_stats": stats,
+        "cached": False
+    }
+
+
+async def read_upload(file, request, deadline):
+    """Read stage: skip reading the upload if nobody is waiting any more"""
+    await check_request("read", deadline, request.is_disconnected, deadline_metrics)
+    return await file.read()
+
+
+async def extract_features_with_deadline(image_bytes, request, deadline):
+    """
+    Decode on the thread pool, then queue for batched inference
+
+    The deadline and client connection are checked before decoding, before
+    queueing and while waiting; DeadlineExceeded aborts the pipeline.
+    """
+    # Pin the model and its engine: a cut-over may swap the globals meanwhile
+    extractor, engine = feature_extractor, inference_engine
+
+    await check_request("decode", deadline, request.is_disconnected, deadline_metrics)
+    try:
+        processed_image = await run_in_threadpool(extractor.preprocess_image, image_bytes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await check_request("queue", deadline, request.is_disconnected, deadline_metrics)
+    ticket = engine.submit(processed_image, deadline)
+    try:
+        vector, batch_seconds, batch_size = await wait_for_result(
+            engine, ticket, request.is_disconnected
+        )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Feature extraction failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Feature extraction error: {e}")
+
+    deadline_metrics.record_completed()
+    features = extractor.format_features(vector, batch_seconds)
+    features["batch_size"] = batch_size
+    return features
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """504 once the deadline passed, 499 (client closed request) after a disconnect"""
+    return JSONResponse(
+        status_code=504 if exc.reason == "deadline" else 499,
+        content={
+            "success": False,
+            "error": str(exc),
+            "stage": exc.stage,
+            "reason": exc.reason
+        }
+    )
+
+
+@app.exception_handler(ShardError)
+async def shard_error_handler(request: Request, exc: ShardError):
+    """A shard process failed or timed out: the index is partially unavailable"""
+    logger.error(str(exc))
+    return JSONResponse(status_code=503, content={"success": False, "error": str(exc)})
 
-# Initialize feature extractor
-feature_extractor = ResNet50FeatureExtractor()
 
 @app.on_event("startup")
 async def startup_event():
     """Startup event handler"""
     logger.info("SMART TRO Image Search Service starting...")
-    logger.info("Model will be loaded lazily on first request.")
+    if not index_preloaded:
+        reload_index()
+    inference_engine.start()
+    job_worker.start()
+
+    if feature_extractor.is_loaded:
+        logger.info(f"{feature_extractor.model_name} was preloaded by the parent process.")
+    elif FAST_BOOT:
+        feature_extractor.load_in_background()
+        logger.info(f"Fast boot: TensorFlow and {feature_extractor.model_name} are loading in the background.")
+    else:
+        # Original behaviour: pay the TensorFlow import before serving
+        import tensorflow as tf
+        feature_extractor.tensorflow_version = tf.__version__
+        logger.info("Model will be loaded lazily on first request.")
     logger.info("Startup completed successfully.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Persist the visual search index on shutdown"""
+    # Unfinished job items go back to the queue and resume on the next start
+    job_worker.stop()
+    inference_engine.stop()
+    if reembed_job is not None:
+        reembed_job.cancel()
+    if index_preloaded:
+        return
+    try:
+        save_index()
+    except Exception as e:
+        logger.error(f"Failed to save visual search index: {e}")
+    if isinstance(embedding_index, ShardedIndex):
+        embedding_index.stop()
+
+
 @app.get("/")
 async def root():
     """Service information and health check"""
@@ -207,13 +527,29 @@ async def root():
         "description": "Google Lens-style visual search for property rentals",
         "version": "1.0.0",
         "model": feature_extractor.model_name,
+        "model_id": feature_extractor.model_id,
         "feature_dimension": feature_extractor.feature_dimension,
         "model_loaded": feature_extractor.is_loaded,
-        "tensorflow_version": tf.__version__,
+        "tensorflow_version": feature_extractor.tensorflow_version,
+        "fast_boot": FAST_BOOT,
         "endpoints": {
             "health": "GET /health",
+            "liveness": "GET /livez",
+            "readiness": "GET /readyz",
             "extract_features": "POST /extract-features",
             "batch_extract": "POST /batch-extract",
+            "search": "POST /search",
+            "search_by_embedding": "POST /search/by-embedding",
+            "index_upsert": "POST /index/upsert",
+            "index_stats": "GET /index/stats",
+            "index_train_compact": "POST /index/train-compact",
+            "deadline_metrics": "GET /metrics/deadlines",
+            "index_shards": "GET /index/shards",
+            "models": "GET /models",
+            "model_reembed": "POST /models/{model_id}/reembed",
+            "model_activate": "POST /models/{model_id}/activate",
+            "embedding_jobs": "POST /jobs/embeddings",
+            "embedding_job": "GET /jobs/embeddings/{job_id}",
             "api_docs": "GET /docs"
         },
         "status": "ready" if feature_extractor.is_loaded else "loading"
@@ -226,17 +562,64 @@ async def health_check():
         "status": "healthy" if feature_extractor.is_loaded else "loading",
         "model_loaded": feature_extractor.is_loaded,
         "model_name": feature_extractor.model_name,
+        "model_id": feature_extractor.model_id,
         "feature_dimension": feature_extractor.feature_dimension,
-        "tensorflow_version": tf.__version__,
-        "python_version": f"{tf.version.VERSION}",
+        "tensorflow_version": feature_extractor.tensorflow_version,
+        "python_version": f"{feature_extractor.tensorflow_version}",
         "timestamp": time.time(),
         "uptime": "ready"
     }
 
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Hit ratios and invalidation counters of the search caches"""
+    return {
+        "result_cache": result_cache.metrics(),
+        "embedding_cache": query_embedding_cache.metrics(),
+        "index_version": embedding_index.version
+    }
+
+@app.get("/metrics/deadlines")
+async def deadline_metrics_endpoint():
+    """Work saved by dropping expired/abandoned requests vs inference wasted on them"""
+    return {
+        "deadlines": deadline_metrics.snapshot(inference_engine.avg_item_ms()),
+        "engine": inference_engine.stats()
+    }
+
+@app.get("/metrics/memory")
+async def memory_metrics():
+    """RSS/PSS of this worker; compare PSS across workers to confirm page sharing"""
+    return {
+        "worker": read_process_memory("self"),
+        "parent_pid": os.getppid(),
+        "index_preloaded": index_preloaded
+    }
+
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: answers as soon as the ASGI app is up"""
+    return {"status": "alive", "timestamp": time.time()}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the model can serve inference, 503 before"""
+    body = {
+        "ready": feature_extractor.is_loaded,
+        "loading": feature_extractor.is_loading,
+        "model_name": feature_extractor.model_name,
+        "model_id": feature_extractor.model_id,
+        "load_time_s": feature_extractor.load_time_s,
+        "error": feature_extractor.load_error
+    }
+    if not feature_extractor.is_loaded:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 @app.post("/extract-features")
-async def extract_image_features(file: UploadFile = File(...)):
+async def extract_image_features(request: Request, file: UploadFile = File(...)):
     """
-    Extract ResNet50 features from property image
+    Extract features from property image with the active model
     
     Use for:
     - Property image search (like Google Lens)
@@ -244,11 +627,16 @@ async def extract_image_features(file: UploadFile = File(...)):
     - Visual search by room type, furniture, etc.
     
     Returns:
-    - embedding: 2048-dimensional normalized feature vector
-    - dimension: 2048 
-    - model: ResNet50
+    - embedding: normalized feature vector (2048-dim for ResNet50)
+    - dimension: 2048 for ResNet50, see GET /models
+    - model / model_id: active embedding model
     - extraction_time_ms: processing time
+
+    Optional X-Request-Timeout-Ms / X-Request-Deadline headers: work is
+    dropped (504) once the deadline passes or (499) the client disconnects.
     """
+    deadline = RequestDeadline.from_headers(request.headers)
+    deadline_metrics.record_request(deadline)
     
     # Validate file type
     if not file.content_type or not file.content_type.startswith('image/'):
@@ -259,7 +647,7 @@ async def extract_image_features(file: UploadFile = File(...)):
     
     try:
         # Read image data
-        image_bytes = await file.read()
+        image_bytes = await read_upload(file, request, deadline)
         file_size_mb = len(image_bytes) / (1024 * 1024)
         
         logger.info(f"Processing property image: {file.filename} ({file_size_mb:.2f}MB)")
@@ -271,20 +659,20 @@ async def extract_image_features(file: UploadFile = File(...)):
                 detail="Image too large. Maximum size: 10MB"
             )
         
-        # Extract ResNet50 features
-        result = feature_extractor.extract_features(image_bytes)
-        print("result Extract ResNet50 features:", result)
+        # Extract features with the active model
+        result = await extract_features_with_deadline(image_bytes, request, deadline)
+        logger.debug(f"Extracted {result['dimension']}-dim {result['model']} features for {file.filename}")
         
         return {
             "success": True,
             "filename": file.filename,
             "file_size_mb": round(file_size_mb, 2),
             **result,
-            "message": f"Successfully extracted {result['dimension']}-dimensional ResNet50 features",
+            "message": f"Successfully extracted {result['dimension']}-dimensional {result['model']} features",
             "use_case": "Property image similarity search"
         }
         
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
         logger.error(f"Unexpected error processing {file.filename}: {e}")
@@ -294,7 +682,7 @@ async def extract_image_features(file: UploadFile = File(...)):
         )
 
 @app.post("/batch-extract") 
-async def batch_extract_features(files: list[UploadFile] = File(...)):
+async def batch_extract_features(request: Request, files: list[UploadFile] = File(...)):
     """
     Extract features from multiple property images
     Useful for:
@@ -303,6 +691,7 @@ async def batch_extract_features(files: list[UploadFile] = File(...)):
     - Property portfolio analysis
     
     Max 20 images per batch for performance
+    Images are decoded concurrently and share inference batches.
     """
     
     if len(files) > 20:
@@ -310,49 +699,66 @@ async def batch_extract_features(files: list[UploadFile] = File(...)):
             status_code=400, 
             detail="Maximum 20 images per batch for performance reasons"
         )
+
+    deadline = RequestDeadline.from_headers(request.headers)
+    deadline_metrics.record_request(deadline)
     
     results = []
     total_processing_time = 0
     successful_count = 0
     
     logger.info(f"Batch processing {len(files)} property images...")
+
+    async def process(file):
+        image_bytes = await read_upload(file, request, deadline)
+        return await extract_features_with_deadline(image_bytes, request, deadline)
+
+    # Validate file types up front, then extract the valid ones concurrently
+    valid_files = [
+        file for file in files
+        if file.content_type and file.content_type.startswith('image/')
+    ]
+    outcomes = await asyncio.gather(
+        *(process(file) for file in valid_files), return_exceptions=True
+    )
+    outcome_by_file = dict(zip(map(id, valid_files), outcomes))
     
     for i, file in enumerate(files):
-        try:
-            # Validate file type
-            if not file.content_type or not file.content_type.startswith('image/'):
-                results.append({
-                    "filename": file.filename,
-                    "success": False,
-                    "error": f"Invalid file type: {file.content_type}"
-                })
-                continue
-            
-            # Process image
-            image_bytes = await file.read()
-            result = feature_extractor.extract_features(image_bytes)
-            
-            total_processing_time += result['extraction_time_ms']
-            successful_count += 1
-            
+        if id(file) not in outcome_by_file:
             results.append({
                 "filename": file.filename,
-                "success": True,
-                "embedding": result['embedding'],
-                "dimension": result['dimension'],
-                "extraction_time_ms": result['extraction_time_ms'],
-                "normalized": result['normalized']
+                "success": False,
+                "error": f"Invalid file type: {file.content_type}"
             })
-            
-            logger.info(f"[{i+1}/{len(files)}] Processed: {file.filename}")
-            
-        except Exception as e:
-            logger.error(f"[{i+1}/{len(files)}] Failed: {file.filename} - {e}")
+            continue
+
+        result = outcome_by_file[id(file)]
+        if isinstance(result, DeadlineExceeded):
+            # The whole batch response is abandoned, not just this image
+            raise result
+        if isinstance(result, Exception):
+            detail = result.detail if isinstance(result, HTTPException) else str(result)
+            logger.error(f"[{i+1}/{len(files)}] Failed: {file.filename} - {detail}")
             results.append({
                 "filename": file.filename,
                 "success": False,
-                "error": str(e)
+                "error": detail
             })
+            continue
+            
+        total_processing_time += result['extraction_time_ms']
+        successful_count += 1
+        
+        results.append({
+            "filename": file.filename,
+            "success": True,
+            "embedding": result['embedding'],
+            "dimension": result['dimension'],
+            "extraction_time_ms": result['extraction_time_ms'],
+            "normalized": result['normalized']
+        })
+        
+        logger.info(f"[{i+1}/{len(files)}] Processed: {file.filename}")
     
     return {
         "success": True,
@@ -366,17 +772,445 @@ async def batch_extract_features(files: list[UploadFile] = File(...)):
         },
         "results": results,
         "model": feature_extractor.model_name,
+        "model_id": feature_extractor.model_id,
         "feature_dimension": feature_extractor.feature_dimension
     }
 
-if __name__ == "__main__":
-    port = int(os.getenv("PORT", "8080"))  # Cloud Run truyền PORT vào env
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=port,
-        log_level="info",
-        access_log=True,
-        workers=1
+def _upsert_items(items):
+    try:
+        for item in items:
+            embedding_index.upsert(
+                image_id=item.imageId,
+                property_id=item.propertyId,
+                embedding=item.embedding,
+                image_url=item.imageUrl,
+                province=item.province,
+                category=item.category,
+                price=item.price,
+                approval_status=item.approvalStatus
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "success": True,
+        "indexed": len(items),
+        "total_vectors": len(embedding_index)
+    }
+
+@app.post("/index/upsert")
+async def index_upsert(payload: IndexUpsertRequest):
+    """
+    Add or replace image embeddings in the visual search index
+
+    Each item carries the property metadata (province, category, price,
+    approval status) that filtered searches use to skip ineligible vectors.
+    """
+    ensure_index_writable()
+    ensure_active_model(payload.model)
+    # Off the event loop: index writes (and shard IPC) block
+    return await run_in_threadpool(_upsert_items, payload.items)
+
+@app.delete("/index/images/{image_id}")
+async def index_remove_image(image_id: str):
+    """Remove one image embedding from the index"""
+    ensure_index_writable()
+    removed = await run_in_threadpool(embedding_index.remove_image, image_id)
+    return {"success": True, "removed": 1 if removed else 0}
+
+@app.delete("/index/properties/{property_id}")
+async def index_remove_property(property_id: str):
+    """Remove every image embedding of a property from the index"""
+    ensure_index_writable()
+    removed = await run_in_threadpool(embedding_index.remove_property, property_id)
+    return {"success": True, "removed": removed}
+
+@app.get("/index/stats")
+async def index_stats():
+    """Index size, memory footprint and metadata cardinalities"""
+    # Off the event loop: sharded stats are gathered from every shard process
+    stats = await run_in_threadpool(embedding_index.stats)
+    return {
+        "success": True,
+        **stats,
+        "property_index": property_index.stats() if property_index is not None else None
+    }
+
+@app.post("/index/save")
+async def index_save():
+    """Persist the index to INDEX_DIR"""
+    ensure_index_writable()
+    await run_in_threadpool(save_index)
+    vectors = await run_in_threadpool(len, embedding_index)
+    return {
+        "success": True,
+        "directory": _index_dir(),
+        "model_id": embedding_index.model_id,
+        "vectors": vectors,
+        "property_vectors": len(property_index) if property_index is not None else None
+    }
+
+@app.post("/index/train-compact")
+async def index_train_compact():
+    """
+    Fit the PCA codec used by two-stage search on the current vectors and
+    re-encode every compact code
+    """
+    ensure_index_writable()
+    # PCA fit + re-encoding every vector: minutes of CPU on a large index
+    trained = await run_in_threadpool(embedding_index.train_compact_codec)
+    stats = await run_in_threadpool(embedding_index.stats)
+    return {"success": trained, **stats["compact_codec"]}
+
+@app.get("/index/shards")
+async def index_shards():
+    """Shard layout, sizes, imbalance and per-shard search latency percentiles"""
+    ensure_sharded()
+    return {"success": True, **await run_in_threadpool(embedding_index.shard_stats)}
+
+class RebalanceRequest(BaseModel):
+    shards: Optional[int] = None
+    strategy: Optional[str] = None  # "hash" | "province"
+
+@app.post("/index/shards/rebalance")
+async def index_shards_rebalance(request: RebalanceRequest):
+    """
+    Re-partition the sharded index (shard count and/or strategy); only the
+    images whose shard changes are moved. Searches keep running, writes wait.
+    """
+    ensure_sharded()
+    try:
+        result = await run_in_threadpool(embedding_index.rebalance, request.shards, request.strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result_cache.clear()
+    return {"success": True, **result}
+
+@app.post("/search/by-embedding")
+async def search_by_embedding(request: EmbeddingSearchRequest):
+    """
+    Filtered top-K visual search with a precomputed query embedding
+
+    Filters are resolved against the metadata bitmaps first, so only the
+    eligible vectors are scored. mode="two_stage" retrieves `candidates`
+    rows with compact codes and re-ranks them with full-precision vectors.
+    mode="hierarchical" scores the per-property aggregates first and
+    re-ranks the photos of the best `candidates` properties.
+    """
+    ensure_active_model(request.model)
+    # Off the event loop: sharded searches wait on shard processes
+    return await run_in_threadpool(
+        run_index_search,
+        request.embedding,
+        request.topK,
+        request.filters,
+        request.minScore,
+        request.groupByProperty,
+        request.mode,
+        request.candidates
     )
 
+@app.post("/search")
+async def search_by_image(
+    request: Request,
+    file: UploadFile = File(...),
+    top_k: int = Form(5),
+    min_score: float = Form(0.0),
+    group_by_property: bool = Form(True),
+    province: Optional[str] = Form(None),
+    category: Optional[str] = Form(None),
+    approval_status: Optional[str] = Form(None),
+    min_price: Optional[float] = Form(None),
+    max_price: Optional[float] = Form(None),
+    mode: str = Form("exact"),
+    candidates: int = Form(DEFAULT_CANDIDATES)
+):
+    """
+    Google Lens-style search: extract features from the uploaded image and
+    run a filtered top-K query against the index
+
+    List filters (province, category, approval_status) accept comma
+    separated values. mode is "exact", "two_stage" or "hierarchical".
+    """
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=400,
+            detail=f"File must be an image. Received: {file.content_type}"
+        )
+
+    deadline = RequestDeadline.from_headers(request.headers)
+    deadline_metrics.record_request(deadline)
+
+    image_bytes = await read_upload(file, request, deadline)
+    if len(image_bytes) > 10 * 1024 * 1024:
+        raise HTTPException(
+            status_code=400,
+            detail="Image too large. Maximum size: 10MB"
+        )
+
+    # Keyed per model so a cut-over never serves the previous model's vector
+    digest = f"{feature_extractor.model_id}:{EmbeddingCache.digest(image_bytes)}"
+    features = query_embedding_cache.get(digest)
+    embedding_cached = features is not None
+    if features is None:
+        features = await extract_features_with_deadline(image_bytes, request, deadline)
+        query_embedding_cache.put(digest, features)
+    filters = SearchFilters(
+        province=_split_form_values(province),
+        category=_split_form_values(category),
+        approvalStatus=_split_form_values(approval_status),
+        minPrice=min_price,
+        maxPrice=max_price
+    )
+
+    response = await run_in_threadpool(
+        run_index_search,
+        features["embedding"], top_k, filters, min_score, group_by_property,
+        mode, candidates
+    )
+    extraction_ms = 0.0 if embedding_cached else features["extraction_time_ms"]
+    response["extraction_time_ms"] = extraction_ms
+    response["embedding_cached"] = embedding_cached
+    # Copy before annotating: stats may be shared with the result cache
+    response["index_stats"] = {
+        **response["index_stats"],
+        "timings": {**response["index_stats"]["timings"], "extraction_ms": extraction_ms}
+    }
+    response["model"] = features["model"]
+    response["model_id"] = features["model_id"]
+    return response
+
+@app.get("/models")
+async def list_models():
+    """Registered embedding models, the active one and the namespaces on disk"""
+    namespaces = {}
+    for model_id in MODEL_SPECS:
+        directory = namespace_dir(INDEX_DIR, model_id)
+        namespaces[model_id] = {
+            "directory": directory,
+            "exists": os.path.exists(os.path.join(directory, "meta.json"))
+        }
+    return {
+        "success": True,
+        "active_model": feature_extractor.model_id,
+        "models": model_registry.describe(),
+        "namespaces": namespaces,
+        "reembed": reembed_job.progress() if reembed_job is not None else None
+    }
+
+def _target_model(model_id):
+    try:
+        model_id = resolve_model_id(model_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if model_id == feature_extractor.model_id:
+        raise HTTPException(status_code=400, detail=f"{model_id} is already the active model")
+    return model_id
+
+@app.post("/models/{model_id}/reembed")
+async def start_reembed(model_id: str, batch_size: int = 32, fetch_workers: int = 8):
+    """
+    Re-embed every indexed image with another model into that model's
+    namespace, in the background; the active model keeps serving meanwhile.
+    Resumable: images already in the namespace are skipped.
+    """
+    global reembed_job
+    ensure_index_writable()
+    ensure_unsharded("Re-embedding")
+    model_id = _target_model(model_id)
+    if reembed_job is not None and reembed_job.is_running():
+        raise HTTPException(
+            status_code=409,
+            detail=f"Re-embedding into {reembed_job.extractor.model_id} is already running"
+        )
+    reembed_job = ReembedJob(
+        embedding_index, model_registry.get(model_id), namespace_dir(INDEX_DIR, model_id),
+        batch_size=batch_size, fetch_workers=fetch_workers
+    ).start()
+    return {"success": True, "reembed": reembed_job.progress()}
+
+@app.get("/models/reembed")
+async def reembed_progress():
+    """Progress, throughput and ETA of the re-embedding job"""
+    if reembed_job is None:
+        raise HTTPException(status_code=404, detail="No re-embedding job")
+    return {"success": True, "reembed": reembed_job.progress()}
+
+@app.delete("/models/reembed")
+async def cancel_reembed():
+    """Stop the re-embedding job after its current batch (progress is kept)"""
+    if reembed_job is None:
+        raise HTTPException(status_code=404, detail="No re-embedding job")
+    reembed_job.cancel()
+    return {"success": True, "reembed": reembed_job.progress()}
+
+@app.post("/models/{model_id}/activate")
+async def activate_model(model_id: str, force: bool = False):
+    """
+    Cut over to another embedding model
+
+    Runs a final catch-up of the re-embedding job (images indexed since it
+    finished), then swaps the extractor, index namespace and inference
+    engine. Refused while the namespace lacks images of the current index
+    unless force=true. Callers (the Node backend) must re-extract stored
+    query embeddings: /search/by-embedding rejects other models with 409.
+    """
+    global reembed_job, feature_extractor, inference_engine, embedding_index, property_index
+    ensure_index_writable()
+    ensure_unsharded("Model cut-over")
+    model_id = _target_model(model_id)
+    if reembed_job is not None and reembed_job.is_running():
+        raise HTTPException(status_code=409, detail="Wait for the re-embedding job to finish first")
+
+    target_dir = namespace_dir(INDEX_DIR, model_id)
+    if reembed_job is None or reembed_job.extractor.model_id != model_id:
+        if not os.path.exists(os.path.join(target_dir, "meta.json")) and not force:
+            raise HTTPException(
+                status_code=409,
+                detail=f"No {model_id} index yet; run POST /models/{model_id}/reembed first"
+            )
+        reembed_job = ReembedJob(embedding_index, model_registry.get(model_id), target_dir)
+
+    # Catch up with uploads since the job finished; the second pass is short
+    # and only covers what arrived during the first one
+    catch_up = [await run_in_threadpool(reembed_job.run) for _ in range(2)]
+    progress = catch_up[-1]
+    if progress["status"] != "completed":
+        raise HTTPException(status_code=500, detail=f"Re-embedding catch-up failed: {progress['error']}")
+    missing = len(await run_in_threadpool(
+        lambda: embedding_index.image_ids() - reembed_job.target.image_ids()
+    ))
+    if missing and not force:
+        raise HTTPException(
+            status_code=409,
+            detail=f"{missing} images could not be re-embedded with {model_id}; "
+                   "retry, or pass force=true to cut over without them"
+        )
+
+    await run_in_threadpool(save_index)
+    # Load the new namespace off the event loop, then swap extractor and index
+    # together so no request sees the new model with the old index
+    extractor = reembed_job.extractor
+    loaded_index, loaded_property_index = await run_in_threadpool(_load_namespace, extractor)
+    previous_model, previous_engine = feature_extractor.model_id, inference_engine
+    feature_extractor = extractor
+    embedding_index, property_index = loaded_index, loaded_property_index
+    logger.info(
+        f"Visual search index ready with {len(embedding_index)} vectors "
+        f"({len(property_index)} property vectors)"
+    )
+    inference_engine = _make_engine(feature_extractor)
+    inference_engine.start()
+    # Requests already queued on the old engine finish with the old model
+    await run_in_threadpool(previous_engine.stop)
+
+    with open(ACTIVE_MODEL_PATH, "w", encoding="utf-8") as f:
+        json.dump({"model_id": model_id, "activated_at": time.time()}, f)
+    result_cache.clear()
+    query_embedding_cache.clear()
+    reembed_job = None
+    logger.info(f"Embedding model switched from {previous_model} to {model_id}")
+
+    return {
+        "success": True,
+        "previous_model": previous_model,
+        "active_model": model_id,
+        "vectors": len(embedding_index),
+        "missing_images": missing,
+        "catch_up": catch_up
+    }
+
+@app.post("/jobs/embeddings")
+async def create_embedding_job(payload: EmbeddingJobRequest):
+    """
+    Queue a durable embedding job for a manifest of image URLs
+
+    Returns immediately with a job id. The job survives restarts, runs on
+    the shared inference engine at background priority and writes results
+    incrementally (GET /jobs/embeddings/{id}/results).
+    """
+    if not payload.items:
+        raise HTTPException(status_code=400, detail="Manifest has no items")
+    if payload.indexResults:
+        ensure_index_writable()
+    job_id = await run_in_threadpool(
+        job_store.create,
+        [item.dict(exclude_none=True) for item in payload.items],
+        {"indexResults": payload.indexResults, "model_id": feature_extractor.model_id}
+    )
+    job_worker.notify()
+    return {"success": True, "job": job_worker.progress(job_id)}
+
+@app.get("/jobs/embeddings")
+async def list_embedding_jobs(limit: int = 50):
+    """Most recent embedding jobs"""
+    jobs = await run_in_threadpool(job_store.list, limit)
+    return {"success": True, "jobs": [job_worker.progress(job["id"]) for job in jobs]}
+
+def _job_or_404(job_id):
+    job = job_worker.progress(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Embedding job {job_id} not found")
+    return job
+
+@app.get("/jobs/embeddings/{job_id}")
+async def embedding_job_progress(job_id: str):
+    """Status, processed/failed counts, throughput and ETA of a job"""
+    return {"success": True, "job": await run_in_threadpool(_job_or_404, job_id)}
+
+@app.get("/jobs/embeddings/{job_id}/results")
+async def embedding_job_results(job_id: str, offset: int = 0, limit: int = 100):
+    """
+    Results written so far, in completion order; page with offset = next_offset.
+    Delivery is at-least-once after a crash: dedupe on "seq".
+    """
+    await run_in_threadpool(_job_or_404, job_id)
+    results = await run_in_threadpool(job_store.read_results, job_id, offset, min(limit, 1000))
+    return {
+        "success": True,
+        "results": results,
+        "count": len(results),
+        "next_offset": offset + len(results)
+    }
+
+@app.get("/jobs/embeddings/{job_id}/events")
+async def embedding_job_events(job_id: str, request: Request, interval_ms: int = 1000):
+    """Server-sent progress events until the job reaches a terminal state"""
+    await run_in_threadpool(_job_or_404, job_id)
+
+    async def events():
+        while True:
+            job = await run_in_threadpool(job_worker.progress, job_id)
+            yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in TERMINAL_STATUSES or await request.is_disconnected():
+                return
+            await asyncio.sleep(max(interval_ms, 100) / 1000)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/embeddings/{job_id}")
+async def cancel_embedding_job(job_id: str):
+    """Cancel a queued or running job; results written so far are kept"""
+    await run_in_threadpool(_job_or_404, job_id)
+    cancelled = await run_in_threadpool(job_store.cancel, job_id)
+    return {"success": True, "cancelled": cancelled, "job": job_worker.progress(job_id)}
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", "8080"))  # Cloud Run truyền PORT vào env
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Load model + index once, fork workers that share them copy-on-write
+        from prefork import serve
+        serve(workers, host="0.0.0.0", port=port)
+    else:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=port,
+            log_level="info",
+            access_log=True,
+            workers=1
+        )
@@ -0,0 +1,134 @@
+"""
+SMART TRO - Image service boot time measurement
+Starts the service in a subprocess and measures:
+- first_response_s: process start -> first HTTP 200 on the probe path
+- ready_s: process start -> first successful /extract-features call
+
+Usage:
+    python measure_boot.py                      # FAST_BOOT=0 vs FAST_BOOT=1
+    python measure_boot.py --runs 5 --modes 1
+    python measure_boot.py --app-dir ../baseline-checkout --modes 0   # "before"
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from PIL import Image
+
+
+def _sample_jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (180, 160, 140)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _multipart(image_bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="probe.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _get_ok(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def _extract_ok(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status == 200 and json.loads(response.read()).get("success")
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def measure_once(app_dir, port, fast_boot, probe_path, timeout):
+    env = dict(os.environ, FAST_BOOT="1" if fast_boot else "0", PORT=str(port))
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    body, content_type = _multipart(_sample_jpeg())
+    result = {"fast_boot": fast_boot, "first_response_s": None, "ready_s": None}
+
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                result["error"] = f"server exited with code {process.returncode}"
+                return result
+            if _get_ok(base_url + probe_path):
+                result["first_response_s"] = round(time.perf_counter() - start, 3)
+                break
+            time.sleep(0.01)
+
+        while result["first_response_s"] is not None and time.perf_counter() - start < timeout:
+            if _extract_ok(base_url + "/extract-features", body, content_type):
+                result["ready_s"] = round(time.perf_counter() - start, 3)
+                break
+            time.sleep(0.1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure image service boot time")
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", default="0,1", help="comma separated FAST_BOOT values")
+    parser.add_argument("--probe", default="/health", help="path used for first response")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    summary = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        fast_boot = mode in ("1", "true", "yes")
+        runs = [
+            measure_once(args.app_dir, args.port, fast_boot, args.probe, args.timeout)
+            for _ in range(args.runs)
+        ]
+        first = [r["first_response_s"] for r in runs if r["first_response_s"] is not None]
+        ready = [r["ready_s"] for r in runs if r["ready_s"] is not None]
+        summary.append({
+            "fast_boot": fast_boot,
+            "runs": runs,
+            "median_first_response_s": sorted(first)[len(first) // 2] if first else None,
+            "median_ready_s": sorted(ready)[len(ready) // 2] if ready else None
+        })
+
+    for row in summary:
+        print(
+            f"FAST_BOOT={int(row['fast_boot'])}: "
+            f"first response {row['median_first_response_s']}s, "
+            f"ready {row['median_ready_s']}s (median of {len(row['runs'])})"
+        )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
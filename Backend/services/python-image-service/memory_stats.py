@@ -0,0 +1,53 @@
+"""
+SMART TRO - Process memory statistics
+Reads RSS/PSS from /proc so pre-forked workers can confirm that model
+weights and index pages are shared copy-on-write
+"""
+
+import os
+
+_SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb",
+}
+
+
+def read_process_memory(pid="self"):
+    """
+    Return memory usage of a process in MB
+
+    PSS (proportional set size) divides every shared page by the number of
+    processes mapping it, so summing PSS over the workers gives the real
+    footprint while summing RSS counts shared pages once per worker.
+    """
+    stats = {"pid": os.getpid() if pid == "self" else int(pid)}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                field = parts[0].rstrip(":")
+                if field in _SMAPS_FIELDS:
+                    stats[_SMAPS_FIELDS[field]] = round(int(parts[1]) / 1024, 1)
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        # Older kernels / non-Linux: RSS only
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        stats["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            pass
+    return stats
+
+
+def summarize(process_stats):
+    """Totals over a list of read_process_memory() results"""
+    return {
+        "processes": len(process_stats),
+        "total_rss_mb": round(sum(s.get("rss_mb", 0) for s in process_stats), 1),
+        "total_pss_mb": round(sum(s.get("pss_mb", 0) for s in process_stats), 1),
+    }
@@ -0,0 +1,321 @@
+"""
+SMART TRO - Embedding model registry
+Backbones the image service can serve behind one FeatureExtractor
+interface (uint8 pixels in, L2-normalized feature vector out), and the
+per-model index namespaces their embeddings live in.
+
+Vectors from different models are never comparable, so every model writes
+to its own namespace directory and the index records its model id and
+dimension; loading a namespace with the wrong model fails loudly.
+"""
+
+import io
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.getenv(
+    "MODEL_WEIGHTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+# Missing bundled weights fail the load unless downloading them at boot is allowed
+ALLOW_WEIGHTS_DOWNLOAD = os.getenv("ALLOW_WEIGHTS_DOWNLOAD", "0").lower() in ("1", "true", "yes")
+
+# tf.keras.applications backbones without their classification head;
+# "application" is the module holding the model's preprocess_input
+MODEL_SPECS = {
+    "resnet50": {
+        "name": "ResNet50",
+        "application": "resnet50",
+        "builder": "ResNet50",
+        "input_size": 224,
+        "dimension": 2048,
+        "weights_file": "resnet50_weights_tf_dim_ordering_tf_kernels_notop.h5",
+    },
+    "mobilenet_v3_large": {
+        "name": "MobileNetV3Large",
+        "application": "mobilenet_v3",
+        "builder": "MobileNetV3Large",
+        "input_size": 224,
+        "dimension": 960,
+        "weights_file": "weights_mobilenet_v3_large_224_1.0_float_no_top_v2.h5",
+    },
+    "efficientnet_b0": {
+        "name": "EfficientNetB0",
+        "application": "efficientnet",
+        "builder": "EfficientNetB0",
+        "input_size": 224,
+        "dimension": 1280,
+        "weights_file": "efficientnetb0_notop.h5",
+    },
+}
+
+DEFAULT_MODEL_ID = "resnet50"
+
+
+def resolve_model_id(value):
+    """Model id from an id or display name ("ResNet50" -> "resnet50")"""
+    if not value:
+        return None
+    key = str(value).strip().lower()
+    if key in MODEL_SPECS:
+        return key
+    for model_id, spec in MODEL_SPECS.items():
+        if spec["name"].lower() == key:
+            return model_id
+    raise ValueError(f"Unknown embedding model: {value}")
+
+
+def namespace_dir(index_dir, model_id):
+    """
+    Index directory of one model
+
+    ResNet50 keeps the original INDEX_DIR layout so existing indexes load
+    unchanged; other models live under INDEX_DIR/models/<model_id>.
+    """
+    if model_id == DEFAULT_MODEL_ID:
+        return index_dir
+    return os.path.join(index_dir, "models", model_id)
+
+
+def weights_path(model_id):
+    """Bundled weights file, overridable with <MODEL_ID>_WEIGHTS_PATH"""
+    spec = MODEL_SPECS[model_id]
+    return os.getenv(
+        f"{model_id.upper()}_WEIGHTS_PATH", os.path.join(MODELS_DIR, spec["weights_file"])
+    )
+
+
+class FeatureExtractor:
+    """
+    Feature extractor for image similarity search
+    Extracts L2-normalized feature vectors from property images with one of
+    the registered backbones
+    """
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID):
+        spec = MODEL_SPECS[model_id]
+        self.model_id = model_id
+        self.model = None
+        self.model_name = spec["name"]
+        self.feature_dimension = spec["dimension"]
+        self.input_size = (spec["input_size"], spec["input_size"])
+        self.is_loaded = False
+        self.is_loading = False
+        self.load_error = None
+        self.load_time_s = None
+        self.tensorflow_version = None
+        self._spec = spec
+        self._infer = None
+        self._load_lock = threading.Lock()
+
+    def _resolve_weights(self):
+        """Bundled weights file; downloading 'imagenet' weights needs ALLOW_WEIGHTS_DOWNLOAD=1"""
+        path = weights_path(self.model_id)
+        if os.path.exists(path):
+            return path
+        if not ALLOW_WEIGHTS_DOWNLOAD:
+            raise FileNotFoundError(
+                f"Bundled {self.model_name} weights not found at {path}; bundle them, point "
+                f"{self.model_id.upper()}_WEIGHTS_PATH at them, or set ALLOW_WEIGHTS_DOWNLOAD=1"
+            )
+        logger.warning(f"Bundled weights not found at {path}, downloading 'imagenet' weights")
+        return 'imagenet'
+
+    def load_model(self):
+        """Load the backbone for feature extraction"""
+        if self.model is not None:
+            return True
+
+        with self._load_lock:
+            # Another thread (e.g. the fast-boot loader) may have finished meanwhile
+            if self.model is not None:
+                return True
+
+            logger.info(f"Loading {self.model_name} model for property image search...")
+            start_time = time.time()
+            self.is_loading = True
+
+            try:
+                import tensorflow as tf
+
+                application = getattr(tf.keras.applications, self._spec["application"])
+                builder = getattr(tf.keras.applications, self._spec["builder"])
+
+                # Backbone without classification head
+                backbone = builder(
+                    weights=self._resolve_weights(),  # Pre-trained weights
+                    include_top=False,            # Remove classification layer
+                    pooling='avg',                # Global average pooling
+                    input_shape=(*self.input_size, 3)
+                )
+
+                # Make model non-trainable for inference
+                backbone.trainable = False
+
+                # uint8 pixels in, normalized features out: the float cast and
+                # the backbone's own preprocess_input (ImageNet mean/BGR for
+                # ResNet50, a no-op for models with built-in rescaling) and the
+                # L2 norm run once per batch inside the graph
+                pixels = tf.keras.Input(shape=(*self.input_size, 3), dtype=tf.uint8, name="pixels")
+                x = tf.keras.layers.Lambda(
+                    lambda t: application.preprocess_input(tf.cast(t, tf.float32)),
+                    name="preprocess"
+                )(pixels)
+                x = backbone(x)
+                x = tf.keras.layers.Lambda(
+                    lambda t: tf.math.l2_normalize(t, axis=1), name="l2_normalize"
+                )(x)
+                model = tf.keras.Model(pixels, x, name=f"{self.model_id}_uint8")
+
+                # One traced graph for every batch size (model.predict would
+                # build a new data pipeline per call)
+                self._infer = tf.function(
+                    lambda batch: model(batch, training=False),
+                    input_signature=[tf.TensorSpec([None, *self.input_size, 3], tf.uint8)]
+                )
+                self.tensorflow_version = tf.__version__
+                self.model = model
+
+                load_time = time.time() - start_time
+                self.load_time_s = round(load_time, 2)
+                self.load_error = None
+                self.is_loaded = True
+
+                logger.info(f"{self.model_name} loaded successfully in {load_time:.2f}s")
+                logger.info(f"Model output shape: {self.model.output_shape}")
+                logger.info(f"Feature dimension: {self.feature_dimension}")
+
+                return True
+
+            except Exception as e:
+                logger.error(f"Failed to load {self.model_name}: {e}")
+                self.load_error = str(e)
+                self.is_loaded = False
+                return False
+
+            finally:
+                self.is_loading = False
+
+    def load_in_background(self):
+        """Import TensorFlow and load the model without blocking the event loop"""
+        thread = threading.Thread(target=self.load_model, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def preprocess_image(self, image_bytes):
+        """
+        Preprocess image for inference
+        - Resize to the model input size
+        - Convert to RGB
+        Returns uint8 pixels [H, W, 3]; normalization happens in the model
+        graph once the image is copied into the inference batch buffer
+
+        Raises ValueError for unreadable images.
+        """
+        try:
+            # Load image from bytes
+            pil_image = Image.open(io.BytesIO(image_bytes))
+
+            # Convert to RGB if needed
+            if pil_image.mode != 'RGB':
+                logger.info(f"Converting image from {pil_image.mode} to RGB")
+                pil_image = pil_image.convert('RGB')
+
+            # Resize to the model input size
+            pil_image = pil_image.resize(self.input_size, Image.Resampling.LANCZOS)
+
+            # uint8 copy of the resized pixels (one allocation per image)
+            img_array = np.asarray(pil_image, dtype=np.uint8)
+
+            logger.info(f"Image preprocessed to shape: {img_array.shape}")
+            return img_array
+
+        except Exception as e:
+            logger.error(f"Image preprocessing error: {e}")
+            raise ValueError(f"Invalid image format or corrupted file: {e}")
+
+    def predict_batch(self, batch):
+        """
+        Forward pass for a uint8 pixel batch [N, H, W, 3]
+        Returns L2-normalized feature vectors [N, dimension] for cosine similarity
+        """
+        if not self.load_model():
+            raise RuntimeError(f"{self.model_name} model failed to load")
+
+        return self._infer(batch).numpy()
+
+    def format_features(self, feature_vector, extraction_time):
+        """Response payload for one normalized feature vector"""
+        # Convert to Python list for JSON serialization
+        feature_list = feature_vector.tolist()
+
+        logger.info(f"Extracted {len(feature_list)}-dim features in {extraction_time:.2f}s")
+
+        return {
+            "embedding": feature_list,
+            "dimension": len(feature_list),
+            "model": self.model_name,
+            "model_id": self.model_id,
+            "extraction_time_ms": round(extraction_time * 1000, 2),
+            "normalized": True
+        }
+
+    def extract_features(self, image_bytes):
+        """Synchronous single-image extraction (offline jobs and tools)"""
+        processed_image = self.preprocess_image(image_bytes)
+        start_time = time.time()
+        features = self.predict_batch(processed_image[np.newaxis])
+        return self.format_features(features[0], time.time() - start_time)
+
+    def describe(self):
+        return {
+            "model_id": self.model_id,
+            "model_name": self.model_name,
+            "dimension": self.feature_dimension,
+            "input_size": self.input_size[0],
+            "loaded": self.is_loaded,
+            "loading": self.is_loading,
+            "load_time_s": self.load_time_s,
+            "error": self.load_error
+        }
+
+
+class ModelRegistry:
+    """Lazily created extractors, one per model id (loading is up to the caller)"""
+
+    def __init__(self):
+        self._extractors = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_id):
+        model_id = resolve_model_id(model_id)
+        with self._lock:
+            extractor = self._extractors.get(model_id)
+            if extractor is None:
+                extractor = FeatureExtractor(model_id)
+                self._extractors[model_id] = extractor
+            return extractor
+
+    def describe(self):
+        with self._lock:
+            extractors = dict(self._extractors)
+        models = []
+        for model_id, spec in MODEL_SPECS.items():
+            extractor = extractors.get(model_id)
+            models.append(extractor.describe() if extractor else {
+                "model_id": model_id,
+                "model_name": spec["name"],
+                "dimension": spec["dimension"],
+                "input_size": spec["input_size"],
+                "loaded": False,
+                "loading": False,
+                "load_time_s": None,
+                "error": None
+            })
+        return models
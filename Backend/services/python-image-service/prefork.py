@@ -0,0 +1,221 @@
+"""
+SMART TRO - Pre-fork server for the image service
+Loads ResNet50 and the visual search index once in the parent process, then
+forks uvicorn workers on a shared listening socket. Workers inherit the
+model weights, TensorFlow runtime and index arrays copy-on-write, so N
+workers cost far less than N separate processes.
+
+Usage:
+    python prefork.py --workers 4
+    WEB_CONCURRENCY=4 python main.py
+
+Notes:
+- The parent never runs inference: TensorFlow thread pools are created on the
+  first forward pass, which then happens inside each worker after the fork.
+- The index is read-only in workers (mutations would only reach one worker).
+  Send SIGHUP to the parent to reload INDEX_DIR and roll the workers.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from memory_stats import read_process_memory, summarize
+
+logger = logging.getLogger("prefork")
+
+
+def _bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock, app, log_level):
+    """Child process body: serve the preloaded app on the inherited socket"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, access_log=True)
+    server = uvicorn.Server(config)
+    try:
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+class PreforkServer:
+    def __init__(self, workers, host, port, preload_model=True,
+                 memory_report_interval=60, log_level="info"):
+        self.num_workers = workers
+        self.host = host
+        self.port = port
+        self.preload_model = preload_model
+        self.memory_report_interval = memory_report_interval
+        self.log_level = log_level
+        self.workers = {}
+        self.sock = None
+        self.service = None
+        self._stopping = False
+        self._reload_requested = False
+
+    def preload(self):
+        """Load everything workers should share before the first fork"""
+        import main as service
+        service.preload(load_model=self.preload_model)
+        self.service = service
+        # Move preloaded objects to the permanent generation so the cyclic GC
+        # in the workers does not write to (and un-share) their pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(self.sock, self.service.app, self.log_level)
+        self.workers[pid] = time.time()
+        logger.info(f"Started worker {pid}")
+        return pid
+
+    def _signal_workers(self, sig):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.workers.pop(pid, None) is not None and not self._stopping:
+                logger.warning(f"Worker {pid} exited with status {status}")
+
+    def memory_report(self):
+        """RSS/PSS per process; the sum of PSS is the real memory footprint"""
+        parent = read_process_memory("self")
+        parent["role"] = "parent"
+        workers = []
+        for pid in sorted(self.workers):
+            stats = read_process_memory(pid)
+            stats["role"] = "worker"
+            workers.append(stats)
+        return {
+            "parent": parent,
+            "workers": workers,
+            "summary": summarize([parent] + workers)
+        }
+
+    def _log_memory_report(self):
+        report = self.memory_report()
+        for stats in [report["parent"]] + report["workers"]:
+            logger.info(
+                f"{stats['role']:>6} pid={stats['pid']} "
+                f"rss={stats.get('rss_mb', '?')}MB pss={stats.get('pss_mb', '?')}MB "
+                f"private_dirty={stats.get('private_dirty_mb', '?')}MB"
+            )
+        logger.info(f"memory summary: {report['summary']}")
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _reload(self):
+        """Reload the index in the parent, then replace workers one by one"""
+        self._reload_requested = False
+        logger.info("Reloading visual search index and rolling workers...")
+        gc.unfreeze()
+        self.service.reload_index()
+        gc.collect()
+        gc.freeze()
+        for pid in list(self.workers):
+            self.spawn_worker()
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.workers.pop(pid, None)
+
+    def run(self):
+        self.preload()
+        self.sock = _bind_socket(self.host, self.port)
+        logger.info(
+            f"Pre-fork server listening on {self.host}:{self.port} with {self.num_workers} workers"
+        )
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+
+        last_report = time.time()
+        while not self._stopping:
+            time.sleep(0.5)
+            self._reap()
+            if self._reload_requested:
+                self._reload()
+            while not self._stopping and len(self.workers) < self.num_workers:
+                self.spawn_worker()
+            if self.memory_report_interval and time.time() - last_report >= self.memory_report_interval:
+                self._log_memory_report()
+                last_report = time.time()
+
+        logger.info("Stopping workers...")
+        self._signal_workers(signal.SIGTERM)
+        deadline = time.time() + 30
+        while self.workers and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        self._signal_workers(signal.SIGKILL)
+        self.sock.close()
+
+
+def serve(workers, host="0.0.0.0", port=8080, preload_model=True, memory_report_interval=60):
+    server = PreforkServer(
+        workers, host, port,
+        preload_model=preload_model,
+        memory_report_interval=memory_report_interval
+    )
+    server.run()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pre-fork server for the image service")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--no-preload-model", action="store_true",
+                        help="only share the index, let each worker load the model")
+    parser.add_argument("--memory-report-interval", type=float, default=60,
+                        help="seconds between RSS/PSS reports (0 disables)")
+    args = parser.parse_args()
+
+    serve(
+        args.workers, args.host, args.port,
+        preload_model=not args.no_preload_model,
+        memory_report_interval=args.memory_report_interval
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
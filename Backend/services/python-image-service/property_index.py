@@ -0,0 +1,248 @@
+"""
+SMART TRO - Property-level aggregate index
+One (mean) or a few (k-medoid) vectors per listing instead of one per photo.
+Visual search first scores the small property index, then re-ranks only the
+photos of the best properties with their full-precision vectors, so the
+coarse pass is smaller and faster by the average photos-per-listing factor.
+
+The aggregates are derived from the image index and kept in sync by
+replaying its mutation log: only properties touched since the last sync are
+recomputed.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from vector_index import EmbeddingIndex
+
+logger = logging.getLogger(__name__)
+
+AGGREGATE_METHODS = ("mean", "medoids")
+DEFAULT_REPRESENTATIVES = 3
+DEFAULT_PROPERTY_CANDIDATES = 300
+MEDOID_ITERATIONS = 5
+
+
+def mean_pool(vectors):
+    """Mean of L2-normalized photo vectors, renormalized"""
+    mean = vectors.mean(axis=0)
+    norm = np.linalg.norm(mean)
+    return (mean / norm if norm > 0 else mean)[np.newaxis]
+
+
+def k_medoids(vectors, k, iterations=MEDOID_ITERATIONS):
+    """
+    Up to k representative photos (rows of `vectors`) under cosine similarity
+
+    Listings have few photos, so the full similarity matrix is cheap:
+    farthest-first initialisation from the most central photo, then a few
+    assign / re-centre rounds.
+    """
+    count = vectors.shape[0]
+    if count <= k:
+        return vectors
+    sims = vectors @ vectors.T
+    medoids = [int(np.argmax(sims.sum(axis=1)))]
+    while len(medoids) < k:
+        closest = sims[:, medoids].max(axis=1)
+        closest[medoids] = np.inf
+        medoids.append(int(np.argmin(closest)))
+
+    for _ in range(iterations):
+        assignment = np.argmax(sims[:, medoids], axis=1)
+        updated = []
+        for cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(assignment == cluster)
+            if members.size == 0:
+                updated.append(medoid)
+                continue
+            centrality = sims[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmax(centrality)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return vectors[medoids]
+
+
+class PropertyIndex:
+    """
+    Coarse index of property aggregates on top of an image EmbeddingIndex
+
+    The aggregates live in a small in-RAM EmbeddingIndex whose rows are
+    representatives ("<propertyId>#<n>") carrying the property's metadata, so
+    the same bitmap filters apply to the coarse pass.
+    """
+
+    def __init__(self, image_index, method="mean", representatives=DEFAULT_REPRESENTATIVES):
+        if method not in AGGREGATE_METHODS:
+            raise ValueError(f"Unknown aggregate method: {method}")
+        self.image_index = image_index
+        self.method = method
+        self.representatives = 1 if method == "mean" else max(1, representatives)
+        self.coarse = EmbeddingIndex(image_index.dimension)
+        self.synced_version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.coarse)
+
+    def _aggregate(self, vectors):
+        if self.method == "mean":
+            return mean_pool(vectors)
+        return k_medoids(vectors, self.representatives)
+
+    def _refresh_property(self, property_id):
+        self.coarse.remove_property(property_id)
+        snapshot = self.image_index.property_snapshot(property_id)
+        if snapshot is None:
+            return
+        vectors, metadata = snapshot
+        for n, vector in enumerate(self._aggregate(vectors)):
+            self.coarse.upsert(
+                image_id=f"{property_id}#{n}",
+                property_id=property_id,
+                embedding=vector,
+                province=metadata["province"],
+                category=metadata["category"],
+                price=metadata["price"],
+                approval_status=metadata["approval_status"]
+            )
+
+    def rebuild(self):
+        """Recompute every property aggregate from the image index"""
+        with self._lock:
+            start_time = time.perf_counter()
+            version = self.image_index.version
+            self.coarse = EmbeddingIndex(self.image_index.dimension)
+            for property_id in self.image_index.property_ids():
+                self._refresh_property(property_id)
+            self.synced_version = version
+            logger.info(
+                f"Built {self.method} property index: {len(self.coarse)} vectors for "
+                f"{len(self.image_index)} photos in {time.perf_counter() - start_time:.2f}s"
+            )
+
+    def sync(self):
+        """Recompute the properties touched since the last sync; returns how many"""
+        if self.synced_version == self.image_index.version:
+            return 0
+        if self.synced_version is None:
+            self.rebuild()
+            return len(self.coarse)
+
+        with self._lock:
+            version = self.image_index.version
+            mutations = self.image_index.mutations_since(self.synced_version)
+            if mutations is None:
+                # The log no longer reaches back to our version
+                touched = None
+            else:
+                touched = {
+                    property_id
+                    for mutation in mutations
+                    for property_id in mutation.get("property_ids", ())
+                }
+                for property_id in touched:
+                    self._refresh_property(property_id)
+                self.synced_version = version
+
+        if touched is None:
+            self.rebuild()
+            return len(self.coarse)
+        return len(touched)
+
+    def search(self, query, top_k=5, filters=None, min_score=0.0, group_by_property=True,
+               candidates=DEFAULT_PROPERTY_CANDIDATES):
+        """
+        Hierarchical search: top `candidates` properties from the aggregates,
+        then an exact search over those properties' photos
+
+        Returns (hits, stats) shaped like EmbeddingIndex.search.
+        """
+        start_time = time.perf_counter()
+        synced = self.sync()
+        synced_at = time.perf_counter()
+
+        property_hits, coarse_stats = self.coarse.search(
+            query, top_k=max(candidates, top_k), filters=filters,
+            min_score=-1.0, group_by_property=True
+        )
+        coarse_at = time.perf_counter()
+
+        hits, scored, version = self.image_index.search_properties(
+            query, [hit["propertyId"] for hit in property_hits], top_k=top_k, filters=filters,
+            min_score=min_score, group_by_property=group_by_property
+        )
+        done_at = time.perf_counter()
+
+        total_ms = round((done_at - start_time) * 1000, 3)
+        return hits, {
+            "mode": "hierarchical",
+            "aggregate": self.method,
+            "index_version": version,
+            "total_vectors": len(self.image_index),
+            "property_vectors": coarse_stats["total_vectors"],
+            "eligible_vectors": coarse_stats["eligible_vectors"],
+            "candidate_properties": len(property_hits),
+            "scored_vectors": coarse_stats["scored_vectors"] + scored,
+            "search_time_ms": total_ms,
+            "timings": {
+                "sync_ms": round((synced_at - start_time) * 1000, 3),
+                "synced_properties": synced,
+                "coarse_ms": round((coarse_at - synced_at) * 1000, 3),
+                "rerank_ms": round((done_at - coarse_at) * 1000, 3),
+                "total_ms": total_ms
+            }
+        }
+
+    def stats(self):
+        photos = len(self.image_index)
+        properties = len(self.image_index.property_ids())
+        coarse = self.coarse.stats()
+        return {
+            "aggregate": self.method,
+            "representatives": self.representatives,
+            "property_vectors": coarse["vectors"],
+            "properties": properties,
+            "photos_per_property": round(photos / properties, 2) if properties else None,
+            "memory_mb": coarse["memory_mb"],
+            "synced_version": self.synced_version
+        }
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, directory):
+        with self._lock:
+            self.coarse.save(directory)
+            with open(os.path.join(directory, "aggregate.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "method": self.method,
+                    "representatives": self.representatives,
+                    "synced_version": self.synced_version
+                }, f)
+
+    @classmethod
+    def load(cls, directory, image_index, method="mean", representatives=DEFAULT_REPRESENTATIVES):
+        """Load saved aggregates if they match the image index version, else rebuild"""
+        index = cls(image_index, method, representatives)
+        meta_path = os.path.join(directory, "aggregate.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if (meta.get("method") == index.method
+                    and meta.get("representatives") == index.representatives
+                    and meta.get("synced_version") == image_index.version):
+                index.coarse = EmbeddingIndex.load(
+                    directory, image_index.dimension, memory_mapped=False
+                )
+                index.synced_version = image_index.version
+                logger.info(f"Loaded property index with {len(index.coarse)} vectors")
+                return index
+        index.rebuild()
+        return index
@@ -0,0 +1,228 @@
+"""
+SMART TRO - Re-embed the catalog into another model's namespace
+Walks every image of the source index, downloads it from its stored URL,
+embeds it with the target model and upserts it (with the same property
+metadata) into the target model's namespace. The job is resumable: images
+already in the target namespace are skipped, so running it again after it
+finished only embeds what was added since (the final catch-up before
+cut-over) and drops what was deleted.
+
+Runs in the background inside the service (POST /models/{id}/reembed) or
+offline:
+    python reembed_job.py --model efficientnet_b0 --fetch-workers 16
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_registry import DEFAULT_MODEL_ID, FeatureExtractor, namespace_dir, resolve_model_id
+from vector_index import EmbeddingIndex
+
+logger = logging.getLogger("reembed_job")
+
+FETCH_TIMEOUT_S = 15
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FETCH_WORKERS = 8
+SAVE_EVERY_BATCHES = 20
+
+
+def fetch_image(url, timeout=FETCH_TIMEOUT_S):
+    request = urllib.request.Request(url, headers={"User-Agent": "smart-tro-image-service"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+class ReembedJob:
+    """
+    Populate `target_dir` with `extractor` embeddings of every image in
+    `source_index`; one batch of downloads runs concurrently while the
+    previous batch is embedded
+    """
+
+    def __init__(self, source_index, extractor, target_dir, batch_size=DEFAULT_BATCH_SIZE,
+                 fetch_workers=DEFAULT_FETCH_WORKERS, fetch_fn=fetch_image):
+        self.source_index = source_index
+        self.extractor = extractor
+        self.target_dir = target_dir
+        self.batch_size = batch_size
+        self.fetch_workers = fetch_workers
+        self.fetch_fn = fetch_fn
+        self.target = None
+        self.status = "pending"
+        self.error = None
+        self.total = 0
+        self.processed = 0
+        self.embedded = 0
+        self.failed = 0
+        self.removed = 0
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="reembed-job", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_running(self):
+        return self.status == "running"
+
+    def _load_target(self):
+        if self.target is None:
+            os.makedirs(self.target_dir, exist_ok=True)
+            self.target = EmbeddingIndex.load(
+                self.target_dir, self.extractor.feature_dimension,
+                model_id=self.extractor.model_id
+            )
+        return self.target
+
+    def _fetch_and_preprocess(self, item):
+        if not item["image_url"]:
+            return None
+        try:
+            return self.extractor.preprocess_image(self.fetch_fn(item["image_url"]))
+        except Exception as e:
+            logger.warning(f"Skipping {item['image_id']} ({item['image_url']}): {e}")
+            return None
+
+    def _embed_chunk(self, target, chunk, pixels):
+        ok = [(item, px) for item, px in zip(chunk, pixels) if px is not None]
+        if ok:
+            vectors = self.extractor.predict_batch(np.stack([px for _, px in ok]))
+            for (item, _), vector in zip(ok, vectors):
+                target.upsert(
+                    image_id=item["image_id"],
+                    property_id=item["property_id"],
+                    embedding=vector,
+                    image_url=item["image_url"],
+                    province=item["province"],
+                    category=item["category"],
+                    price=item["price"],
+                    approval_status=item["approval_status"]
+                )
+        self.embedded += len(ok)
+        self.failed += len(chunk) - len(ok)
+        self.processed += len(chunk)
+
+    def run(self):
+        """Embed every source image missing from the target; safe to call again"""
+        if not self._run_lock.acquire(blocking=False):
+            raise RuntimeError("Re-embedding job is already running")
+        try:
+            self.status = "running"
+            self.error = None
+            self._cancel.clear()
+            self.started_at = time.time()
+            self.finished_at = None
+            self.processed = self.embedded = self.failed = self.removed = 0
+
+            if not self.extractor.load_model():
+                raise RuntimeError(f"{self.extractor.model_name} failed to load")
+            target = self._load_target()
+
+            done = target.image_ids()
+            pending = [item for item in self.source_index.items() if item["image_id"] not in done]
+            self.total = len(pending)
+            logger.info(
+                f"Re-embedding {self.total} images into {self.extractor.model_id} "
+                f"({len(done)} already present) -> {self.target_dir}"
+            )
+
+            chunks = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            with ThreadPoolExecutor(self.fetch_workers) as pool:
+                # Download + decode batch n+1 while batch n runs through the model
+                upcoming = pool.map(self._fetch_and_preprocess, chunks[0]) if chunks else None
+                for n, chunk in enumerate(chunks):
+                    pixels = list(upcoming)
+                    if n + 1 < len(chunks) and not self._cancel.is_set():
+                        upcoming = pool.map(self._fetch_and_preprocess, chunks[n + 1])
+                    self._embed_chunk(target, chunk, pixels)
+                    if self._cancel.is_set():
+                        break
+                    if (n + 1) % SAVE_EVERY_BATCHES == 0:
+                        target.save()
+                        logger.info(f"Re-embedding progress: {self.progress()}")
+
+            if self._cancel.is_set():
+                self.status = "cancelled"
+            else:
+                # Drop images deleted from the source since they were embedded
+                for image_id in target.image_ids() - self.source_index.image_ids():
+                    self.removed += int(target.remove_image(image_id))
+                self.status = "completed"
+            target.save()
+
+        except Exception as e:
+            logger.error(f"Re-embedding into {self.extractor.model_id} failed: {e}")
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            self._run_lock.release()
+        return self.progress()
+
+    def progress(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.processed
+        return {
+            "model_id": self.extractor.model_id,
+            "target_dir": self.target_dir,
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "processed": self.processed,
+            "embedded": self.embedded,
+            "failed": self.failed,
+            "removed": self.removed,
+            "target_vectors": len(self.target) if self.target is not None else None,
+            "images_per_s": round(rate, 2),
+            "eta_s": round(remaining / rate, 1) if rate > 0 and self.status == "running" else None,
+            "elapsed_s": round(elapsed, 1)
+        }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Re-embed the image index with another model")
+    parser.add_argument("--model", required=True, help="target model id (see model_registry.py)")
+    parser.add_argument("--source-model", default=DEFAULT_MODEL_ID)
+    parser.add_argument("--index-dir", default=os.getenv(
+        "INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_data")
+    ))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--fetch-workers", type=int, default=DEFAULT_FETCH_WORKERS)
+    args = parser.parse_args()
+
+    source_model = resolve_model_id(args.source_model)
+    target_model = resolve_model_id(args.model)
+    if source_model == target_model:
+        parser.error("--model must differ from --source-model")
+
+    source = FeatureExtractor(source_model)
+    source_index = EmbeddingIndex.load(
+        namespace_dir(args.index_dir, source_model), source.feature_dimension,
+        model_id=source_model
+    )
+    job = ReembedJob(
+        source_index, FeatureExtractor(target_model),
+        namespace_dir(args.index_dir, target_model),
+        batch_size=args.batch_size, fetch_workers=args.fetch_workers
+    )
+    logger.info(f"Finished: {job.run()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+SMART TRO - Visual search result cache
+Caches top-K results keyed by query embedding fingerprint, top-K and filters.
+Entries are tagged with the index version they were computed at; when the
+index moves on, the mutations in between are replayed against the entry and
+only entries a mutation could actually change are dropped.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from vector_index import matches_filters
+
+# Modes whose results depend on a candidate set (compact codes or property
+# aggregates), not only on the exact top-K
+CANDIDATE_MODES = ("two_stage", "hierarchical")
+
+
+def embedding_fingerprint(embedding):
+    """Stable fingerprint of a query embedding (float16-rounded, L2-normalized)"""
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return hashlib.sha1(vector.astype(np.float16).tobytes()).hexdigest()
+
+
+def _filters_key(filters):
+    if not filters:
+        return ""
+    canonical = {}
+    for key, value in filters.items():
+        if value in (None, "", []):
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v).strip().lower() for v in value)
+        canonical[key] = value
+    return json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+
+
+class _CacheEntry:
+    __slots__ = ("hits", "stats", "query", "filters", "top_k", "min_score", "mode",
+                 "index_id", "version", "created_at")
+
+    def __init__(self, hits, stats, query, filters, top_k, min_score, mode, index_id, version):
+        self.hits = hits
+        self.stats = stats
+        self.query = query
+        self.filters = filters
+        self.top_k = top_k
+        self.min_score = min_score
+        self.mode = mode
+        self.index_id = index_id
+        self.version = version
+        self.created_at = time.time()
+
+    def threshold(self):
+        """Score a new vector must reach to possibly enter this result list"""
+        if len(self.hits) >= self.top_k:
+            return self.hits[-1]["score"]
+        return self.min_score
+
+    def affected_by(self, mutation):
+        """Whether one logged index mutation could change this result"""
+        op = mutation["op"]
+        if op == "codec":
+            # Compact codes only drive two-stage candidate retrieval
+            return self.mode == "two_stage"
+
+        result_ids = {hit["imageId"] for hit in self.hits}
+        if any(image_id in result_ids for image_id in mutation["image_ids"]):
+            return True
+
+        candidate_mode = self.mode in CANDIDATE_MODES
+        if op == "remove":
+            # Removing a non-result never changes an exact top-K, but it can
+            # free a candidate slot (or move a property aggregate)
+            return candidate_mode and any(
+                matches_filters(metadata, self.filters) for metadata in mutation["metadata"]
+            )
+
+        # upsert: a replaced vector that used to match might have been a
+        # candidate; the new vector matters if it passes the filters and
+        # scores at least as high as the current last hit
+        replaced = mutation.get("replaced")
+        if candidate_mode and replaced and matches_filters(replaced, self.filters):
+            return True
+        if not matches_filters(mutation["metadata"], self.filters):
+            return False
+        if candidate_mode:
+            return True
+        score = float(mutation["vector"].astype(np.float32) @ self.query)
+        # float16 log vectors: keep a small margin so ties are invalidated
+        return score >= self.threshold() - 1e-3
+
+
+class SearchResultCache:
+    """
+    LRU + TTL cache of visual search results with exact, lazy invalidation
+
+    get() validates an entry against the current index: same version is a
+    hit, a newer version replays the index mutation log and keeps the entry
+    unless a mutation could change it.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.invalidated = 0
+        self.expired = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(embedding, top_k, filters, min_score, group_by_property, mode, candidates):
+        return (
+            embedding_fingerprint(embedding),
+            int(top_k),
+            _filters_key(filters),
+            round(float(min_score), 6),
+            bool(group_by_property),
+            mode,
+            int(candidates) if mode in CANDIDATE_MODES else 0,
+        )
+
+    def get(self, key, index):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if self.ttl_seconds and time.time() - entry.created_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            if entry.index_id != index.instance_id:
+                del self._entries[key]
+                self.invalidated += 1
+                self.misses += 1
+                return None
+
+        if entry.version != index.version:
+            mutations = index.mutations_since(entry.version)
+            stale = mutations is None or any(entry.affected_by(m) for m in mutations)
+            with self._lock:
+                if stale:
+                    self._entries.pop(key, None)
+                    self.invalidated += 1
+                    self.misses += 1
+                    return None
+                if mutations:
+                    entry.version = mutations[-1]["version"]
+                self.revalidated += 1
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return entry.hits, entry.stats
+
+    def put(self, key, index, version, hits, stats, query, filters, top_k, min_score, mode):
+        """Store a result computed at index `version`"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        entry = _CacheEntry(
+            hits, stats, query, filters or {}, top_k, min_score, mode,
+            index.instance_id, version
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "revalidated": self.revalidated,
+                "invalidated": self.invalidated,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
+
+
+class EmbeddingCache:
+    """
+    Small LRU of query image digest -> embedding, so repeated uploads of the
+    same reference photo skip decoding and ResNet50 inference
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(image_bytes):
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def get(self, digest):
+        with self._lock:
+            features = self._entries.get(digest)
+            if features is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return features
+
+    def put(self, digest, features):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = features
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
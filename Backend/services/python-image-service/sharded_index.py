@@ -0,0 +1,556 @@
+"""
+SMART TRO - Sharded visual search index
+Partitions the image index across shard worker processes so search
+throughput is not capped by one interpreter and the catalog is not capped by
+one process' memory. Each shard is an ordinary EmbeddingIndex in its own
+process (spawned, one directory per shard under <index_dir>/shards/<n>).
+
+Images are routed by property (every photo of a listing lives on one shard,
+so per-shard property grouping stays exact):
+- "hash":     crc32(property_id) % shards
+- "province": provinces are assigned to shards, largest first onto the
+              least loaded shard; province-filtered queries only touch the
+              shards owning those provinces
+
+Queries scatter to the shards in parallel and the partial top-K lists are
+merged with a heap. rebalance() changes the shard count or strategy and
+moves only the images whose shard changes.
+"""
+
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from vector_index import DEFAULT_CANDIDATES, EmbeddingIndex
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("hash", "province")
+SHARD_CALL_TIMEOUT_S = 30
+LATENCY_WINDOW = 2048
+MOVE_BATCH = 1000
+SCATTER_THREADS = 32
+
+
+def _province_key(province):
+    return str(province or "").strip().lower()
+
+
+# ----------------------------------------------------------------------
+# Shard process
+# ----------------------------------------------------------------------
+def _upsert_many(index, items):
+    for item in items:
+        index.upsert(**item)
+    return len(items)
+
+
+def _remove_images(index, image_ids):
+    return sum(int(index.remove_image(image_id)) for image_id in image_ids)
+
+
+def _placements(index):
+    return [(item["image_id"], item["property_id"], item["province"]) for item in index.items()]
+
+
+def _search(index, query, top_k, filters, min_score, group_by_property, mode, candidates):
+    return index.search(
+        query, top_k=top_k, filters=filters, min_score=min_score,
+        group_by_property=group_by_property, mode=mode, candidates=candidates
+    )
+
+
+SHARD_OPS = {
+    "search": _search,
+    "upsert_many": _upsert_many,
+    "remove_images": _remove_images,
+    "remove_property": lambda index, property_id: index.remove_property(property_id),
+    "placements": _placements,
+    "export": lambda index, image_ids: index.export(image_ids),
+    "train_compact": lambda index: index.train_compact_codec(),
+    "stats": lambda index: index.stats(),
+    "size": lambda index: len(index),
+    "save": lambda index: index.save(),
+}
+
+
+def _shard_main(conn, directory, dimension, model_id):
+    """Shard process body: serve requests from the parent until "stop" or EOF"""
+    logging.basicConfig(level=logging.INFO)
+    index = EmbeddingIndex.load(directory, dimension, model_id=model_id)
+    while True:
+        try:
+            request_id, op, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            # Parent gone without "stop": keep what was written since the last save
+            index.save()
+            break
+        if op == "stop":
+            index.save()
+            conn.send((request_id, "ok", None))
+            break
+        try:
+            conn.send((request_id, "ok", SHARD_OPS[op](index, *args)))
+        except Exception as e:
+            conn.send((request_id, "error", f"{type(e).__name__}: {e}"))
+
+
+# ----------------------------------------------------------------------
+# Parent side
+# ----------------------------------------------------------------------
+class ShardError(RuntimeError):
+    """A shard process failed, timed out or raised"""
+
+
+class ShardClient:
+    """
+    Pipe to one shard process; one request in flight at a time
+
+    Requests carry an id echoed in the reply: the late reply of a call that
+    timed out is dropped by the next call instead of being taken as its answer.
+    """
+
+    def __init__(self, shard_id, directory, dimension, model_id, context):
+        self.shard_id = shard_id
+        self.directory = directory
+        self._conn, child = context.Pipe()
+        self._process = context.Process(
+            target=_shard_main, args=(child, directory, dimension, model_id),
+            name=f"index-shard-{shard_id}", daemon=True
+        )
+        self._process.start()
+        child.close()
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self.stale_replies = 0
+        self.requests = 0
+        self.errors = 0
+        self.round_trip_ms = deque(maxlen=LATENCY_WINDOW)
+        self.search_ms = deque(maxlen=LATENCY_WINDOW)
+
+    def call(self, op, *args, timeout=SHARD_CALL_TIMEOUT_S):
+        start_time = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+            try:
+                self._conn.send((request_id, op, args))
+                while True:
+                    if not self._conn.poll(max(0.0, deadline - time.monotonic())):
+                        raise TimeoutError(f"no reply within {timeout}s")
+                    reply_id, status, result = self._conn.recv()
+                    if reply_id == request_id:
+                        break
+                    self.stale_replies += 1
+            except Exception as e:
+                self.errors += 1
+                raise ShardError(f"Shard {self.shard_id} {op} failed: {e}") from e
+        if status != "ok":
+            self.errors += 1
+            raise ShardError(f"Shard {self.shard_id} {op} failed: {result}")
+        if op == "search":
+            self.requests += 1
+            self.round_trip_ms.append((time.perf_counter() - start_time) * 1000)
+            self.search_ms.append(result[1]["search_time_ms"])
+        return result
+
+    def stop(self, timeout=10):
+        try:
+            self.call("stop", timeout=timeout)
+        except ShardError as e:
+            logger.warning(str(e))
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+
+    def alive(self):
+        return self._process.is_alive()
+
+    def latency(self):
+        def percentiles(window):
+            if not window:
+                return None
+            p50, p95, p99 = np.percentile(np.fromiter(window, dtype=np.float64), [50, 95, 99])
+            return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+        return {
+            "searches": self.requests,
+            "errors": self.errors,
+            "stale_replies": self.stale_replies,
+            "round_trip_ms": percentiles(self.round_trip_ms),
+            "search_ms": percentiles(self.search_ms)
+        }
+
+
+class ShardRouter:
+    """Maps a property (and its province) to a shard"""
+
+    def __init__(self, strategy="hash", shards=2, provinces=None):
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy: {strategy}")
+        if shards < 1:
+            raise ValueError("Need at least one shard")
+        self.strategy = strategy
+        self.shards = shards
+        self.provinces = dict(provinces or {})  # province key -> shard
+
+    def shard_for(self, property_id, province=None):
+        if self.strategy == "province":
+            key = _province_key(province)
+            shard = self.provinces.get(key)
+            if shard is None:
+                # Unseen province: stable placement until the next rebalance
+                shard = zlib.crc32(key.encode("utf-8")) % self.shards
+            return shard
+        return zlib.crc32(str(property_id).encode("utf-8")) % self.shards
+
+    def shards_for_filters(self, filters):
+        """Shards that can hold matches for `filters` (all of them unless pruned by province)"""
+        provinces = (filters or {}).get("province")
+        if self.strategy != "province" or not provinces:
+            return list(range(self.shards))
+        return sorted({self.shard_for(None, province) for province in provinces})
+
+    @staticmethod
+    def assign_provinces(counts, shards):
+        """Greedy balance: largest province first onto the least loaded shard"""
+        loads = [(0, shard) for shard in range(shards)]
+        heapq.heapify(loads)
+        assignment = {}
+        for province, count in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+            load, shard = heapq.heappop(loads)
+            assignment[province] = shard
+            heapq.heappush(loads, (load + count, shard))
+        return assignment
+
+    def to_dict(self):
+        return {"strategy": self.strategy, "shards": self.shards, "provinces": self.provinces}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["strategy"], data["shards"], data.get("provinces"))
+
+
+class ShardedIndex:
+    """
+    EmbeddingIndex-like facade over shard processes
+
+    Supports upsert / remove / search / stats / save / train_compact_codec;
+    per-image operations that need one local index (property aggregates,
+    result cache replay, re-embedding) are not available in sharded mode.
+    """
+
+    def __init__(self, directory, dimension, model_id=None, shards=2, strategy="hash"):
+        self.directory = directory
+        self.dimension = dimension
+        self.model_id = model_id
+        self.instance_id = uuid.uuid4().hex
+        self.version = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._write_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(SCATTER_THREADS, thread_name_prefix="shard-scatter")
+
+        router_path = self._router_path()
+        if os.path.exists(router_path):
+            with open(router_path, encoding="utf-8") as f:
+                router = ShardRouter.from_dict(json.load(f))
+            self._layout = (router, [])
+            if (self.router.shards, self.router.strategy) != (shards, strategy):
+                logger.info(
+                    f"Saved shard layout is {self.router.shards} x {self.router.strategy}; "
+                    f"POST /index/shards/rebalance to change it to {shards} x {strategy}"
+                )
+        else:
+            self._layout = (ShardRouter(strategy, shards), [])
+
+    # Router and shard clients are swapped together as one tuple so that a
+    # search never pairs a new router with the old client list
+    @property
+    def router(self):
+        return self._layout[0]
+
+    @property
+    def _clients(self):
+        return self._layout[1]
+
+    def _router_path(self):
+        return os.path.join(self.directory, "shards", "router.json")
+
+    def _shard_dir(self, shard):
+        return os.path.join(self.directory, "shards", str(shard))
+
+    def _save_router(self):
+        os.makedirs(os.path.dirname(self._router_path()), exist_ok=True)
+        with open(self._router_path(), "w", encoding="utf-8") as f:
+            json.dump(self.router.to_dict(), f, ensure_ascii=False)
+
+    def _spawn(self, shard):
+        os.makedirs(self._shard_dir(shard), exist_ok=True)
+        return ShardClient(shard, self._shard_dir(shard), self.dimension, self.model_id, self._context)
+
+    def start(self, seed=None):
+        """
+        Spawn the shard processes; a fresh layout is seeded from `seed()`
+        (returning the unsharded index of this namespace), called only then
+        """
+        fresh = not os.path.exists(self._router_path())
+        self._layout = (self.router, [self._spawn(shard) for shard in range(self.router.shards)])
+        if fresh:
+            seed_index = seed() if seed is not None else None
+            if seed_index is not None and len(seed_index):
+                self._seed(seed_index)
+            self._save_router()
+        logger.info(
+            f"Sharded index ready: {len(self)} vectors on {self.router.shards} "
+            f"{self.router.strategy} shards"
+        )
+        return self
+
+    def stop(self):
+        for client in self._clients:
+            client.stop()
+        self._layout = (self.router, [])
+
+    def _scatter(self, op, *args, shards=None, clients=None):
+        """Run one op on several shards in parallel; returns {shard: result}"""
+        clients = self._clients if clients is None else clients
+        shards = range(len(clients)) if shards is None else shards
+        futures = {shard: self._pool.submit(clients[shard].call, op, *args) for shard in shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def _seed(self, index):
+        if self.router.strategy == "province":
+            counts = {}
+            for item in index.items():
+                key = _province_key(item["province"])
+                counts[key] = counts.get(key, 0) + 1
+            self.router.provinces = ShardRouter.assign_provinces(counts, self.router.shards)
+        batches = {shard: [] for shard in range(self.router.shards)}
+        for item in index.items():
+            shard = self.router.shard_for(item["property_id"], item["province"])
+            batches[shard].append(item["image_id"])
+        for shard, image_ids in batches.items():
+            for start in range(0, len(image_ids), MOVE_BATCH):
+                self._clients[shard].call("upsert_many", index.export(image_ids[start:start + MOVE_BATCH]))
+        self._scatter("save")
+        logger.info(f"Seeded {len(index)} vectors into {self.router.shards} shards")
+
+    def __len__(self):
+        return sum(self._scatter("size").values())
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+    def upsert(self, image_id, property_id, embedding, image_url=None,
+               province=None, category=None, price=None, approval_status=None):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vector.shape[0]} does not match index dimension {self.dimension}"
+            )
+        item = {
+            "image_id": image_id, "property_id": property_id, "embedding": vector,
+            "image_url": image_url, "province": province, "category": category,
+            "price": price, "approval_status": approval_status
+        }
+        with self._write_lock:
+            shard = self.router.shard_for(property_id, province)
+            self._clients[shard].call("upsert_many", [item])
+            # The image may have lived on another shard under its old property/province
+            others = [s for s in range(len(self._clients)) if s != shard]
+            if others:
+                self._scatter("remove_images", [image_id], shards=others)
+            self.version += 1
+
+    def remove_image(self, image_id):
+        with self._write_lock:
+            removed = sum(self._scatter("remove_images", [image_id]).values())
+            self.version += 1
+        return removed > 0
+
+    def remove_property(self, property_id):
+        with self._write_lock:
+            removed = sum(self._scatter("remove_property", property_id).values())
+            self.version += 1
+        return removed
+
+    def mutations_since(self, version):
+        """No mutation log across shards: cached results are dropped on any write"""
+        return [] if version >= self.version else None
+
+    def train_compact_codec(self):
+        return all(self._scatter("train_compact").values())
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def search(self, query, top_k=5, filters=None, min_score=0.0, group_by_property=True,
+               mode="exact", candidates=DEFAULT_CANDIDATES):
+        """
+        Scatter the query to the shards that can match, merge their top-K
+
+        Each shard returns its own (grouped) top_k; since a property lives on
+        exactly one shard, the global top_k is the heap merge of those lists.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dimension:
+            raise ValueError(
+                f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}"
+            )
+        start_time = time.perf_counter()
+        # Consistent snapshot of the layout while a rebalance swaps it
+        router, clients = self._layout
+        shards = router.shards_for_filters(filters)
+        partials = self._scatter(
+            "search", query, top_k, filters, min_score, group_by_property, mode, candidates,
+            shards=shards, clients=clients
+        )
+        gathered_at = time.perf_counter()
+
+        # k-way heap merge of the score-sorted partial lists
+        merged = heapq.merge(*(hits for hits, _ in partials.values()), key=lambda hit: -hit["score"])
+        hits, seen_images, seen_properties = [], set(), set()
+        for hit in merged:
+            # A rebalance may briefly hold an image on two shards
+            if hit["imageId"] in seen_images:
+                continue
+            seen_images.add(hit["imageId"])
+            if group_by_property:
+                if hit["propertyId"] in seen_properties:
+                    continue
+                seen_properties.add(hit["propertyId"])
+            hits.append(hit)
+            if len(hits) >= top_k:
+                break
+        done_at = time.perf_counter()
+
+        stats = [s for _, s in partials.values()]
+        total_ms = round((done_at - start_time) * 1000, 3)
+        return hits, {
+            "mode": stats[0]["mode"] if stats else mode,
+            "index_version": self.version,
+            "total_vectors": sum(s["total_vectors"] for s in stats),
+            "eligible_vectors": sum(s["eligible_vectors"] for s in stats),
+            "scored_vectors": sum(s["scored_vectors"] for s in stats),
+            "shards_queried": len(shards),
+            "search_time_ms": total_ms,
+            "timings": {
+                "scatter_gather_ms": round((gathered_at - start_time) * 1000, 3),
+                "slowest_shard_ms": max((s["search_time_ms"] for s in stats), default=0.0),
+                "merge_ms": round((done_at - gathered_at) * 1000, 3),
+                "total_ms": total_ms
+            }
+        }
+
+    # ------------------------------------------------------------------
+    # Rebalancing
+    # ------------------------------------------------------------------
+    def rebalance(self, shards=None, strategy=None):
+        """
+        Re-partition onto `shards` shards with `strategy` (defaults: current)
+
+        Province assignments are recomputed from current counts. Only images
+        whose shard changes are moved (copied to the target, then removed
+        from the source); writes wait, searches keep running.
+        """
+        start_time = time.perf_counter()
+        shards = shards or self.router.shards
+        strategy = strategy or self.router.strategy
+        with self._write_lock:
+            placements = self._scatter("placements")
+            router = ShardRouter(strategy, shards)
+            if strategy == "province":
+                counts = {}
+                for rows in placements.values():
+                    for _, _, province in rows:
+                        key = _province_key(province)
+                        counts[key] = counts.get(key, 0) + 1
+                router.provinces = ShardRouter.assign_provinces(counts, shards)
+
+            clients = list(self._clients)
+            while len(clients) < shards:
+                clients.append(self._spawn(len(clients)))
+            self._layout = (self.router, clients)
+
+            moved = 0
+            for source, rows in placements.items():
+                moves = {}
+                for image_id, property_id, province in rows:
+                    target = router.shard_for(property_id, province)
+                    if target != source:
+                        moves.setdefault(target, []).append(image_id)
+                for target, image_ids in moves.items():
+                    for start in range(0, len(image_ids), MOVE_BATCH):
+                        batch = image_ids[start:start + MOVE_BATCH]
+                        items = clients[source].call("export", batch)
+                        clients[target].call("upsert_many", items)
+                        clients[source].call("remove_images", batch)
+                        moved += len(batch)
+
+            self._layout = (router, clients[:shards])
+            for client in clients[shards:]:
+                client.stop()
+                shutil.rmtree(client.directory, ignore_errors=True)
+            self._scatter("save")
+            self._save_router()
+            self.version += 1
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Rebalanced to {shards} {strategy} shards: moved {moved} vectors in {elapsed:.2f}s")
+        return {"moved": moved, "elapsed_s": round(elapsed, 2), **self.shard_stats()}
+
+    # ------------------------------------------------------------------
+    # Stats and persistence
+    # ------------------------------------------------------------------
+    def shard_stats(self):
+        sizes = self._scatter("size")
+        total = sum(sizes.values())
+        return {
+            "strategy": self.router.strategy,
+            "shards": self.router.shards,
+            "vectors": total,
+            "imbalance": round(max(sizes.values()) * len(sizes) / total, 3) if total else None,
+            "per_shard": [
+                {
+                    "shard": client.shard_id,
+                    "alive": client.alive(),
+                    "vectors": sizes[client.shard_id],
+                    "provinces": sorted(
+                        p for p, s in self.router.provinces.items() if s == client.shard_id
+                    ),
+                    **client.latency()
+                }
+                for client in self._clients
+            ]
+        }
+
+    def stats(self):
+        per_shard = self._scatter("stats")
+        return {
+            "instance_id": self.instance_id,
+            "model_id": self.model_id,
+            "vectors": sum(s["vectors"] for s in per_shard.values()),
+            "dimension": self.dimension,
+            "properties": sum(s["properties"] for s in per_shard.values()),
+            "version": self.version,
+            "memory_mb": round(sum(s["memory_mb"] for s in per_shard.values()), 2),
+            "compact_codec": next(iter(per_shard.values()))["compact_codec"],
+            "sharding": self.shard_stats()
+        }
+
+    def save(self, directory=None):
+        self._scatter("save")
+        self._save_router()
@@ -0,0 +1,913 @@
+"""
+SMART TRO - Visual search index
+Stores normalized ResNet50 embeddings together with compact per-vector
+metadata columns so that filtered top-K queries only score eligible vectors.
+Full-precision vectors can live in a memory-mapped file, with int8 compact
+codes kept in RAM for fast candidate retrieval (two-stage search).
+
+Saved files are never modified in place: save() writes a new generation of
+vectors/columns/codec files and publishes it by atomically replacing
+meta.json, which names the files of the current generation. A crash between
+saves loses the unsaved mutations but never mixes rows of two generations.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Metadata columns kept next to every vector (dictionary-encoded, 0 = unknown)
+METADATA_COLUMNS = ("province", "category", "price_bucket", "approval_status")
+
+# Monthly rent bucket edges in VND: bucket i covers [edges[i-1], edges[i])
+PRICE_BUCKET_EDGES = np.array(
+    [1e6, 2e6, 3e6, 4e6, 5e6, 7e6, 10e6, 15e6, 20e6, 30e6],
+    dtype=np.float64
+)
+
+INITIAL_CAPACITY = 1024
+
+# Two-stage search defaults
+COMPACT_DIMENSION = 128
+DEFAULT_CANDIDATES = 300
+SCORING_BLOCK_ROWS = 65536
+
+# Recent mutations kept so caches can tell which entries a change affects
+MUTATION_LOG_SIZE = 1024
+
+# Data files of indexes saved before generations (meta.json without "files")
+LEGACY_FILES = {"vectors": "vectors.npy", "columns": "columns.npz", "codec": "codec.npz"}
+
+
+def price_to_bucket(price):
+    """Map a rent price to its bucket code (0 means unknown price)"""
+    if price is None or price <= 0:
+        return 0
+    return int(np.searchsorted(PRICE_BUCKET_EDGES, price, side="right")) + 1
+
+
+def price_range_to_buckets(min_price=None, max_price=None):
+    """Return the list of bucket codes overlapping [min_price, max_price]"""
+    low = price_to_bucket(min_price) if min_price else 1
+    high = price_to_bucket(max_price) if max_price else len(PRICE_BUCKET_EDGES) + 1
+    return list(range(low, high + 1))
+
+
+class CompactCodec:
+    """
+    Compact int8 representation of the embeddings used by the first search stage
+
+    Vectors are projected to a small number of dimensions (seeded random
+    projection by default, PCA once trained) and scalar-quantized to int8.
+    A 2048-d float32 vector (8 KB) becomes 128 bytes.
+    """
+
+    def __init__(self, dimension, compact_dimension=COMPACT_DIMENSION, seed=42):
+        self.dimension = dimension
+        self.compact_dimension = compact_dimension
+        rng = np.random.default_rng(seed)
+        self.projection = (
+            rng.standard_normal((dimension, compact_dimension)) / np.sqrt(compact_dimension)
+        ).astype(np.float32)
+        self.mean = np.zeros(dimension, dtype=np.float32)
+        # Projected components of unit vectors are ~N(0, 1/k): +-4 sigma fits int8
+        self.scale = np.full(compact_dimension, 4.0 / np.sqrt(compact_dimension) / 127.0, dtype=np.float32)
+        self.method = "random_projection"
+
+    def fit(self, vectors):
+        """Fit a PCA projection and per-dimension quantization scale"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[0] < self.compact_dimension:
+            return False
+        self.mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+        self.projection = np.ascontiguousarray(vt[:self.compact_dimension].T)
+        projected = (vectors - self.mean) @ self.projection
+        max_abs = np.percentile(np.abs(projected), 99.9, axis=0)
+        self.scale = (np.maximum(max_abs, 1e-6) / 127.0).astype(np.float32)
+        self.method = "pca"
+        return True
+
+    def encode(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        projected = (vectors - self.mean) @ self.projection
+        return np.clip(np.rint(projected / self.scale), -127, 127).astype(np.int8)
+
+    def project_query(self, query):
+        """Query-side projection, pre-multiplied by the code scale"""
+        return (((query - self.mean) @ self.projection) * self.scale).astype(np.float32)
+
+    def save(self, path):
+        np.savez(path, projection=self.projection, mean=self.mean, scale=self.scale,
+                 method=np.array(self.method))
+
+    @classmethod
+    def load(cls, path, dimension):
+        data = np.load(path)
+        codec = cls(dimension, data["projection"].shape[1])
+        codec.projection = data["projection"]
+        codec.mean = data["mean"]
+        codec.scale = data["scale"]
+        codec.method = str(data["method"])
+        return codec
+
+
+def _normalize_value(value):
+    if value is None:
+        return ""
+    return str(value).strip().lower()
+
+
+def matches_filters(metadata, filters):
+    """Whether one vector's metadata (as logged in mutations) passes the filters"""
+    if not filters:
+        return True
+    for column in ("province", "category", "approval_status"):
+        values = filters.get(column)
+        if not values:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        if metadata.get(column) not in {_normalize_value(v) for v in values}:
+            return False
+    price = metadata.get("price") or 0
+    min_price = filters.get("min_price")
+    max_price = filters.get("max_price")
+    if (min_price or max_price) and price <= 0:
+        return False
+    if min_price and price < min_price:
+        return False
+    if max_price and price > max_price:
+        return False
+    return True
+
+
+class EmbeddingIndex:
+    """
+    Flat cosine-similarity index over L2-normalized vectors
+
+    Rows are kept dense (deletes swap the last row into the hole) and every
+    metadata value has a boolean bitmap over the rows, so a filtered query
+    ANDs a handful of bitmaps and runs one matrix-vector product over the
+    eligible rows only.
+
+    With a storage directory the full-precision vectors are a memory-mapped
+    .npy file: exact search pages them in on demand and two-stage search
+    only touches the rows of the re-ranked candidates. The saved file is
+    mapped copy-on-write, so rows changed since the last save live in private
+    pages (or in an unlinked scratch file once the index grows).
+
+    model_id records which embedding model produced the vectors, so a
+    namespace is never filled or queried with another model's vectors.
+    """
+
+    def __init__(self, dimension=2048, storage_dir=None, compact_dimension=COMPACT_DIMENSION,
+                 model_id=None):
+        self.dimension = dimension
+        self.model_id = model_id
+        self.storage_dir = storage_dir
+        self._lock = threading.RLock()
+        self._size = 0
+        self._capacity = 0
+
+        self.codec = CompactCodec(dimension, compact_dimension)
+        self._compact = np.zeros((0, compact_dimension), dtype=np.int8)
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._prices = np.zeros(0, dtype=np.float32)
+        self._image_ids = []
+        self._property_ids = []
+        self._image_urls = []
+        self._row_by_image = {}
+        self._images_by_property = {}
+
+        # column -> value -> code, and column -> codes per row
+        self._dictionaries = {name: {} for name in METADATA_COLUMNS if name != "price_bucket"}
+        self._codes = {name: np.zeros(0, dtype=np.uint16) for name in METADATA_COLUMNS}
+        # column -> code -> bitmap over rows
+        self._bitmaps = {name: {} for name in METADATA_COLUMNS}
+
+        # version increases by one per mutation; the log records what changed
+        self.instance_id = uuid.uuid4().hex
+        self.version = 0
+        self._mutations = deque(maxlen=MUTATION_LOG_SIZE)
+        self._grow(INITIAL_CAPACITY)
+
+    # ------------------------------------------------------------------
+    # Storage management
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return self._size
+
+    def _grow(self, min_capacity):
+        new_capacity = max(min_capacity, self._capacity * 2, INITIAL_CAPACITY)
+        if new_capacity <= self._capacity:
+            return
+        self._vectors = self._allocate_vectors(new_capacity)
+        self._grow_columns(new_capacity)
+
+    def _grow_columns(self, new_capacity):
+        """Grow every in-RAM column (compact codes, prices, metadata, bitmaps)"""
+        compact = np.zeros((new_capacity, self.codec.compact_dimension), dtype=np.int8)
+        compact[:self._size] = self._compact[:self._size]
+        self._compact = compact
+
+        prices = np.zeros(new_capacity, dtype=np.float32)
+        prices[:self._size] = self._prices[:self._size]
+        self._prices = prices
+
+        for name in METADATA_COLUMNS:
+            codes = np.zeros(new_capacity, dtype=np.uint16)
+            codes[:self._size] = self._codes[name][:self._size]
+            self._codes[name] = codes
+            for code, bitmap in self._bitmaps[name].items():
+                grown = np.zeros(new_capacity, dtype=bool)
+                grown[:self._size] = bitmap[:self._size]
+                self._bitmaps[name][code] = grown
+
+        self._capacity = new_capacity
+
+    def _write_vectors(self, path, capacity):
+        """Write the live rows to a new .npy file of `capacity` rows (tail stays sparse)"""
+        vectors = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float32, shape=(capacity, self.dimension)
+        )
+        for start in range(0, self._size, SCORING_BLOCK_ROWS):
+            end = min(start + SCORING_BLOCK_ROWS, self._size)
+            vectors[start:end] = self._vectors[start:end]
+        return vectors
+
+    def _allocate_vectors(self, capacity):
+        """Allocate full-precision storage (RAM or memory-mapped file) and copy live rows"""
+        if not self.storage_dir:
+            vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            return vectors
+
+        # Scratch file, unlinked right away: only save() publishes vectors
+        os.makedirs(self.storage_dir, exist_ok=True)
+        path = os.path.join(self.storage_dir, f"vectors-scratch-{uuid.uuid4().hex}.npy")
+        vectors = self._write_vectors(path, capacity)
+        os.unlink(path)
+        return vectors
+
+    def _rebuild_bitmaps(self):
+        """Recompute every bitmap from the code columns"""
+        for name in METADATA_COLUMNS:
+            codes = self._codes[name]
+            self._bitmaps[name] = {
+                int(code): codes == code
+                for code in np.unique(codes[:self._size])
+            }
+            for bitmap in self._bitmaps[name].values():
+                bitmap[self._size:] = False
+
+    def _encode(self, column, value):
+        """Dictionary-encode a metadata value (code 0 is reserved for unknown)"""
+        value = _normalize_value(value)
+        if not value:
+            return 0
+        dictionary = self._dictionaries[column]
+        code = dictionary.get(value)
+        if code is None:
+            code = len(dictionary) + 1
+            dictionary[value] = code
+        return code
+
+    def _decode(self, column, code):
+        for value, value_code in self._dictionaries[column].items():
+            if value_code == code:
+                return value
+        return ""
+
+    def _row_metadata(self, row):
+        return {
+            "province": self._decode("province", int(self._codes["province"][row])),
+            "category": self._decode("category", int(self._codes["category"][row])),
+            "approval_status": self._decode("approval_status", int(self._codes["approval_status"][row])),
+            "price": float(self._prices[row])
+        }
+
+    def _log_mutation(self, op, **fields):
+        """Bump the version and record the mutation (caller holds the lock)"""
+        self.version += 1
+        self._mutations.append({"version": self.version, "op": op, **fields})
+
+    def mutations_since(self, version):
+        """
+        Mutations applied after `version`, oldest first
+
+        Returns None when the log no longer reaches back that far.
+        """
+        with self._lock:
+            if version >= self.version:
+                return []
+            if not self._mutations or self._mutations[0]["version"] > version + 1:
+                return None
+            return [m for m in self._mutations if m["version"] > version]
+
+    def _set_code(self, column, row, code):
+        old_code = int(self._codes[column][row])
+        if old_code in self._bitmaps[column]:
+            self._bitmaps[column][old_code][row] = False
+        self._codes[column][row] = code
+        bitmap = self._bitmaps[column].get(code)
+        if bitmap is None:
+            bitmap = np.zeros(self._capacity, dtype=bool)
+            self._bitmaps[column][code] = bitmap
+        bitmap[row] = True
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+    def upsert(self, image_id, property_id, embedding, image_url=None,
+               province=None, category=None, price=None, approval_status=None):
+        """Insert or replace one image vector with its metadata"""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vector.shape[0]} does not match index dimension {self.dimension}"
+            )
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        property_id = str(property_id)
+        with self._lock:
+            row = self._row_by_image.get(image_id)
+            replaced = None if row is None else self._row_metadata(row)
+            property_ids = [property_id]
+            if row is None:
+                if self._size >= self._capacity:
+                    self._grow(self._size + 1)
+                row = self._size
+                self._size += 1
+                self._image_ids.append(image_id)
+                self._property_ids.append(property_id)
+                self._image_urls.append(image_url or "")
+                self._row_by_image[image_id] = row
+            else:
+                previous_property = self._property_ids[row]
+                if previous_property != property_id:
+                    self._unlink_property(previous_property, image_id)
+                    property_ids.append(previous_property)
+                self._property_ids[row] = property_id
+                self._image_urls[row] = image_url or self._image_urls[row]
+            self._images_by_property.setdefault(property_id, set()).add(image_id)
+
+            self._vectors[row] = vector
+            self._compact[row] = self.codec.encode(vector)[0]
+            self._prices[row] = float(price or 0)
+            self._set_code("province", row, self._encode("province", province))
+            self._set_code("category", row, self._encode("category", category))
+            self._set_code("price_bucket", row, price_to_bucket(price))
+            self._set_code("approval_status", row, self._encode("approval_status", approval_status))
+            self._log_mutation(
+                "upsert",
+                image_ids=[image_id],
+                property_ids=property_ids,
+                vector=vector.astype(np.float16),
+                metadata=self._row_metadata(row),
+                replaced=replaced
+            )
+            return row
+
+    def _unlink_property(self, property_id, image_id):
+        images = self._images_by_property.get(property_id)
+        if images is not None:
+            images.discard(image_id)
+            if not images:
+                del self._images_by_property[property_id]
+
+    def _remove_row(self, row):
+        self._unlink_property(self._property_ids[row], self._image_ids[row])
+        last = self._size - 1
+        if row != last:
+            # Move the last row into the hole to keep storage dense
+            self._vectors[row] = self._vectors[last]
+            self._compact[row] = self._compact[last]
+            self._prices[row] = self._prices[last]
+            for name in METADATA_COLUMNS:
+                self._set_code(name, row, int(self._codes[name][last]))
+            moved_image = self._image_ids[last]
+            self._image_ids[row] = moved_image
+            self._property_ids[row] = self._property_ids[last]
+            self._image_urls[row] = self._image_urls[last]
+            self._row_by_image[moved_image] = row
+
+        for name in METADATA_COLUMNS:
+            code = int(self._codes[name][last])
+            if code in self._bitmaps[name]:
+                self._bitmaps[name][code][last] = False
+            self._codes[name][last] = 0
+        self._vectors[last] = 0
+        self._compact[last] = 0
+        self._prices[last] = 0
+        self._image_ids.pop()
+        self._property_ids.pop()
+        self._image_urls.pop()
+        self._size -= 1
+
+    def remove_image(self, image_id):
+        """Remove one image vector, returns True if it existed"""
+        with self._lock:
+            row = self._row_by_image.get(image_id)
+            if row is None:
+                return False
+            metadata = self._row_metadata(row)
+            property_id = self._property_ids[row]
+            del self._row_by_image[image_id]
+            self._remove_row(row)
+            self._log_mutation(
+                "remove", image_ids=[image_id], property_ids=[property_id], metadata=[metadata]
+            )
+            return True
+
+    def remove_property(self, property_id):
+        """Remove every image vector of a property, returns the number removed"""
+        property_id = str(property_id)
+        with self._lock:
+            image_ids = sorted(self._images_by_property.get(property_id, ()))
+            metadata = []
+            for image_id in image_ids:
+                row = self._row_by_image.pop(image_id)
+                metadata.append(self._row_metadata(row))
+                self._remove_row(row)
+            if image_ids:
+                self._log_mutation(
+                    "remove", image_ids=image_ids, property_ids=[property_id], metadata=metadata
+                )
+            return len(image_ids)
+
+    # ------------------------------------------------------------------
+    # Per-property access (property aggregate index)
+    # ------------------------------------------------------------------
+    def property_ids(self):
+        with self._lock:
+            return list(self._images_by_property)
+
+    def property_rows(self, property_id):
+        """Sorted rows of every image of a property"""
+        with self._lock:
+            images = self._images_by_property.get(str(property_id), ())
+            return np.array(sorted(self._row_by_image[i] for i in images), dtype=np.int64)
+
+    def items(self):
+        """Every image with its property and metadata (no vectors), in row order"""
+        with self._lock:
+            return [
+                {
+                    "image_id": self._image_ids[row],
+                    "property_id": self._property_ids[row],
+                    "image_url": self._image_urls[row],
+                    **self._row_metadata(row)
+                }
+                for row in range(self._size)
+            ]
+
+    def image_ids(self):
+        with self._lock:
+            return set(self._row_by_image)
+
+    def export(self, image_ids):
+        """Vectors and metadata of the given images as upsert() keyword arguments"""
+        with self._lock:
+            exported = []
+            for image_id in image_ids:
+                row = self._row_by_image.get(image_id)
+                if row is None:
+                    continue
+                exported.append({
+                    "image_id": image_id,
+                    "property_id": self._property_ids[row],
+                    "embedding": np.array(self._vectors[row], dtype=np.float32),
+                    "image_url": self._image_urls[row],
+                    **self._row_metadata(row)
+                })
+            return exported
+
+    def property_snapshot(self, property_id):
+        """(vectors, metadata of its first image) of one property, or None if it has no images"""
+        with self._lock:
+            rows = self.property_rows(property_id)
+            if rows.size == 0:
+                return None
+            return np.array(self._vectors[rows], dtype=np.float32), self._row_metadata(int(rows[0]))
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _column_mask(self, column, codes):
+        mask = np.zeros(self._size, dtype=bool)
+        for code in codes:
+            bitmap = self._bitmaps[column].get(code)
+            if bitmap is not None:
+                mask |= bitmap[:self._size]
+        return mask
+
+    def _lookup_codes(self, column, values):
+        if isinstance(values, str):
+            values = [values]
+        dictionary = self._dictionaries[column]
+        return [dictionary[v] for v in (_normalize_value(x) for x in values) if v in dictionary]
+
+    def eligible_rows(self, filters=None):
+        """
+        Resolve filters to the row indices that may be scored
+
+        Supported filters: province, category, approval_status (str or list),
+        min_price, max_price (VND).
+        """
+        filters = filters or {}
+        mask = None
+
+        for column in ("province", "category", "approval_status"):
+            values = filters.get(column)
+            if not values:
+                continue
+            column_mask = self._column_mask(column, self._lookup_codes(column, values))
+            mask = column_mask if mask is None else mask & column_mask
+
+        min_price = filters.get("min_price")
+        max_price = filters.get("max_price")
+        if min_price or max_price:
+            bucket_mask = self._column_mask(
+                "price_bucket", price_range_to_buckets(min_price, max_price)
+            )
+            mask = bucket_mask if mask is None else mask & bucket_mask
+
+        if mask is None:
+            return None
+
+        rows = np.flatnonzero(mask)
+        if (min_price or max_price) and rows.size:
+            # Buckets are coarse, refine with the exact price column
+            prices = self._prices[rows]
+            keep = np.ones(rows.size, dtype=bool)
+            if min_price:
+                keep &= prices >= min_price
+            if max_price:
+                keep &= prices <= max_price
+            rows = rows[keep]
+        return rows
+
+    def filter_rows(self, rows, filters=None):
+        """Subset of the given rows that passes the filters (checked on those rows only)"""
+        filters = filters or {}
+        keep = np.ones(rows.size, dtype=bool)
+        for column in ("province", "category", "approval_status"):
+            values = filters.get(column)
+            if values:
+                keep &= np.isin(self._codes[column][rows], self._lookup_codes(column, values))
+        min_price = filters.get("min_price")
+        max_price = filters.get("max_price")
+        if min_price:
+            keep &= self._prices[rows] >= min_price
+        if max_price:
+            keep &= self._prices[rows] <= max_price
+        return rows[keep]
+
+    def _rank(self, rows, scores, top_k, min_score, group_by_property):
+        """Turn raw scores into the final (optionally property-deduplicated) hit list"""
+        if scores.size == 0:
+            return []
+
+        # Over-fetch so that property deduplication still yields top_k results
+        fetch = top_k * 8 if group_by_property else top_k
+        fetch = min(fetch, scores.size)
+        while True:
+            if fetch < scores.size:
+                top = np.argpartition(-scores, fetch - 1)[:fetch]
+            else:
+                top = np.arange(scores.size)
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            hits = []
+            seen = set()
+            for position in top:
+                score = float(scores[position])
+                if score < min_score:
+                    break
+                row = int(rows[position]) if rows is not None else int(position)
+                property_id = self._property_ids[row]
+                if group_by_property:
+                    if property_id in seen:
+                        continue
+                    seen.add(property_id)
+                hits.append({
+                    "imageId": self._image_ids[row],
+                    "propertyId": property_id,
+                    "imageUrl": self._image_urls[row],
+                    "score": round(score, 6)
+                })
+                if len(hits) >= top_k:
+                    return hits
+
+            exhausted = fetch >= scores.size or (top.size and scores[top[-1]] < min_score)
+            if exhausted:
+                return hits
+            fetch = min(fetch * 4, scores.size)
+
+    def _prepare_query(self, query):
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dimension:
+            raise ValueError(
+                f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}"
+            )
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        return query
+
+    def _exact_scores(self, rows, query):
+        """Full-precision scores, read block by block from (possibly mapped) storage"""
+        if rows is None:
+            scores = np.empty(self._size, dtype=np.float32)
+            for start in range(0, self._size, SCORING_BLOCK_ROWS):
+                end = min(start + SCORING_BLOCK_ROWS, self._size)
+                scores[start:end] = self._vectors[start:end] @ query
+            return scores
+        # Sorted row order keeps reads from the mapped file sequential
+        return self._vectors[rows] @ query
+
+    def _compact_scores(self, rows, query):
+        """Approximate scores from the int8 codes, converted to float in blocks"""
+        projected = self.codec.project_query(query)
+        count = self._size if rows is None else rows.size
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORING_BLOCK_ROWS):
+            end = min(start + SCORING_BLOCK_ROWS, count)
+            block = self._compact[start:end] if rows is None else self._compact[rows[start:end]]
+            scores[start:end] = block.astype(np.float32) @ projected
+        return scores
+
+    def search(self, query, top_k=5, filters=None, min_score=0.0, group_by_property=True,
+               mode="exact", candidates=DEFAULT_CANDIDATES):
+        """
+        Filtered top-K cosine search
+
+        mode="exact" scores every eligible vector at full precision.
+        mode="two_stage" retrieves `candidates` rows with the compact int8
+        codes, then re-ranks them exactly with the full-precision vectors.
+
+        Returns (hits, stats); stats includes a per-stage timing breakdown.
+        """
+        query = self._prepare_query(query)
+        timings = {}
+        start_time = time.perf_counter()
+
+        with self._lock:
+            rows = self.eligible_rows(filters)
+            filtered_at = time.perf_counter()
+            timings["filter_ms"] = round((filtered_at - start_time) * 1000, 3)
+            eligible = self._size if rows is None else int(rows.size)
+
+            if mode == "two_stage" and eligible > candidates:
+                approx = self._compact_scores(rows, query)
+                top = np.argpartition(-approx, candidates - 1)[:candidates]
+                candidate_rows = np.sort(top if rows is None else rows[top])
+                retrieved_at = time.perf_counter()
+                timings["candidate_ms"] = round((retrieved_at - filtered_at) * 1000, 3)
+
+                scores = self._exact_scores(candidate_rows, query)
+                hits = self._rank(candidate_rows, scores, top_k, min_score, group_by_property)
+                timings["rerank_ms"] = round((time.perf_counter() - retrieved_at) * 1000, 3)
+                scored = int(candidate_rows.size)
+            else:
+                mode = "exact"
+                scores = self._exact_scores(rows, query)
+                hits = self._rank(rows, scores, top_k, min_score, group_by_property)
+                timings["score_ms"] = round((time.perf_counter() - filtered_at) * 1000, 3)
+                scored = eligible
+            total = self._size
+            version = self.version
+
+        timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+        return hits, {
+            "mode": mode,
+            "index_version": version,
+            "total_vectors": total,
+            "eligible_vectors": eligible,
+            "scored_vectors": scored,
+            "search_time_ms": timings["total_ms"],
+            "timings": timings
+        }
+
+    def search_properties(self, query, property_ids, top_k=5, filters=None, min_score=0.0,
+                          group_by_property=True):
+        """
+        Exact search restricted to the photos of the given properties (e.g.
+        the properties a coarse search selected)
+
+        Rows are resolved and scored under one lock acquisition, so a
+        concurrent remove can't move rows between the two.
+        Returns (hits, scored_rows, index_version).
+        """
+        query = self._prepare_query(query)
+        with self._lock:
+            rows = [self.property_rows(property_id) for property_id in property_ids]
+            rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+            rows = self.filter_rows(np.sort(rows), filters)
+            scores = self._exact_scores(rows, query)
+            hits = self._rank(rows, scores, top_k, min_score, group_by_property)
+            return hits, int(rows.size), self.version
+
+    def train_compact_codec(self, sample_size=20000):
+        """Fit the PCA codec on a sample of stored vectors and re-encode all codes"""
+        with self._lock:
+            if self._size == 0:
+                return False
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(self._size, min(sample_size, self._size), replace=False))
+            if not self.codec.fit(self._vectors[sample_rows]):
+                return False
+            for start in range(0, self._size, SCORING_BLOCK_ROWS):
+                end = min(start + SCORING_BLOCK_ROWS, self._size)
+                self._compact[start:end] = self.codec.encode(self._vectors[start:end])
+            self._log_mutation("codec")
+            logger.info(f"Trained {self.codec.method} compact codec on {sample_rows.size} vectors")
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "instance_id": self.instance_id,
+                "model_id": self.model_id,
+                "vectors": self._size,
+                "capacity": self._capacity,
+                "dimension": self.dimension,
+                "properties": len(self._images_by_property),
+                "version": self.version,
+                "memory_mb": round(
+                    (self._compact.nbytes + self._prices.nbytes
+                     + sum(c.nbytes for c in self._codes.values())
+                     + (0 if self.storage_dir else self._vectors.nbytes)) / (1024 * 1024), 2
+                ),
+                "vectors_memory_mapped": bool(self.storage_dir),
+                "compact_codec": {
+                    "method": self.codec.method,
+                    "dimension": self.codec.compact_dimension,
+                    "bytes_per_vector": self.codec.compact_dimension
+                },
+                "metadata_values": {
+                    name: len(values) for name, values in self._dictionaries.items()
+                }
+            }
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, directory=None):
+        """
+        Persist vectors, compact codes, metadata columns and dictionaries
+
+        Every save writes a new generation of data files, then replaces
+        meta.json (the commit point) and deletes the previous generation.
+        """
+        directory = directory or self.storage_dir
+        os.makedirs(directory, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        files = {
+            "vectors": f"vectors-{generation}.npy",
+            "columns": f"columns-{generation}.npz",
+            "codec": f"codec-{generation}.npz"
+        }
+        paths = {name: os.path.join(directory, file) for name, file in files.items()}
+        with self._lock:
+            own_storage = bool(self.storage_dir) and (
+                os.path.abspath(directory) == os.path.abspath(self.storage_dir)
+            )
+            vectors = self._write_vectors(paths["vectors"], self._capacity if own_storage else self._size)
+            vectors.flush()
+            del vectors
+            np.savez(
+                paths["columns"],
+                prices=self._prices[:self._size],
+                compact=self._compact[:self._size],
+                **{name: self._codes[name][:self._size] for name in METADATA_COLUMNS}
+            )
+            self.codec.save(paths["codec"])
+            for path in paths.values():
+                _fsync(path)
+
+            meta_path = os.path.join(directory, "meta.json")
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "model_id": self.model_id,
+                    "dimension": self.dimension,
+                    "size": self._size,
+                    "version": self.version,
+                    "files": files,
+                    "image_ids": self._image_ids,
+                    "property_ids": self._property_ids,
+                    "image_urls": self._image_urls,
+                    "dictionaries": self._dictionaries
+                }, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(meta_path + ".tmp", meta_path)
+            _fsync(directory)
+
+            if own_storage:
+                # Unsaved private pages / the scratch file are now on disk
+                self._vectors = np.load(paths["vectors"], mmap_mode="c")
+            _remove_stale_files(directory, files)
+        logger.info(f"Saved index with {self._size} vectors to {directory}")
+
+    @classmethod
+    def load(cls, directory, dimension=2048, memory_mapped=True, model_id=None):
+        """
+        Load an index saved with save(), or return an empty one
+
+        With memory_mapped=True the directory becomes the backing store and
+        full-precision vectors are paged in lazily. With model_id set, a
+        saved index recorded for another model (or dimension) is refused;
+        legacy indexes without a model id are adopted.
+        """
+        storage_dir = directory if memory_mapped else None
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return cls(dimension, storage_dir=storage_dir, model_id=model_id)
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        saved_model = meta.get("model_id")
+        if model_id and saved_model and saved_model != model_id:
+            raise ValueError(
+                f"Index at {directory} holds {saved_model} vectors, not {model_id}"
+            )
+        if model_id and meta.get("dimension", dimension) != dimension:
+            raise ValueError(
+                f"Index at {directory} has dimension {meta.get('dimension')}, "
+                f"{model_id} produces {dimension}"
+            )
+        dimension = meta.get("dimension", dimension)
+        index = cls(dimension, model_id=model_id or saved_model)
+        files = {**LEGACY_FILES, **meta.get("files", {})}
+        columns = np.load(os.path.join(directory, files["columns"]))
+        codec_path = os.path.join(directory, files["codec"])
+        if os.path.exists(codec_path):
+            index.codec = CompactCodec.load(codec_path, dimension)
+
+        size = meta.get("size", len(meta["image_ids"]))
+        vectors_path = os.path.join(directory, files["vectors"])
+        if storage_dir:
+            # The saved file becomes the backing store, nothing is read eagerly;
+            # copy-on-write keeps mutations out of it until the next save()
+            index.storage_dir = storage_dir
+            index._vectors = np.load(vectors_path, mmap_mode="c")
+            index._grow_columns(max(index._vectors.shape[0], size))
+        else:
+            index._capacity = 0
+            index._grow(size)
+            index._vectors[:size] = np.load(vectors_path, mmap_mode="r")[:size]
+        index._size = size
+        if "compact" in columns:
+            index._compact[:size] = columns["compact"]
+        else:
+            index._compact[:size] = index.codec.encode(index._vectors[:size])
+        index._prices[:size] = columns["prices"]
+        index._image_ids = list(meta["image_ids"])
+        index._property_ids = list(meta["property_ids"])
+        index._image_urls = list(meta["image_urls"])
+        index._row_by_image = {image_id: row for row, image_id in enumerate(index._image_ids)}
+        for image_id, property_id in zip(index._image_ids, index._property_ids):
+            index._images_by_property.setdefault(property_id, set()).add(image_id)
+        index._dictionaries = {
+            name: dict(values) for name, values in meta["dictionaries"].items()
+        }
+        for name in METADATA_COLUMNS:
+            index._codes[name][:size] = columns[name]
+        index._rebuild_bitmaps()
+        index.version = meta.get("version", 0)
+
+        logger.info(f"Loaded index with {size} vectors from {directory}")
+        return index
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove_stale_files(directory, files):
+    """Delete data files of earlier generations (and of saves that crashed before meta.json)"""
+    current = set(files.values())
+    for name in os.listdir(directory):
+        stale = name in LEGACY_FILES.values() or (
+            name.startswith(("vectors-", "columns-", "codec-")) and name.endswith((".npy", ".npz"))
+        )
+        if stale and name not in current:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                logger.warning(f"Could not remove stale index file {name}: {e}")
@@ -1,4 +1,5 @@
 import reportRepository from '../repositories/reportRepository.js';
+import imageSearchService from '../../image-search-service/service/imageSearchService.js';
 
 // Báo cáo tin đăng
 const reportProperty = async (req, res) => {
@@ -142,6 +143,8 @@ const handlePropertyReport = async (req, res) => {
     // Nếu resolve, có thể ẩn property hoặc thực hiện action khác
     if (action === 'resolve') {
       await reportRepository.handleApprovedReport(report.property);
+      // Tin chuyển về chờ duyệt => cập nhật visual search index
+      imageSearchService.syncPropertyIndex(report.property);
     }
 
     res.status(200).json({